@@ -0,0 +1,89 @@
+#!/usr/local/bin/python3.1
+
+# bench.py [-n] [-p] [-l run_label] [-t tolerance%] [-c max_cycles] [kernel...]
+
+r'''Runs the code quality benchmarks in examples/bench.
+
+Compiles each kernel, runs it on the simulator, checks its results against
+its expected.trace and expected.vars, and prints its cycles, flash bytes and
+peak stack use along with the change from the last run in the history file.
+
+With -p, it also prints the number of times that each peephole rule was
+applied to each kernel.
+
+The results are appended to the history file unless -n is given.  The run is
+labeled with the date and time unless -l is given.
+
+Exits with status 1 if any kernel got worse by more than the tolerance (in
+percent, default 0).
+'''
+
+import os
+import sys
+import time
+
+from doctest_tools import setpath
+setpath.setpath(__file__, remove_first = True)
+
+from ucc.simulator import bench
+
+def usage():
+    sys.stderr.write("usage: {} [-n] [-p] [-l run_label] [-t tolerance%] "
+                       "[-c max_cycles] [kernel...]\n"
+                       .format(os.path.basename(sys.argv[0])))
+    sys.exit(2)
+
+def run(kernels, run_label, record = True, tolerance = 0,
+        max_cycles = bench.Max_cycles, peephole = False):
+    old = bench.latest(bench.read_history())
+    results = []
+    for kernel in kernels:
+        results.append(bench.run_kernel(kernel, max_cycles = max_cycles))
+    for line in bench.format_results(results, old):
+        print(line)
+    if peephole:
+        print()
+        for line in bench.format_peephole_counts(
+                        (kernel, bench.peephole_counts(kernel))
+                        for kernel in kernels):
+            print(line)
+    if record:
+        bench.write_history(run_label, results)
+    regressions = list(bench.regressions(old, results, tolerance))
+    for kernel, metric, old_value, new_value in regressions:
+        if metric == 'error':
+            print("REGRESSION: {}: {}".format(kernel, new_value))
+        else:
+            print("REGRESSION: {}: {} went from {} to {}"
+                    .format(kernel, metric, old_value, new_value))
+    return not regressions
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    record = True
+    run_label = time.strftime("%Y-%m-%d %H:%M:%S")
+    tolerance = 0
+    max_cycles = bench.Max_cycles
+    peephole = False
+    while args and args[0].startswith('-'):
+        if args[0] == '-n':
+            record = False
+            del args[0]
+        elif args[0] == '-p':
+            peephole = True
+            del args[0]
+        elif len(args) > 1 and args[0] == '-l':
+            run_label = args[1]
+            del args[:2]
+        elif len(args) > 1 and args[0] == '-t':
+            tolerance = float(args[1])
+            del args[:2]
+        elif len(args) > 1 and args[0] == '-c':
+            max_cycles = int(args[1])
+            del args[:2]
+        else:
+            usage()
+    kernels = args or bench.kernels()
+    sys.exit(0 if run(kernels, run_label, record, tolerance, max_cycles,
+                      peephole)
+               else 1)
@@ -4,7 +4,7 @@
 
 r'''Dumps the icode database in a simple ascii format.
 
-fun_name.id: name [next id [/ id]] (predecessor ids)
+fun_name.id: name [next id [/ id] [/ [jump table ids]]] (predecessor ids)
   id: >abs_order_in_block [use_count] operator int1 int2 symbol string (predecessor ids) => sym
     child1
     child2
@@ -52,8 +52,16 @@ def dump_block(info, db_cur):
                    """,
                    (id,))
     predecessors = ' '.join([str(x[0]) for x in db_cur])
+    db_cur.execute("""select target
+                        from jump_table
+                       where block_id = ?
+                       order by position
+                   """,
+                   (id,))
+    targets = ' '.join([x[0] for x in db_cur])
     fun_name, kind, flags = get_symbol(db_cur, word_symbol_id)
-    print("{fun_name}{kind}.{id}: {block_name}{next}{next_cond}{pred}{flags}"
+    print("{fun_name}{kind}.{id}: {block_name}{next}{next_cond}{table}{pred}"
+          "{flags}"
             .format(fun_name=fun_name,
                     kind=kind,
                     flags=flags,
@@ -61,6 +69,7 @@ def dump_block(info, db_cur):
                     block_name=name,
                     next=' next {}'.format(next) if next else '',
                     next_cond=' / {}'.format(next_cond) if next_cond else '',
+                    table=' / [{}]'.format(targets) if targets else '',
                     pred=' ({})'.format(predecessors) if predecessors else ''))
     dump_triples(db_cur, id)
 
@@ -29,6 +29,9 @@ def main(argv):
     print('Running load_patterns.py...')
     load_patterns.load(db_name, os.path.join(architecture, 'patterns'))
 
+    print('Running load_peephole.py...')
+    load_peephole.load(db_name, os.path.join(architecture, 'peephole'))
+
     query = """
             insert into code_seq_by_processor (processor, code_seq_id)
             select ?, id
@@ -58,5 +61,5 @@ if __name__ == "__main__":
     codegen_dir = os.path.join(root_dir, 'ucc', 'codegen')
     print("Changing to", codegen_dir)
     os.chdir(codegen_dir)
-    from ucc.codegen import load_patterns
+    from ucc.codegen import load_patterns, load_peephole
     main(sys.argv)
@@ -0,0 +1,45 @@
+#!/usr/local/bin/python3.1
+
+# map_diff.py old.map new.map
+
+r'''Shows which symbols changed size between two .map files.
+
+Prints one line per changed (symbol, section), biggest growth first, followed
+by the totals for each section.
+'''
+
+import os
+import sys
+
+from doctest_tools import setpath
+setpath.setpath(__file__, remove_first = True)
+
+from ucc.assembler import map_file
+
+def usage():
+    sys.stderr.write("usage: {} old.map new.map\n"
+                       .format(os.path.basename(sys.argv[0])))
+    sys.exit(2)
+
+def size_str(size):
+    if size is None: return '-'
+    return str(size)
+
+def run(old_filename, new_filename):
+    old = map_file.read(old_filename)
+    new = map_file.read(new_filename)
+    for label, section, old_size, new_size, delta in map_file.diff(old, new):
+        print("{:+6} {:>6} -> {:<6} {:10} {}"
+                .format(delta, size_str(old_size), size_str(new_size),
+                        section, label))
+    old_totals = map_file.totals(old)
+    new_totals = map_file.totals(new)
+    for section in sorted(set(old_totals.keys()) | set(new_totals.keys())):
+        old_size = old_totals.get(section, 0)
+        new_size = new_totals.get(section, 0)
+        print("total {}: {} -> {} ({:+})"
+                .format(section, old_size, new_size, new_size - old_size))
+
+if __name__ == '__main__':
+    len(sys.argv) == 3 or usage()
+    run(sys.argv[1], sys.argv[2])
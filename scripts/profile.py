@@ -0,0 +1,36 @@
+#!/usr/local/bin/python3.1
+
+# profile.py [-c max_cycles] package_dir
+
+r'''Runs a compiled package on the simulator and writes its flash.profile.
+
+The flash.profile has the block, edge and call execution counts.  It is used
+by the next compile of the package to lay out the hot paths as fall-throughs
+and keep hot calls within RCALL range.
+
+Programs that never halt (like blinky) are stopped after max_cycles.
+'''
+
+import os
+import sys
+
+from doctest_tools import setpath
+setpath.setpath(__file__, remove_first = True)
+
+from ucc.simulator import profile
+
+def usage():
+    sys.stderr.write("usage: {} [-c max_cycles] package_dir\n"
+                       .format(os.path.basename(sys.argv[0])))
+    sys.exit(2)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    max_cycles = profile.Max_cycles
+    if len(args) > 1 and args[0] == '-c':
+        max_cycles = int(args[1])
+        del args[:2]
+    len(args) == 1 or usage()
+    cpu = profile.write(args[0], max_cycles)
+    print("{} cycles, {}".format(cpu.cycles,
+                                 "halted" if cpu.halted else "stopped"))
@@ -0,0 +1,47 @@
+#!/usr/local/bin/python3.1
+
+# simulate.py [-c max_cycles] (package_dir | file.hex)
+
+r'''Runs a flash.hex file on the AVR simulator.
+
+Prints the number of clock cycles run, where the program stopped and the peak
+stack use.
+'''
+
+import os
+import sys
+import time
+
+from doctest_tools import setpath
+setpath.setpath(__file__, remove_first = True)
+
+from ucc.simulator import avr
+
+def usage():
+    sys.stderr.write("usage: {} [-c max_cycles] (package_dir | file.hex)\n"
+                       .format(os.path.basename(sys.argv[0])))
+    sys.exit(2)
+
+def run(filename, max_cycles = None):
+    if os.path.isdir(filename):
+        filename = os.path.join(filename, 'flash.hex')
+    cpu = avr.cpu()
+    cpu.load_hex(filename)
+    start = time.time()
+    cpu.run(max_cycles)
+    elapsed = time.time() - start
+    print("{}: {} cycles in {:.3f} seconds".format(filename, cpu.cycles,
+                                                   elapsed))
+    print("{} at 0x{:04x}, peak stack use {} bytes"
+            .format("halted" if cpu.halted else "stopped", 2 * cpu.pc,
+                    cpu.stack_used()))
+    return cpu
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    max_cycles = None
+    if len(args) > 1 and args[0] == '-c':
+        max_cycles = int(args[1])
+        del args[:2]
+    len(args) == 1 or usage()
+    run(args[0], max_cycles)
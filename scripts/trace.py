@@ -0,0 +1,64 @@
+#!/usr/local/bin/python3.1
+
+# trace.py [-c max_cycles] [-n max_changes] [-g golden [-w] [-t tol%]] package_dir
+
+r'''Runs a compiled package on the simulator and traces its port writes.
+
+Prints each change to PORTB, PORTC and PORTD as "cycle port value".
+
+With -g, the trace is compared against the golden .trace file instead, and
+the differences are printed (exit status 1 if there are any).  The cycles are
+only compared if a -t tolerance (in percent) is given.  With -w (and -g), the
+golden .trace file is (re)written from this run.
+'''
+
+import os
+import sys
+
+from doctest_tools import setpath
+setpath.setpath(__file__, remove_first = True)
+
+from ucc.simulator import gpio_trace
+
+Max_cycles = 1000000
+
+def usage():
+    sys.stderr.write("usage: {} [-c max_cycles] [-n max_changes] "
+                       "[-g golden [-w] [-t tol%]] package_dir\n"
+                       .format(os.path.basename(sys.argv[0])))
+    sys.exit(2)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    max_cycles = Max_cycles
+    max_changes = None
+    golden = None
+    rewrite = False
+    tolerance = None
+    while args and args[0].startswith('-'):
+        if args[0] == '-w':
+            rewrite = True
+            del args[0]
+            continue
+        len(args) > 1 or usage()
+        if args[0] == '-c': max_cycles = int(args[1])
+        elif args[0] == '-n': max_changes = int(args[1])
+        elif args[0] == '-g': golden = args[1]
+        elif args[0] == '-t': tolerance = float(args[1]) / 100
+        else: usage()
+        del args[:2]
+    len(args) == 1 or usage()
+    if rewrite and golden is None: usage()
+
+    hex_filename = os.path.join(args[0], 'flash.hex')
+    if golden is not None and not rewrite:
+        differences = gpio_trace.check(hex_filename, golden, tolerance)
+        for line in differences: print(line)
+        if differences: sys.exit(1)
+    else:
+        trace = gpio_trace.capture_hex(hex_filename, max_cycles, max_changes)
+        if golden is None:
+            for line in gpio_trace.format_trace(trace): print(line)
+        else:
+            gpio_trace.write(trace, golden)
+            print("wrote {} changes to {}".format(len(trace), golden))
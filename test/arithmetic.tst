@@ -0,0 +1,43 @@
+# arithmetic.tst
+
+Compile and run each of the packages in examples/arithmetic on the simulator
+and check the values left in its global variables (see
+examples/arithmetic/README).  Each result is None if the package left the
+values in its expected.vars:
+
+>>> import os
+>>> from ucc.database import crud
+>>> from ucc.simulator import bench
+
+>>> arithmetic_dir = os.path.join(bench.Root_dir, 'examples', 'arithmetic')
+>>> def check(package):
+...     result = bench.run_kernel(package, arithmetic_dir)
+...     return result.error
+
+A '/' of two ints rounds down, whatever the signs of its operands:
+
+>>> check('signed_divide')
+
+And so does a '/' by a power of 2, which is an arithmetic shift:
+
+>>> check('signed_shift')
+
+A '*' of two signed bytes gives their whole 16-bit product:
+
+>>> check('signed_multiply')
+
+A constant used by both word and byte triples doesn't keep the byte ones from
+being narrowed.  Here the 1 of 'x + 1' is shared with the counter of the outer
+'repeat', which still gets a single register with a DEC:
+
+>>> check('repeat_counter')
+>>> with crud.db_connection(os.path.join(arithmetic_dir, 'repeat_counter')):
+...     list(crud.fetchall('''
+...         select c.opcode
+...           from assembler_code c
+...                inner join assembler_blocks b on c.block_id = b.id
+...                inner join symbol_table sym on b.word_symbol_id = sym.id
+...          where sym.label = 'run'
+...          order by b.address, c.inst_order
+...       ''', ctor=lambda row: row[0]))
+['LDI', 'LDI', 'DEC', 'BRNE', 'ADIW', 'DEC', 'BRNE', 'RET']
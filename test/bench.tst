@@ -0,0 +1,49 @@
+# bench.tst
+
+    >>> import os
+    >>> import shutil
+    >>> import tempfile
+    >>> from ucc.database import crud
+    >>> from ucc.simulator import avr, bench
+
+A kernel that leaves 3700 in its global var 'total' (pinned in Z) and has
+another global var 'scaled' (pinned in X):
+
+    >>> kernel_dir = os.path.join(tempfile.gettempdir(), 'bench_test')
+    >>> shutil.rmtree(kernel_dir, ignore_errors = True)
+    >>> os.mkdir(kernel_dir)
+    >>> with crud.db_connection(kernel_dir, create = True) as db_conn:
+    ...     with db_conn.db_transaction():
+    ...         _ = crud.insert('symbol_table', id=1, label='total', kind='var')
+    ...         _ = crud.insert('symbol_table', id=2, label='scaled',
+    ...                         kind='var')
+    ...         _ = crud.insert('reg_use', kind='global', ref_id=1,
+    ...                         assigned_register='Z')
+    ...         _ = crud.insert('reg_use', kind='global', ref_id=2,
+    ...                         assigned_register='X')
+
+    >>> cpu = avr.cpu()
+    >>> cpu.load_words(0, (0xe7e4, 0xe0fe))    # ldi r30,0x74; ldi r31,0x0e
+    >>> cpu.run_instructions(2)
+
+    >>> def write(filename, *lines):
+    ...     with open(os.path.join(kernel_dir, filename), 'wt') as f:
+    ...         for line in lines: print(line, file = f)
+    >>> write(bench.Expected_trace, '# cycle port value')
+
+Every global var must be checked, so leaving 'scaled' out of the
+expected.vars fails:
+
+    >>> bench.check(cpu, [], kernel_dir)
+    'scaled: not in expected.vars'
+    >>> write(bench.Expected_vars, 'total 3700')
+    >>> bench.check(cpu, [], kernel_dir)
+    'scaled: not in expected.vars'
+
+Once it's there, the values are checked:
+
+    >>> write(bench.Expected_vars, 'total 3700', 'scaled 454')
+    >>> bench.check(cpu, [], kernel_dir)
+    'scaled is 0, expected 454'
+    >>> write(bench.Expected_vars, 'total 3700', 'scaled 0')
+    >>> bench.check(cpu, [], kernel_dir)
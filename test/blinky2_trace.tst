@@ -0,0 +1,10 @@
+# blinky2_trace.tst
+
+Run the blinky2 example on the simulator and compare the changes it makes to
+the output ports against its golden trace (test/traces/blinky2.trace):
+
+>>> import blinky_examples
+
+>>> blinky_examples.test_trace('blinky2')
+[]
+
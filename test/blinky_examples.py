@@ -5,6 +5,7 @@ r'''Helper functions for blinky tests.
 
 import os, sys
 from scripts import compile
+from ucc.simulator import gpio_trace
 
 def del_file(filename):
     if os.path.exists(filename):
@@ -12,6 +13,7 @@ def del_file(filename):
 
 def del_files(del_db = True):
     del_file('flash.hex')
+    del_file('flash.map')
     del_file('parser.py')
     del_file('parser.pyc')
     del_file('parser_tables.py')
@@ -19,6 +21,7 @@ def del_files(del_db = True):
     if (del_db): del_file('ucc.db')
 
 os.chdir(sys.path[0])
+traces_dir = os.path.abspath(os.path.join('test', 'traces'))
 os.chdir('examples')
 
 target_blinky = ''':100000000c9434000c9400000c9400000c9400003c
@@ -40,34 +43,8 @@ if target_blinky[-2] != '\r':
     target_blinky = target_blinky.replace('\n', '\r\n')
 
 target_blinky2 = [
-''':100000000c9434000c9400000c9400000c9400003c
-:100010000c9400000c9400000c9400000c94000060
-:100020000c9400000c9400000c9400000c94000050
-:100030000c9400000c9400000c9400000c94000040
-:100040000c9400000c9400000c9400000c94000030
-:100050000c9400000c9400000c9400000c94000020
-:100060000c9400000c94000011241fbecfefd8e0c8
-:10007000debfcdbf0e943d00ffcf1d9a80e293e01e
-:10008000a8eeb3e01197aa2bab0711f00c94420035
-:100090000197882b890711f00c9440000c943d00c7
-:00000001FF
-''',
-
-''':100000000c9434000c9400000c9400000c9400003c
-:100010000c9400000c9400000c9400000c94000060
-:100020000c9400000c9400000c9400000c94000050
-:100030000c9400000c9400000c9400000c94000040
-:100040000c9400000c9400000c9400000c94000030
-:100050000c9400000c9400000c9400000c94000020
-:100060000c9400000c94000011241fbecfefd8e0c8
-:10007000debfcdbf0e943d00ffcf80e293e01d9a1e
-:10008000a8eeb3e01197aa2bab0711f00c94420035
-:100090000197882b890711f00c9440000c943d00c7
-:00000001FF
-''',
-
-# after adding attempt_number, the registers seem to be assigned in the
-# reverse order...
+# the peephole optimizer drops the 'SBIW d, 0' after each 'SBIW d, 1' and
+# turns each BREQ over a JMP back to the top of a loop into a BRNE to it...
 ''':100000000c9434000c9400000c9400000c9400003c
 :100010000c9400000c9400000c9400000c94000060
 :100020000c9400000c9400000c9400000c94000050
@@ -76,8 +53,7 @@ target_blinky2 = [
 :100050000c9400000c9400000c9400000c94000020
 :100060000c9400000c94000011241fbecfefd8e0c8
 :10007000debfcdbf0e943d00ffcf1d9aa0e2b3e0de
-:1000800088ee93e00197882b890711f00c944200c9
-:100090001197aa2bab0711f00c9440000c943d0073
+:1000800088ee93e00197f1f71197d1f70c943d00ba
 :00000001FF
 ''',
 
@@ -90,8 +66,7 @@ target_blinky2 = [
 :100050000c9400000c9400000c9400000c94000020
 :100060000c9400000c94000011241fbecfefd8e0c8
 :10007000debfcdbf0e943d00ffcfa0e2b3e01d9ade
-:1000800088ee93e00197882b890711f00c944200c9
-:100090001197aa2bab0711f00c9440000c943d0073
+:1000800088ee93e00197f1f71197d1f70c943d00ba
 :00000001FF
 ''',
 ]
@@ -107,3 +82,19 @@ def test_compile(directory, del_db = True):
     with open('flash.hex', 'rt', encoding='ascii', newline='') as f:
         return f.read()
 
+
+def test_trace(directory, tolerance = None):
+    r'''Compiles 'directory' and compares its trace to the golden trace.
+
+    The golden trace is test/traces/<directory>.trace.  Returns the list of
+    differences.
+    '''
+    test_compile(directory)
+    try:
+        return gpio_trace.check('flash.hex',
+                                os.path.join(traces_dir,
+                                             directory + '.trace'),
+                                tolerance)
+    finally:
+        del_files()
+        os.chdir('..')
@@ -0,0 +1,11 @@
+# blinky_trace.tst
+
+Run the blinky example on the simulator and compare the changes it makes to
+the output ports against its golden trace (test/traces/blinky.trace).  The
+order and values of the changes must match exactly, the timing within 10%:
+
+>>> import blinky_examples
+
+>>> blinky_examples.test_trace('blinky', 0.1)
+[]
+
@@ -0,0 +1,122 @@
+# block_dataflow.tst
+
+    >>> import os
+    >>> import tempfile
+    >>> from ucc.compiler import block_dataflow
+    >>> from ucc.database import crud, optimizer_prep
+
+Open a dummy database:
+
+    >>> Db_file = os.path.join(tempfile.gettempdir(), 'bd_test.db')
+    >>> db_conn = crud.db_connection(Db_file, create = True, delete = True)
+    >>> db_conn.dummy_transaction()
+
+We'll have a function 'f' with a local variable 'x' and a global variable
+'g', and a function 'h' that sets 'g':
+
+    f:      set x 0
+    test:   if x < 10: goto body (else goto done)
+    body:   set x x + 1
+            goto test
+    done:   set g x
+            h
+            return
+
+    >>> _ = crud.insert('symbol_table', id=1, label='f', kind='function')
+    >>> _ = crud.insert('symbol_table', id=2, label='g', kind='var')
+    >>> _ = crud.insert('symbol_table', id=3, label='x', kind='var',
+    ...                 context=1)
+    >>> _ = crud.insert('symbol_table', id=4, label='h', kind='function')
+    >>> _ = crud.insert('fn_global_var_uses', fn_id=4, var_id=2, sets=True)
+    >>> _ = crud.insert('blocks', id=1, name='f', word_symbol_id=1,
+    ...                 next='test')
+    >>> _ = crud.insert('blocks', id=2, name='test', word_symbol_id=1,
+    ...                 next='done', next_conditional='body')
+    >>> _ = crud.insert('blocks', id=3, name='body', word_symbol_id=1,
+    ...                 next='test')
+    >>> _ = crud.insert('blocks', id=4, name='done', word_symbol_id=1)
+
+    >>> def triple(id, block_id, operator, *params, int1=None, symbol_id=None,
+    ...            sets=None):
+    ...     _ = crud.insert('triples', id=id, block_id=block_id,
+    ...                     operator=operator, int1=int1, symbol_id=symbol_id)
+    ...     for i, param in enumerate(params, 1):
+    ...         _ = crud.insert('triple_parameters', parent_id=id,
+    ...                         parameter_id=param, parameter_num=i)
+    ...     if sets is not None:
+    ...         _ = crud.insert('triple_labels', triple_id=id, symbol_id=sets,
+    ...                         is_gen=True)
+
+    >>> triple(1, 1, 'int', int1=0, sets=3)
+    >>> triple(2, 2, 'local', symbol_id=3)
+    >>> triple(3, 2, 'int', int1=10)
+    >>> triple(4, 2, 'if-<', 2, 3)
+    >>> triple(5, 3, 'local', symbol_id=3)
+    >>> triple(6, 3, 'int', int1=1)
+    >>> triple(7, 3, '+', 5, 6, sets=3)
+    >>> triple(8, 4, 'local', symbol_id=3, sets=2)
+    >>> triple(9, 4, 'call_direct', symbol_id=4)
+    >>> triple(10, 4, 'return')
+
+    >>> optimizer_prep.fill_block_successors()
+
+    >>> Names = {1: 'f', 2: 'g', 3: 'x', 4: 'h'}
+    >>> Blocks = {1: 'f', 2: 'test', 3: 'body', 4: 'done'}
+    >>> def show(facts, fact_name):
+    ...     for block_id in sorted(facts):
+    ...         print(Blocks[block_id], sorted(fact_name(fact)
+    ...                                        for fact in facts[block_id]))
+
+Reaching definitions, as (variable, triple_id).  The call to 'h' defines 'g'
+too, but doesn't kill the other definitions of 'g':
+
+    >>> ins, outs = block_dataflow.reaching_definitions()
+    >>> def definition(d): return Names[d[0]], d[1]
+    >>> show(ins, definition)
+    f []
+    test [('x', 1), ('x', 7)]
+    body [('x', 1), ('x', 7)]
+    done [('x', 1), ('x', 7)]
+    >>> show(outs, definition)
+    f [('x', 1)]
+    test [('x', 1), ('x', 7)]
+    body [('x', 7)]
+    done [('g', 8), ('g', 9), ('x', 1), ('x', 7)]
+
+These are also stored in the ins and outs tables:
+
+    >>> tuple(crud.read_as_tuples('outs', 'symbol_id', 'triple_id',
+    ...                           block_id=3))
+    ((3, 7),)
+
+Live variables.  The global 'g' is live at the end of the function, but 'x'
+is dead once 'done' has read it:
+
+    >>> ins, outs = block_dataflow.live_variables()
+    >>> show(ins, Names.get)
+    f []
+    test ['x']
+    body ['x']
+    done ['x']
+    >>> show(outs, Names.get)
+    f ['x']
+    test ['x']
+    body ['x']
+    done ['g']
+
+Available expressions, by their operator and int1.  The 'x < 10' comparison
+is a branch, which isn't an expression, and setting 'x' in 'body' kills the
+'local x':
+
+    >>> ins, outs = block_dataflow.available_expressions()
+    >>> def expression(e): return e[0], e[1]
+    >>> show(ins, expression)
+    f []
+    test [('int', 0)]
+    body [('int', 0), ('int', 10), ('local', None)]
+    done [('int', 0), ('int', 10), ('local', None)]
+    >>> show(outs, expression)
+    f [('int', 0)]
+    test [('int', 0), ('int', 10), ('local', None)]
+    body [('int', 0), ('int', 1), ('int', 10)]
+    done [('int', 0), ('int', 10), ('local', None)]
@@ -0,0 +1,62 @@
+# break_links.tst
+
+    >>> import os
+    >>> import tempfile
+    >>> from ucc.codegen import codegen, assign_registers
+    >>> from ucc.database import crud
+
+Open a dummy database:
+
+    >>> Db_file = os.path.join(tempfile.gettempdir(), 'bl_test.db')
+    >>> db_conn = crud.db_connection(Db_file, create = True, delete = True)
+    >>> db_conn.dummy_transaction()
+    >>> db_conn.attach(os.path.join(os.path.dirname(codegen.__file__),
+    ...                             'avr.db'),
+    ...                'architecture')
+
+Register_group 3 needs one of the 'offset' registers (Y or Z), but its
+neighbor 1 has been given Y and its neighbor 2 has been given Z:
+
+    >>> offset = crud.read1_column('reg_class', 'id', name='offset')
+    >>> _ = crud.insert('register_group', id=1, attempt_number=1,
+    ...                 reg_class=offset, assigned_register='Y')
+    >>> _ = crud.insert('register_group', id=2, attempt_number=1,
+    ...                 reg_class=offset, assigned_register='Z')
+    >>> _ = crud.insert('register_group', id=3, attempt_number=1,
+    ...                 reg_class=offset, assignment_certain=False)
+    >>> _ = crud.insert('rg_neighbors', id=1, attempt_number=1, rg1=1, rg2=3)
+    >>> _ = crud.insert('rg_neighbors', id=2, attempt_number=1, rg1=2, rg2=3)
+
+Breaking link 1 would free Y, but its moves would run on each of the 100
+passes of a loop.  Freeing Z needs both links 2 and 3 broken, but their
+moves only run once each:
+
+    >>> def link(rul_id, spill_cost, rg_neighbor_id):
+    ...     ru_1 = crud.insert('reg_use', kind='triple-output', ref_id=rul_id,
+    ...                        spill_cost=spill_cost)
+    ...     ru_2 = crud.insert('reg_use', kind='triple', ref_id=rul_id,
+    ...                        position_kind='parameter', position=1,
+    ...                        spill_cost=spill_cost)
+    ...     _ = crud.insert('reg_use_linkage', id=rul_id,
+    ...                     reg_use_1=ru_1, reg_use_2=ru_2)
+    ...     _ = crud.insert('overlaps', attempt_number=1, linkage_id=rul_id,
+    ...                     reg_use_id=ru_1, rg_neighbor_id=rg_neighbor_id)
+    >>> link(1, 100, 1)
+    >>> link(2, 1, 2)
+    >>> link(3, 1, 2)
+
+The cheaper links are broken, even though there are more of them:
+
+    >>> assign_registers.break_links(1)
+    >>> tuple(crud.read_as_tuples('reg_use_linkage', 'id', 'broken',
+    ...                           order_by='id'))
+    ((1, 0), (2, 1), (3, 1))
+
+Once the moves for link 1 are cheaper, it is broken instead:
+
+    >>> _ = crud.update('reg_use_linkage', {}, broken=0)
+    >>> _ = crud.update('reg_use', {}, spill_cost=1)
+    >>> assign_registers.break_links(1)
+    >>> tuple(crud.read_as_tuples('reg_use_linkage', 'id', 'broken',
+    ...                           order_by='id'))
+    ((1, 1), (2, 0), (3, 0))
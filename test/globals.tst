@@ -0,0 +1,29 @@
+# globals.tst
+
+Compile and run each of the packages in examples/globals on the simulator
+and check the values left in its global variables (see
+examples/globals/README).  Each result is None if the package left the values
+in its expected.vars:
+
+>>> import os
+>>> from ucc.simulator import bench
+
+>>> globals_dir = os.path.join(bench.Root_dir, 'examples', 'globals')
+>>> def check(package):
+...     result = bench.run_kernel(package, globals_dir)
+...     return result.error
+
+The value of y is set from the value of x before x is set again, but x's
+store must not be run before y's is done with the old value:
+
+>>> check('interleaved')
+>>> check('interleaved_loop')
+
+The register of a global variable must still hold its value when the
+variable is read, however it was stored, and must start out holding the
+variable's initial value (0 if it doesn't have one):
+
+>>> check('read_then_set')
+>>> check('overwritten_store')
+>>> check('four_words')
+>>> check('initial_value')
@@ -0,0 +1,25 @@
+# operators_trace.tst
+
+Run the operators example on the simulator and compare the changes it makes
+to the output ports against its golden trace (test/traces/operators.trace).
+
+Its 'run' task counts the global var x from 1 to 20, and each test toggles
+its own pin when it comes out true:
+
+    times-pin (portd 0x04)          x * 3 = 9, x * x = 49
+    and-pin (portd 0x08)            (x bit-and 3) = 0
+    or-pin (portd 0x10)             (x bit-or 1) = 7
+    xor-pin (portd 0x20)            (x bit-xor 5) = 1
+    not-pin (portd 0x40)            (bit-not x) = -5
+    negate-pin (portd 0x80)         -x = -4
+    compare-pin (portb 0x01)        x < 3, x <= 1, x = 10, x > 18, x >= 20
+    shift-left-pin (portb 0x02)     x * 8 = 40, x * 16 = 96
+    shift-right-pin (portb 0x04)    (x bit-and 255) / 4 = 2
+
+Then the done-pin (portb 0x20) is toggled, so a test that fires too often
+shows up as well as one that doesn't fire:
+
+>>> import blinky_examples
+
+>>> blinky_examples.test_trace('operators')
+[]
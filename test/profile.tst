@@ -0,0 +1,39 @@
+# profile.tst
+
+Compiling a bench kernel again with the execution profile of a run of it
+(see ucc.simulator.profile) lays out its blocks and functions for the paths
+taken most (see ucc.codegen.expand_assembler.order_by_profile).  This must
+never cost cycles.
+
+>>> import os
+>>> from ucc.simulator import bench, profile
+
+>>> def no_slower_with_profile(kernel):
+...     kernel_dir = os.path.join(bench.Bench_dir, kernel)
+...     profile_filename = os.path.join(kernel_dir, 'flash.profile')
+...     if os.path.exists(profile_filename): os.remove(profile_filename)
+...     before = bench.run_kernel(kernel)
+...     profile.write(kernel_dir)
+...     try:
+...         after = bench.run_kernel(kernel)
+...     finally:
+...         os.remove(profile_filename)
+...     assert before.ok and after.ok, (before, after)
+...     return after.cycles <= before.cycles
+
+In if_chain, the hot edge out of each 'if' goes to its next_conditional, so
+its conditional branch is inverted to fall through to it:
+
+>>> no_slower_with_profile('if_chain')
+True
+
+The repeat loops keep their test at the bottom:
+
+>>> no_slower_with_profile('nested_repeat')
+True
+
+>>> no_slower_with_profile('table_lookup')
+True
+
+>>> no_slower_with_profile('pin_toggle')
+True
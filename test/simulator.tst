@@ -0,0 +1,190 @@
+# simulator.tst
+
+Test the AVR simulator:
+
+    >>> import os
+    >>> import tempfile
+    >>> from ucc.assembler import asm_opcodes
+    >>> from ucc.simulator import avr
+
+A little assembler for the tests, takes (label, opcode, op1, op2) tuples:
+
+    >>> def assemble(*lines):
+    ...     labels = {}
+    ...     address = 0
+    ...     for label, opcode, op1, op2 in lines:
+    ...         if label: labels[label] = address
+    ...         address += getattr(asm_opcodes, opcode).length(op1, op2)[1]
+    ...     bytes = []
+    ...     for label, opcode, op1, op2 in lines:
+    ...         bytes.extend(getattr(asm_opcodes, opcode)
+    ...                        .assemble(op1, op2, labels, len(bytes)))
+    ...     return [bytes[i] | (bytes[i + 1] << 8)
+    ...             for i in range(0, len(bytes), 2)]
+
+    >>> def run(*lines):
+    ...     cpu = avr.cpu()
+    ...     lines += ((None, 'SLEEP', None, None),)
+    ...     cpu.load_words(0, assemble(*lines))
+    ...     cpu.run(10000)
+    ...     assert cpu.halted
+    ...     return cpu
+
+    >>> def flags(cpu):
+    ...     return ''.join(name if cpu.data[avr.SREG] & bit else '-'
+    ...                    for name, bit in zip('ITHSVNZC',
+    ...                                         (avr.I, avr.T, avr.H, avr.S,
+    ...                                          avr.V, avr.N, avr.Z, avr.C)))
+
+Arithmetic:
+
+    >>> c = run((None, 'LDI', 'r16', '0x7F'),
+    ...         (None, 'LDI', 'r17', '1'),
+    ...         (None, 'ADD', 'r16', 'r17'))
+    >>> hex(c.data[16]), flags(c)
+    ('0x80', '--H-VN--')
+
+    >>> c = run((None, 'LDI', 'r24', '0xFF'),
+    ...         (None, 'LDI', 'r25', '0x00'),
+    ...         (None, 'ADIW', 'r24', '1'))
+    >>> hex(c.reg16(24)), flags(c)
+    ('0x100', '--------')
+
+    >>> c = run((None, 'LDI', 'r24', '0'),
+    ...         (None, 'LDI', 'r25', '0'),
+    ...         (None, 'SBIW', 'r24', '1'))
+    >>> hex(c.reg16(24)), flags(c)
+    ('0xffff', '---S-N-C')
+
+16 bit compare with CP/CPC (Z is only kept by CPC):
+
+    >>> c = run((None, 'LDI', 'r16', '0x00'),
+    ...         (None, 'LDI', 'r17', '0x01'),
+    ...         (None, 'LDI', 'r18', '0x00'),
+    ...         (None, 'LDI', 'r19', '0x02'),
+    ...         (None, 'CP', 'r16', 'r18'),
+    ...         (None, 'CPC', 'r17', 'r19'))
+    >>> flags(c)
+    '--HS-N-C'
+
+    >>> c = run((None, 'LDI', 'r16', '0x34'),
+    ...         (None, 'LDI', 'r17', '0x12'),
+    ...         (None, 'SUBI', 'r16', '0x35'),
+    ...         (None, 'SBCI', 'r17', '0x12'))
+    >>> hex(c.reg16(16)), flags(c)
+    ('0xffff', '--HS-N-C')
+
+Multiply:
+
+    >>> c = run((None, 'LDI', 'r16', '200'),
+    ...         (None, 'LDI', 'r17', '100'),
+    ...         (None, 'MUL', 'r16', 'r17'))
+    >>> c.reg16(0), flags(c)
+    (20000, '--------')
+
+    >>> c = run((None, 'LDI', 'r16', '0xFE'),      # -2
+    ...         (None, 'LDI', 'r17', '3'),
+    ...         (None, 'MULS', 'r16', 'r17'))
+    >>> hex(c.reg16(0)), flags(c)
+    ('0xfffa', '-------C')
+
+    >>> c = run((None, 'LDI', 'r16', '0x40'),      # 0.5 in 1.7 format
+    ...         (None, 'LDI', 'r17', '0x40'),
+    ...         (None, 'FMUL', 'r16', 'r17'))
+    >>> hex(c.reg16(0))                            # 0.25 in 1.15 format
+    '0x2000'
+
+Shifts:
+
+    >>> c = run((None, 'LDI', 'r16', '0x81'),
+    ...         (None, 'LSR', 'r16', None))
+    >>> hex(c.data[16]), flags(c)
+    ('0x40', '---SV--C')
+
+    >>> c = run((None, 'LDI', 'r16', '0x81'),
+    ...         (None, 'ASR', 'r16', None))
+    >>> hex(c.data[16]), flags(c)
+    ('0xc0', '---S-N-C')
+
+Branches, skips and cycle counts:
+
+    >>> c = run((None, 'LDI', 'r16', '10'),
+    ...         ('loop', 'DEC', 'r16', None),
+    ...         (None, 'BRNE', 'loop', None))
+    >>> c.data[16], c.cycles
+    (0, 30)
+
+    >>> c = run((None, 'LDI', 'r16', '1'),
+    ...         (None, 'SBRS', 'r16', '0'),
+    ...         (None, 'JMP', 'skipped', None),
+    ...         (None, 'LDI', 'r17', '1'),
+    ...         ('skipped', 'NOP', None, None))
+    >>> c.data[17], c.cycles
+    (1, 6)
+
+Memory and the stack:
+
+    >>> c = run((None, 'LDI', 'r26', '0x00'),
+    ...         (None, 'LDI', 'r27', '0x01'),
+    ...         (None, 'LDI', 'r16', '0x55'),
+    ...         (None, 'ST', 'X+', 'r16'),
+    ...         (None, 'ST', 'X+', 'r16'),
+    ...         (None, 'LDI', 'r30', '0x00'),
+    ...         (None, 'LDI', 'r31', '0x01'),
+    ...         (None, 'LDD', 'r17', 'Z+1'),
+    ...         (None, 'STS', '0x200', 'r17'),
+    ...         (None, 'LDS', 'r18', '0x200'))
+    >>> hex(c.reg16(26)), hex(c.data[0x101]), hex(c.data[18])
+    ('0x102', '0x55', '0x55')
+
+    >>> c = run((None, 'LDI', 'r16', '0x12'),
+    ...         (None, 'PUSH', 'r16', None),
+    ...         (None, 'RCALL', 'sub', None),
+    ...         (None, 'POP', 'r17', None),
+    ...         (None, 'RJMP', 'done', None),
+    ...         ('sub', 'LDI', 'r18', '1'),
+    ...         (None, 'RET', None, None),
+    ...         ('done', 'NOP', None, None))
+    >>> hex(c.data[17]), c.data[18], c.get_sp() == avr.Ram_end, c.stack_used()
+    ('0x12', 1, True, 3)
+
+LPM reads the flash:
+
+    >>> c = run((None, 'LDI', 'r30', '2'),
+    ...         (None, 'LDI', 'r31', '0'),
+    ...         (None, 'LPM', 'r16', 'Z+'),
+    ...         (None, 'LPM', 'r17', 'Z'))
+    >>> c.data[16] | (c.data[17] << 8) == c.flash[1], c.reg16(30)
+    (True, 3)
+
+I/O, PINx writes toggle PORTx:
+
+    >>> c = run((None, 'LDI', 'r16', '0x20'),
+    ...         (None, 'OUT', 'io.ddrb', 'r16'),
+    ...         (None, 'SBI', 'io.portb', '0'),
+    ...         (None, 'SBI', 'io.pinb', '5'),
+    ...         (None, 'SBIS', 'io.pinb', '5'),
+    ...         (None, 'LDI', 'r17', '1'))
+    >>> hex(c.data[0x25]), hex(c.data[0x23]), c.data[17]
+    ('0x21', '0x21', 0)
+
+    >>> c.set_input(0x23, 0x02)
+    >>> hex(c.data[0x23])
+    '0x22'
+
+Run the blinky example:
+
+    >>> import blinky_examples
+    >>> hex_filename = os.path.join(tempfile.gettempdir(), 'sim_test.hex')
+    >>> with open(hex_filename, 'wt', newline='') as f:
+    ...     _ = f.write(blinky_examples.target_blinky)
+
+    >>> c = avr.cpu()
+    >>> c.load_hex(hex_filename)
+    >>> writes = []
+    >>> c.watch(0x25, lambda cpu, address, value:
+    ...                 writes.append((cpu.cycles, hex(value))))
+    >>> c.run(100000)
+    >>> writes
+    [(14, '0xdf'), (35, '0xff'), (31288, '0xdf'), (62541, '0xff'), (93794, '0xdf')]
+    >>> os.remove(hex_filename)
@@ -0,0 +1,24 @@
+# tables.tst
+
+Compile and run each of the packages in examples/tables on the simulator and
+check the values left in its global variables (see examples/tables/README).
+Each result is None if the package left the values in its expected.vars:
+
+>>> import os
+>>> from ucc.simulator import bench
+
+>>> tables_dir = os.path.join(bench.Root_dir, 'examples', 'tables')
+>>> def check(package):
+...     result = bench.run_kernel(package, tables_dir)
+...     return result.error
+
+The table read is a value like any other, wherever it is in the expression:
+
+>>> check('table_read')
+>>> check('table_read_sum')
+>>> check('table_read_parens')
+
+A table has one index:
+
+>>> check('table_two_indexes')
+'AssertionError: levels: expected one index, got 2'
@@ -0,0 +1,20 @@
+# unreferenced_words.tst
+
+The code of a word that the program never gets to is left out of the flash
+(see ucc.database.assembler.delete_unreferenced_words).
+
+>>> import os
+>>> from ucc.simulator import bench
+
+>>> def symbols(kernel):
+...     assert bench.run_kernel(kernel).error is None
+...     with open(os.path.join(bench.Bench_dir, kernel, 'flash.map')) as f:
+...         return [line.split()[-1] for line in f
+...                                  if not line.startswith('#')]
+
+In the call_chain bench kernel, 'third' is small enough to be inlined into
+'second', its only caller, so nothing calls it any more.  'first' calls
+'second' last, so it just falls through to it:
+
+>>> symbols('call_chain')
+['startup', 'first', 'second', 'run']
@@ -335,6 +335,28 @@ class inst1:
         if 'end' in self.notes: return self.notes['end']
         return False
 
+    def in_range(self, op1, op2, labels, address):
+        r'''Can this instruction at 'address' reach its target label?
+
+        Only relative jumps and branches have a limited range.  The target
+        must be in 'labels'.
+
+            >>> brne = inst1('BRNE', '1111 01kk kkkk k001', (1, 2),
+            ...              k=(-64,63))
+            >>> brne.in_range('foo', None, {'foo': 0x100}, 0x80)
+            True
+            >>> brne.in_range('foo', None, {'foo': 0x100}, 0x00)
+            False
+            >>> brne.in_range('foo', None, {}, 0x100)
+            False
+        '''
+        if not isinstance(self.notes.get('k'), tuple): return True
+        target = self.make_args(op1, op2)['k']
+        if target not in labels: return False
+        low, high = self.notes['k']
+        offset = (labels[target] - address - self.length(op1, op2)[1]) // 2
+        return low <= offset <= high
+
     def make_args(self, op1, op2):
         if len(self.operand_codes) == 0:
             assert op1 is None and op2 is None, \
@@ -381,6 +403,49 @@ class inst2(inst1):
         yield int((bits >> 8) & 0xff)
 
 
+class relaxed(inst1):
+    r'''Pseudo instruction for a relative or absolute jump or call.
+
+    This is replaced by the 'short' (relative) instruction if its target label
+    is in range, and the 'long' (absolute) instruction if not.  The choice is
+    made by `ucc.assembler.assemble.relax` before the final addresses are
+    assigned.  If it's never relaxed, it assembles as the 'long' instruction.
+
+        >>> xcall = relaxed('XCALL', inst1('RCALL', '1101 kkkk kkkk kkkk', 3,
+        ...                                k=(-2048,2047)),
+        ...                          inst2('CALL', '1001 010k kkkk 111k '
+        ...                                        'kkkk kkkk kkkk kkkk', 4))
+        >>> xcall.length('foo', None)
+        (2, 4)
+        >>> xcall.choose('foo', {'foo': 0x1000}, 0x100).name
+        'RCALL'
+        >>> xcall.choose('foo', {'foo': 0x1000}, 0x2000).name
+        'CALL'
+        >>> xcall.choose('foo', {}, 0x100).name
+        'CALL'
+    '''
+    def __init__(self, name, short, long):
+        self.name = name
+        self.short = short
+        self.long = long
+        self.cycles = long.cycles
+        self.notes = long.notes
+
+    def length(self, op1, op2):
+        return self.short.length(op1, op2)[0], self.long.length(op1, op2)[1]
+
+    def choose(self, op1, labels, address):
+        r'''Returns the instruction to use at 'address'.
+
+        The label addresses in 'labels' must not increase later.
+        '''
+        if self.short.in_range(op1, None, labels, address): return self.short
+        return self.long
+
+    def assemble(self, op1, op2, labels, address):
+        return self.long.assemble(op1, op2, labels, address)
+
+
 class bytes(inst1):
     r'''Data declaration.
 
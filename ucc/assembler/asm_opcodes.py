@@ -6,7 +6,8 @@ Each instruction is stored as a module variable name matching the opcode for
 that instruction.
 '''
 
-from .asm_inst import inst1, inst2, bytes, int8, int16, int32, zeroes
+from .asm_inst import inst1, inst2, relaxed, bytes, int8, int16, int32, \
+                       zeroes
 
 # Arithmetic and logic instructions
 ADD = inst1('ADD', '0000 11rd dddd rrrr', 1)
@@ -45,6 +46,8 @@ JMP = inst2('JMP', '1001 010k kkkk 110k kkkk kkkk kkkk kkkk', 3, end=True)
 RCALL = inst1('RCALL', '1101 kkkk kkkk kkkk', 3, k=(-2048,2047))
 ICALL = inst1('ICALL', '1001 0101 0000 1001', 3)
 CALL = inst2('CALL', '1001 010k kkkk 111k kkkk kkkk kkkk kkkk', 4)
+XJMP = relaxed('XJMP', RJMP, JMP)       # RJMP if in range, else JMP
+XCALL = relaxed('XCALL', RCALL, CALL)   # RCALL if in range, else CALL
 RET = inst1('RET', '1001 0101 0000 1000', 4, end=True)
 RETI = inst1('RETI', '1001 0101 0001 1000', 4, end=True)
 CPSE = inst1('CPSE', '0001 00rd dddd rrrr', (1,2,3))
@@ -6,26 +6,89 @@ r'''The AVR assembler.
 import itertools
 
 from ucc.database import assembler, crud
-from ucc.assembler import asm_opcodes, hex_file
+from ucc.assembler import asm_inst, asm_opcodes, hex_file, map_file
 from ucc.codegen import expand_assembler
 
+def max_addresses(section, labels, starting_address = 0):
+    r'''Generates the address of each instruction in 'section'.
+
+    Yields (block_id, inst_order, inst, op1, op2, address), where 'inst' is
+    the `asm_inst` object for the opcode.  The labels are added to 'labels'
+    ({label: address}) along the way.
+
+    The addresses are those that the section would have if all of the
+    relaxed pseudo instructions were long, and each block that doesn't fall
+    through to the next block needed a JMP.  Making instructions shorter
+    later only brings the labels closer together.
+    '''
+    last_next = None
+    running_address = starting_address
+    for block_id, block_label, block_address, next_block \
+     in tuple(assembler.gen_blocks(section)):
+        if last_next and last_next != block_label:
+            running_address += \
+              getattr(asm_opcodes, 'JMP').length(last_next, None)[1]
+        address = running_address if block_address is None else block_address
+        labels[block_label] = address
+        for inst_order, label, opcode, op1, op2 \
+         in tuple(assembler.gen_numbered_insts(block_id)):
+            if label is not None:
+                labels[label] = address
+            if opcode is not None:
+                inst = getattr(asm_opcodes, opcode.upper())
+                yield block_id, inst_order, inst, op1, op2, address
+                address += inst.length(op1, op2)[1]
+        if address > running_address:
+            running_address = address
+        last_next = next_block
+
+def relax(section, starting_address = 0):
+    r'''Replaces the relaxed pseudo instructions (like XCALL) in 'section'.
+
+    Each `asm_inst.relaxed` instruction is replaced by its short form if its
+    target is in range, and by its long form otherwise.
+
+    This is done with the addresses that the section would have if all of
+    these instructions were long (see `max_addresses`).  Shortening
+    instructions only brings the labels closer together, so the short forms
+    stay in range.
+    '''
+    labels = {}
+    relaxables = [(block_id, inst_order, inst, op1, address)
+                  for block_id, inst_order, inst, op1, op2, address
+                   in max_addresses(section, labels, starting_address)
+                  if isinstance(inst, asm_inst.relaxed)]
+    for block_id, inst_order, inst, op1, address in relaxables:
+        assembler.update_inst_opcode(block_id, inst_order,
+                                     inst.choose(op1, labels, address).name)
+    return len(relaxables)
+
 def assign_labels(section, labels, starting_address = 0):
     r'''Assign addresses to all labels in 'section'.
 
     Addresses are stored in 'labels' dict.  This is {label: address}.
+
+    Also records the final length of each block, including any JMP needed to
+    get to its next_label.
     '''
     last_next = None
+    last_block_id = None
+    last_length = 0
     running_address = starting_address
     for block_id, block_label, block_address, next_block \
      in assembler.gen_blocks(section):
         if last_next and last_next != block_label:
-            running_address += \
-              getattr(asm_opcodes, 'JMP').length(last_next, None)[1]
+            jmp_length = getattr(asm_opcodes, 'JMP').length(last_next, None)[1]
+            running_address += jmp_length
+            last_length += jmp_length
+        if last_block_id is not None:
+            assembler.update_block_length(last_block_id, last_length)
         if block_address is None:
             address = running_address
             assembler.update_block_address(block_id, address)
         else:
             address = block_address
+        start_address = address
         assert block_label not in labels, \
                "duplicate assembler label: " + block_label
         labels[block_label] = address
@@ -39,6 +102,15 @@ def assign_labels(section, labels, starting_address = 0):
                              .length(op1, op2)[1]
         if address > running_address:
             running_address = address
+        last_next = next_block
+        last_block_id = block_id
+        last_length = address - start_address
+    if last_next is not None:
+        jmp_length = getattr(asm_opcodes, 'JMP').length(last_next, None)[1]
+        running_address += jmp_length
+        last_length += jmp_length
+    if last_block_id is not None:
+        assembler.update_block_length(last_block_id, last_length)
     return running_address
 
 def assemble(section, labels):
@@ -51,11 +123,10 @@ def assemble(section, labels):
     for block_id, block_label, block_address, next_block \
      in assembler.gen_blocks(section):
         if last_next and last_next != block_label:
-            last_address += 1
-            for n in getattr(asm_opcodes, 'JMP') \
-                       .assemble(last_next, None, labels, last_address):
-                yield last_address, n
-                last_address += 1
+            for address, byte in assemble_jmp(last_next, last_address + 1,
+                                              labels):
+                yield address, byte
+                last_address = address
         assert last_address is None or last_address + 1 == block_address, \
                "internal logic error: last_address ({}) != block_address ({})" \
                  .format(last_address, block_address)
@@ -64,11 +135,15 @@ def assemble(section, labels):
             last_address = address
         last_next = next_block
     if last_next is not None:
-        last_address += 1
-        for n in getattr(asm_opcodes, 'JMP') \
-                   .assemble(last_next, None, labels, last_address):
-            yield last_address, n
-            last_address += 1
+        for address, byte in assemble_jmp(last_next, last_address + 1, labels):
+            yield address, byte
+
+def assemble_jmp(label, address, labels):
+    r'''Yields (address, byte) for a JMP to 'label' placed at 'address'.
+    '''
+    for n in getattr(asm_opcodes, 'JMP').assemble(label, None, labels, address):
+        yield address, n
+        address += 1
 
 def assemble_word(block_id, block_address, labels):
     r'''Yields (address, byte) for all instructions in an assembler block.
@@ -89,7 +164,9 @@ def assemble_word(block_id, block_address, labels):
 def assemble_program(package_dir):
     r'''Assemble all of the sections.
 
-    Generates .hex files in package_dir.
+    Generates .hex files and a flash.map file in package_dir.
+
+    Also sets flash_size and ram_size in the symbol_table.
     '''
 
     # Assign addresses to all labels in all sections:
@@ -97,6 +174,7 @@ def assemble_program(package_dir):
 
     with crud.db_transaction():
         # code
+        relax('code')
         start_data = assign_labels('code', labels)
 
         # data
@@ -117,9 +195,16 @@ def assemble_program(package_dir):
         # eeprom
         assign_labels('eeprom', labels)
 
-    # assemble flash and data:
+        assembler.update_symbol_sizes()
+
+    map_file.write(assembler.gen_symbol_extents(), package_dir, 'flash')
+
+    # assemble flash and data (the data's initial values go in the flash
+    # right after the code, at start_data):
     hex_file.write(itertools.chain(assemble('code', labels),
-                                   assemble('data', labels)),
+                                   ((start_data + address, byte)
+                                    for address, byte
+                                     in assemble('data', labels))),
                    package_dir, 'flash')
 
     # check that bss is blank!
@@ -21,6 +21,53 @@ def write(words, package_dir, filetype):
     if not generated_something:
         os.remove(filename)
 
+def read(filename):
+    r'''Generates (address, byte) for each byte in .hex file 'filename'.
+
+    This is the inverse of `write`.
+    '''
+    with open(filename, 'rt', encoding='ascii') as hex_file:
+        for address, byte in parse(hex_file):
+            yield address, byte
+
+def parse(lines):
+    r'''Generates (address, byte) for each data byte in 'lines'.
+
+    Handles data (00), end of file (01) and extended segment address (02)
+    records.
+
+        >>> tuple(parse((':0300100001020fdb', ':00000001FF')))
+        ((16, 1), (17, 2), (18, 15))
+        >>> tuple(parse((':020000021000EC', ':0100000055aa')))
+        ((65536, 85),)
+        >>> tuple(parse((':0300100001020fdc',)))
+        Traceback (most recent call last):
+            ...
+        ValueError: .hex line 1: bad checksum
+    '''
+    base = 0
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line: continue
+        if line[0] != ':':
+            raise ValueError(".hex line {}: missing ':'".format(lineno))
+        if check_sum(line[1:-2]) != int(line[-2:], 16):
+            raise ValueError(".hex line {}: bad checksum".format(lineno))
+        length = int(line[1:3], 16)
+        address = int(line[3:7], 16)
+        record_type = int(line[7:9], 16)
+        data = line[9:9 + 2*length]
+        if record_type == 0:
+            for i in range(length):
+                yield base + address + i, int(data[2*i:2*i + 2], 16)
+        elif record_type == 1:
+            break
+        elif record_type == 2:
+            base = int(data, 16) << 4
+        else:
+            raise ValueError(".hex line {}: unsupported record type {}"
+                               .format(lineno, record_type))
+
 def split(it, size = 16):
     r'''Generates address, bytes where len(bytes) <= size.
 
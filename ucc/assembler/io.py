@@ -5,6 +5,8 @@ r'''This is a list of the ATMega328P IO registers.
 These are presented simply as module variables.  The value of the variable is
 the equivalent RAM address for the IO register (not the IO register number,
 which doesn't apply to all IO registers).
+
+The functions here tell which instructions can reach each IO register.
 '''
 
 clkpr = 0x61
@@ -22,3 +24,39 @@ pinc = 0x26
 portb = 0x25
 ddrb = 0x24
 pinb = 0x23
+
+#: Writing a 1 to a bit of one of these toggles that bit of its PORTx
+#: register.
+Toggle_registers = frozenset(('pinb', 'pinc', 'pind'))
+
+def address(name):
+    r'''Returns the RAM address of the IO register 'name'.
+
+        >>> hex(address('portb'))
+        '0x25'
+    '''
+    return globals()[name]
+
+def bit_addressable(name):
+    r'''True if SBI, CBI, SBIS and SBIC can reach the IO register 'name'.
+
+    These only reach the first 32 IO registers.
+
+        >>> bit_addressable('pinb')
+        True
+        >>> bit_addressable('sreg')
+        False
+    '''
+    return 0x20 <= address(name) < 0x40
+
+def in_out_addressable(name):
+    r'''True if IN and OUT can reach the IO register 'name'.
+
+    These only reach the first 64 IO registers.
+
+        >>> in_out_addressable('sreg')
+        True
+        >>> in_out_addressable('clkpr')
+        False
+    '''
+    return 0x20 <= address(name) < 0x60
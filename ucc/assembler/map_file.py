@@ -0,0 +1,112 @@
+# map_file.py
+
+r'''Reads, writes and compares .map files.
+
+A .map file lists one line per (symbol, section) with the address range and
+size (in bytes) that the symbol occupies in that section:
+
+    section  start   end     size  symbol
+
+Start and end are in hex, end is exclusive.  Lines starting with '#' are
+comments.
+'''
+
+import os
+
+def write(entries, package_dir, filetype):
+    r'''Writes entries to .map file in package_dir.
+
+    'entries' is a sequence of (section, start, end, size, label).
+    '''
+    filename = os.path.join(package_dir, filetype + '.map')
+    with open(filename, 'wt', encoding='ascii') as map_file:
+        map_file.write("# section  start   end     size  symbol\n")
+        for line in format_entries(entries):
+            map_file.write(line + '\n')
+
+def format_entries(entries):
+    r'''Generates the lines of a .map file (without the newlines).
+
+        >>> for line in format_entries((('code', 0, 0x68, 104, 'reset'),
+        ...                             ('data', 0x100, 0x104, 4, 'x'))):
+        ...     print(line)
+        code       0x0000  0x0068   104  reset
+        data       0x0100  0x0104     4  x
+    '''
+    for section, start, end, size, label in entries:
+        yield "{:10} 0x{:04x}  0x{:04x} {:5}  {}" \
+                .format(section, start, end, size, label)
+
+def read(filename):
+    r'''Returns a list of (section, start, end, size, label) from filename.
+    '''
+    with open(filename, 'rt', encoding='ascii') as map_file:
+        return list(parse(map_file))
+
+def parse(lines):
+    r'''Generates (section, start, end, size, label) for each line in 'lines'.
+
+        >>> tuple(parse(('# comment', '',
+        ...              'code       0x0000  0x0068   104  reset')))
+        (('code', 0, 104, 104, 'reset'),)
+    '''
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'): continue
+        section, start, end, size, label = line.split(None, 4)
+        yield section, int(start, 16), int(end, 16), int(size), label
+
+def sizes(entries):
+    r'''Returns {(label, section): size} for 'entries'.
+
+    Entries for the same (label, section) are added together.
+
+        >>> sorted(sizes((('code', 0, 4, 4, 'a'), ('code', 8, 10, 2, 'a'),
+        ...               ('data', 0, 1, 1, 'a'))).items())
+        [(('a', 'code'), 6), (('a', 'data'), 1)]
+    '''
+    ans = {}
+    for section, start, end, size, label in entries:
+        ans[label, section] = ans.get((label, section), 0) + size
+    return ans
+
+def diff(old_entries, new_entries):
+    r'''Compares two maps.
+
+    Returns a list of (label, section, old_size, new_size, delta) for each
+    (label, section) whose size changed.  Symbols missing from one of the maps
+    have a size of None there.  The list is sorted with the biggest growth
+    first.
+
+        >>> for x in diff((('code', 0, 4, 4, 'a'), ('code', 4, 6, 2, 'b'),
+        ...                ('code', 6, 8, 2, 'c')),
+        ...               (('code', 0, 8, 8, 'a'), ('code', 8, 10, 2, 'b'),
+        ...                ('data', 0, 2, 2, 'd'))):
+        ...     print(x)
+        ('a', 'code', 4, 8, 4)
+        ('d', 'data', None, 2, 2)
+        ('c', 'code', 2, None, -2)
+    '''
+    old = sizes(old_entries)
+    new = sizes(new_entries)
+    ans = []
+    for key in set(old.keys()) | set(new.keys()):
+        old_size = old.get(key)
+        new_size = new.get(key)
+        delta = (new_size or 0) - (old_size or 0)
+        if old_size != new_size:
+            ans.append(key + (old_size, new_size, delta))
+    ans.sort(key=lambda x: (-x[4], x[0], x[1]))
+    return ans
+
+def totals(entries):
+    r'''Returns {section: total_size} for 'entries'.
+
+        >>> sorted(totals((('code', 0, 4, 4, 'a'), ('code', 4, 6, 2, 'b'),
+        ...                ('data', 0, 1, 1, 'a'))).items())
+        [('code', 6), ('data', 1)]
+    '''
+    ans = {}
+    for section, start, end, size, label in entries:
+        ans[section] = ans.get(section, 0) + size
+    return ans
@@ -0,0 +1,81 @@
+# profile_file.py
+
+r'''Reads and writes .profile files.
+
+A .profile file has the execution counts from a run of the program.  There
+are three kinds of lines:
+
+    block  function  block_name  count
+    edge   function  from_block  to_block  count
+    call   caller    called      count
+
+The 'block' lines give the number of times that each block was entered, the
+'edge' lines the number of times that control went from one block to another
+within a function, and the 'call' lines the number of times that one function
+called another.  Lines starting with '#' are comments.
+'''
+
+import os
+
+def write(entries, package_dir, filetype):
+    r'''Writes entries to .profile file in package_dir.
+
+    'entries' is a sequence of tuples starting with 'block', 'edge' or
+    'call', as returned by `parse`.
+    '''
+    filename = os.path.join(package_dir, filetype + '.profile')
+    with open(filename, 'wt', encoding='ascii') as profile_file:
+        profile_file.write("# execution counts\n")
+        for line in format_entries(entries):
+            profile_file.write(line + '\n')
+
+def format_entries(entries):
+    r'''Generates the lines of a .profile file (without the newlines).
+
+        >>> for line in format_entries((('block', 'run', 'run', 1),
+        ...                             ('edge', 'run', 'run', 'loop', 1),
+        ...                             ('call', 'run', 'blink', 10))):
+        ...     print(line)
+        block run run 1
+        edge run run loop 1
+        call run blink 10
+    '''
+    for entry in entries:
+        yield ' '.join(str(x) for x in entry)
+
+def read(filename):
+    r'''Returns a list of the entries in 'filename'.
+    '''
+    with open(filename, 'rt', encoding='ascii') as profile_file:
+        return list(parse(profile_file))
+
+def parse(lines):
+    r'''Generates an entry tuple for each line in 'lines'.
+
+    The counts are converted to ints.
+
+        >>> for entry in parse(('# comment', '',
+        ...                     'block run run 1',
+        ...                     'edge run run loop 1',
+        ...                     'call run blink 10')):
+        ...     print(entry)
+        ('block', 'run', 'run', 1)
+        ('edge', 'run', 'run', 'loop', 1)
+        ('call', 'run', 'blink', 10)
+        >>> tuple(parse(('bogus a b',)))
+        Traceback (most recent call last):
+            ...
+        ValueError: .profile line 1: unknown entry 'bogus'
+    '''
+    num_fields = {'block': 4, 'edge': 5, 'call': 4}
+    for lineno, line in enumerate(lines, 1):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'): continue
+        if fields[0] not in num_fields:
+            raise ValueError(".profile line {}: unknown entry {!r}"
+                               .format(lineno, fields[0]))
+        if len(fields) != num_fields[fields[0]]:
+            raise ValueError(".profile line {}: expected {} fields, got {}"
+                               .format(lineno, num_fields[fields[0]],
+                                       len(fields)))
+        yield tuple(fields[:-1]) + (int(fields[-1]),)
@@ -11,6 +11,7 @@ import itertools
 import operator
 
 from ucc.database import crud
+from ucc.codegen import spill_costs
 
 Init_done = False
 
@@ -34,6 +35,12 @@ def create_views():
                                   and n.assigned_register2 notnull
                                   and a.r2 = ric.reg
                              )
+                       and not exists (
+                               select null
+                                 from rg_excluded x
+                                where x.reg_group_id = rg.id
+                                  and x.reg = ric.reg
+                             )
           ''')
 
         crud.execute('''
@@ -144,13 +151,27 @@ def assign_registers(attempt_number, max_stacking_order):
 
 def break_links(attempt_number):
     r'''Break reg_use_linkage links blocking unassigned register_groups.
+
+    Each link costs the larger spill_cost of its two reg_uses to break (see
+    ucc/codegen/spill_costs.py), or a fraction of that if the value can be
+    recomputed, and the cheapest links are broken.
     '''
 
     # NOTE: One rul may be involved in more than one reg_class, through
     #       multiple rg_neighbors!  ... But I guess it doesn't matter ...
     it = crud.fetchall('''
-             select unassigned_rg.id, rc.reg, rul.id as rul_id
+             select unassigned_rg.id, rc.reg, rul.id as rul_id,
+                    max(ru1.spill_cost, ru2.spill_cost)
+                      * case when ru1.rematerializable
+                                  and ru2.rematerializable
+                               then ?
+                             else 1
+                        end as cost
                from reg_use_linkage rul
+                    inner join reg_use ru1
+                      on ru1.id = rul.reg_use_1
+                    inner join reg_use ru2
+                      on ru2.id = rul.reg_use_2
                     inner join overlaps ov
                       on  rul.id = ov.linkage_id
                       and ov.attempt_number = ?
@@ -169,24 +190,29 @@ def break_links(attempt_number):
               where unassigned_rg.assigned_register isnull
                 and neighbor_rg.assigned_register notnull
                 and rul.broken = 0
-              order by id, reg
-           ''', (attempt_number,))
+              order by unassigned_rg.id, rc.reg
+           ''', (spill_costs.Remat_factor, attempt_number))
+
+    costs = {}          # {rul_id: cost}
 
     # rg_ruls is [(rg_id, [{rul_id}])]
     # This is in order that the rg_ids need to be processed (ascending min
-    # {rul_id} length).
-    rg_ruls = sorted(((rg_id, [{rul_id for _, _, rul_id in ruls}
-                               for _, ruls
-                                in itertools.groupby(
-                                     regs,
-                                     key=operator.itemgetter(1))])
-                      for rg_id, regs
-                       in itertools.groupby(it, key=operator.itemgetter(0))),
-                     key=lambda x: min(len(s) for s in x[1]))
+    # {rul_id} cost).
+    rg_ruls = []
+    for rg_id, regs in itertools.groupby(it, key=operator.itemgetter(0)):
+        rul_sets = []
+        for _, ruls in itertools.groupby(regs, key=operator.itemgetter(1)):
+            rul_set = set()
+            for _, _, rul_id, cost in ruls:
+                rul_set.add(rul_id)
+                costs[rul_id] = cost
+            rul_sets.append(rul_set)
+        rg_ruls.append((rg_id, rul_sets))
+    rg_ruls.sort(key=lambda x: min(cost_of(s, costs) for s in x[1]))
 
     ruls_broken = set()
     for rg_id, rul_sets in rg_ruls:
-        rul_set = get_smallest_remaining_set(rul_sets, ruls_broken)
+        rul_set = get_cheapest_remaining_set(rul_sets, ruls_broken, costs)
         crud.executemany('''
             update reg_use_linkage
                set broken = ?
@@ -194,5 +220,25 @@ def break_links(attempt_number):
           ''', zip(itertools.repeat(attempt_number), rul_set))
         ruls_broken.update(rul_set)
 
-def get_smallest_remaining_set(source_sets, items_to_ignore):
-    return min((s.difference(items_to_ignore) for s in source_sets), key=len)
+def cost_of(rul_set, costs):
+    r'''Returns the total cost of breaking the links in rul_set.
+
+        >>> cost_of({1, 2}, {1: 10, 2: 1, 3: 100})
+        11
+    '''
+    return sum(costs[rul_id] for rul_id in rul_set)
+
+def get_cheapest_remaining_set(source_sets, items_to_ignore, costs):
+    r'''Returns the cheapest of the source_sets, less the items_to_ignore.
+
+    The items_to_ignore have already been broken, so they are free.
+
+        >>> costs = {1: 100, 2: 1, 3: 1, 4: 1}
+        >>> sorted(get_cheapest_remaining_set(({1}, {2, 3, 4}), set(), costs))
+        [2, 3, 4]
+        >>> sorted(get_cheapest_remaining_set(({1, 2}, {2, 3, 4}), {1},
+        ...                                   costs))
+        [2]
+    '''
+    return min((s.difference(items_to_ignore) for s in source_sets),
+               key=lambda s: (cost_of(s, costs), len(s)))
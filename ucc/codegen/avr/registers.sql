@@ -161,3 +161,17 @@ insert into reg_in_class (reg_class, reg) values (10, 'd22');
 insert into reg_class (id, name, num_registers) values (11, 'mul_out', 2);
 insert into reg_in_class (reg_class, reg) values (11, 'd0');
 
+
+-- the registers used by the divide16 routine (see
+-- ucclib/built_in/divide16.asm):
+insert into reg_class (id, name, num_registers) values (12, 'div_left', 2);
+insert into reg_in_class (reg_class, reg) values (12, 'd24');
+
+insert into reg_class (id, name, num_registers) values (13, 'div_right', 2);
+insert into reg_in_class (reg_class, reg) values (13, 'd22');
+
+insert into reg_class (id, name, num_registers) values (14, 'div_rem', 2);
+insert into reg_in_class (reg_class, reg) values (14, 'd26');
+
+insert into reg_class (id, name) values (15, 'div_count');
+insert into reg_in_class (reg_class, reg) values (15, 'r21');
@@ -0,0 +1,202 @@
+# clobbers.py
+
+r'''Interprocedural register clobber sets.
+
+A value that is kept in a register across a call must not be in a register
+that the called function (or any function that it calls) changes.  The
+primary registers that calling each function may change are its "clobbers",
+kept in the fn_clobbers table.
+
+The clobbers are figured bottom-up over the call graph (fn_calls), by
+walking the strongly connected components of the call graph in reverse
+topological order.  All of the functions in one component (that call each
+other recursively) share the same clobbers.
+
+Register allocation is done for all of the functions at once, so the
+registers used by a called function aren't known until after the allocation.
+So `ucc.codegen.reg_alloc.alloc_regs` alternates between allocating
+registers (with the register_groups that are live across each call kept out
+of the called function's clobbers by `exclude`) and calling `update` until
+the clobbers stop growing.  The clobbers only grow, so this always ends.
+
+The only functions called here from outside are `exclude` and `update`.
+'''
+
+import re
+
+from ucc.database import crud
+
+def strongly_connected(nodes, successors):
+    r'''Returns the strongly connected components of a directed graph.
+
+    'successors' is {node: sequence of nodes}.  The components are tuples of
+    nodes, in reverse topological order (each component comes after all of
+    the components that it has edges to).
+
+    This is Tarjan's algorithm.
+
+        >>> strongly_connected('abcde', {'a': 'b', 'b': 'cd', 'c': 'b',
+        ...                              'd': 'e'})
+        [('e',), ('d',), ('b', 'c'), ('a',)]
+    '''
+    index = {}          # {node: order visited}
+    low = {}            # {node: lowest index reachable}
+    stack = []
+    on_stack = set()
+    ans = []
+    def visit(node):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for succ in successors.get(node, ()):
+            if succ not in index:
+                visit(succ)
+                low[node] = min(low[node], low[succ])
+            elif succ in on_stack:
+                low[node] = min(low[node], index[succ])
+        if low[node] == index[node]:
+            component = []
+            while True:
+                n = stack.pop()
+                on_stack.discard(n)
+                component.append(n)
+                if n == node: break
+            ans.append(tuple(sorted(component)))
+    for node in nodes:
+        if node not in index: visit(node)
+    return ans
+
+def literal_registers(operand):
+    r'''Returns the registers named directly in an assembler operand.
+
+        >>> sorted(literal_registers('r0'))
+        ['r0']
+        >>> sorted(literal_registers('hi_reg({left})'))
+        []
+        >>> sorted(literal_registers(None))
+        []
+    '''
+    if operand is None: return set()
+    return set(re.findall(r'\b[rd]\d+\b', operand))
+
+def registers_used(fn_id):
+    r'''Returns the set of primary registers used by the code in fn_id.
+
+    These are the registers assigned to its reg_uses, the registers named in
+    the code_seqs for its triples (like r0 and r1 for MUL), and, for words
+    written in assembler, the registers named in their assembler_code.
+    '''
+    regs = set(crud.fetchall("""
+        select ru.assigned_register
+          from reg_use ru
+               inner join blocks b on ru.block_id = b.id
+         where b.word_symbol_id = ?
+           and ru.assigned_register notnull
+        union
+        select assigned_register
+          from reg_use
+         where kind in ('function', 'function-return')
+           and ref_id = ?
+           and assigned_register notnull
+        """, (fn_id, fn_id), ctor=lambda row: row[0]))
+    for operand1, operand2 in crud.fetchall("""
+        select distinct c.operand1, c.operand2
+          from triples t
+               inner join blocks b on t.block_id = b.id
+               inner join code c on t.code_seq_id = c.code_seq_id
+         where b.word_symbol_id = ?
+        union
+        select distinct ac.operand1, ac.operand2
+          from assembler_code ac
+               inner join assembler_blocks ab on ac.block_id = ab.id
+         where ab.word_symbol_id = ?
+           and ab.section = 'code'
+        """, (fn_id, fn_id)):
+        regs.update(literal_registers(operand1))
+        regs.update(literal_registers(operand2))
+    if not regs: return set()
+    return set(crud.fetchall("""
+        select distinct a.r2
+          from alias a
+               inner join register r on a.r2 = r.name
+         where r.is_primary
+           and a.r1 in ({})
+        """.format(', '.join(('?',) * len(regs))),
+        tuple(regs), ctor=lambda row: row[0]))
+
+def update():
+    r'''Updates fn_clobbers from the registers assigned to each function.
+
+    Returns the number of registers added to fn_clobbers.
+    '''
+    with crud.db_transaction():
+        fns = tuple(crud.read_column('symbol_table', 'id',
+                                     kind=('function', 'task',
+                                           'assembler_word'),
+                                     order_by='id'))
+        successors = {fn: [] for fn in fns}
+        for caller, called in crud.read_as_tuples('fn_calls', 'caller_id',
+                                                  'called_id', depth=1):
+            if caller in successors and called in successors:
+                successors[caller].append(called)
+        old = {fn: set() for fn in fns}
+        for fn, reg in crud.read_as_tuples('fn_clobbers', 'fn_id', 'reg'):
+            old[fn].add(reg)
+
+        clobbers = {}           # {fn: set of regs}
+        for component in strongly_connected(fns, successors):
+            regs = set()
+            for fn in component:
+                regs.update(registers_used(fn))
+                for called in successors[fn]:
+                    if called not in component:
+                        regs.update(clobbers[called])
+            for fn in component:
+                clobbers[fn] = regs
+
+        added = 0
+        for fn in fns:
+            for reg in sorted(clobbers[fn] - old[fn]):
+                crud.insert('fn_clobbers', fn_id=fn, reg=reg)
+                added += 1
+        return added
+
+def exclude(attempt_number):
+    r'''Populates rg_excluded for the register_groups live across calls.
+
+    A register_group is live across a call if it has reg_uses in the call's
+    block both before and after the call.  It can't use any register that
+    overlaps the called function's clobbers.
+
+    The register_groups of pinned global variables (see
+    `ucc.codegen.pin_globals`) are skipped, since the called function
+    changing their register is how it sets the variable.
+
+    This function can be run multiple times with different attempt_numbers.
+    '''
+    with crud.db_transaction():
+        crud.execute('''
+            insert or ignore into rg_excluded
+              (attempt_number, reg_group_id, reg)
+            select ?, before.reg_group_id, a.r1
+              from triples call
+                   inner join reg_use before
+                     on  before.block_id = call.block_id
+                     and before.abs_order_in_block < call.abs_order_in_block
+                   inner join register_group rg
+                     on  rg.id = before.reg_group_id
+                     and rg.attempt_number = ?
+                   inner join reg_use after
+                     on  after.block_id = call.block_id
+                     and after.reg_group_id = before.reg_group_id
+                     and after.abs_order_in_block > call.abs_order_in_block
+                   inner join fn_clobbers fc
+                     on fc.fn_id = call.symbol_id
+                   inner join alias a
+                     on a.r2 = fc.reg
+             where call.operator = 'call_direct'
+               and not exists (select null
+                                 from reg_use g
+                                where g.reg_group_id = rg.id
+                                  and g.kind = 'global')
+          ''', (attempt_number, attempt_number))
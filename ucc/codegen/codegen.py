@@ -4,10 +4,15 @@ import sys
 import itertools
 
 from ucc.database import crud
-from ucc.codegen import order_triples, reg_alloc, expand_assembler
+from ucc.codegen import order_triples, reg_alloc, expand_assembler, \
+                        pin_globals
 
 Debug = True
 
+# The operators that don't need any code of their own: the loads of
+# variables, which are kept in registers.
+No_code_operators = ('global', 'local')
+
 def gen_assembler(processor):
     r'''Translate intermediate code into assembler.
 
@@ -16,8 +21,10 @@ def gen_assembler(processor):
     update_use_counts()
     order_triples.order_children()
     assign_code_seq_ids(processor)
+    check_code_seq_ids()
     reg_alloc.alloc_regs()
     expand_assembler.expand_assembler()
+    pin_globals.init_globals()
 
 def update_use_counts():
     r'''Update use_counts of all triples.
@@ -41,6 +48,7 @@ def assign_code_seq_ids(processor):
                            on cs.id = csbp.code_seq_id
                    where csbp.processor = ?
                      and cs.operator = triples.operator
+                     and cs.byte = triples.byte
                      and not exists
                            (select null
                               from code_seq_parameter csp
@@ -68,3 +76,26 @@ def assign_code_seq_ids(processor):
                         from triples t
                        where t.id = triple_parameters.parent_id)
           ''')
+
+def check_code_seq_ids():
+    r'''Checks that every triple that needs code has a code_seq.
+
+    A triple without a code_seq would generate no code at all, so its answer
+    would be whatever was left in its register.  This raises an
+    AssertionError for the first one instead.
+    '''
+    for operator, word, line, column in crud.fetchall('''
+            select t.operator, sym.label, t.line_start, t.column_start
+              from triples t
+                   inner join blocks b
+                     on t.block_id = b.id
+                   inner join symbol_table sym
+                     on b.word_symbol_id = sym.id
+             where t.code_seq_id isnull
+               and t.operator not in ({})
+             order by sym.label, t.line_start, t.column_start
+          '''.format(', '.join(('?',) * len(No_code_operators))),
+          No_code_operators):
+        raise AssertionError(
+                "{}: line {}, column {}: no code for {!r} on this processor"
+                  .format(word, line, column, operator))
@@ -3,13 +3,79 @@
 import sys  # for debug traces
 import collections
 import itertools
+import string
 
 from ucc.database import crud
+from ucc.assembler import profile_file
 
 def expand_assembler():
+    check_broken_links()
     order_blocks()
     gen_instructions()
 
+def check_broken_links():
+    r'''Checks that gen_block has code for every broken reg_use_linkage.
+
+    The register allocator has no way to spill a value to RAM.  So when two
+    linked reg_uses end up in different registers, the value must be
+    recomputed (rematerialized) or copied at the triple.  gen_block copies
+    values at a triple:
+
+        - into a 'triple'/'parameter', from the register of the triple
+          feeding it, if that register still holds the value at the triple
+          (a reg_use in its register_group comes at or after the triple, or
+          it is a pinned global);
+        - from the output parameter of a code_seq to the triple's output;
+        - between a pinned global and the triples loading or storing it;
+        - from the function-return of a called function to the output of
+          its 'call_direct'.
+
+    Any other broken link means that the value is lost, so this raises an
+    AssertionError rather than generating the wrong code.
+    '''
+    bad = crud.fetchall('''
+        select rul.id, ru1.kind, ru1.position_kind, ru1.ref_id,
+               ru2.kind, ru2.position_kind, ru2.ref_id
+          from reg_use_linkage rul
+               inner join reg_use ru1
+                 on ru1.id = rul.reg_use_1
+               inner join reg_use ru2
+                 on ru2.id = rul.reg_use_2
+         where rul.broken != 0
+           and not (ru1.rematerializable and ru2.rematerializable)
+           and not (ru1.kind = 'triple-output'
+                    and ru2.kind in ('global', 'function-return'))
+           and not (ru1.kind = 'triple' and ru1.position_kind = 'parameter'
+                    and ru2.kind = 'triple-output'
+                    and ru2.ref_id = ru1.ref_id)
+           and not (rul.is_segment
+                    and ru2.kind = 'triple'
+                    and ru2.position_kind = 'parameter'
+                    and exists (
+                          select null
+                            from triple_parameters tp
+                                 inner join reg_use src
+                                   on  src.kind = 'triple-output'
+                                   and src.ref_id = tp.parameter_id
+                                 inner join reg_use ru3
+                                   on ru3.reg_group_id = src.reg_group_id
+                           where tp.parent_id = ru2.ref_id
+                             and tp.parameter_num = ru2.position
+                             and ru3.id != ru2.id
+                             and (ru3.kind = 'global'
+                                  or ru3.block_id = ru2.block_id
+                                     and (ru3.kind = 'block-end-marker'
+                                          or ru3.abs_order_in_block >=
+                                               ru2.abs_order_in_block))))
+      ''')
+    for rul_id, kind1, position_kind1, ref_id1, \
+        kind2, position_kind2, ref_id2 in bad:
+        raise AssertionError(
+                "value lost across broken reg_use_linkage {} "
+                "from {}/{} {} to {}/{} {}: no code to copy it"
+                  .format(rul_id, kind1, position_kind1, ref_id1,
+                          kind2, position_kind2, ref_id2))
+
 def order_blocks():
     it = crud.fetchall('''
         select fn.label, b.id, name, next, next_conditional
@@ -49,6 +115,94 @@ def order_blocks():
                          where id = ?
                       ''', (offset + subspan / 2, node))
                 offset += subspan
+        order_functions_by_profile()
+
+def order_functions_by_profile():
+    r'''Sets fn_order from the call counts in the call_profile (if any).
+
+    The functions are chained together along their calls, hottest calls
+    first, so that hot callers and callees end up next to each other (and in
+    RCALL range).  Functions not in the profile go after these.
+    '''
+    calls = crud.fetchall('''
+                select cp.caller, cp.called
+                  from call_profile cp
+                       inner join symbol_table caller
+                         on caller.label = cp.caller
+                         and caller.kind in ('function', 'task')
+                       inner join symbol_table called
+                         on called.label = cp.called
+                         and called.kind in ('function', 'task')
+                 order by cp.count desc, cp.caller, cp.called
+              ''')
+    order = chain_calls(calls)
+    if order:
+        crud.execute('''
+            update symbol_table
+               set fn_order = fn_order + ?
+             where kind in ('function', 'task')
+          ''', (len(order),))
+        for fn_order, label in enumerate(order):
+            crud.execute('''
+                update symbol_table
+                   set fn_order = ?
+                 where label = ?
+                   and kind in ('function', 'task')
+              ''', (fn_order, label))
+
+def chain_calls(calls):
+    r'''Returns the function labels in 'calls' chained along the calls.
+
+    'calls' is a sequence of (caller, called), hottest first.  The chain of
+    the called function follows the chain of the caller, unless the called
+    function is already inside its chain, then the caller's chain follows
+    that chain.
+
+        >>> chain_calls((('run', 'blink'), ('run', 'wait'), ('blink', 'wait'),
+        ...              ('init', 'wait')))
+        ['run', 'blink', 'wait', 'init']
+        >>> chain_calls(())
+        []
+    '''
+    chain_of = {}
+    chains = []
+    for caller, called in calls:
+        for fn in caller, called:
+            if fn not in chain_of:
+                chain_of[fn] = [fn]
+                chains.append(chain_of[fn])
+        first = chain_of[caller]
+        second = chain_of[called]
+        if first is not second:
+            if second[0] != called:
+                first, second = second, first
+            first.extend(second)
+            for fn in second:
+                chain_of[fn] = first
+            chains.remove(second)
+    return [fn for chain in chains for fn in chain]
+
+def load_profile(filename):
+    r'''Loads the execution counts in .profile file 'filename'.
+
+    These are used to order the blocks and functions.
+    '''
+    with crud.db_transaction():
+        for entry in profile_file.read(filename):
+            if entry[0] == 'block':
+                _, word_label, block_name, count = entry
+                crud.insert('block_profile', 'replace',
+                            word_label=word_label, block_name=block_name,
+                            count=count)
+            elif entry[0] == 'edge':
+                _, word_label, predecessor, successor, count = entry
+                crud.insert('edge_profile', 'replace',
+                            word_label=word_label, predecessor=predecessor,
+                            successor=successor, count=count)
+            else:
+                _, caller, called, count = entry
+                crud.insert('call_profile', 'replace',
+                            caller=caller, called=called, count=count)
 
 def order_blocks_in_fun(fn, blocks):
     with crud.db_transaction():
@@ -59,18 +213,148 @@ def order_blocks_in_fun(fn, blocks):
             block_dict[name] = id, next_block, next_conditional
             if next_block: next_dict[next_block].add(name)
             if next_conditional: next_cond[next_conditional].add(name)
-        seen = set()
-        sequencer = iter(itertools.count(1))
+        jump_targets = collections.defaultdict(list)
+        for name, target in crud.fetchall('''
+                                select b.name, jt.target
+                                  from jump_table jt
+                                       inner join blocks b
+                                         on jt.block_id = b.id
+                                       inner join symbol_table fn
+                                         on b.word_symbol_id = fn.id
+                                 where fn.label = ?
+                                 order by b.name, jt.position
+                              ''', (fn,)):
+            jump_targets[name].append(target)
+        order = []
         def follow(name, stop = None):
-            if name not in seen and name != stop:
-                seen.add(name)
+            if name not in order and name != stop:
+                order.append(name)
                 id, next_block, next_conditional = block_dict[name]
-                crud.update('blocks', {'id': id}, block_order = next(sequencer))
-                if next_conditional and next_conditional not in seen:
+                if next_conditional and next_conditional not in order:
                     follow(next_conditional, next_block)
-                if next_block and next_block not in seen:
+                if next_block and next_block not in order:
                     follow(next_block)
+                for target in jump_targets[name]:
+                    if target not in order:
+                        follow(target)
         follow(fn)
+        block_counts = dict(crud.fetchall('''
+                               select block_name, count
+                                 from block_profile
+                                where word_label = ?
+                             ''', (fn,)))
+        if block_counts:
+            edge_counts = {(pred, succ): count
+                           for pred, succ, count
+                            in crud.fetchall('''
+                                   select predecessor, successor, count
+                                     from edge_profile
+                                    where word_label = ?
+                                 ''', (fn,))}
+            order = order_by_profile(order, block_dict, block_counts,
+                                     edge_counts)
+        for block_order, name in enumerate(order, 1):
+            crud.update('blocks', {'id': block_dict[name][0]},
+                        block_order=block_order)
+
+def order_by_profile(order, block_dict, block_counts, edge_counts):
+    r'''Reorders the block names in 'order' to put hot fall-throughs first.
+
+    'order' is the default order (starting with the function's entry block),
+    'block_dict' is {name: (id, next_block, next_conditional)},
+    'block_counts' is {name: count} and 'edge_counts' is
+    {(predecessor, successor): count} from the profile.
+
+    Each block can fall through to its 'next_block', or to its
+    'next_conditional' (the peephole optimizer then inverts its conditional
+    branch, see the 'peephole' file).  So chains of blocks are built by
+    joining blocks to one of these, most cycles saved first.  A block that
+    doesn't fall through to its next_block needs a JMP (3 cycles), while a
+    conditional branch that is taken only costs one cycle more than one that
+    isn't.  So the edges out of a block with a next_conditional are worth a
+    third of the others.  A conditional branch back to an earlier block (the
+    test at the bottom of a loop) is left as a branch: falling through it
+    would only move the taken branch to another edge of the loop, and add a
+    JMP into the loop and a taken branch out of it.  The entry block's chain
+    goes first, then the other chains hottest first.  Edges into empty blocks
+    (that the profile can't see) are weighted by the count of the block
+    jumping to them.
+
+        >>> block_dict = {'f': (1, 'test', None),
+        ...               'test': (2, 'done', 'body'),
+        ...               'body': (3, 'test', None),
+        ...               'done': (4, None, None)}
+        >>> order_by_profile(['f', 'test', 'body', 'done'], block_dict,
+        ...                  {'f': 1, 'test': 101, 'body': 100, 'done': 1},
+        ...                  {('f', 'test'): 1, ('test', 'body'): 100,
+        ...                   ('body', 'test'): 100, ('test', 'done'): 1})
+        ['f', 'body', 'test', 'done']
+        >>> order_by_profile(['f', 'test', 'body', 'done'], block_dict,
+        ...                  {'f': 100, 'test': 101, 'body': 1, 'done': 100},
+        ...                  {('f', 'test'): 100, ('test', 'body'): 1,
+        ...                   ('body', 'test'): 1, ('test', 'done'): 100})
+        ['f', 'test', 'done', 'body']
+
+    A hot next_conditional is kept as the fall through:
+
+        >>> block_dict = {'f': (1, 'test', None),
+        ...               'test': (2, 'then', 'endif'),
+        ...               'then': (3, 'endif', None),
+        ...               'endif': (4, None, None)}
+        >>> order_by_profile(['f', 'test', 'then', 'endif'], block_dict,
+        ...                  {'f': 10, 'test': 10, 'then': 1, 'endif': 10},
+        ...                  {('f', 'test'): 10, ('test', 'then'): 1,
+        ...                   ('test', 'endif'): 9, ('then', 'endif'): 1})
+        ['f', 'test', 'endif', 'then']
+
+    But not the branch back to the top of a loop:
+
+        >>> block_dict = {'f': (1, 'body', None),
+        ...               'body': (2, 'test', None),
+        ...               'test': (3, 'done', 'body'),
+        ...               'done': (4, None, None)}
+        >>> order_by_profile(['f', 'body', 'test', 'done'], block_dict,
+        ...                  {'f': 1, 'body': 10, 'test': 10, 'done': 1},
+        ...                  {('f', 'body'): 1, ('body', 'test'): 10,
+        ...                   ('test', 'body'): 9, ('test', 'done'): 1})
+        ['f', 'body', 'test', 'done']
+    '''
+    position = {name: i for i, name in enumerate(order)}
+    entry = order[0]
+    def count(pred, succ):
+        if (pred, succ) in edge_counts: return edge_counts[pred, succ]
+        if succ not in block_counts: return block_counts.get(pred, 0)
+        return 0
+    def weight(pred, succ):
+        if block_dict[pred][2]: return count(pred, succ)
+        return 3 * count(pred, succ)
+    fall_throughs = sorted(((weight(name, succ), name, succ)
+                            for name in order
+                            for succ in block_dict[name][1:]
+                             if succ in position and succ != entry and
+                                not (block_dict[name][2] and
+                                     position[succ] < position[name])),
+                           key=lambda x: (-x[0], position[x[1]],
+                                          position[x[2]]))
+    chain_of = {name: [name] for name in order}
+    for _, pred, succ in fall_throughs:
+        pred_chain = chain_of[pred]
+        succ_chain = chain_of[succ]
+        if pred_chain is not succ_chain and pred_chain[-1] == pred and \
+           succ_chain[0] == succ:
+            pred_chain.extend(succ_chain)
+            for name in succ_chain:
+                chain_of[name] = pred_chain
+    chains = []
+    for name in order:
+        if chain_of[name][0] == name:
+            chains.append(chain_of[name])
+    chains[1:] = sorted(chains[1:],
+                        key=lambda chain:
+                              (-max(block_counts.get(name, 0)
+                                    for name in chain),
+                               position[chain[0]]))
+    return [name for chain in chains for name in chain]
 
 def gen_instructions():
     for fn in crud.read_column('symbol_table', 'id', kind=('function', 'task'),
@@ -104,17 +388,95 @@ def with_next(it):
 
 def gen_block(fn, current_block, next_block):
     id, label, next_name, next_conditional = current_block
-    next_block_name = next_block[1] if next_block else None 
+
+    # A block ending in a 'jump-table' jumps through the jump table instead
+    # of falling through to its next block.  The table goes in its own
+    # assembler block right after this one.
+    jump_targets = tuple(crud.read_column('jump_table', 'target', block_id=id,
+                                          order_by='position'))
+    jump_table = '{}_jump_table'.format(label) if jump_targets else None
+
     assem_block = crud.insert('assembler_blocks',
-                              section='code', label=label, next_label=next_name,
+                              section='code', label=label,
+                              next_label=None if jump_targets else next_name,
                               word_symbol_id=fn)
     inst_order = 1
+
+    # {(parent_id, parameter_num): row} of the rematerializable parameters
+    # that didn't end up in the register of the triple feeding them.  These
+    # get their own copy of the feeding triple's code.
+    remats = {(r.parent_id, r.parameter_num): r
+              for r in crud.fetchall('''
+                  select tp.parent_id, tp.parameter_num, c.code_seq_id,
+                         c.int1, c.int2, ru.assigned_register as reg
+                    from triple_parameters tp
+                         inner join triples c
+                           on tp.parameter_id = c.id
+                         inner join reg_use out
+                           on  out.kind = 'triple-output'
+                           and out.ref_id = c.id
+                         inner join reg_use ru
+                           on  ru.kind = 'triple'
+                           and ru.position_kind = 'parameter'
+                           and ru.ref_id = tp.parent_id
+                           and ru.position = tp.parameter_num
+                   where c.block_id = ?
+                     and ru.rematerializable
+                     and ru.assigned_register != out.assigned_register
+                ''', (id,), ctor_factory=crud.row.factory_from_cur)}
+
+    # {triple_id: [(dest, source)]} of the copies done after each triple for
+    # its broken links to pinned globals and function-returns (see
+    # check_broken_links).  The loads come before the stores.
+    copies_after = collections.defaultdict(list)
+    for triple_id, dest, source, _ in crud.fetchall('''
+            select t.id, out.assigned_register, ru.assigned_register,
+                   1 as copy_order
+              from triples t
+                   inner join reg_use out
+                     on  out.kind = 'triple-output'
+                     and out.ref_id = t.id
+                   inner join reg_use_linkage rul
+                     on rul.reg_use_1 = out.id
+                   inner join reg_use ru
+                     on ru.id = rul.reg_use_2
+             where t.block_id = ?
+               and rul.broken != 0
+               and (ru.kind = 'function-return'
+                    or ru.kind = 'global' and t.operator = 'global'
+                       and ru.ref_id = t.symbol_id)
+            union all
+            select t.id, ru.assigned_register, out.assigned_register, 2
+              from triples t
+                   inner join reg_use out
+                     on  out.kind = 'triple-output'
+                     and out.ref_id = t.id
+                   inner join reg_use_linkage rul
+                     on rul.reg_use_1 = out.id
+                   inner join reg_use ru
+                     on ru.id = rul.reg_use_2
+             where t.block_id = ?
+               and rul.broken != 0
+               and ru.kind = 'global'
+               and not (t.operator = 'global' and ru.ref_id = t.symbol_id)
+             order by 1, 4
+          ''', (id, id)):
+        copies_after[triple_id].append((dest, source))
     it = crud.fetchall('''
-        select t.code_seq_id, t.int1, t.int2, t.string,
+        select t.id, t.code_seq_id, t.int1, t.int2, t.string,
+               sym.label as symbol,
                t.line_start, t.column_start, t.line_end,
                t.column_end, ru1.assigned_register as ans,
-               param.int1 as param_int1, param.assigned_register as param
+               cs.from_param_num as output_param,
+               param.int1 as param_int1, param.assigned_register as param,
+               param.parameter_num as param_num,
+               param.source as param_source,
+               param.rematerializable as param_remat
           from triples t
+               left join code_seq cs
+                 on t.code_seq_id = cs.id
+               left join symbol_table sym
+                 on t.symbol_id = sym.id
                left join reg_use ru1
                  on ru1.kind = 'triple-output'
                  and t.id = ru1.ref_id
@@ -125,7 +487,12 @@ def gen_block(fn, current_block, next_block):
                             on ru2.kind = 'triple'
                             and ru2.position_kind = 'parameter'
                             and ru2.ref_id = tp.parent_id
-                            and ru2.position = tp.parameter_num) param 
+                            and ru2.position = tp.parameter_num
+                          left join (select ref_id,
+                                            assigned_register as source
+                                       from reg_use
+                                      where kind = 'triple-output') out
+                            on out.ref_id = c.id) param
                  on t.id = param.parent_id
          where t.block_id = ?
            and (t.use_count = 0
@@ -137,28 +504,118 @@ def gen_block(fn, current_block, next_block):
       ''', (id,), ctor_factory=crud.row.factory_from_cur)
     for t, params \
      in itertools.groupby(it, lambda x:
-                                crud.row.from_kws(code_seq_id=x.code_seq_id,
+                                crud.row.from_kws(id=x.id,
+                                                  code_seq_id=x.code_seq_id,
                                                   int1=x.int1,
                                                   int2=x.int2,
                                                   string=x.string,
+                                                  symbol=x.symbol,
                                                   line_start=x.line_start,
                                                   column_start=x.column_start,
                                                   line_end=x.line_end,
                                                   column_end=x.column_end,
-                                                  ans=x.ans)):
+                                                  ans=x.ans,
+                                                  output_param=
+                                                    x.output_param)):
+        params = tuple(params)
+        for p in params:
+            r = remats.get((t.id, p.param_num))
+            if r is not None:
+                inst_order = gen_code(assem_block, r.code_seq_id,
+                                      {'ans': r.reg, 'int1': r.int1,
+                                       'int2': r.int2},
+                                      t, inst_order)
+            elif not p.param_remat:
+                # The parameter didn't end up in the register of the triple
+                # feeding it, so it gets a copy.
+                inst_order = gen_copy(assem_block, p.param, p.param_source,
+                                      t, inst_order)
         inst_order = \
-          gen_triple(assem_block, next_block[1], next_conditional, t,
+          gen_triple(assem_block, next_name, next_conditional, t,
                      tuple((p.param, p.param_int1) for p in params),
-                     inst_order)
+                     inst_order, jump_table)
+        for p in params:
+            if p.param_num == t.output_param:
+                # The code_seq left its answer in this parameter's register.
+                inst_order = gen_copy(assem_block, t.ans, p.param, t,
+                                      inst_order)
+        for dest, source in copies_after[t.id]:
+            inst_order = gen_copy(assem_block, dest, source, t, inst_order)
+
+    if jump_targets:
+        table_block = crud.insert('assembler_blocks',
+                                  section='code', label=jump_table,
+                                  word_symbol_id=fn)
+        for inst_order, target in enumerate(jump_targets, 1):
+            crud.insert('assembler_code',
+                        block_id=table_block,
+                        inst_order=inst_order,
+                        opcode='RJMP',
+                        operand1=target,
+                        min_length=1,
+                        max_length=2)
+
+Pointer_pairs = {'X': 'd26', 'Y': 'd28', 'Z': 'd30'}
+
+def copy_insts(dest, source):
+    r'''Returns the instructions to copy register 'source' to 'dest'.
+
+    Each instruction is an (opcode, operand1, operand2).  Nothing is needed
+    if either register is None, or if they're the same:
+
+        >>> copy_insts('d24', 'd24')
+        ()
+        >>> copy_insts(None, 'd24')
+        ()
+
+    The pairs are always even aligned, so a pair is copied with one MOVW:
+
+        >>> copy_insts('d18', 'd24')
+        (('MOVW', 'd18', 'd24'),)
+        >>> copy_insts('Z', 'd24')
+        (('MOVW', 'd30', 'd24'),)
+        >>> copy_insts('r18', 'r24')
+        (('MOV', 'r18', 'r24'),)
+    '''
+    if dest is None or source is None or dest == source: return ()
+    dest = Pointer_pairs.get(dest, dest)
+    source = Pointer_pairs.get(source, source)
+    assert dest[0] == source[0], \
+           "can't copy {} to {}".format(source, dest)
+    if dest[0] == 'd': return (('MOVW', dest, source),)
+    return (('MOV', dest, source),)
+
+def gen_copy(assem_block, dest, source, t, inst_order):
+    r'''Generates the code to copy register 'source' to 'dest' for triple t.
+
+    Returns the next inst_order.
+    '''
+    for opcode, operand1, operand2 in copy_insts(dest, source):
+        crud.insert('assembler_code',
+                    block_id=assem_block,
+                    inst_order=inst_order,
+                    opcode=opcode,
+                    operand1=operand1,
+                    operand2=operand2,
+                    min_length=1,
+                    max_length=2,
+                    line_start=t.line_start,
+                    column_start=t.column_start,
+                    line_end=t.line_end,
+                    column_end=t.column_end)
+        inst_order += 1
+    return inst_order
 
 def gen_triple(assem_block, next_block, next_conditional, t, params,
-               inst_order):
+               inst_order, jump_table=None):
     expansions = {'next_block': next_block,
                   'next_conditional': next_conditional,
+                  'jump_table': jump_table,
                   'ans': t.ans,
                   'int1': t.int1,
                   'int2': t.int2,
                   'string': t.string,
+                  'symbol': t.symbol,
                  }
     #print(t.code_seq_id, "params", params, file = sys.stderr)
     if len(params) >= 1:
@@ -168,12 +625,25 @@ def gen_triple(assem_block, next_block, next_conditional, t, params,
         expansions['right'] = params[1][0]
         expansions['right_int1'] = params[1][1]
 
+    return gen_code(assem_block, t.code_seq_id, expansions, t, inst_order)
+
+def gen_code(assem_block, code_seq_id, expansions, t, inst_order):
+    r'''Generates the code for code_seq_id, for triple t.
+
+    Returns the next inst_order.
+    '''
     def expand(s):
         #print(code.opcode, "expand", s, expansions, file=sys.stderr)
         if s is None: return None
+        for _, name, _, _ in string.Formatter().parse(s):
+            if name in ('ans', 'left', 'right') and \
+               expansions.get(name) is None:
+                raise AssertionError(
+                        "line {}, column {}: no register for {{{}}} in {}"
+                          .format(t.line_start, t.column_start, name, s))
         return s.format(**expansions)
 
-    for code in crud.read_as_rows('code', code_seq_id=t.code_seq_id,
+    for code in crud.read_as_rows('code', code_seq_id=code_seq_id,
                                           order_by='inst_order'):
         crud.insert('assembler_code',
                     block_id=assem_block,
@@ -6,8 +6,10 @@ The patterns file uses '#' to EOL as comments and blank lines are ignored.
 
 Each pattern has one line with 1 to 3 comma separated components:
 
-    operator
-        -- this is simply the name of the triples.operator followed by a colon
+    operator [byte]
+        -- this is simply the name of the triples.operator followed by a colon.
+           'byte' marks code that only works on values that fit in one
+           register (see ucc/compiler/value_ranges.py).
     parameter
         -- comma separated parameter specification in parameter_num order
            followed by a colon
@@ -78,7 +80,7 @@ def load(database_filename, pattern_filename):
                             raise SyntaxError("too many ':' components",
                                               (Filename, Lineno, None, Line))
 
-                        operator = components[0].strip()
+                        operator, byte = parse_operator(components[0])
                         #print("operator", operator)
                         if operator != last_operator:
                             last_operator = operator
@@ -86,7 +88,8 @@ def load(database_filename, pattern_filename):
 
                         code_seq_id = db_conn.insert('code_seq',
                                         preference=preference,
-                                        operator=operator)
+                                        operator=operator,
+                                        byte=byte)
 
                         preference += 1
 
@@ -142,6 +145,23 @@ def load(database_filename, pattern_filename):
                                            operand1=operand1,
                                            operand2=operand2)
 
+def parse_operator(text):
+    r'''Parse the operator component.
+
+    Returns operator, byte.
+
+        >>> parse_operator(" + ")
+        ('+', False)
+        >>> parse_operator(" if-true byte")
+        ('if-true', True)
+    '''
+    args = text.split()
+    if len(args) == 2 and args[1] == 'byte':
+        return args[0], True
+    if len(args) != 1:
+        raise SyntaxError("invalid operator", (Filename, Lineno, None, Line))
+    return args[0], False
+
 Pattern_re = re.compile(r'''
       \s*
       (?: (?P<delink> delink)
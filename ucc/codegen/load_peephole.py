@@ -0,0 +1,191 @@
+# load_peephole.py
+
+r'''Loads a "peephole" rules file into a machine database.
+
+The rules file uses '#' to EOL as comments and blank lines are ignored.
+
+Each rule starts with its name, followed by a colon, at the start of a line.
+This is followed by the indented instructions to match, a '=>' line, and the
+indented instructions to replace them with:
+
+    dec_tst:
+        DEC  {r}
+        TST  {r}
+        {br=BREQ|BRNE} {label}
+      =>
+        DEC  {r}
+        {br} {label}
+
+The opcode and operands may use {name} variables (see `ucc.codegen.peephole`
+for how these match).  All of the variables used in the replacement must be
+set by the pattern.  The replacement must have fewer instructions than the
+pattern, so that applying the rules always ends.
+
+The NEXT pseudo instruction stands for the block falling through to its
+next_label, and may only be the last instruction of the pattern and
+replacement.  If the pattern ends in NEXT, so must the replacement.
+'''
+
+import sys
+
+if __name__ == "__main__":
+    from doctest_tools import setpath
+    setpath.setpath(__file__, remove_first=True)
+
+from ucc.database import crud
+from ucc.codegen import peephole
+
+# SyntaxError params (filename, lineno, column, line)
+
+Filename = 'test file'
+Line = 'test line'
+Lineno = 0
+
+def load(database_filename, rules_filename):
+    global Filename
+    Filename = rules_filename
+    with crud.db_connection(database_filename) as db_conn:
+        with open(rules_filename) as f:
+            for name, pattern, replacement in read_rules(f):
+                with db_conn.db_transaction():
+                    rule_id = db_conn.insert('peephole_rule', name=name)
+                    for side, insts in (('pattern', pattern),
+                                        ('replacement', replacement)):
+                        for i, (opcode, operand1, operand2) \
+                         in enumerate(insts):
+                            db_conn.insert('peephole_inst',
+                                           rule_id=rule_id,
+                                           side=side,
+                                           inst_order=i + 1,
+                                           opcode=opcode,
+                                           operand1=operand1,
+                                           operand2=operand2)
+
+def read_rules(f):
+    r'''Generates name, pattern, replacement for each rule in 'f'.
+
+    The pattern and replacement are lists of (opcode, operand1, operand2).
+
+        >>> from io import StringIO
+        >>> for rule in read_rules(StringIO("""
+        ... # a comment
+        ... mov_self:
+        ...     MOV {a}, {a}   # to itself
+        ...   =>
+        ...
+        ... breq_jmp:
+        ...     BREQ {l}
+        ...     JMP  {t}
+        ...     NEXT {l}
+        ...   =>
+        ...     BRNE {t}
+        ...     NEXT {l}
+        ... """)):
+        ...     print(rule)
+        ('mov_self', [('MOV', '{a}', '{a}')], [])
+        ('breq_jmp', [('BREQ', '{l}', None), ('JMP', '{t}', None), ('NEXT', '{l}', None)], [('BRNE', '{t}', None), ('NEXT', '{l}', None)])
+        >>> for rule in read_rules(StringIO("""
+        ... bad:
+        ...     MOV {a}, {a}
+        ...     MOV {a}, {a}
+        ...   =>
+        ...     MOV {a}, {b}
+        ... """)):
+        ...     print(rule)
+        Traceback (most recent call last):
+           ...
+        SyntaxError: bad: variable 'b' not set by the pattern
+    '''
+    global Line, Lineno
+
+    rule = None         # [name, pattern, replacement]
+    insts = None        # the side of the rule being read
+    for Lineno, Line in enumerate(f, 1):
+        line = Line
+        if '#' in line:
+            line = line[:line.index('#')]
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            if rule is not None:
+                yield check(*rule)
+            name = line.strip()
+            if not name.endswith(':') or len(name.split()) != 1:
+                raise SyntaxError("expected rule name followed by ':'",
+                                  (Filename, Lineno, None, Line))
+            rule = [name[:-1], [], None]
+            insts = rule[1]
+        elif rule is None:
+            raise SyntaxError("instruction outside of a rule",
+                              (Filename, Lineno, None, Line))
+        elif line.strip() == '=>':
+            if rule[2] is not None:
+                raise SyntaxError("duplicate '=>'",
+                                  (Filename, Lineno, None, Line))
+            rule[2] = insts = []
+        else:
+            insts.append(parse_inst(line))
+    if rule is not None:
+        yield check(*rule)
+
+def parse_inst(line):
+    r'''Returns opcode, operand1, operand2.
+
+        >>> parse_inst("   LDI  lo_reg({a}), lo8({k}) ")
+        ('LDI', 'lo_reg({a})', 'lo8({k})')
+        >>> parse_inst("   {br:BRNE|BREQ} {t}")
+        ('{br:BRNE|BREQ}', '{t}', None)
+        >>> parse_inst("   NEXT")
+        ('NEXT', None, None)
+    '''
+    fields = line.strip().split(None, 1)
+    opcode = fields[0]
+    operand1 = operand2 = None
+    if len(fields) > 1:
+        operands = [operand.strip() for operand in fields[1].split(',')]
+        if len(operands) > 2 or not all(operands):
+            raise SyntaxError("bad operands", (Filename, Lineno, None, Line))
+        operand1 = operands[0]
+        if len(operands) == 2: operand2 = operands[1]
+    return opcode, operand1, operand2
+
+def check(name, pattern, replacement):
+    r'''Checks the rule, returns name, pattern, replacement.
+    '''
+    def error(msg):
+        raise SyntaxError("{}: {}".format(name, msg),
+                          (Filename, Lineno, None, Line))
+    if not pattern or pattern[0][0] == 'NEXT':
+        error("empty pattern")
+    if replacement is None:
+        error("missing '=>'")
+    if len(replacement) >= len(pattern):
+        error("the replacement must have fewer instructions than the pattern")
+    for insts in pattern, replacement:
+        if any(inst[0] == 'NEXT' for inst in insts[:-1]):
+            error("NEXT must be the last instruction")
+    if (pattern[-1][0] == 'NEXT') != \
+       bool(replacement and replacement[-1][0] == 'NEXT'):
+        error("NEXT must end both the pattern and replacement, or neither")
+    choices = {}
+    for inst in pattern:
+        for var, kind, alternatives in peephole.variables(inst):
+            if kind == ':':
+                error("{{{}:...}} is only allowed in the replacement"
+                        .format(var))
+            if alternatives:
+                choices[var] = len(alternatives)
+    for inst in replacement:
+        for var, kind, alternatives in peephole.variables(inst):
+            if kind == '=':
+                error("{{{}=...}} is only allowed in the pattern".format(var))
+            if var != peephole.Following and \
+               var not in peephole.variables_set(pattern):
+                error("variable {!r} not set by the pattern".format(var))
+            if kind == ':' and choices.get(var) != len(alternatives):
+                error("{{{}:...}} needs one alternative for each in the "
+                      "pattern".format(var))
+    return name, pattern, replacement
+
+if __name__ == "__main__":
+    load(sys.argv[1], sys.argv[2])
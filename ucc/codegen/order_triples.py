@@ -2,6 +2,7 @@
 
 import sys
 import itertools
+import collections
 
 from ucc.database import crud
 
@@ -45,10 +46,130 @@ def order_children():
 
 def update_order_constraints():
     with crud.db_transaction():
+        readers = global_readers()
         print("propogate_links iterations:", propogate_links(), file=sys.stderr)
         delete_extranious_links()
+        add_reader_links(readers)
         add_transitive_links()
 
+def global_readers():
+    r'''Returns the (reader, writer) pairs for the global variables.
+
+    Global variables are kept in registers (see `ucc.codegen.pin_globals`),
+    so a global variable isn't read when its value is loaded (or stored),
+    but when each triple using that value (the reader) is run.  So each
+    reader of the value has to run before the next triple that sets the
+    variable (the writer), either by storing to it (a triple_label) or by
+    calling a function that sets it.
+
+    The constraints between the value (a 'global' load or a triple stored to
+    the variable) and the next writer are already there from the parse (see
+    `ucc.database.block`).  This gets the readers for these.
+
+    This must be run before `propogate_links`.
+    '''
+    return tuple(crud.fetchall('''
+        select distinct tp.parent_id, toc.successor
+          from triple_order_constraints toc
+               inner join (select t.id as triple_id, t.symbol_id as var_id
+                             from triples t
+                            where t.operator = 'global'
+                           union
+                           select tl.triple_id, tl.symbol_id
+                             from triple_labels tl
+                                  inner join symbol_table sym
+                                    on tl.symbol_id = sym.id
+                            where sym.kind = 'var'
+                              and sym.context isnull) as v
+                 on v.triple_id = toc.predecessor
+               inner join (select tl.triple_id, tl.symbol_id as var_id
+                             from triple_labels tl
+                           union
+                           select t.id, u.var_id
+                             from triples t
+                                  inner join fn_global_var_uses u
+                                    on u.fn_id = t.symbol_id
+                            where t.operator = 'call_direct'
+                              and u.sets) as w
+                 on  w.triple_id = toc.successor
+                 and w.var_id = v.var_id
+               inner join triple_parameters tp
+                 on tp.parameter_id = v.triple_id
+         where tp.parent_id != toc.successor
+         order by tp.parent_id, toc.successor
+      '''))
+
+def add_reader_links(readers):
+    r'''Adds the constraints to run each reader before its writer.
+
+    'readers' are the (reader, writer) pairs from `global_readers`.  These
+    are propogated up to the siblings, like `propogate_links` and
+    `delete_extranious_links` do for the other constraints.  But a link is
+    only added if it doesn't close a cycle (taking each child as coming
+    before its parents), and if its predecessor isn't the last triple of its
+    block (which always goes last).  `ucc.codegen.pin_globals.link` copies
+    the value out of the variable's register for the readers that still run
+    too late.
+
+    This must be run after `delete_extranious_links`.
+    '''
+    if not readers: return
+    parents = collections.defaultdict(set)      # {child: {parent}}
+    for parent_id, child_id in crud.fetchall('''
+                                   select parent_id, parameter_id
+                                     from triple_parameters
+                                 '''):
+        parents[child_id].add(parent_id)
+    top_levels = dict(crud.fetchall('''
+                          select id, block_id from triples where use_count = 0
+                        '''))
+    last_triples = frozenset(crud.read_column('blocks', 'last_triple_id'))
+    successors = collections.defaultdict(set)   # {pred: {succ}}
+    for pred, succ in crud.fetchall('''
+                          select predecessor, successor
+                            from triple_order_constraints
+                        '''):
+        successors[pred].add(succ)
+
+    def ancestors(triple_id):
+        ans = {triple_id}
+        todo = [triple_id]
+        while todo:
+            for parent in parents[todo.pop()]:
+                if parent not in ans:
+                    ans.add(parent)
+                    todo.append(parent)
+        return ans
+
+    def reaches(start, goal):
+        seen = {start}
+        todo = [start]
+        while todo:
+            t = todo.pop()
+            if t == goal: return True
+            for next in itertools.chain(successors[t], parents[t]):
+                if next not in seen:
+                    seen.add(next)
+                    todo.append(next)
+        return False
+
+    def siblings(a, b):
+        return parents[a] & parents[b] or \
+               a in top_levels and top_levels.get(b) == top_levels[a]
+
+    for reader, writer in readers:
+        reader_ancestors = ancestors(reader)
+        writer_ancestors = ancestors(writer)
+        if writer in reader_ancestors or reader in writer_ancestors:
+            continue
+        for pred in sorted(reader_ancestors - last_triples):
+            for succ in sorted(writer_ancestors - reader_ancestors):
+                if succ not in successors[pred] and siblings(pred, succ) \
+                   and not reaches(succ, pred):
+                    successors[pred].add(succ)
+                    crud.insert('triple_order_constraints',
+                                predecessor=pred, successor=succ)
+
 def propogate_links():
     r'''Propogate links upward through the heirarchy.
 
@@ -0,0 +1,355 @@
+# peephole.py
+
+r'''Peephole optimization of the assembler code.
+
+`ucc.codegen.expand_assembler` expands each triple into the code for its
+code_seq on its own, which leaves waste where the code for one triple meets
+the code for the next.  Like a TST after a DEC has already set the Z flag, or
+a conditional branch over a JMP.
+
+This slides a window over the instructions of each compiled assembler block
+and tries the rules in the peephole_rule table in order at each position.
+These come from the machine's 'peephole' file (see
+`ucc.codegen.load_peephole`).  When a rule's pattern matches the
+instructions starting at the window, they are replaced by the rule's
+replacement and the window backs up, so that the new instructions can be
+matched by other rules.
+
+The opcodes and operands in the rules may use variables:
+
+    {name}              matches any text, and the same text everywhere in the
+                        rule.
+    {name=A|B|C}        matches one of the alternatives (pattern only).
+    {name:X|Y|Z}        the alternative in the same position as the one
+                        matched by {name=A|B|C} (replacement only).
+    {following}         the label of the block after this one in the layout.
+
+The last instruction in each block is a NEXT pseudo instruction that stands
+for the block's fall through.  It is "NEXT label" for a block with a
+next_label and "NEXT" for a block without one.  Replacing it changes the
+block's next_label.
+
+A rule is only applied if its replacement is no longer than the code that it
+replaces (counting the JMP that the assembler adds when a block's next_label
+isn't the following block), and if each relative branch in the replacement
+can reach its label.  The label addresses are taken with every instruction at
+its max length (see `ucc.assembler.assemble.max_addresses`).  As the rules
+never make the code longer, these branches stay in range.
+
+The number of times that each rule was applied is stored in the
+peephole_counts table.
+'''
+
+import re
+import collections
+
+from ucc.database import assembler, crud
+from ucc.assembler import asm_opcodes, assemble
+from ucc.codegen import expand_assembler
+
+Following = 'following'         #: the variable for the following block
+
+Var_re = re.compile(r'\{(\w+)(?:([=:])([\w|]+))?\}')
+
+def variables(inst):
+    r'''Generates (name, kind, alternatives) for each variable in 'inst'.
+
+    'inst' is (opcode, operand1, operand2).  'kind' is '=', ':' or None.
+
+        >>> list(variables(('{br=BREQ|BRNE}', 'lo8({k})', None)))
+        [('br', '=', ('BREQ', 'BRNE')), ('k', None, ())]
+    '''
+    for field in inst:
+        if field is not None:
+            for m in Var_re.finditer(field):
+                name, kind, alternatives = m.groups()
+                yield name, kind, \
+                      tuple(alternatives.split('|')) if alternatives else ()
+
+def variables_set(insts):
+    r'''Returns the set of variable names used in 'insts'.
+    '''
+    return set(name for inst in insts for name, _, _ in variables(inst))
+
+def match_field(template, text, bindings):
+    r'''Matches 'text' to 'template', adding the variables set to 'bindings'.
+
+    Returns True if it matched.  'bindings' is only changed on a match.
+
+        >>> b = {}
+        >>> match_field('lo8({k})', 'lo8(300)', b), b
+        (True, {'k': '300'})
+        >>> match_field('{k}', '301', b), b
+        (False, {'k': '300'})
+        >>> match_field('{br=BREQ|BRNE}', 'BRNE', b), sorted(b.items())
+        (True, [('br', 'BRNE'), ('k', '300')])
+        >>> match_field('{x}, {x}', 'r1, r2', b), match_field('{x}', None, b)
+        (False, False)
+        >>> match_field(None, None, b)
+        True
+    '''
+    if template is None or text is None:
+        return template is None and text is None
+    regex = []
+    new = []
+    last = 0
+    for m in Var_re.finditer(template):
+        regex.append(re.escape(template[last:m.start()]))
+        name, kind, alternatives = m.groups()
+        if name in bindings:
+            regex.append(re.escape(bindings[name]))
+        elif name in new:
+            regex.append('(?P={})'.format(name))
+        else:
+            new.append(name)
+            regex.append('(?P<{}>{})'.format(name, alternatives or '.+'))
+        last = m.end()
+    regex.append(re.escape(template[last:]))
+    m = re.fullmatch(''.join(regex), text)
+    if m is None: return False
+    bindings.update(m.groupdict())
+    return True
+
+class rule:
+    r'''A peephole rule.
+
+    The 'pattern' and 'replacement' are sequences of (opcode, operand1,
+    operand2) templates.
+
+        >>> dec_tst = rule('dec_tst',
+        ...                (('DEC', '{r}', None), ('TST', '{r}', None),
+        ...                 ('{br=BREQ|BRNE}', '{l}', None)),
+        ...                (('DEC', '{r}', None), ('{br}', '{l}', None)))
+        >>> dec_tst.match((('DEC', 'r16', None), ('TST', 'r16', None),
+        ...                ('BRNE', 'foo', None), ('NEXT', 'bar', None)),
+        ...               'bar')
+        [('DEC', 'r16', None), ('BRNE', 'foo', None)]
+        >>> dec_tst.match((('DEC', 'r16', None), ('TST', 'r17', None),
+        ...                ('BRNE', 'foo', None), ('NEXT', 'bar', None)),
+        ...               'bar')
+        >>> breq_jmp = rule('breq_jmp',
+        ...                 (('{br=BREQ|BRLO}', '{l}', None),
+        ...                  ('JMP', '{following}', None),
+        ...                  ('NEXT', '{l}', None)),
+        ...                 (('{br:BRNE|BRSH}', '{following}', None),
+        ...                  ('NEXT', '{l}', None)))
+        >>> breq_jmp.match((('brlo', 'a', None), ('jmp', 'b', None),
+        ...                 ('NEXT', 'a', None)),
+        ...                'b')
+        [('BRSH', 'b', None), ('NEXT', 'a', None)]
+        >>> breq_jmp.match((('BRLO', 'a', None), ('JMP', 'b', None),
+        ...                 ('NEXT', 'a', None)),
+        ...                None)
+    '''
+    def __init__(self, name, pattern, replacement):
+        self.name = name
+        self.pattern = tuple(pattern)
+        self.replacement = tuple(replacement)
+        self.choices = {name: alternatives
+                        for inst in self.pattern
+                        for name, kind, alternatives in variables(inst)
+                        if kind == '='}
+        self.uses_following = Following in variables_set(self.pattern) or \
+                              Following in variables_set(self.replacement)
+
+    def __repr__(self):
+        return "<rule {}>".format(self.name)
+
+    def match(self, insts, following):
+        r'''Matches the start of 'insts' to the pattern.
+
+        'insts' is a sequence of (opcode, operand1, operand2), and 'following'
+        is the label of the following block (or None).
+
+        Returns the list of replacement instructions, or None.
+        '''
+        if len(insts) < len(self.pattern): return None
+        if self.uses_following and following is None: return None
+        bindings = {Following: following} if following is not None else {}
+        for template, (opcode, operand1, operand2) in zip(self.pattern, insts):
+            if not match_field(template[0],
+                               opcode and opcode.upper(),
+                               bindings) or \
+               not match_field(template[1], operand1, bindings) or \
+               not match_field(template[2], operand2, bindings):
+                return None
+        def expand(field):
+            if field is None: return None
+            def substitute(m):
+                name, kind, alternatives = m.groups()
+                if kind == ':':
+                    return alternatives.split('|')[
+                             self.choices[name].index(bindings[name])]
+                return bindings[name]
+            return Var_re.sub(substitute, field)
+        return [tuple(expand(field) for field in inst)
+                for inst in self.replacement]
+
+def read_rules():
+    r'''Returns the rules in the peephole_rule table, in order.
+    '''
+    sides = collections.defaultdict(lambda: {'pattern': [],
+                                             'replacement': []})
+    names = collections.OrderedDict()
+    for id, name, side, opcode, operand1, operand2 in crud.fetchall("""
+        select r.id, r.name, i.side, i.opcode, i.operand1, i.operand2
+          from peephole_rule r
+               inner join peephole_inst i on i.rule_id = r.id
+         order by r.id, i.side, i.inst_order
+        """):
+        names[id] = name
+        sides[id][side].append((opcode, operand1, operand2))
+    return tuple(rule(name, sides[id]['pattern'], sides[id]['replacement'])
+                 for id, name in names.items())
+
+def length(opcode, operand1, operand2, following):
+    r'''The max length in bytes of an instruction.
+
+    The length of NEXT is that of the JMP that the assembler adds if the
+    next_label isn't the 'following' label.
+
+        >>> length('LDI', 'r16', '1', None)
+        2
+        >>> length('NEXT', 'foo', None, 'foo'), length('NEXT', None, None, 'x')
+        (0, 0)
+        >>> length('NEXT', 'foo', None, 'bar')
+        4
+    '''
+    if opcode == 'NEXT':
+        if operand1 is None or operand1 == following: return 0
+        return getattr(asm_opcodes, 'JMP').length(operand1, None)[1]
+    return getattr(asm_opcodes, opcode.upper()).length(operand1, operand2)[1]
+
+class block:
+    r'''The instructions of one assembler block.
+
+    Each row of the block's assembler_code is kept as a dict, along with its
+    'address' from `assemble.max_addresses`.
+    '''
+    def __init__(self, block_id, next_label, following, addresses):
+        self.block_id = block_id
+        self.next_label = next_label
+        self.following = following
+        self.rows = [dict(row, address=addresses.get((block_id,
+                                                      row['inst_order'])))
+                     for row in crud.read_as_dicts('assembler_code',
+                                                   block_id=block_id,
+                                                   order_by=('inst_order',))]
+        self.changed = False
+
+    def insts(self, start):
+        r'''Returns the (opcode, operand1, operand2) from 'start' on.
+
+        This ends with the NEXT pseudo instruction.
+        '''
+        return [(row['opcode'], row['operand1'], row['operand2'])
+                for row in self.rows[start:]] + \
+               [('NEXT', self.next_label, None)]
+
+    def optimize(self, rules, labels, counts):
+        r'''Applies the 'rules' to this block.
+
+        'labels' is {label: address} from `assemble.max_addresses`.  'counts'
+        is a Counter of the number of times that each rule is applied.
+        '''
+        back_up = max(len(r.pattern) for r in rules) - 1
+        i = 0
+        while i < len(self.rows):
+            insts = self.insts(i)
+            for r in rules:
+                replacement = r.match(insts, self.following)
+                if replacement is not None and \
+                   self.replace(i, len(r.pattern), replacement, labels):
+                    counts[r.name] += 1
+                    i = max(0, i - back_up)
+                    break
+            else:
+                i += 1
+
+    def replace(self, i, n, replacement, labels):
+        r'''Replaces 'n' instructions starting at row 'i' with 'replacement'.
+
+        The NEXT in the 'replacement', if any, replaces the block's
+        next_label.
+
+        Returns False, without replacing them, if they can't be replaced.
+        '''
+        new_next = self.next_label
+        if replacement and replacement[-1][0] == 'NEXT':
+            new_next = replacement[-1][1]
+            replacement = replacement[:-1]
+            n -= 1
+        old = self.rows[i:i + n]
+        if any(row['label'] is not None for row in old[1:]):
+            return False        # something jumps into the middle
+        old_length = sum(length(row['opcode'], row['operand1'],
+                                row['operand2'], self.following)
+                         for row in old) + \
+                     length('NEXT', self.next_label, None, self.following)
+        new_length = sum(length(opcode, operand1, operand2, self.following)
+                         for opcode, operand1, operand2 in replacement) + \
+                     length('NEXT', new_next, None, self.following)
+        if new_length > old_length:
+            return False
+        first = old[0]
+        address = first['address']
+        new_rows = []
+        for opcode, operand1, operand2 in replacement:
+            inst = getattr(asm_opcodes, opcode.upper())
+            if address is None or \
+               not inst.in_range(operand1, operand2, labels, address):
+                return False
+            inst_length = inst.length(operand1, operand2)
+            new_rows.append(dict(first, id=None, label=None, opcode=opcode,
+                                 operand1=operand1, operand2=operand2,
+                                 min_length=inst_length[0],
+                                 max_length=inst_length[1],
+                                 address=address))
+            address += inst_length[1]
+        if first['label'] is not None:
+            if new_rows:
+                new_rows[0]['label'] = first['label']
+            else:
+                new_rows.append(dict(first, id=None, opcode=None,
+                                     operand1=None, operand2=None))
+        self.rows[i:i + n] = new_rows
+        self.next_label = new_next
+        self.changed = True
+        return True
+
+    def write(self):
+        r'''Writes the changed instructions back to the database.
+        '''
+        crud.delete('assembler_code', block_id=self.block_id)
+        for inst_order, row in enumerate(self.rows, 1):
+            row = dict(row, inst_order=inst_order)
+            del row['id'], row['address']
+            crud.insert('assembler_code', **row)
+        crud.update('assembler_blocks', {'id': self.block_id},
+                    next_label=self.next_label)
+
+def optimize():
+    r'''Runs the peephole rules over the code blocks of the compiled words.
+
+    Records and returns the {rule name: count} of the rules applied.
+    '''
+    counts = collections.Counter()
+    with crud.db_transaction():
+        rules = read_rules()
+        if rules:
+            labels = {}
+            addresses = {(block_id, inst_order): address
+                         for block_id, inst_order, inst, op1, op2, address
+                          in assemble.max_addresses('code', labels)}
+            compiled = frozenset(crud.read_column('blocks', 'name'))
+            for (block_id, label, address, next_label), following \
+             in expand_assembler.with_next(
+                  tuple(assembler.gen_blocks('code'))):
+                if label in compiled:
+                    b = block(block_id, next_label,
+                              following and following[1], addresses)
+                    b.optimize(rules, labels, counts)
+                    if b.changed: b.write()
+        for name, count in sorted(counts.items()):
+            crud.insert('peephole_counts', rule=name, count=count)
+    return counts
@@ -0,0 +1,593 @@
+# pin_globals.py
+
+r'''Keeps the hottest global variables in registers for the whole program.
+
+Each global variable chosen by `choose` (listed in the pinned_global table)
+gets a 'global' reg_use in `ucc.codegen.reg_alloc.populate_reg_use`, which
+is linked to all of the 'global' triples that load it and all of the triples
+that store to it (through triple_labels).  So all of these end up in the same
+register_group.
+
+Then `exclude` (run on each register allocation attempt) picks the register
+for each of these register_groups, and keeps every other register_group out
+of it (through the rg_excluded table).  And `init_globals` sets these
+registers to the variables' initial values in the startup code.
+
+The only functions called here from outside are `choose`, `link`, `exclude`
+and `init_globals`.
+'''
+
+import bisect
+import collections
+import itertools
+
+from ucc.database import crud, symbol_table
+from ucc.codegen import clobbers, expand_assembler
+
+# The most registers that pinned globals may take away from the rest of the
+# program.
+Max_registers = 8
+
+def budget(candidates, max_registers=None):
+    r'''Picks the candidates that fit into max_registers.
+
+    'candidates' is a sequence of (var_id, num_registers), hottest first.
+    Returns the chosen candidates.  A candidate that doesn't fit is skipped,
+    so that smaller, cooler candidates may still fit after it.
+
+        >>> budget(((1, 2), (2, 2), (3, 2), (4, 2), (5, 2)))
+        [(1, 2), (2, 2), (3, 2), (4, 2)]
+        >>> budget(((1, 2), (2, 2), (3, 1)), 3)
+        [(1, 2), (3, 1)]
+        >>> budget((), 3)
+        []
+    '''
+    if max_registers is None: max_registers = Max_registers
+    ans = []
+    for var_id, num_registers in candidates:
+        if num_registers <= max_registers:
+            ans.append((var_id, num_registers))
+            max_registers -= num_registers
+    return ans
+
+def choose():
+    r'''Fills the pinned_global table with the hottest global variables.
+
+    The heat of a global variable is the number of times that it is loaded
+    or stored, each weighted by the execution count of its block if there is
+    a profile (see block_profile), then the number of functions that use it
+    directly (from fn_global_var_uses).
+
+    Variables whose loads and stores are all 'byte' triples take one
+    register, the rest take two.  There is no code to load or store a global
+    variable that isn't in a register, so this raises an AssertionError if
+    they don't all fit into Max_registers.  Their registers are set to their
+    initial values by `init_globals`.
+    '''
+    with crud.db_transaction():
+        crud.delete('pinned_global')
+        it = crud.fetchall('''
+            select refs.var_id,
+                   sum(ifnull(bp.count, 1)) as heat,
+                   (select count(*)
+                      from fn_global_var_uses u
+                     where u.var_id = refs.var_id
+                       and u.depth = 0) as fns,
+                   case when min(t.byte) then 1 else 2 end as num_registers
+              from (select t.id as triple_id, t.symbol_id as var_id
+                      from triples t
+                     where t.operator = 'global'
+                    union all
+                    select tl.triple_id, tl.symbol_id
+                      from triple_labels tl
+                           inner join symbol_table sym
+                             on tl.symbol_id = sym.id
+                     where sym.kind = 'var'
+                       and sym.context isnull) as refs
+                   inner join triples t
+                     on t.id = refs.triple_id
+                   inner join blocks b
+                     on t.block_id = b.id
+                   inner join symbol_table fn
+                     on b.word_symbol_id = fn.id
+                   left outer join block_profile bp
+                     on  bp.word_label = fn.label
+                     and bp.block_name = b.name
+             group by refs.var_id
+             order by heat desc, fns desc, refs.var_id
+          ''')
+        candidates = [(var_id, num_registers)
+                      for var_id, heat, fns, num_registers in it]
+        chosen = budget(candidates)
+        for var_id, num_registers in chosen:
+            crud.insert('pinned_global', var_id=var_id,
+                        num_registers=num_registers)
+        for var_id, num_registers in candidates:
+            if (var_id, num_registers) not in chosen:
+                raise AssertionError(
+                        "{}: global variable doesn't fit into the {} "
+                        "registers for global variables"
+                          .format(symbol_table.get_by_id(var_id).label,
+                                  Max_registers))
+
+def link():
+    r'''Links the loads of and stores to the pinned_globals to their register.
+
+    This adds the reg_use_linkages from the triple-outputs of the 'global'
+    triples loading each pinned_global, and of the triples stored to it (its
+    triple_labels), to its 'global' reg_use.  It must be run after all of the
+    other reg_use_linkages are in.
+
+    A linked triple-output shares the variable's register with all of the
+    reg_uses linked to it (its piece).  So the value in the register is lost
+    as soon as the first triple in the piece of the next store to the
+    variable is run.  All of the readers of the old value (see `versions`)
+    must have run by then.  `ucc.codegen.order_triples` adds the constraints
+    to run the readers first, but this isn't always possible.  So the links
+    that would lose a value are added already broken (with a broken of -2),
+    and the value is copied instead (see
+    `ucc.codegen.expand_assembler.gen_block`): out of the variable's
+    register right at a 'global' load, or into it right after the storing
+    triple has run.  This is also done for the pieces that go outside of
+    their block (through local variables, parameters and function returns),
+    and for all but one link of a piece that would be linked to more than
+    one variable.
+    '''
+    roots = {}                  # {reg_use_id: linked reg_use_id}
+    def find(ru_id):
+        while ru_id in roots:
+            ru_id = roots[ru_id]
+        return ru_id
+    for ru_1, ru_2 in crud.fetchall('''
+                          select reg_use_1, reg_use_2 from reg_use_linkage
+                        '''):
+        root_1, root_2 = find(ru_1), find(ru_2)
+        if root_1 != root_2: roots[root_1] = root_2
+
+    positions = dict(crud.fetchall('''
+                         select id, abs_order_in_block from triples
+                       '''))
+    parents = collections.defaultdict(list)     # {triple_id: [parent_id]}
+    for parameter_id, parent_id in crud.fetchall('''
+                                       select parameter_id, parent_id
+                                         from triple_parameters
+                                        where not delink
+                                     '''):
+        parents[parameter_id].append(parent_id)
+
+    # Each triple runs in two steps: at 2 * abs_order_in_block it copies its
+    # parameters into place and reads them, and at 2 * abs_order_in_block + 1
+    # it writes its output.  Copying a 'global' load of the variable into a
+    # parameter in the variable's register doesn't change the register, so
+    # this is only a write if the load isn't linked to it.
+    #
+    # {root: piece}
+    pieces = collections.defaultdict(piece)
+    for ru_id, kind, ref_id, position_kind, block_id, position, operator, \
+        load_id \
+     in crud.fetchall('''
+            select ru.id, ru.kind, ru.ref_id, ru.position_kind, ru.block_id,
+                   ru.abs_order_in_block,
+                   (select t.operator
+                      from triples t
+                     where ru.kind = 'triple-output'
+                       and t.id = ru.ref_id),
+                   (select c.id
+                      from triple_parameters tp
+                           inner join triples c
+                             on c.id = tp.parameter_id
+                     where ru.position_kind = 'parameter'
+                       and tp.parent_id = ru.ref_id
+                       and tp.parameter_num = ru.position
+                       and c.operator = 'global')
+              from reg_use ru
+             where ru.kind != 'global'
+          '''):
+        p = pieces[find(ru_id)]
+        if block_id is not None: p.blocks.add(block_id)
+        if kind == 'triple-output':
+            if operator != 'local': p.outputs.add(ref_id)
+            p.times.append(2 * position + 1)
+            if operator not in ('global', 'local'):
+                p.writes.append(2 * position + 1)
+            p.times.extend(2 * positions[parent]
+                           for parent in parents[ref_id])
+        elif kind == 'triple':
+            p.times.append(2 * position)
+            if load_id is None:
+                p.writes.append(2 * position)
+            else:
+                p.load_params.append((2 * position, load_id))
+        elif kind == 'function-return' or position_kind == 'parameter':
+            # The value goes out to (or comes in from) another function.
+            p.blocks.add(None)
+        elif kind == 'block-start-marker':
+            # The value is already there when the block starts.
+            p.times.append(2 * position)
+            p.writes.append(2 * position)
+        elif kind == 'block-end-marker':
+            p.times.append(2 * position)
+
+    # The links to the 'global' reg_uses, loads first.
+    links = tuple(crud.fetchall('''
+        select ru.id, g.id as g_id, pg.var_id, t.id as triple_id, t.block_id,
+               t.abs_order_in_block, 1 as is_load
+          from pinned_global pg
+               inner join reg_use g
+                 on  g.kind = 'global'
+                 and g.ref_id = pg.var_id
+               inner join triples t
+                 on  t.operator = 'global'
+                 and t.symbol_id = pg.var_id
+               inner join reg_use ru
+                 on  ru.kind = 'triple-output'
+                 and ru.ref_id = t.id
+        union all
+        select ru.id, g.id, pg.var_id, t.id, t.block_id,
+               t.abs_order_in_block, 0
+          from pinned_global pg
+               inner join reg_use g
+                 on  g.kind = 'global'
+                 and g.ref_id = pg.var_id
+               inner join triple_labels tl
+                 on tl.symbol_id = pg.var_id
+               inner join triples t
+                 on t.id = tl.triple_id
+               inner join reg_use ru
+                 on  ru.kind = 'triple-output'
+                 and ru.ref_id = t.id
+         order by is_load desc, 6, 1
+      ''', ctor_factory=crud.row.factory_from_cur))
+
+    # The calls that read or set each variable:
+    # {(block_id, var_id): [(time, sets)]}
+    calls = collections.defaultdict(list)
+    for block_id, var_id, position, sets \
+     in crud.fetchall('''
+            select t.block_id, u.var_id, t.abs_order_in_block, u.sets
+              from triples t
+                   inner join fn_global_var_uses u
+                     on u.fn_id = t.symbol_id
+                   inner join pinned_global pg
+                     on pg.var_id = u.var_id
+             where t.operator = 'call_direct'
+          '''):
+        calls[block_id, var_id].append((2 * position + sets, sets))
+
+    # The blocks where each variable is set: {(block_id, var_id)}
+    writers = set((l.block_id, l.var_id) for l in links if not l.is_load)
+    writers.update(key for key, var_calls in calls.items()
+                       if any(sets for time, sets in var_calls))
+
+    # A load's piece may go on to other blocks (in local variables) if the
+    # variable isn't set in any of them.
+    broken = set()              # the indexes into links
+    taken = set()               # the roots of the pieces already linked
+    for i, l in enumerate(links):
+        root = find(l.id)
+        p = pieces[root]
+        if root in taken or \
+           len(p.blocks) > 1 and \
+             (not l.is_load or None in p.blocks or
+              any((block_id, l.var_id) in writers for block_id in p.blocks)) \
+           or l.is_load and p.outputs != {l.triple_id}:
+            broken.add(i)
+        else:
+            taken.add(root)
+
+    by_var = collections.defaultdict(list)      # {(block_id, var_id): [i]}
+    loads = {}                                  # {(triple_id, g_id): i}
+    for i, l in enumerate(links):
+        by_var[l.block_id, l.var_id].append(i)
+        if l.is_load: loads[l.triple_id, l.g_id] = i
+    def span(i):
+        if i in broken: return None
+        l = links[i]
+        p = pieces[find(l.id)]
+        writes = p.writes + [time for time, load_id in p.load_params
+                                  if loads.get((load_id, l.g_id), i) == i
+                                  or loads[load_id, l.g_id] in broken]
+        return min(writes, default=min(p.times)), max(p.times)
+    for key in set(by_var) | set(calls):
+        while True:
+            lost = versions(
+                     [(2 * links[i].abs_order_in_block + 1, links[i].is_load,
+                       span(i), i)
+                      for i in by_var[key]],
+                     calls[key])
+            if lost is False: break
+            block_id, var_id = key
+            assert lost is not None and lost not in broken, \
+                   "{}: a value is lost in block {}" \
+                     .format(symbol_table.get_by_id(var_id).label, block_id)
+            broken.add(lost)
+
+    with crud.db_transaction():
+        crud.executemany('''
+            insert into reg_use_linkage (reg_use_1, reg_use_2, broken)
+              values (?, ?, ?)
+          ''', ((l.id, l.g_id, -2 if i in broken else 0)
+                for i, l in enumerate(links)))
+
+class piece:
+    r'''The reg_uses linked together, that share a register.
+
+    'blocks' are the block_ids of the reg_uses (None for those not in a
+    block), 'outputs' are the ids of the triples whose triple-outputs are in
+    it (other than the 'local' triples, which only pass on one of the
+    others), 'times' are the times that its register is read or written, and
+    'writes' the times that it is written (see `link`).  'load_params' are
+    the (time, triple_id) of the parameters copied from a 'global' load,
+    which are only writes if the load isn't linked to the same register.
+    '''
+    def __init__(self):
+        self.blocks = set()
+        self.outputs = set()
+        self.times = []
+        self.writes = []
+        self.load_params = []
+
+def versions(values, calls):
+    r'''Checks that no value of a variable is lost in its register.
+
+    The values of the variable in one block are each (time, is_load, span,
+    key) where the time is when the value is stored (or the 'global' load is
+    done).  The span is (first, last) time that the variable's register is
+    used for the value, or None if its link is broken (so the value is only
+    copied at its time).  'calls' are the (time, sets) of the calls that read
+    or set the variable.  Each store, and each call setting the variable,
+    starts a new version of the variable.
+
+    Returns the key of a value whose link should be broken to keep an older
+    version from being lost (None for a call), or False if no version is
+    lost.
+
+    Each version must be done being read before the first time that the
+    next version is written.  The triple that reads the old version at time
+    6 may write the new one at time 7:
+
+        >>> versions([(3, True, (3, 6), 'load'), (9, False, (7, 9), 'store')],
+        ...          ())
+        False
+        >>> versions([(3, True, (3, 8), 'load'), (9, False, (7, 9), 'store')],
+        ...          ())
+        'store'
+        >>> versions([(3, True, (3, 8), 'load'), (9, False, None, 'store')],
+        ...          ())
+        False
+        >>> versions([(3, True, (3, 10), 'load'), (9, False, None, 'store')],
+        ...          ())
+        'load'
+
+    A call reading the variable reads it at its even time, and one setting it
+    sets it at its odd time:
+
+        >>> versions([(9, False, (7, 9), 'store')], [(6, False)])
+        False
+        >>> versions([(9, False, (7, 9), 'store')], [(8, False)])
+        'store'
+        >>> versions([(3, True, (3, 8), 'load')], [(5, True)])
+        'load'
+        >>> versions([(3, True, None, 'load')], [(5, True)])
+        False
+    '''
+    writes = sorted([(time, key, span) for time, is_load, span, key in values
+                                       if not is_load] +
+                    [(time, None, None) for time, sets in calls if sets])
+    times = [time for time, key, span in writes]
+    def version(time):
+        return bisect.bisect_left(times, time)
+    # {version: [(last time read, key, linked)]}
+    reads = collections.defaultdict(list)
+    for time, is_load, span, key in values:
+        reads[version(time) + (not is_load)].append(
+          (time if span is None else span[1], key, span is not None))
+    for time, sets in calls:
+        reads[version(time) + sets].append((time, None, False))
+    for v, (time, key, span) in enumerate(writes, 1):
+        first = time if span is None else span[0]
+        late = [(k, linked) for t, k, linked in reads[v - 1] if t >= first]
+        if late:
+            if span is not None: return key
+            for k, linked in late:
+                if linked: return k
+            return late[0][0]
+    return False
+
+def init_globals():
+    r'''Sets the registers of the pinned_globals to their initial values.
+
+    The code goes at the start of the 'init_globals' block of the startup
+    code, which then calls the 'run' task.  Variables without an initial
+    value (in the 'bss' section) start at 0.
+    '''
+    with crud.db_transaction():
+        insts = []
+        for label, reg, opcode, value in crud.fetchall('''
+                select sym.label, ru.assigned_register, ac.opcode,
+                       ac.operand1
+                  from pinned_global pg
+                       inner join symbol_table sym
+                         on sym.id = pg.var_id
+                       inner join reg_use ru
+                         on  ru.kind = 'global'
+                         and ru.ref_id = pg.var_id
+                       left outer join (assembler_blocks ab
+                                        inner join assembler_code ac
+                                          on ac.block_id = ab.id)
+                         on  ab.word_symbol_id = pg.var_id
+                         and ab.section = 'data'
+                 order by pg.rowid
+              '''):
+            if opcode is None:
+                value = 0
+            else:
+                try:
+                    assert opcode == 'int16'
+                    value = int(value, 0)
+                except (AssertionError, ValueError):
+                    raise AssertionError(
+                            "{}: initial value must be a number, not {}"
+                              .format(label, value))
+            insts.extend(set_insts(reg, value))
+        if not insts: return
+        block_id = crud.read1_column('assembler_blocks', 'id',
+                                     section='code', label='init_globals')
+        crud.execute('''
+            update assembler_code
+               set inst_order = inst_order + ?
+             where block_id = ?
+          ''', (len(insts), block_id))
+        for inst_order, (opcode, operand1, operand2) in enumerate(insts):
+            crud.insert('assembler_code',
+                        block_id=block_id,
+                        inst_order=inst_order,
+                        opcode=opcode,
+                        operand1=operand1,
+                        operand2=operand2,
+                        min_length=1,
+                        max_length=1)
+
+def set_insts(reg, value):
+    r'''Returns the instructions to set register 'reg' to 'value'.
+
+    Each instruction is an (opcode, operand1, operand2).  LDI only works on
+    r16 to r31, so the lower registers are loaded through r28, which isn't
+    used until the 'run' task is called (see `exclude`):
+
+        >>> set_insts('r16', 0x1234)
+        [('LDI', 'r16', '52')]
+        >>> set_insts('d14', 0x0100)
+        [('CLR', 'r14', None), ('LDI', 'r28', '1'), ('MOV', 'r15', 'r28')]
+        >>> set_insts('Z', -2)
+        [('LDI', 'r30', '254'), ('LDI', 'r31', '255')]
+    '''
+    reg = expand_assembler.Pointer_pairs.get(reg, reg)
+    num = int(reg[1:])
+    ans = []
+    for i in range(2 if reg[0] == 'd' else 1):
+        r = 'r{}'.format(num + i)
+        byte = (value >> (8 * i)) & 0xff
+        if byte == 0:
+            ans.append(('CLR', r, None))
+        elif num >= 16:
+            ans.append(('LDI', r, str(byte)))
+        else:
+            ans.append(('LDI', 'r28', str(byte)))
+            ans.append(('MOV', r, 'r28'))
+    return ans
+
+def exclude(attempt_number):
+    r'''Pins the register_group of each pinned_global to one register.
+
+    The register chosen is the one in the register_group's reg_class that is
+    least wanted by the other register_groups (see `candidates`), and that
+    isn't named directly by the code_seqs used (like r0 and r1 for MUL, or
+    the registers that the divide16 routine is called with) or by the
+    code of the words written in assembler (like r28 and r29, used to set
+    the stack pointer in the startup code).  There is no code to load or
+    store a global variable that isn't in a register, so the variable is
+    pinned however much its register is wanted; and this raises an
+    AssertionError if all of the registers that it could have are already
+    taken.
+
+    All of the other registers in its reg_class are added to rg_excluded for
+    the pinned register_group; and the chosen register (and its aliases) are
+    added to rg_excluded for every other register_group.
+
+    This function can be run multiple times with different attempt_numbers.
+    '''
+    with crud.db_transaction():
+        crud.execute('update pinned_global set reg = null')
+        taken = set()           # primary registers
+        for operand1, operand2 in crud.fetchall('''
+                select distinct c.operand1, c.operand2
+                  from code c
+                 where c.code_seq_id in (select t.code_seq_id from triples t)
+                union
+                select distinct ac.operand1, ac.operand2
+                  from assembler_code ac
+                       inner join assembler_blocks ab
+                         on ac.block_id = ab.id
+                 where ab.section = 'code'
+              '''):
+            taken.update(clobbers.literal_registers(operand1))
+            taken.update(clobbers.literal_registers(operand2))
+        pins = {}               # {reg_group_id: reg}
+        for var_id, rg_id, reg_class \
+         in crud.fetchall('''
+                select pg.var_id, rg.id, rg.reg_class
+                  from pinned_global pg
+                       inner join reg_use ru
+                         on  ru.kind = 'global'
+                         and ru.ref_id = pg.var_id
+                       inner join register_group rg
+                         on  rg.id = ru.reg_group_id
+                         and rg.attempt_number = ?
+                 where rg.reg_class notnull
+                 order by pg.rowid
+              ''', (attempt_number,)):
+            for reg, primaries, wanted in candidates(reg_class,
+                                                     attempt_number):
+                if not primaries & taken:
+                    taken.update(primaries)
+                    pins[rg_id] = reg
+                    crud.update('pinned_global', {'var_id': var_id}, reg=reg)
+                    break
+            else:
+                raise AssertionError(
+                        "{}: no register left for this global variable"
+                          .format(symbol_table.get_by_id(var_id).label))
+        for rg_id, reg in pins.items():
+            crud.execute('''
+                insert or ignore into rg_excluded
+                  (attempt_number, reg_group_id, reg)
+                select ?, rg.id, ric.reg
+                  from register_group rg
+                       inner join reg_in_class ric
+                         on ric.reg_class = rg.reg_class
+                 where rg.id = ?
+                   and ric.reg != ?
+                union
+                select ?, rg.id, a.r1
+                  from register_group rg
+                       cross join alias a
+                 where rg.attempt_number = ?
+                   and rg.id != ?
+                   and a.r2 = ?
+              ''', (attempt_number, rg_id, reg,
+                    attempt_number, attempt_number, rg_id, reg))
+
+def candidates(reg_class, attempt_number):
+    r'''Generates reg, {primary registers}, wanted for the regs in reg_class.
+
+    These come least wanted first.  How much a register is wanted is the sum,
+    over the reg_classes that overlap it, of the number of register_groups
+    in that reg_class divided by the size of the reg_class.  Ties go to the
+    highest numbered register.
+    '''
+    rows = crud.fetchall('''
+        select ric.reg, p.name,
+               ifnull((select sum(cast(d.num_groups as real) / rc.class_size)
+                         from (select rg.reg_class, count(*) as num_groups
+                                 from register_group rg
+                                where rg.attempt_number = ?
+                                group by rg.reg_class) as d
+                              inner join reg_class rc
+                                on rc.id = d.reg_class
+                              inner join class_alias ca
+                                on ca.reg_class = d.reg_class
+                        where ca.reg = ric.reg),
+                      0) as wanted
+          from reg_in_class ric
+               inner join alias a
+                 on a.r1 = ric.reg
+               inner join register p
+                 on  p.name = a.r2
+                 and p.is_primary
+         where ric.reg_class = ?
+         order by wanted, length(ric.reg) desc, ric.reg desc, p.name
+      ''', (attempt_number, reg_class))
+    for reg, regs in itertools.groupby(rows, key=lambda row: row[0]):
+        regs = tuple(regs)
+        yield reg, {primary for _, primary, _ in regs}, regs[0][2]
@@ -12,7 +12,8 @@ import collections
 import operator
 
 from ucc.database import crud
-from ucc.codegen import assign_registers, stack_register_groups
+from ucc.codegen import assign_registers, clobbers, pin_globals, \
+                        stack_register_groups
 
 def attempt_register_allocation(attempt_number):
     r'''This assigns the actual registers to each register_group.
@@ -33,8 +34,8 @@ def attempt_register_allocation(attempt_number):
     num_register_groups = populate_register_group(attempt_number)
 
     # Split register_groups that include conflicting reg_uses.  A conflict
-    # could be due to incompatible register classes, or two reg_uses for the
-    # same kind and ref_id.
+    # could be due to incompatible register classes, two reg_uses for the
+    # same kind and ref_id, or two pinned global variables.
     num_register_groups += eliminate_conflicts(attempt_number)
 
     # Sets the reg_class and num_registers in each register_group.
@@ -42,6 +43,14 @@ def attempt_register_allocation(attempt_number):
 
     populate_rg_neighbors(attempt_number)
 
+    # Give each pinned global variable its own register for the whole
+    # program.
+    pin_globals.exclude(attempt_number)
+
+    # Keep the register_groups live across calls out of the registers that
+    # the called functions change.
+    clobbers.exclude(attempt_number)
+
     stack_register_groups.initialize_rawZ_and_Z(attempt_number)
 
     max_stacking_order = stack_register_groups.stack_register_groups(
@@ -134,8 +143,9 @@ def populate_register_group(attempt_number):
 def eliminate_conflicts(attempt_number):
     r'''Eliminate conflicts between reg_uses in the same register_group.
 
-    The two causes of conflict are incompatible register classes, and two
-    reg_uses for the same kind and ref_id.
+    The three causes of conflict are incompatible register classes, two
+    reg_uses for the same kind and ref_id, and two pinned global variables
+    (see ucc/codegen/pin_globals.py).
 
     This function sets the 'broken' flag in affected reg_use_linkages to -1.
     If no other function uses -1 for the broken value, this function can
@@ -172,6 +182,8 @@ def eliminate_conflicts(attempt_number):
                                        and rc2 = ru2.initial_reg_class)
                      or ru1.kind = ru2.kind
                     and ru1.ref_id = ru2.ref_id
+                     or ru1.kind = 'global'
+                    and ru2.kind = 'global'
                   order by ru1.reg_group_id
                ''', ctor_factory=crud.row.factory_from_cur)
 
@@ -187,8 +199,15 @@ def eliminate_conflicts(attempt_number):
             print("reg_group_id", reg_group_id, "conflicts", conflicts,
                   file=sys.stderr)
 
+            # only the links within this register_group
+            group_neighbors = {
+              ru_id: neighbors.get(ru_id, collections.Counter())
+              for ru_id in crud.read_column('reg_use', 'id',
+                                            reg_group_id=reg_group_id)}
+
             # split yields groups of non-conflicting ru_ids
-            for ru_ids in split(conflicts, neighbors):
+            for ru_ids in split(conflicts, group_neighbors):
+                ru_ids = tuple(sorted(ru_ids))
                 # create new register_group (let sqlite assign reg_group_id)
                 ru_qmarks = ', '.join(('?',) * len(ru_ids))
                 new_group_id = crud.execute('''
@@ -199,7 +218,7 @@ def eliminate_conflicts(attempt_number):
                       from reg_use
                      where id in ({})
                   '''.format(ru_qmarks),
-                  [attempt_number] + ru_ids)[1]
+                  (attempt_number,) + ru_ids)[1]
                 print("new_group_id", new_group_id, file=sys.stderr)
                 num_new_register_groups += 1
 
@@ -9,8 +9,13 @@ gen_assembler in ucc/codegen/codegen.py).
 import sys   # for debug traces
 import itertools
 
+# The operators whose values are cheaper to recompute at each use than to
+# keep in a register (or spill) when their links have to be broken.
+Rematerializable = ('int', 'global_addr')
+
 from ucc.database import crud
-from ucc.codegen import code_seq, extend_sqlite, populate_register_groups
+from ucc.codegen import clobbers, code_seq, extend_sqlite, pin_globals, \
+                        populate_register_groups, spill_costs
 
 def alloc_regs():
     # Set up sqlite3 user functions:
@@ -23,15 +28,28 @@ def alloc_regs():
     # access.
     prepare_triples()
 
+    # Which global variables are hot enough to keep in registers?
+    pin_globals.choose()
+
     # Who all needs a register?
     populate_reg_use()
 
+    # How costly is it to spill each of them?
+    spill_costs.set_spill_costs()
+
     # Which pairs of reg_uses represent the same value and should be put into
     # the same register?
     populate_reg_use_linkage()
 
-    for attempt_number in itertools.count(1):
-        if populate_register_groups.attempt_register_allocation(attempt_number):
+    # Keep allocating until the registers clobbered by each function (which
+    # aren't known until its registers are allocated) stop growing:
+    attempt_number = 0
+    while True:
+        for attempt_number in itertools.count(attempt_number + 1):
+            if populate_register_groups.attempt_register_allocation(
+                 attempt_number):
+                break
+        if not clobbers.update():
             break
 
 def get_reg_class_sizes():
@@ -52,6 +70,8 @@ def delete():
         crud.delete('reg_use_linkage')
         crud.delete('rg_neighbors')
         crud.delete('rawZ')
+        crud.delete('rg_excluded')
+        crud.delete('fn_clobbers')
         crud.delete('register_group')
 
 def prepare_triples():
@@ -128,6 +148,9 @@ def populate_reg_use():
         - function-return
         - block-start-marker
         - block-end-marker
+        - global (for the pinned_global variables)
+
+    It also marks the triple-outputs of the Rematerializable operators.
     '''
 
     with crud.db_transaction():
@@ -194,7 +217,7 @@ def populate_reg_use():
                           and tp.parameter_num = csp.parameter_num
                where t.code_seq_id notnull
                  and t.operator not in 
-                     ('output', 'output-bit-set', 'output-bit-clear',
+                     ('output-bit-set', 'output-bit-clear',
                       'global_addr', 'global', 'local_addr', 'local',
                       'call_direct', 'call_indirect', 'return',
                       'if_false', 'if_true')
@@ -269,7 +292,15 @@ def populate_reg_use():
                      inner join symbol_table local
                        on fn.id = local.context
                where fn.kind in ('function', 'task')
-                 and local.kind in ('parameter', 'var')
+                 and (local.kind = 'parameter'
+                      or local.kind = 'var'
+                         and (exists (select null
+                                        from triple_labels tl
+                                       where tl.symbol_id = local.id)
+                              or exists (select null
+                                           from triples t
+                                          where t.operator = 'local'
+                                            and t.symbol_id = local.id)))
           ''')
 
         # Populate reg_use for function-return:
@@ -313,6 +344,64 @@ def populate_reg_use():
                where ru.kind = 'block-start-marker'
           ''')
 
+        # Populate reg_use for global:
+        #   with the largest reg_class of its width, in case nothing is
+        #   linked to it.
+        crud.execute('''
+            insert into reg_use
+              (kind, ref_id, initial_reg_class, num_registers)
+              select 'global', pg.var_id,
+                     (select rc.id
+                        from reg_class rc
+                       where rc.num_registers = pg.num_registers
+                       order by rc.class_size desc, rc.id
+                       limit 1),
+                     1
+                from pinned_global pg
+          ''')
+
+        # Mark the rematerializable triple-outputs:
+        crud.execute('''
+            update reg_use
+               set rematerializable = 1
+             where kind = 'triple-output'
+               and exists (select null
+                             from triples t
+                            where t.id = reg_use.ref_id
+                              and t.operator in ({}))
+          '''.format(', '.join(('?',) * len(Rematerializable))),
+          Rematerializable)
+
+        # And the triple/parameters that these feed, which must be able to
+        # take the recomputed value, in case they end up in a different
+        # register than the triple-output.
+        crud.execute('''
+            update reg_use
+               set rematerializable = 1,
+                   initial_reg_class =
+                     (select rc_subset(reg_use.initial_reg_class,
+                                       out.initial_reg_class)
+                        from triple_parameters tp
+                             inner join reg_use out
+                               on  out.kind = 'triple-output'
+                               and out.ref_id = tp.parameter_id
+                       where tp.parent_id = reg_use.ref_id
+                         and tp.parameter_num = reg_use.position
+                         and out.rematerializable)
+             where kind = 'triple'
+               and position_kind = 'parameter'
+               and exists (select null
+                             from triple_parameters tp
+                                  inner join reg_use out
+                                    on  out.kind = 'triple-output'
+                                    and out.ref_id = tp.parameter_id
+                            where tp.parent_id = reg_use.ref_id
+                              and tp.parameter_num = reg_use.position
+                              and out.rematerializable
+                              and rc_subset(reg_use.initial_reg_class,
+                                            out.initial_reg_class) notnull)
+          ''')
+
 def populate_reg_use_linkage():
     r'''Populate the reg_use_linkage table.
 
@@ -323,9 +412,18 @@ def populate_reg_use_linkage():
     with crud.db_transaction():
         # triple(-output) -> triple/parameter linkages
         #   chaining the triple-output to its parent's triple_parameters.
+        #   A parameter that its parent trashes is left out of the chain
+        #   unless it is the last use of the triple-output, since the value
+        #   is still needed after the parent.  It gets its own register, and
+        #   expand_assembler copies the value into it.  The same goes for
+        #   the values of variables (loads of globals and locals, and
+        #   triples stored in a variable), which live on after their last
+        #   use here.
         it = crud.fetchall('''
               select ru1.id, ru2.id
                 from reg_use ru1
+                     inner join triples c
+                       on ru1.ref_id = c.id
                      inner join triple_parameters tp
                        on ru1.ref_id = tp.parameter_id
                      inner join reg_use ru2
@@ -334,6 +432,12 @@ def populate_reg_use_linkage():
                where ru1.kind = 'triple-output'
                  and ru2.kind = 'triple'
                  and ru2.position_kind = 'parameter'
+                 and (not tp.trashed
+                      or tp.last_parameter_use
+                         and c.operator not in ('global', 'local')
+                         and not exists (select null
+                                           from triple_labels tl
+                                          where tl.triple_id = c.id))
                order by ru1.id, ru2.abs_order_in_block
           ''')
         crud.executemany('''
@@ -346,6 +450,26 @@ def populate_reg_use_linkage():
 
         print("done inserting reg_use_linkage segments", file = sys.stderr)
 
+        # triple/parameter -> triple-output linkages
+        #   the output parameter of a code_seq is where it leaves its answer.
+        crud.execute('''
+            insert into reg_use_linkage (reg_use_1, reg_use_2)
+              select ru1.id, ru2.id
+                from reg_use ru1
+                     inner join triples t
+                       on ru1.ref_id = t.id
+                     inner join code_seq cs
+                       on cs.id = t.code_seq_id
+                     inner join reg_use ru2
+                       on ru2.ref_id = t.id
+               where ru1.kind = 'triple'
+                 and ru1.position_kind = 'parameter'
+                 and ru1.position = cs.from_param_num
+                 and ru2.kind = 'triple-output'
+          ''')
+
+        print("done triple/parameter -> triple-output", file = sys.stderr)
+
         # triple-output -> function/parameter linkages
         #   assignment to parameter inside the function (not passing parameter).
         crud.execute('''
@@ -394,7 +518,7 @@ def populate_reg_use_linkage():
                      inner join reg_use ru2
                        on ru2.ref_id = t.symbol_id
                where ru1.kind = 'triple-output'
-                 and t.operator = 'call-direct'
+                 and t.operator = 'call_direct'
                  and ru2.kind = 'function-return'
           ''')
 
@@ -434,10 +558,11 @@ def populate_reg_use_linkage():
                          on ru1.ref_id = t.id
                        inner join reg_use ru2
                          on     ru2.ref_id = t.symbol_id
-                            and ru1.position = ru2.position
+                            -- parameter_nums start at 1, symbol int1 at 0
+                            and ru1.position = ru2.position + 1
                where ru1.kind = 'triple'
                  and ru1.position_kind = 'parameter'
-                 and t.operator = 'call-direct'
+                 and t.operator = 'call_direct'
                  and ru2.kind = 'function'
                  and ru2.position_kind = 'parameter'
           ''')
@@ -466,6 +591,7 @@ def populate_reg_use_linkage():
         print("done triple/parameter -> function-return", file = sys.stderr)
 
         # Gather last references to locals
+        #   (parameters that are trashed don't hold the variable's value).
         it = crud.fetchall('''
                  -- get labels
                  select t.block_id as block_id, tl.symbol_id as symbol_id,
@@ -481,6 +607,7 @@ def populate_reg_use_linkage():
                           and var.kind in ('parameter', 'var')
                         left join triple_parameters tp
                           on tp.parameter_id = t.id
+                          and not tp.trashed
                         left join triples p
                           on tp.parent_id = p.id
 
@@ -496,6 +623,7 @@ def populate_reg_use_linkage():
                         inner join triples p
                           on tp.parent_id = p.id
                   where t.operator = 'local'
+                    and not tp.trashed
 
                   order by block_id, symbol_id,
                            abs_order_in_block desc, parameter_num desc
@@ -655,6 +783,13 @@ def populate_reg_use_linkage():
 
         print("done function -> block-*-marker", file = sys.stderr)
 
+    # triple-output -> global linkages
+    #   binding the loads of and stores to pinned global variables to their
+    #   global reg_use.  This needs all of the other linkages to be in.
+    pin_globals.link()
+
+    print("done triple-output -> global", file = sys.stderr)
+
 def pairs(it):
     r'''Generates pairs from seq.
 
@@ -0,0 +1,109 @@
+# spill_costs.py
+
+r'''The spill cost of each reg_use, for choosing which links to break.
+
+When `ucc.codegen.assign_registers.break_links` has to break
+reg_use_linkages to make room for a register_group, each broken link costs
+a move every time that its block runs.  So the spill cost of a reg_use is
+how often its block is expected to run:
+
+    - the block's count from the profile (block_profile), if there is one
+      for its function,
+    - otherwise Loop_weight to the power of the block's loop nesting depth.
+
+Breaking a link between two rematerializable reg_uses (see
+`ucc.codegen.reg_alloc.populate_reg_use`) only costs Remat_factor as much.
+
+The loop nesting depth is the number of natural loops that contain the
+block.  Each back edge (an edge to a block that dominates its predecessor)
+in block_successors makes a natural loop, like the ones made by 'repeat'
+and 'if-true' at the bottom of a loop.
+
+The only function called here from outside is `set_spill_costs`.
+'''
+
+import collections
+
+from ucc.database import crud, optimizer_prep
+from ucc.compiler import dataflow, value_numbering
+
+# How many times more often the body of a loop is expected to run than the
+# code around it.
+Loop_weight = 10
+
+# What breaking a link between rematerializable reg_uses costs, relative to
+# other links.  The value is just recomputed (like an LDI for an 'int')
+# rather than moved or spilled.
+Remat_factor = 0.25
+
+def loop_depths(entry, successors):
+    r'''Returns {node: loop nesting depth} for the nodes reachable from entry.
+
+    'successors' is {node: sequence of nodes}.
+
+        >>> sorted(loop_depths('a', {'a': ('b',), 'b': ('c', 'e'),
+        ...                          'c': ('d', 'c'), 'd': ('b',)}).items())
+        [('a', 0), ('b', 1), ('c', 2), ('d', 1), ('e', 0)]
+        >>> sorted(loop_depths('a', {'a': ('b',), 'b': ('c', 'd'),
+        ...                          'c': ('b',), 'd': ('b',)}).items())
+        [('a', 0), ('b', 1), ('c', 1), ('d', 1)]
+        >>> loop_depths('a', {})
+        {'a': 0}
+    '''
+    idom = value_numbering.dominators(entry, successors)
+    def dominates(a, b):
+        while b is not None:
+            if a == b: return True
+            b = idom[b]
+        return False
+    predecessors = dataflow.predecessors_of(
+                     {node: successors.get(node, ()) for node in idom})
+    bodies = collections.defaultdict(set)       # {header: {node}}
+    for node in idom:
+        for succ in successors.get(node, ()):
+            if succ in idom and dominates(succ, node):
+                # node -> succ is a back edge, walk back from node to succ:
+                body = bodies[succ]
+                body.add(succ)
+                stack = [node]
+                while stack:
+                    n = stack.pop()
+                    if n not in body:
+                        body.add(n)
+                        stack.extend(p for p in predecessors[n] if p in idom)
+    depths = dict.fromkeys(idom, 0)
+    for body in bodies.values():
+        for node in body:
+            depths[node] += 1
+    return depths
+
+def block_weights():
+    r'''Returns {block_id: expected execution count} for all of the blocks.
+    '''
+    optimizer_prep.fill_block_successors()
+    entries, successors, _ = optimizer_prep.flow_graph()
+    weights = {}
+    for entry in entries:
+        for block_id, depth in loop_depths(entry, successors).items():
+            weights[block_id] = Loop_weight ** depth
+    weights.update(crud.fetchall('''
+        select b.id, bp.count
+          from blocks b
+               inner join symbol_table fn
+                 on b.word_symbol_id = fn.id
+               inner join block_profile bp
+                 on  bp.word_label = fn.label
+                 and bp.block_name = b.name
+      '''))
+    return weights
+
+def set_spill_costs():
+    r'''Sets reg_use.spill_cost for all of the reg_uses within blocks.
+    '''
+    with crud.db_transaction():
+        crud.executemany('''
+            update reg_use
+               set spill_cost = ?
+             where block_id = ?
+          ''', ((weight, block_id)
+                for block_id, weight in block_weights().items()))
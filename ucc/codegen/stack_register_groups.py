@@ -104,7 +104,8 @@ def set_Z(attempt_number):
     '''
     crud.execute('''
         update register_group
-           set Z = (select sum(min(b.value, root.value))
+           set Z = ifnull(
+                   (select sum(min(b.value, root.value))
                       from rawZ root
                            inner join vertex v
                              on  root.vertex_id = v.id
@@ -114,7 +115,8 @@ def set_Z(attempt_number):
                              on  b.N = rg.reg_class
                              and b.v = v.id
                      where v.parent isnull
-                       and root.reg_group_id = register_group.id)
+                       and root.reg_group_id = register_group.id),
+                   0)   -- no neighbors
          where attempt_number = ?
       ''', (attempt_number,))
 
@@ -147,6 +149,12 @@ def stack_register_groups(attempt_number, num_register_groups):
                    (select class_size
                       from reg_class rc
                      where rc.id = register_group.reg_class)
+                   - (select count(*)   -- less the ones it can't use
+                        from rg_excluded x
+                             inner join reg_in_class ric
+                               on  ric.reg = x.reg
+                               and ric.reg_class = register_group.reg_class
+                       where x.reg_group_id = register_group.id)
               ''', (i, attempt_number))[0]
             print("stacking", i, "assignment_certain got", row_count,
                   file=sys.stderr)
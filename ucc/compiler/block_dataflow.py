@@ -0,0 +1,197 @@
+# block_dataflow.py
+
+r'''The dataflow problems solved over the blocks of the program.
+
+These are reaching definitions, live variables and available expressions,
+solved with the `ucc.compiler.dataflow` engine over the flow graph from
+`ucc.database.optimizer_prep`.  They all need
+`ucc.database.optimizer_prep.fill_block_successors` to have been run.
+'''
+
+import collections
+
+from ucc.database import crud, optimizer_prep
+from ucc.compiler import dataflow, dead_code
+
+def reaching_definitions(materialize = True):
+    r'''Figures out which definitions of each variable reach each block.
+
+    A definition is a (symbol_id, triple_id) pair for each triple_label.
+    Calls to functions that set global variables are also definitions of
+    those variables (by the call triple).  These are not included in kills,
+    because there may be paths through the function that don't set the
+    variable.
+
+    Returns ({block_id: set of definitions}, {block_id: set of definitions})
+    for the ins and outs of each block.  If 'materialize', these are also
+    stored in the gens, kills, ins and outs tables.
+    '''
+    defs = dataflow.bit_map()
+    defs_of = collections.defaultdict(int)      # {symbol_id: bits}
+    gen_defs = collections.defaultdict(list)    # {block_id: [definition]}
+    for block_id, symbol_id, triple_id, is_gen in crud.fetchall("""
+        select t.block_id, tl.symbol_id, tl.triple_id, tl.is_gen
+          from triple_labels tl
+               inner join triples t on tl.triple_id = t.id
+         order by t.block_id, tl.triple_id
+        """):
+        bit = defs.bit((symbol_id, triple_id))
+        defs_of[symbol_id] |= bit
+        if is_gen: gen_defs[block_id].append((symbol_id, triple_id))
+    kill = {}
+    for block_id, d in gen_defs.items():
+        bits = 0
+        for symbol_id, _ in d: bits |= defs_of[symbol_id]
+        kill[block_id] = bits
+    kill_symbols = {block_id: sorted(set(symbol_id for symbol_id, _ in d))
+                    for block_id, d in gen_defs.items()}
+    for block_id, var_id, triple_id in optimizer_prep.call_sets(True):
+        gen_defs[block_id].append((var_id, triple_id))
+    gen = {block_id: defs.bits(d) for block_id, d in gen_defs.items()}
+
+    entries, successors, nodes = optimizer_prep.flow_graph()
+    ins, outs = dataflow.solve(entries, successors, gen, kill, nodes=nodes)
+    ins = {block_id: set(defs.items(bits)) for block_id, bits in ins.items()}
+    outs = {block_id: set(defs.items(bits)) for block_id, bits in outs.items()}
+
+    if materialize:
+        for table in 'gens', 'kills', 'ins', 'outs':
+            crud.delete(table)
+        for block_id, d in gen_defs.items():
+            for symbol_id, triple_id in sorted(set(d)):
+                crud.insert('gens', block_id=block_id, symbol_id=symbol_id,
+                            triple_id=triple_id)
+        for block_id, symbols in kill_symbols.items():
+            for symbol_id in symbols:
+                crud.insert('kills', block_id=block_id, symbol_id=symbol_id)
+        for table, values in ('ins', ins), ('outs', outs):
+            for block_id, d in values.items():
+                for symbol_id, triple_id in sorted(d):
+                    crud.insert(table, block_id=block_id, symbol_id=symbol_id,
+                                triple_id=triple_id)
+    return ins, outs
+
+def live_variables():
+    r'''Figures out which variables are live at the start and end of each block.
+
+    A variable is used by a 'global' or 'local' triple, or by calling a
+    function that uses (without setting) a global variable.  It is defined
+    by a triple_label.  The global variables are live at the end of each
+    function.
+
+    Returns ({block_id: set of symbol_ids}, {block_id: set of symbol_ids})
+    for the ins and outs of each block.
+    '''
+    vars = dataflow.bit_map()
+    uses = collections.defaultdict(int)
+    for block_id, symbol_id in crud.fetchall("""
+        select block_id, symbol_id
+          from triples
+         where operator in ('global', 'local')
+        """):
+        uses[block_id] |= vars.bit(symbol_id)
+    for block_id, var_id, _ in optimizer_prep.call_sets(False):
+        uses[block_id] |= vars.bit(var_id)
+    defs = collections.defaultdict(int)
+    for block_id, symbol_id in crud.fetchall("""
+        select t.block_id, tl.symbol_id
+          from triple_labels tl
+               inner join triples t on tl.triple_id = t.id
+        """):
+        defs[block_id] |= vars.bit(symbol_id)
+    globals = 0
+    for symbol_id in crud.read_column('symbol_table', 'id', kind='var',
+                                      context=None):
+        if symbol_id in vars.index: globals |= vars.bit(symbol_id)
+
+    entries, successors, nodes = optimizer_prep.flow_graph()
+    # The variables used in a block are read before any of its labels set
+    # them, since the labels are on the values being stored.  So the uses
+    # aren't killed by the defs in the same block.
+    ins, outs = dataflow.solve(entries, successors, uses, defs,
+                               forward=False, boundary=globals, nodes=nodes)
+    return ({block_id: set(vars.items(bits)) for block_id, bits in ins.items()},
+            {block_id: set(vars.items(bits))
+             for block_id, bits in outs.items()})
+
+def available_expressions():
+    r'''Figures out which expressions are available at the start of each block.
+
+    An expression is a triple without side effects, identified by its
+    structure: (operator, int1, int2, symbol_id, string, (parameters...)).
+    So the same expression computed in two blocks is the same fact.  An
+    expression is killed by any definition of a variable it reads (including
+    by calls to functions setting global variables).
+
+    Returns ({block_id: set of expressions}, {block_id: set of expressions})
+    for the ins and outs of each block.
+    '''
+    triples = {}
+    for row in crud.fetchall("""
+        select id, block_id, operator, int1, int2, symbol_id, string
+          from triples
+         order by id
+        """):
+        triples[row[0]] = row[1:]
+    params = collections.defaultdict(list)
+    for parent, child in crud.fetchall("""
+        select parent_id, parameter_id
+          from triple_parameters
+         order by parent_id, parameter_num
+        """):
+        params[parent].append(child)
+    sets = collections.defaultdict(set)
+    for block_id, symbol_id in crud.fetchall("""
+        select t.block_id, tl.symbol_id
+          from triple_labels tl
+               inner join triples t on tl.triple_id = t.id
+        """):
+        sets[block_id].add(symbol_id)
+    for block_id, var_id, _ in optimizer_prep.call_sets(True):
+        sets[block_id].add(var_id)
+
+    exprs = dataflow.bit_map()
+    reads = collections.defaultdict(int)        # {symbol_id: bits}
+    keys = {}                   # {triple_id: (expression, symbols read)}
+    def key(triple_id):
+        if triple_id not in keys:
+            _, operator, int1, int2, symbol_id, string = triples[triple_id]
+            if operator in dead_code.Side_effects:
+                keys[triple_id] = None
+            else:
+                children = tuple(key(p) for p in params[triple_id])
+                if None in children:
+                    keys[triple_id] = None
+                else:
+                    read = frozenset(s for _, r in children for s in r)
+                    if operator in ('global', 'local'):
+                        read |= frozenset((symbol_id,))
+                    keys[triple_id] = \
+                      ((operator, int1, int2, symbol_id, string,
+                        tuple(e for e, _ in children)),
+                       read)
+        return keys[triple_id]
+    gen = collections.defaultdict(int)
+    for triple_id, (block_id, *_) in triples.items():
+        k = key(triple_id)
+        if k is not None:
+            expr, read = k
+            bit = exprs.bit(expr)
+            for symbol_id in read: reads[symbol_id] |= bit
+            # Conservative: an expression reading a variable set in the same
+            # block may be computed before the set.
+            if not (read & sets[block_id]):
+                gen[block_id] |= bit
+    kill = {}
+    for block_id, symbols in sets.items():
+        bits = 0
+        for symbol_id in symbols: bits |= reads[symbol_id]
+        kill[block_id] = bits
+
+    entries, successors, nodes = optimizer_prep.flow_graph()
+    ins, outs = dataflow.solve(entries, successors, gen, kill,
+                               intersect=True, universe=exprs.universe,
+                               nodes=nodes)
+    return ({block_id: set(exprs.items(bits)) for block_id, bits in ins.items()},
+            {block_id: set(exprs.items(bits))
+             for block_id, bits in outs.items()})
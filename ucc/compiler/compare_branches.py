@@ -0,0 +1,98 @@
+# compare_branches.py
+
+r'''Fuses comparisons into the conditional branches that test them.
+
+An 'if-true' or 'if-false' whose condition is a comparison that isn't used
+anywhere else is replaced by a single compare-and-branch triple.  This
+branches to the block's next_conditional if its comparison is true:
+
+    if-true (a < b)     =>  if-< a b
+    if-false (a < b)    =>  if->= a b
+
+The AVR has no BRGT or BRLE, so 'a > b' is done as 'b < a' and 'a <= b' as
+'b >= a'.  When b is a constant, these become 'a >= b+1' and 'a < b+1'
+instead, so that the constant can stay an immediate operand (CPI).
+
+So the code generator only sees 'if-=', 'if-!=', 'if-<' and 'if->='.
+'''
+
+from ucc.database import crud, triple
+from ucc.compiler import fold_constants
+
+Branches = {'=': 'if-=', '!=': 'if-!=', '<': 'if-<', '>=': 'if->='}
+Fused = tuple(sorted(Branches.values()))
+
+Inverse = {'=': '!=', '!=': '=', '<': '>=', '>=': '<', '>': '<=', '<=': '>'}
+
+def canonical(comparison, right_int):
+    r'''Returns (comparison, swap, new_right_int) to get rid of '>' and '<='.
+
+    'right_int' is the value of the right operand if it's an 'int' triple,
+    else None.  'new_right_int' is the value for a new right 'int' operand,
+    or None to keep the old one.
+
+        >>> canonical('<', None)
+        ('<', False, None)
+        >>> canonical('>', None)
+        ('<', True, None)
+        >>> canonical('<=', 9)
+        ('<', False, 10)
+        >>> canonical('>', 0x7fff)
+        ('<', True, None)
+    '''
+    if comparison in Branches:
+        return comparison, False, None
+    flipped = {'>': '<', '<=': '>='}[comparison]
+    if right_int is not None and \
+       fold_constants.to_signed(right_int) < fold_constants.Signed_max:
+        return {'>': '>=', '<=': '<'}[comparison], False, \
+               fold_constants.to_signed(right_int) + 1
+    return flipped, True, None
+
+def fuse():
+    r'''Fuses the comparisons into their branches.
+
+    Returns the number of branches fused.
+
+    This must be run inside a db_transaction.
+    '''
+    rows = tuple(crud.fetchall("""
+        select t.id, t.operator, t.block_id, c.id, c.operator
+          from triples t
+               inner join triple_parameters tp on tp.parent_id = t.id
+               inner join triples c on tp.parameter_id = c.id
+         where t.operator in ('if-true', 'if-false')
+           and c.operator in ({})
+           and (select count(*) from triple_parameters u
+                 where u.parameter_id = c.id) = 1
+           and not exists (select null from triple_labels tl
+                            where tl.triple_id = c.id)
+        """.format(', '.join('?' * len(fold_constants.Comparisons))),
+        fold_constants.Comparisons))
+    for branch_id, branch, block_id, compare_id, comparison in rows:
+        if branch == 'if-false': comparison = Inverse[comparison]
+        left, right = crud.read_column('triple_parameters', 'parameter_id',
+                                       parent_id=compare_id,
+                                       order_by='parameter_num')
+        right_operator, right_int = \
+          crud.read1_as_tuple('triples', 'operator', 'int1', id=right)
+        comparison, swap, new_right = \
+          canonical(comparison,
+                    right_int if right_operator == 'int' else None)
+        if new_right is not None:
+            right = crud.insert('triples', block_id=block_id, operator='int',
+                                int1=new_right)
+        if swap: left, right = right, left
+        crud.delete('triple_parameters', parent_id=branch_id)
+        crud.update('triples', {'id': branch_id},
+                    operator=Branches[comparison])
+        crud.insert('triple_parameters', parent_id=branch_id,
+                    parameter_id=left, parameter_num=1)
+        crud.insert('triple_parameters', parent_id=branch_id,
+                    parameter_id=right, parameter_num=2)
+        crud.update('triple_order_constraints', {'successor': compare_id},
+                    successor=branch_id)
+        crud.update('triple_order_constraints', {'predecessor': compare_id},
+                    predecessor=branch_id)
+        triple.delete_ids((compare_id,))
+    return len(rows)
@@ -5,8 +5,8 @@ import time
 
 from ucc.compiler import parse, optimize
 from ucc.assembler import assemble
-from ucc.codegen import codegen
-from ucc.database import crud, block, symbol_table, ucl_types
+from ucc.codegen import codegen, expand_assembler, peephole
+from ucc.database import assembler, crud, block, symbol_table, ucl_types
 
 Debug = 0
 
@@ -62,10 +62,32 @@ def run(top, processor, prime_start_time = True, quiet = False):
         optimize.optimize()
         if not quiet: print("optimize: {:.2f}".format(elapsed()))
 
+        # execution counts from the last run (optional)
+        profile_filename = os.path.join(top.packages[-1].package_dir,
+                                        'flash.profile')
+        if os.path.exists(profile_filename):
+            expand_assembler.load_profile(profile_filename)
+            if not quiet: print("load_profile: {:.2f}".format(elapsed()))
+
         # intermediate code => assembler
         codegen.gen_assembler(processor)
         if not quiet: print("gen_assembler: {:.2f}".format(elapsed()))
 
+        # assembler => better assembler
+        counts = peephole.optimize()
+        if not quiet:
+            print("peephole ({} applied): {:.2f}"
+                    .format(', '.join("{} {}".format(rule, counts[rule])
+                                      for rule in sorted(counts))
+                              or 'none',
+                            elapsed()))
+
+        # leave out the code that the program never gets to
+        with db_conn.db_transaction():
+            assembler.delete_unreferenced_words()
+        if not quiet:
+            print("delete_unreferenced_words: {:.2f}".format(elapsed()))
+
         # assembler => .hex files
         assemble.assemble_program(top.packages[-1].package_dir)
         if not quiet: print("assemble_program: {:.2f}".format(elapsed()))
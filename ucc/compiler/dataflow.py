@@ -0,0 +1,210 @@
+# dataflow.py
+
+r'''An iterative bitvector dataflow engine.
+
+The dataflow facts are Python ints used as bitsets, with a `bit_map` to map
+the facts (definitions, variables, expressions, ...) to bits.  The nodes are
+usually block ids.
+
+`solve` does both forward and backward problems, with either union (may) or
+intersection (must) as the meet operator:
+
+    forward:    in[n] = meet(out[p] for p in predecessors(n))
+                out[n] = gen[n] | (in[n] & ~kill[n])
+
+    backward:   out[n] = meet(in[s] for s in successors(n))
+                in[n] = gen[n] | (out[n] & ~kill[n])
+
+It uses a worklist seeded in reverse postorder (postorder for backward
+problems), so that most problems converge in a couple of passes.
+
+The problems solved with this on the blocks (reaching definitions, live
+variables and available expressions) are in `ucc.compiler.block_dataflow`.
+'''
+
+import collections
+
+class bit_map:
+    r'''Maps facts to bits.
+
+        >>> defs = bit_map(('a', 'b'))
+        >>> defs.bit('c')
+        4
+        >>> defs.bits(('a', 'c'))
+        5
+        >>> defs.items(6)
+        ['b', 'c']
+        >>> defs.universe
+        7
+        >>> len(defs)
+        3
+    '''
+    def __init__(self, items = ()):
+        self.index = {}
+        self.list = []
+        for item in items: self.bit(item)
+
+    def __len__(self):
+        return len(self.list)
+
+    def bit(self, item):
+        r'''Returns the bit for 'item' (adding it if it's new).
+        '''
+        if item not in self.index:
+            self.index[item] = len(self.list)
+            self.list.append(item)
+        return 1 << self.index[item]
+
+    def bits(self, items):
+        r'''Returns the bitset for all of 'items'.
+        '''
+        ans = 0
+        for item in items: ans |= self.bit(item)
+        return ans
+
+    def items(self, bits):
+        r'''Returns the list of items in 'bits'.
+        '''
+        ans = []
+        i = 0
+        while bits:
+            if bits & 1: ans.append(self.list[i])
+            bits >>= 1
+            i += 1
+        return ans
+
+    @property
+    def universe(self):
+        return (1 << len(self.list)) - 1
+
+def reverse_postorder(entries, successors):
+    r'''Returns the nodes reachable from 'entries' in reverse postorder.
+
+    'successors' is {node: sequence of nodes}.  Each entry is done in turn.
+
+        >>> reverse_postorder(('a',), {'a': ('b', 'c'), 'b': ('d',),
+        ...                            'c': ('d',), 'd': ('a',)})
+        ['a', 'c', 'b', 'd']
+        >>> reverse_postorder(('a', 'x'), {'a': ('b',), 'x': ('b', 'y')})
+        ['x', 'y', 'a', 'b']
+    '''
+    order = []
+    seen = set()
+    for entry in entries:
+        if entry in seen: continue
+        seen.add(entry)
+        # iterative DFS, so that long chains of blocks don't hit the
+        # recursion limit:
+        stack = [(entry, iter(successors.get(entry, ())))]
+        while stack:
+            node, it = stack[-1]
+            for succ in it:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append((succ, iter(successors.get(succ, ()))))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+    order.reverse()
+    return order
+
+def predecessors_of(successors):
+    r'''Returns {node: [predecessors]} for the {node: [successors]}.
+
+        >>> sorted(predecessors_of({'a': ('b', 'c'), 'b': ('c',)}).items())
+        [('b', ['a']), ('c', ['a', 'b'])]
+    '''
+    ans = collections.defaultdict(list)
+    for node, succs in successors.items():
+        for succ in succs:
+            ans[succ].append(node)
+    return ans
+
+def solve(entries, successors, gen, kill, forward = True, intersect = False,
+          boundary = 0, universe = 0, nodes = ()):
+    r'''Solves the dataflow problem, returns ({node: in}, {node: out}).
+
+    'entries' are the entry nodes (e.g., the entry block of each function),
+    'successors' is {node: sequence of nodes}, 'gen' and 'kill' are {node:
+    bitset}.  Missing nodes in 'gen' and 'kill' are taken as 0.
+
+    'boundary' is the value flowing into the entries (forward problems) or
+    out of the exits (nodes without successors, backward problems).
+
+    For 'intersect' problems, 'universe' must have all of the bits set.  The
+    other nodes start at 'universe', so that the answer is the greatest
+    fixed point.
+
+    'nodes' are additional nodes to solve (that may not be reachable from
+    the entries).
+
+    Reaching definitions, forward with union:
+
+        >>> succ = {'a': ('b', 'c'), 'b': ('d',), 'c': ('d',), 'd': ('b',)}
+        >>> ins, outs = solve(('a',), succ,
+        ...                   gen={'a': 0b001, 'b': 0b010, 'c': 0b100},
+        ...                   kill={'a': 0b110, 'b': 0b101, 'c': 0b011})
+        >>> [bin(ins[n]) for n in 'abcd']
+        ['0b0', '0b111', '0b1', '0b110']
+        >>> [bin(outs[n]) for n in 'abcd']
+        ['0b1', '0b10', '0b100', '0b110']
+
+    Live variables, backward with union:
+
+        >>> ins, outs = solve(('a',), succ, gen={'d': 0b01, 'c': 0b10},
+        ...                   kill={'b': 0b01}, forward=False)
+        >>> [bin(ins[n]) for n in 'abcd']
+        ['0b11', '0b0', '0b11', '0b1']
+
+    Available expressions, forward with intersection:
+
+        >>> ins, outs = solve(('a',), succ, gen={'a': 0b01, 'b': 0b10},
+        ...                   kill={'c': 0b01}, intersect=True,
+        ...                   universe=0b11)
+        >>> [bin(ins[n]) for n in 'abcd']
+        ['0b0', '0b0', '0b1', '0b0']
+        >>> [bin(outs[n]) for n in 'abcd']
+        ['0b1', '0b10', '0b0', '0b0']
+    '''
+    order = reverse_postorder(entries, successors)
+    seen = set(order)
+    order.extend(n for n in nodes if n not in seen)
+    predecessors = predecessors_of(successors)
+    if forward:
+        sources, targets = predecessors, successors
+        starts = frozenset(entries)
+    else:
+        order.reverse()
+        sources, targets = successors, predecessors
+        starts = frozenset(n for n in order if not successors.get(n))
+    initial = universe if intersect else 0
+    before = {}         # in for forward, out for backward
+    after = {}          # out for forward, in for backward
+    for n in order:
+        before[n] = boundary if n in starts else initial
+        after[n] = gen.get(n, 0) | (before[n] & ~kill.get(n, 0))
+    worklist = collections.deque(order)
+    queued = set(order)
+    while worklist:
+        n = worklist.popleft()
+        queued.discard(n)
+        values = [after[s] for s in sources.get(n, ()) if s in after]
+        if n in starts:
+            values.append(boundary)
+        if values:
+            value = values[0]
+            for v in values[1:]:
+                value = value & v if intersect else value | v
+        else:
+            value = before[n]
+        before[n] = value
+        new_after = gen.get(n, 0) | (value & ~kill.get(n, 0))
+        if new_after != after[n]:
+            after[n] = new_after
+            for t in targets.get(n, ()):
+                if t in after and t not in queued:
+                    worklist.append(t)
+                    queued.add(t)
+    if forward: return before, after
+    return after, before
@@ -0,0 +1,215 @@
+# dead_code.py
+
+r'''Dead triple and dead block elimination.
+
+This is done in these steps:
+
+    1. 'if-true' and 'if-false' triples with a constant condition are
+       replaced by an unconditional jump (the block's 'next').
+    2. Blocks that can't be reached from their word's entry block (the block
+       with the word's name) are deleted.  The targets in a block's
+       jump_table are reached from it too.
+    3. Triples that aren't needed are deleted.  The needed triples are the
+       ones with side effects, labels (stores to variables), or that end
+       their block, and all of the triples that these depend on (through
+       their parameters or triple_order_constraints).
+    4. Empty blocks that just jump to another block are deleted, and the
+       blocks jumping to them are pointed at their target instead.  Then
+       step 3 is repeated for the branches that this made pointless.
+'''
+
+import collections
+import itertools
+
+from ucc.database import block, crud, triple
+from ucc.compiler import compare_branches, fold_constants, io_bits
+
+Branches = ('if-true', 'if-false') + compare_branches.Fused
+
+Side_effects = ('input', 'input-bit',
+                'output', 'output-bit-set', 'output-bit-clear',
+                'call_direct', 'call_indirect', 'return',
+                'jump-table') + Branches + io_bits.Branches
+
+def closure(roots, successors):
+    r'''Returns the set of nodes reachable from 'roots' (including 'roots').
+
+    'successors' is {node: iterable of nodes}.
+
+        >>> sorted(closure((1,), {1: (2, 3), 3: (4,), 4: (1,), 5: (6,)}))
+        [1, 2, 3, 4]
+    '''
+    ans = set(roots)
+    to_do = list(ans)
+    while to_do:
+        for succ in successors.get(to_do.pop(), ()):
+            if succ not in ans:
+                ans.add(succ)
+                to_do.append(succ)
+    return ans
+
+def resolve_jumps(jumps):
+    r'''Returns the final target of each empty block in 'jumps'.
+
+    'jumps' is {empty_block: next_block}.  Empty blocks in a cycle (which
+    would just jump around forever) are left out of the answer.
+
+        >>> sorted(resolve_jumps({'a': 'b', 'b': 'c', 'd': 'e', 'e': 'd'})
+        ...          .items())
+        [('a', 'c'), ('b', 'c')]
+    '''
+    ans = {}
+    for name in jumps:
+        seen = [name]
+        target = jumps[name]
+        while target in jumps:
+            if target in seen: break
+            seen.append(target)
+            target = jumps[target]
+        else:
+            ans[name] = target
+    return ans
+
+def fold_branches():
+    r'''Replaces branches on constant conditions by unconditional jumps.
+
+    Returns the number of branches replaced.
+    '''
+    rows = tuple(crud.fetchall("""
+        select b.id, b.next, b.next_conditional, t.id, t.operator,
+               c.operator, c.int1, c.int2
+          from blocks b
+               inner join triples t on b.last_triple_id = t.id
+               inner join triple_parameters tp on tp.parent_id = t.id
+               inner join triples c on tp.parameter_id = c.id
+         where t.operator in ('if-true', 'if-false')
+           and c.operator in ({})
+        """.format(','.join('?' * len(fold_constants.Constants))),
+        fold_constants.Constants))
+    for block_id, next, next_conditional, triple_id, operator, \
+        c_operator, int1, int2 \
+     in rows:
+        cond = fold_constants.value((c_operator, int1, int2)) != 0
+        if cond == (operator == 'if-true'):
+            next = next_conditional
+        remove_branch(block_id, triple_id, next)
+    return len(rows)
+
+def remove_branch(block_id, triple_id, next):
+    crud.update('blocks', {'id': block_id},
+                next=next, next_conditional=None, last_triple_id=None)
+    triple.delete_ids((triple_id,))
+
+def delete_unreachable_blocks():
+    r'''Deletes the blocks that can't be reached from their word's entry.
+
+    Returns the number of blocks deleted.
+    '''
+    jump_targets = collections.defaultdict(list)
+    for name, target in crud.fetchall("""
+                            select b.name, jt.target
+                              from jump_table jt
+                                   inner join blocks b
+                                     on jt.block_id = b.id
+                          """):
+        jump_targets[name].append(target)
+    dead = []
+    for word_label, blocks \
+     in itertools.groupby(crud.fetchall("""
+                              select sym.label, b.id, b.name, b.next,
+                                     b.next_conditional
+                                from blocks b
+                                     inner join symbol_table sym
+                                       on b.word_symbol_id = sym.id
+                               order by b.word_symbol_id
+                            """),
+                          lambda row: row[0]):
+        blocks = tuple(blocks)
+        successors = {name: tuple(filter(None, (next, next_conditional))) +
+                            tuple(jump_targets[name])
+                      for _, _, name, next, next_conditional in blocks}
+        if word_label not in successors: continue
+        live = closure((word_label,), successors)
+        dead.extend(id for _, id, name, _, _ in blocks if name not in live)
+    block.delete_ids(tuple(dead))
+    return len(dead)
+
+def merge_jump_blocks():
+    r'''Deletes empty blocks that only jump to another block.
+
+    The blocks jumping to them are pointed at their final target instead.  A
+    conditional branch whose target ends up the same as its 'next' block is
+    removed.
+
+    Returns the number of blocks deleted.
+    '''
+    jumps = resolve_jumps(dict(crud.fetchall("""
+        select b.name, b.next
+          from blocks b
+               inner join symbol_table sym on b.word_symbol_id = sym.id
+         where b.next not null
+           and b.next_conditional isnull
+           and b.name != sym.label
+           and not exists (select null from triples t
+                            where t.block_id = b.id)
+        """)))
+    for name, target in jumps.items():
+        crud.update('blocks', {'next': name}, next=target)
+        crud.update('blocks', {'next_conditional': name},
+                    next_conditional=target)
+        crud.update('jump_table', {'target': name}, target=target)
+        crud.execute("""
+            update triples
+               set string = ?
+             where string = ?
+               and operator in ({})
+            """.format(', '.join('?' * len(Branches))),
+            (target, name) + Branches)
+    if jumps:
+        block.delete_ids(tuple(crud.read_column('blocks', 'id',
+                                                name=tuple(jumps))))
+    for block_id, next, triple_id in tuple(crud.fetchall("""
+        select id, next, last_triple_id
+          from blocks
+         where next = next_conditional
+        """)):
+        remove_branch(block_id, triple_id, next)
+    return len(jumps)
+
+def delete_dead_triples():
+    r'''Deletes the triples whose results are not needed.
+
+    Returns the number of triples deleted.
+    '''
+    roots = set(crud.read_column('triples', 'id', operator=Side_effects))
+    roots.update(crud.fetchall("""
+        select triple_id from triple_labels
+        union
+        select last_triple_id from blocks where last_triple_id not null
+        """, ctor=lambda row: row[0]))
+    needs = collections.defaultdict(list)
+    for parent, child in crud.fetchall("""
+        select parent_id, parameter_id from triple_parameters
+        union
+        select successor, predecessor from triple_order_constraints
+        """):
+        needs[parent].append(child)
+    live = closure(roots, needs)
+    dead = tuple(id for id in crud.read_column('triples', 'id')
+                    if id not in live)
+    triple.delete_ids(dead)
+    return len(dead)
+
+def eliminate():
+    r'''Runs all of the dead code elimination steps.
+
+    Returns (branches folded, blocks deleted, triples deleted).
+
+    This must be run inside a db_transaction.
+    '''
+    branches = fold_branches()
+    blocks = delete_unreachable_blocks()
+    # the blocks must be cleared of dead triples before they look empty:
+    triples = delete_dead_triples()
+    blocks += merge_jump_blocks()
+    return branches, blocks, triples + delete_dead_triples()
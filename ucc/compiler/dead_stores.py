@@ -0,0 +1,40 @@
+# dead_stores.py
+
+r'''Dead store elimination for local variables.
+
+A triple_label stores the value of its triple into a variable.  The labels
+for local variables that aren't live at the end of their block (by
+`ucc.compiler.block_dataflow.live_variables`) are deleted, so that
+`ucc.compiler.dead_code` can then delete the triples that only computed
+their values.  These show up, for example, when the parameters of an
+inlined word are only used within one block.
+
+Global variables are live at the end of each function, so all of the
+stores to them are kept.
+'''
+
+from ucc.database import crud, optimizer_prep
+from ucc.compiler import block_dataflow
+
+def delete():
+    r'''Deletes the dead stores to local variables.
+
+    Returns the number of triple_labels deleted.
+
+    This must be run inside a db_transaction.
+    '''
+    optimizer_prep.fill_block_successors()
+    _, outs = block_dataflow.live_variables()
+    dead = [(triple_id, symbol_id)
+            for triple_id, symbol_id, block_id in crud.fetchall("""
+                select tl.triple_id, tl.symbol_id, t.block_id
+                  from triple_labels tl
+                       inner join triples t on tl.triple_id = t.id
+                       inner join symbol_table sym on tl.symbol_id = sym.id
+                 where tl.is_gen
+                   and sym.context notnull
+                """)
+            if symbol_id not in outs.get(block_id, ())]
+    for triple_id, symbol_id in dead:
+        crud.delete('triple_labels', triple_id=triple_id, symbol_id=symbol_id)
+    return len(dead)
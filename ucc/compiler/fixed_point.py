@@ -0,0 +1,527 @@
+# fixed_point.py
+
+r'''Fixed-point lowering of the 'ratio' and 'approx' constants.
+
+The AVR has no floating point, so fractions are done in fixed point.  A
+fixed-point value is kept as a plain integer (its "raw" value) in the
+registers, and its binary point is only known at compile time.  As in
+`ucc.database.ucl_types.fixedpt`, the binary_pt is the power of 2 that the
+raw value is scaled by, so that:
+
+    value == raw * 2**binary_pt
+
+An integer has a binary_pt of 0, a value with 8 fraction bits has a
+binary_pt of -8.
+
+This pass figures out the binary_pt of each triple (bottom up) and rewrites
+the triples so that only integer operators are left:
+
+    - A 'ratio' or 'approx' constant becomes a scaled 'int'.  The scaling is
+      picked by the operator using the constant (see `multiply_by`, `add`
+      and `compare_to`).
+    - A '*' of a value that fits in a byte by a fraction is done in Q1.7
+      format with FMUL, FMULS or FMULSU (the 'fmul', 'fmuls' and 'fmulsu'
+      operators), which leave 8 fraction bits in the product.  Other
+      multiplies are done with the constant scaled to an integer.
+    - A '/' by a constant is done as a '*' by its reciprocal.
+    - The binary points of the operands of '+', '-' and the comparisons are
+      aligned at compile time with 'shift-left' (or, if there isn't room,
+      'shift-right') triples.
+    - A fixed-point value used where an integer is needed (stored in an
+      integer variable, output, etc) is shifted right to drop its fraction
+      bits.  This truncates towards minus infinity.
+
+A variable declared as a `ucl_types.fixedpt` keeps the raw value with its
+declared binary_pt.  Other variables are integers.
+
+The value ranges (from `ucc.compiler.value_ranges`) are used to keep the
+raw values within 16 bits.  A value with an unknown range is taken to have no
+room for more fraction bits.
+'''
+
+import fractions
+import math
+
+from ucc.database import crud
+from ucc.compiler import fold_constants, strength_reduce, value_ranges
+
+Fraction_bits = 8       #: most fraction bits used for inexact constants
+
+Byte = (0, 255)
+Signed_byte = (-128, 127)
+
+Comparisons = {'=': '=', '!=': '!=', '<': '>', '<=': '>=', '>': '<',
+               '>=': '<='}      #: {comparison: comparison with swapped args}
+
+def exact_bits(c):
+    r'''Returns the fraction bits needed to represent 'c' exactly, or None.
+
+        >>> exact_bits(fractions.Fraction(3, 4))
+        2
+        >>> exact_bits(fractions.Fraction(5))
+        0
+        >>> exact_bits(fractions.Fraction(1, 3))
+    '''
+    d = c.denominator
+    if d & (d - 1): return None
+    return d.bit_length() - 1
+
+def scale(c, bits, rounding = round):
+    r'''Returns 'c' as a raw integer with 'bits' fraction bits.
+
+        >>> scale(fractions.Fraction(1, 3), 8)
+        85
+        >>> scale(fractions.Fraction(1, 3), 8, math.ceil)
+        86
+        >>> scale(fractions.Fraction(5, 2), -1, math.floor)
+        1
+    '''
+    return int(rounding(c * fractions.Fraction(2)**bits))
+
+def headroom(range):
+    r'''Returns how many bits a value in 'range' can be shifted left.
+
+    An unknown range (None) has no headroom.
+
+        >>> headroom((0, 255))
+        8
+        >>> headroom((-100, 100))
+        8
+        >>> headroom(None)
+        0
+    '''
+    n = 0
+    while n < 15 and value_ranges.evaluate('shift-left',
+                                           (range, (n + 1, n + 1))) \
+                       is not None:
+        n += 1
+    return n
+
+def multiply_by(c, x_range):
+    r'''Returns (operator, m, bits) to multiply a raw value by 'c'.
+
+    The answer is 'operator' of the raw value and the 'int' 'm', which has
+    'bits' more fraction bits than the raw value.
+
+    FMUL does a byte times a Q1.7 constant, shifting the product left one bit
+    so that it has 8 fraction bits:
+
+        >>> multiply_by(fractions.Fraction(3, 4), (0, 100))
+        ('fmul', 96, 8)
+        >>> multiply_by(fractions.Fraction(-1, 3), (-100, 100))
+        ('fmuls', -43, 8)
+        >>> multiply_by(fractions.Fraction(3, 2), (-50, 50))
+        ('fmulsu', 192, 8)
+
+    Otherwise the constant is scaled to an integer, exactly if possible, or
+    else with as many fraction bits as will fit:
+
+        >>> multiply_by(fractions.Fraction(3, 4), (0, 1000))
+        ('*', 3, 2)
+        >>> multiply_by(fractions.Fraction(1, 3), (0, 1000))
+        ('*', 43, 7)
+        >>> multiply_by(fractions.Fraction(1, 3), None)
+        ('*', 85, 8)
+    '''
+    def fits(operator, m):
+        return x_range is None or \
+               value_ranges.evaluate(operator, (x_range, (m, m))) is not None
+    bits = exact_bits(c)
+    if bits != 0:
+        m = scale(c, 7)
+        if value_ranges.within(x_range, Byte) and 0 < m <= 255:
+            if fits('fmul', m): return 'fmul', m, 8
+        elif value_ranges.within(x_range, Signed_byte):
+            if -128 <= m < 128 and fits('fmuls', m): return 'fmuls', m, 8
+            if 0 <= m <= 255 and fits('fmulsu', m): return 'fmulsu', m, 8
+    if bits is not None and fits('*', scale(c, bits)):
+        return '*', scale(c, bits), bits
+    for bits in range(Fraction_bits, 0, -1):
+        if fits('*', scale(c, bits)): return '*', scale(c, bits), bits
+    return '*', scale(c, 0), 0
+
+def compare_to(comparison, c, bits):
+    r'''Returns the raw 'int' to compare a value with 'bits' fraction bits to.
+
+    The 'c' constant is the right operand of the 'comparison'.  It is rounded
+    so that the answer doesn't change.  Returns None for '=' (or '!=') if the
+    value can never be equal to 'c'.
+
+        >>> compare_to('<', fractions.Fraction(5, 2), 0)
+        3
+        >>> compare_to('<=', fractions.Fraction(5, 2), 0)
+        2
+        >>> compare_to('=', fractions.Fraction(5, 2), 1)
+        5
+        >>> compare_to('=', fractions.Fraction(5, 2), 0)
+    '''
+    if comparison in ('<', '>='): return scale(c, bits, math.ceil)
+    if comparison in ('<=', '>'): return scale(c, bits, math.floor)
+    if scale(c, bits, math.floor) != scale(c, bits, math.ceil): return None
+    return scale(c, bits)
+
+class lowering(strength_reduce.reducer):
+    r'''Rewrites the triples in the database.
+
+    Like `strength_reduce.reducer`, a rewritten triple keeps its id.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.triples = {}       # {id: [operator, int1, int2, symbol_id,
+                                #       block_id]}
+        self.ranges = {}        # {id: (min, max)}
+        for id, operator, int1, int2, symbol_id, block_id, lo, hi \
+         in crud.fetchall("""
+            select t.id, t.operator, t.int1, t.int2, t.symbol_id, t.block_id,
+                   ty.min_value, ty.max_value
+              from triples t
+                   left join type ty on t.type_id = ty.id and ty.kind = 'int'
+            """):
+            self.triples[id] = [operator, int1, int2, symbol_id, block_id]
+            self.ranges[id] = None if lo is None else (lo, hi)
+        self.params = {}        # {parent: [child]}
+        for parent, child in crud.fetchall("""
+            select parent_id, parameter_id
+              from triple_parameters
+             order by parent_id, parameter_num
+            """):
+            self.params.setdefault(parent, []).append(child)
+        self.labels = {}        # {triple: [symbol]}
+        for triple_id, symbol_id in crud.fetchall("""
+            select triple_id, symbol_id from triple_labels
+            """):
+            self.labels.setdefault(triple_id, []).append(symbol_id)
+        # {symbol_id: binary_pt}
+        self.fixed_vars = dict(crud.fetchall("""
+            select sym.id, t.binary_pt
+              from symbol_table sym
+                   inner join type t
+                     on sym.type_id = t.id and t.kind = 'fixedpt'
+            """))
+        self.binary_pts = {}    # {triple_id: binary_pt, or None for a
+                                #              'ratio' or 'approx'}
+        self.converted = {}     # {(triple_id, binary_pt): triple_id}
+
+    def run(self):
+        for triple_id in sorted(self.triples):
+            self.binary_pt(triple_id)
+        for triple_id in tuple(id for id, in crud.fetchall("""
+            select t.id
+              from triples t
+             where t.operator in ('ratio', 'approx')
+               and not exists (select null from triple_parameters tp
+                                where tp.parameter_id = t.id)
+               and not exists (select null from triple_labels tl
+                                where tl.triple_id = t.id)
+            """)):
+            crud.delete('triples', id=triple_id)
+        return self.reduced
+
+    def value(self, triple_id):
+        r'''Returns the Fraction value of a 'ratio' or 'approx' triple.
+        '''
+        operator, int1, int2 = self.triples[triple_id][:3]
+        return fold_constants.value((operator, int1, int2))
+
+    def binary_pt(self, triple_id):
+        r'''Returns the binary_pt of 'triple_id', after lowering it.
+
+        Returns None for a 'ratio' or 'approx' constant.  These are left for
+        the parent to scale.
+        '''
+        if triple_id not in self.binary_pts:
+            operator, _, _, symbol_id, _ = self.triples[triple_id]
+            params = self.params.get(triple_id, [])
+            pts = [self.binary_pt(p) for p in params]
+            if operator in ('ratio', 'approx'):
+                ans = None
+            elif operator in ('global', 'local'):
+                ans = self.fixed_vars.get(symbol_id, 0)
+            elif all(pt == 0 for pt in pts):
+                ans = 0
+            elif operator in ('+', '-') and len(params) == 2:
+                ans = self.add(triple_id, operator, params, pts)
+            elif operator in Comparisons:
+                ans = self.compare(triple_id, operator, params, pts)
+            elif operator in ('*', '/') and len(params) == 2:
+                ans = self.multiply(triple_id, operator, params, pts)
+            elif operator in ('-', 'negate') and pts[0] is not None:
+                self.update_range(triple_id)
+                ans = pts[0]
+            elif operator in ('if-true', 'if-false') and pts[0] is not None:
+                # the raw value is 0 iff the value is 0
+                ans = 0
+            else:
+                for i in range(len(params)):
+                    self.convert_param(triple_id, i, 0)
+                ans = 0
+            if triple_id in self.labels:
+                ans = self.store(triple_id, ans)
+            self.binary_pts[triple_id] = ans
+        return self.binary_pts[triple_id]
+
+    def add(self, triple_id, operator, params, pts):
+        r'''Aligns the binary points of the operands of a '+' or '-'.
+
+        A constant operand is scaled to the binary_pt of the other operand,
+        with more fraction bits (up to `Fraction_bits`) if the other operand
+        has room for them.
+        '''
+        if None in pts:
+            if pts == [None, None]:
+                # fold_constants didn't fold this, it overflows
+                for i in range(2): self.convert_param(triple_id, i, 0)
+                return 0
+            i = pts.index(None)
+            x, x_pt = params[1 - i], pts[1 - i]
+            c = self.value(params[i])
+            bits = exact_bits(c)
+            if bits is None or bits > Fraction_bits: bits = Fraction_bits
+            pt = max(min(x_pt, -bits), x_pt - headroom(self.ranges[x]))
+            self.convert_param(triple_id, 1 - i, pt)
+            # x - c is x + floor(-c), the others are floor(c)
+            self.set_param(triple_id, i,
+                           self.new_int(self.block_id(triple_id),
+                                    scale(c, -pt,
+                                          math.ceil if operator == '-' and i
+                                                    else math.floor)))
+        else:
+            pt = self.align(triple_id, params, pts)
+        self.update_range(triple_id)
+        return pt
+
+    def compare(self, triple_id, operator, params, pts):
+        r'''Aligns the binary points of the operands of a comparison.
+
+        A comparison to a constant is done at the binary_pt of the other
+        operand.
+        '''
+        if None in pts and pts != [None, None]:
+            i = pts.index(None)
+            comparison = operator if i else Comparisons[operator]
+            raw = compare_to(comparison, self.value(params[i]), -pts[1 - i])
+            if raw is None:
+                self.rewrite(triple_id, 'int')
+                self.triples[triple_id][:2] = 'int', int(operator == '!=')
+                crud.update('triples', {'id': triple_id},
+                            int1=self.triples[triple_id][1])
+                self.reduced += 1
+            else:
+                self.set_param(triple_id, i,
+                               self.new_int(self.block_id(triple_id), raw))
+        elif None in pts:
+            for i in range(2): self.convert_param(triple_id, i, 0)
+        else:
+            self.align(triple_id, params, pts)
+        return 0
+
+    def align(self, triple_id, params, pts):
+        r'''Converts both (non-constant) params to the same binary_pt.
+
+        This is the finer of the two binary points, if the coarser operand
+        has the room to be shifted left.
+
+        Returns the binary_pt.
+        '''
+        coarse = 0 if pts[0] >= pts[1] else 1
+        pt = max(pts[1 - coarse],
+                 pts[coarse] - headroom(self.ranges[params[coarse]]))
+        for i in range(2): self.convert_param(triple_id, i, pt)
+        return pt
+
+    def multiply(self, triple_id, operator, params, pts):
+        r'''Lowers a '*' or '/' with a fixed-point operand.
+        '''
+        x, y = params
+        x_pt, y_pt = pts
+        block_id = self.block_id(triple_id)
+        if y_pt is None and operator == '/' and self.value(y) == 0:
+            for i in range(2): self.convert_param(triple_id, i, 0)
+            return 0
+        if operator == '*' and x_pt is None:
+            x, y, x_pt, y_pt = y, x, y_pt, x_pt
+        if x_pt is None:
+            # A constant divided by a variable is done in integers (or
+            # fold_constants didn't fold this because it overflows).
+            for i in range(2): self.convert_param(triple_id, i, 0)
+            return 0
+        if y_pt is None:
+            c = self.value(y)
+            if operator == '/': c = 1 / c
+            operator, m, bits = multiply_by(c, self.ranges[x])
+            self.rewrite(triple_id, operator, x, self.new_int(block_id, m))
+            pt = x_pt - bits
+        elif operator == '/':
+            # The fraction bits of the dividend are kept, the divisor is
+            # truncated to an integer.
+            self.rewrite(triple_id, '/', x, self.convert(y, y_pt, 0))
+            pt = x_pt
+        else:
+            operator = '*'
+            if value_ranges.within(self.ranges[x], Byte) and \
+               value_ranges.within(self.ranges[y], Byte):
+                operator = 'fmul'
+            elif value_ranges.within(self.ranges[x], Signed_byte):
+                if value_ranges.within(self.ranges[y], Signed_byte):
+                    operator = 'fmuls'
+                elif value_ranges.within(self.ranges[y], Byte):
+                    operator = 'fmulsu'
+            elif value_ranges.within(self.ranges[y], Signed_byte) and \
+                 value_ranges.within(self.ranges[x], Byte):
+                x, y, x_pt, y_pt = y, x, y_pt, x_pt
+                operator = 'fmulsu'
+            if operator != '*' and \
+               value_ranges.evaluate(operator,
+                                     (self.ranges[x], self.ranges[y])) \
+                 is None:
+                operator = '*'
+            self.rewrite(triple_id, operator, x, y)
+            pt = x_pt + y_pt - (operator != '*')
+        self.triples[triple_id][0] = operator
+        self.update_range(triple_id)
+        return pt
+
+    def store(self, triple_id, old_pt):
+        r'''Converts 'triple_id' to the binary_pt of the variables it's
+        stored in.
+
+        'old_pt' is the binary_pt of its value.  Returns the new binary_pt.
+
+        This is done before the parents of 'triple_id' are lowered, as they
+        use the value stored in the variables.
+        '''
+        pts = set(self.fixed_vars.get(s, 0) for s in self.labels[triple_id])
+        assert len(pts) == 1, \
+               "fixed_point: triple {} stored in variables with different " \
+               "binary points".format(triple_id)
+        pt = pts.pop()
+        if old_pt == pt: return pt
+        operator, int1, int2, symbol_id, block_id = self.triples[triple_id]
+        if old_pt is None or operator == 'int':
+            c = self.value(triple_id) if old_pt is None \
+                                      else fractions.Fraction(int1)
+            n = scale(c, -pt, math.floor)
+            crud.update('triples', {'id': triple_id}, operator='int',
+                        int1=n, int2=None)
+            self.triples[triple_id][:3] = 'int', n, None
+            self.ranges[triple_id] = n, n
+            self.reduced += 1
+            return pt
+
+        # Copy the triple and shift the copy into 'triple_id', so that the
+        # labels stay where they are.
+        params = self.params.get(triple_id, [])
+        copy = self.new(block_id, operator, *params,
+                        int1=int1, int2=int2, symbol_id=symbol_id)
+        self.triples[copy] = [operator, int1, int2, symbol_id, block_id]
+        self.params[copy] = list(params)
+        self.ranges[copy] = self.ranges[triple_id]
+        self.binary_pts[copy] = old_pt
+        crud.execute("""
+            insert into triple_order_constraints (predecessor, successor)
+            select predecessor, ?
+              from triple_order_constraints
+             where successor = ?
+            """, (copy, triple_id))
+        crud.update('triples', {'id': triple_id},
+                    int1=None, int2=None, symbol_id=None)
+        self.shift_to(block_id, copy, old_pt, pt, self.ranges[copy],
+                      into=triple_id)
+        return pt
+
+    def block_id(self, triple_id):
+        return self.triples[triple_id][4]
+
+    def new_int(self, block_id, n):
+        r'''Creates a new 'int' triple, returns its id.
+        '''
+        triple_id = self.new(block_id, 'int', int1=n)
+        self.triples[triple_id] = ['int', n, None, None, block_id]
+        self.ranges[triple_id] = (n, n)
+        self.binary_pts[triple_id] = 0
+        return triple_id
+
+    def set_param(self, triple_id, i, param):
+        r'''Replaces the param at index 'i' of 'triple_id'.
+        '''
+        crud.update('triple_parameters',
+                    {'parent_id': triple_id, 'parameter_num': i + 1},
+                    parameter_id=param)
+        self.params[triple_id][i] = param
+
+    def convert_param(self, triple_id, i, pt):
+        r'''Converts the param at index 'i' of 'triple_id' to binary_pt 'pt'.
+        '''
+        param = self.params[triple_id][i]
+        if self.binary_pts[param] is None:
+            self.set_param(triple_id, i,
+                           self.new_int(self.block_id(triple_id),
+                                    scale(self.value(param), -pt,
+                                          math.floor)))
+        else:
+            new = self.convert(param, self.binary_pts[param], pt)
+            if new != param: self.set_param(triple_id, i, new)
+
+    def convert(self, triple_id, from_pt, to_pt):
+        r'''Returns a triple with the value of 'triple_id' at 'to_pt'.
+        '''
+        if from_pt == to_pt: return triple_id
+        if (triple_id, to_pt) not in self.converted:
+            self.converted[triple_id, to_pt] = \
+              self.shift_to(self.block_id(triple_id), triple_id, from_pt,
+                            to_pt, self.ranges[triple_id])
+        return self.converted[triple_id, to_pt]
+
+    def shift_to(self, block_id, triple_id, from_pt, to_pt, range,
+                 into = None):
+        r'''Shifts 'triple_id' from 'from_pt' to 'to_pt'.
+
+        The 'range' is the range of the raw value of 'triple_id'.
+        '''
+        if to_pt < from_pt:
+            operator = 'shift-left'
+        elif range is not None and range[0] >= 0:
+            operator = 'shift-right'
+        else:
+            operator = 'shift-right-signed'
+        ans = self.shift(block_id, operator, triple_id, abs(to_pt - from_pt),
+                         into=into)
+        self.triples[ans] = [operator, None, None, None, block_id]
+        self.ranges[ans] = \
+          value_ranges.evaluate(operator,
+                                (range, (abs(to_pt - from_pt),) * 2))
+        return ans
+
+    def update_range(self, triple_id):
+        r'''Figures the range of the rewritten 'triple_id'.
+        '''
+        self.ranges[triple_id] = value_ranges.evaluate(
+                                   self.triples[triple_id][0],
+                                   tuple(self.ranges[p]
+                                         for p in self.params[triple_id]))
+
+    def rewrite(self, triple_id, operator, *params):
+        super().rewrite(triple_id, operator, *params)
+        self.params[triple_id] = list(params)
+        self.reduced += 1
+
+def lower():
+    r'''Lowers the 'ratio' and 'approx' constants to fixed-point integers.
+
+    This figures the value ranges first (see `value_ranges.propagate`).
+
+    Returns the number of triples lowered.
+
+    This must be run inside a db_transaction.
+    '''
+    for count, in crud.fetchall("""
+        select (select count(*) from triples
+                 where operator in ('ratio', 'approx'))
+             + (select count(*)
+                  from symbol_table sym
+                       inner join type t on sym.type_id = t.id
+                 where t.kind = 'fixedpt')
+        """):
+        if not count: return 0
+    value_ranges.propagate()
+    return lowering().run()
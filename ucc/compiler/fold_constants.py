@@ -0,0 +1,419 @@
+# fold_constants.py
+
+r'''Constant folding and propagation on the triples.
+
+Operators whose parameters are all constants ('int', 'ratio' or 'approx'
+triples) are evaluated at compile time.  The operator triple is rewritten in
+place as the resulting constant, so its parents (and labels) don't need to
+change.  This is repeated until nothing more folds, so that the folded
+constants propagate up through the expression trees.  `const` words have
+already been macro expanded into 'int' triples by the time this runs.  A
+'flash' read of a constant entry of a `table` is folded into that entry.
+
+A constant added to (or subtracted from) the result of another addition or
+subtraction of a constant is also reassociated, so that 'x + 3 - 1' becomes
+'x + 2'.
+
+Finally, constant triples that are no longer used are deleted, and duplicate
+constants in the same block are merged.
+'''
+
+import fractions
+
+from ucc.database import crud
+
+Constants = ('int', 'ratio', 'approx')
+
+Bit_operators = ('bit-and', 'bit-or', 'bit-xor', 'bit-not')
+Comparisons = ('=', '!=', '<', '<=', '>', '>=')
+Operators = ('+', '-', '*', '/', 'negate') + Bit_operators + Comparisons
+
+Int_min = -2**15        #: smallest int that fits in 16 bits (signed)
+Int_max = 2**16 - 1     #: largest int that fits in 16 bits (unsigned)
+Signed_max = 2**15 - 1  #: largest int compared as positive
+
+def value(constant):
+    r'''Returns the exact value of the (operator, int1, int2) 'constant'.
+
+        >>> value(('int', 7, None))
+        Fraction(7, 1)
+        >>> value(('ratio', 3, 4))
+        Fraction(3, 4)
+        >>> value(('approx', 1976, -4))
+        Fraction(247, 2)
+    '''
+    kind, int1, int2 = constant
+    if kind == 'int': return fractions.Fraction(int1)
+    if kind == 'ratio': return fractions.Fraction(int1, int2)
+    if kind == 'approx': return fractions.Fraction(int1) * \
+                                fractions.Fraction(2)**int2
+    raise AssertionError("value: unknown constant kind {!r}".format(kind))
+
+def floor_log2(x):
+    r'''Returns the greatest integer, e, such that 2**e <= abs(x).
+
+        >>> floor_log2(fractions.Fraction(8))
+        3
+        >>> floor_log2(fractions.Fraction(-7))
+        2
+        >>> floor_log2(fractions.Fraction(1, 3))
+        -2
+    '''
+    x = abs(x)
+    e = x.numerator.bit_length() - x.denominator.bit_length()
+    if x < fractions.Fraction(2)**e: e -= 1
+    return e
+
+def evaluate(operator, operands):
+    r'''Evaluates 'operator' on the constant 'operands' at compile time.
+
+    Each operand is an (operator, int1, int2) tuple for the 'int', 'ratio'
+    or 'approx' triple.  Returns the (operator, int1, int2) of the result, or
+    None if it can't be folded.
+
+        >>> evaluate('+', (('int', 3, None), ('int', 4, None)))
+        ('int', 7, None)
+        >>> evaluate('-', (('int', 3, None),))
+        ('int', -3, None)
+        >>> evaluate('*', (('ratio', 3, 2), ('int', 2, None)))
+        ('int', 3, None)
+        >>> evaluate('bit-and', (('int', 0xf0, None), ('int', 0x3c, None)))
+        ('int', 48, None)
+        >>> evaluate('bit-not', (('int', 5, None),))
+        ('int', -6, None)
+        >>> evaluate('bit-or', (('ratio', 1, 2), ('int', 1, None)))
+
+    Comparisons give 1 or 0.  These are signed 16-bit comparisons, like the
+    code generated for them:
+
+        >>> evaluate('<', (('int', 3, None), ('int', 4, None)))
+        ('int', 1, None)
+        >>> evaluate('<', (('int', 3, None), ('int', 0xffff, None)))
+        ('int', 0, None)
+        >>> evaluate('!=', (('ratio', 1, 2), ('int', 1, None)))
+        ('int', 1, None)
+
+    Results that don't fit in 16 bits are not folded:
+
+        >>> evaluate('*', (('int', 1000, None), ('int', 1000, None)))
+
+    A '/' of two ints is signed floor division, like the code generated for
+    it (see `ucc.compiler.strength_reduce`).  If either operand isn't an
+    int, the answer is exact:
+
+        >>> evaluate('/', (('int', 6, None), ('int', 4, None)))
+        ('int', 1, None)
+        >>> evaluate('/', (('int', -7, None), ('int', 2, None)))
+        ('int', -4, None)
+        >>> evaluate('/', (('int', 0xfff9, None), ('int', 2, None)))
+        ('int', -4, None)
+        >>> evaluate('/', (('int', 7, None), ('int', 0xfffe, None)))
+        ('int', -4, None)
+        >>> evaluate('/', (('ratio', 3, 2), ('int', 2, None)))
+        ('ratio', 3, 4)
+        >>> evaluate('/', (('int', 6, None), ('int', 0, None)))
+
+    Approximate operands give approximate results, with the precision of the
+    least precise operand:
+
+        >>> evaluate('+', (('approx', 1976, -4), ('int', 1, None)))
+        ('approx', 1992, -4)
+        >>> evaluate('*', (('approx', 1976, -4), ('int', 3, None)))
+        ('approx', 1482, -2)
+    '''
+    if operator == '-' and len(operands) == 1: operator = 'negate'
+    if len(operands) != (1 if operator in ('negate', 'bit-not') else 2):
+        return None
+    kinds = frozenset(kind for kind, int1, int2 in operands)
+    if operator in Bit_operators:
+        if kinds != frozenset(('int',)): return None
+        ints = [int1 for kind, int1, int2 in operands]
+        if operator == 'bit-and': ans = ints[0] & ints[1]
+        elif operator == 'bit-or': ans = ints[0] | ints[1]
+        elif operator == 'bit-xor': ans = ints[0] ^ ints[1]
+        else: ans = ~ints[0]
+        return make_int(ans)
+    values = [value(operand) for operand in operands]
+    if operator in Comparisons:
+        a, b = (to_signed(v) for v in values)
+        if operator == '=': ans = a == b
+        elif operator == '!=': ans = a != b
+        elif operator == '<': ans = a < b
+        elif operator == '<=': ans = a <= b
+        elif operator == '>': ans = a > b
+        else: ans = a >= b
+        return make_int(int(ans))
+    if operator == '+': ans = values[0] + values[1]
+    elif operator == '-': ans = values[0] - values[1]
+    elif operator == '*': ans = values[0] * values[1]
+    elif operator == '/':
+        if values[1] == 0: return None
+        if kinds == frozenset(('int',)):
+            ans = to_signed(values[0]) // to_signed(values[1])
+        else: ans = values[0] / values[1]
+    elif operator == 'negate': ans = -values[0]
+    else: return None
+    if 'approx' in kinds:
+        return make_approx(ans, operator,
+                           [(int1, int2) for kind, int1, int2 in operands
+                                         if kind == 'approx'])
+    if ans.denominator == 1: return make_int(ans.numerator)
+    return 'ratio', ans.numerator, ans.denominator
+
+def to_signed(x):
+    r'''Returns 16-bit int 'x' as a signed number.
+
+        >>> to_signed(0xffff), to_signed(7), to_signed(fractions.Fraction(1, 2))
+        (-1, 7, Fraction(1, 2))
+    '''
+    if x.denominator == 1 and Signed_max < x <= Int_max: return x - 2**16
+    return x
+
+def make_int(n):
+    if Int_min <= n <= Int_max: return 'int', n, None
+    return None
+
+def make_approx(ans, operator, approx_operands):
+    r'''Returns the ('approx', int1, int2) for 'ans'.
+
+    For '+', '-' and 'negate', the result has the absolute precision (binary
+    exponent) of the least precise approx operand.  For '*' and '/', it has
+    the relative precision (number of bits) of the least precise approx
+    operand.
+    '''
+    if operator in ('*', '/') and ans != 0:
+        bits = min(max(1, abs(int1).bit_length())
+                   for int1, int2 in approx_operands)
+        exp = floor_log2(ans) - bits + 1
+    else:
+        exp = max(int2 for int1, int2 in approx_operands)
+    return 'approx', int(round(ans / fractions.Fraction(2)**exp)), exp
+
+def fold():
+    r'''Folds all operators with constant parameters.
+
+    Returns the number of triples folded.
+
+    This must be run inside a db_transaction.
+    '''
+    total = 0
+    while True:
+        folded = 0
+        for triple_id, operator in list(crud.fetchall("""
+            select t.id, t.operator
+              from triples t
+             where t.operator in ({})
+               and exists (select null from triple_parameters tp
+                            where tp.parent_id = t.id)
+               and not exists
+                     (select null
+                        from triple_parameters tp
+                             inner join triples p on tp.parameter_id = p.id
+                       where tp.parent_id = t.id
+                         and p.operator not in ({}))
+            """.format(','.join('?' * len(Operators)),
+                       ','.join('?' * len(Constants))),
+            Operators + Constants)):
+            ans = evaluate(operator, tuple(parameters(triple_id)))
+            if ans is not None:
+                replace_with_constant(triple_id, ans)
+                folded += 1
+        for triple_id, symbol_id, index in list(crud.fetchall("""
+            select t.id, t.symbol_id, p.int1
+              from triples t
+                   inner join triple_parameters tp on tp.parent_id = t.id
+                   inner join triples p on tp.parameter_id = p.id
+             where t.operator = 'flash'
+               and p.operator = 'int'
+            """)):
+            values = table_values(symbol_id)
+            if 0 <= index < len(values):
+                replace_with_constant(triple_id, ('int', values[index], None))
+                folded += 1
+        if not folded: break
+        total += folded
+    return total
+
+def parameters(triple_id):
+    r'''Generates the (operator, int1, int2) of each parameter of triple_id.
+    '''
+    return crud.fetchall("""
+        select p.operator, p.int1, p.int2
+          from triple_parameters tp
+               inner join triples p on tp.parameter_id = p.id
+         where tp.parent_id = ?
+         order by tp.parameter_num
+        """, (triple_id,))
+
+def table_values(symbol_id):
+    r'''Returns the values of the `table` symbol_id as a tuple of ints.
+
+    These are the int16s in its 'code' section assembler block.
+    '''
+    return tuple(crud.fetchall("""
+        select ac.operand1
+          from assembler_blocks ab
+               inner join assembler_code ac on ac.block_id = ab.id
+         where ab.word_symbol_id = ?
+           and ab.section = 'code'
+           and ac.opcode = 'int16'
+         order by ab.id, ac.inst_order
+        """, (symbol_id,), ctor=lambda row: int(row[0], 0)))
+
+def replace_with_constant(triple_id, constant):
+    operator, int1, int2 = constant
+    crud.update('triples', {'id': triple_id},
+                operator=operator, int1=int1, int2=int2,
+                symbol_id=None, string=None)
+    crud.delete('triple_parameters', parent_id=triple_id)
+
+def reassociate():
+    r'''Combines the constants in nested additions and subtractions.
+
+    Rewrites '(x + c1) - c2' as 'x + (c1 - c2)' (and likewise for the other
+    combinations of '+' and '-') when the inner triple is only used by the
+    outer one.  A new 'int' triple is created for the combined constant,
+    since the old ones may be shared with other triples.
+
+    Returns the number of triples reassociated.
+
+    This must be run inside a db_transaction.
+    '''
+    total = 0
+    while True:
+        changed = set()         # outer_ids and inner_ids changed on this
+                                # pass
+        count = 0
+        for outer_id, outer_op, block_id, inner_id, inner_op, x_id, \
+            c1, c2 \
+         in list(crud.fetchall("""
+            select o.id, o.operator, o.block_id, i.id, i.operator,
+                   tp_x.parameter_id, c1.int1, c2.int1
+              from triples o
+                   inner join triple_parameters tp_i
+                     on tp_i.parent_id = o.id and tp_i.parameter_num = 1
+                   inner join triples i on tp_i.parameter_id = i.id
+                   inner join triple_parameters tp_c2
+                     on tp_c2.parent_id = o.id and tp_c2.parameter_num = 2
+                   inner join triples c2 on tp_c2.parameter_id = c2.id
+                   inner join triple_parameters tp_x
+                     on tp_x.parent_id = i.id and tp_x.parameter_num = 1
+                   inner join triple_parameters tp_c1
+                     on tp_c1.parent_id = i.id and tp_c1.parameter_num = 2
+                   inner join triples c1 on tp_c1.parameter_id = c1.id
+             where o.operator in ('+', '-')
+               and i.operator in ('+', '-')
+               and c1.operator = 'int' and c2.operator = 'int'
+               and (select count(*) from triple_parameters tp
+                     where tp.parameter_id = i.id) = 1
+               and not exists (select null from triple_labels tl
+                                where tl.triple_id = i.id)
+               and not exists (select null from blocks b
+                                where b.last_triple_id = i.id)
+               and not exists (select null from triple_order_constraints toc
+                                where toc.predecessor = i.id
+                                  and toc.successor != o.id)
+             order by o.id
+            """)):
+            # the query results for these are now stale:
+            if inner_id in changed or outer_id in changed: continue
+            n = (c1 if inner_op == '+' else -c1) + \
+                (c2 if outer_op == '+' else -c2)
+            if make_int(n) is None: continue
+            c_id = crud.insert('triples', block_id=block_id, operator='int',
+                               int1=abs(n))
+            crud.update('triples', {'id': outer_id},
+                        operator='-' if n < 0 else '+')
+            crud.update('triple_parameters',
+                        {'parent_id': outer_id, 'parameter_num': 1},
+                        parameter_id=x_id)
+            crud.update('triple_parameters',
+                        {'parent_id': outer_id, 'parameter_num': 2},
+                        parameter_id=c_id)
+            crud.delete('triple_order_constraints',
+                        predecessor=inner_id, successor=outer_id)
+            crud.execute("""
+                update or ignore triple_order_constraints
+                   set successor = ?, orig_succ = ?
+                 where successor = ?
+                """, (outer_id, outer_id, inner_id))
+            crud.delete('triple_order_constraints', successor=inner_id)
+            crud.delete('triple_parameters', parent_id=inner_id)
+            crud.delete('triples', id=inner_id)
+            changed.update((outer_id, inner_id))
+            count += 1
+        if not count: break
+        total += count
+    return total
+
+def delete_unused_constants():
+    r'''Deletes the constant triples that are no longer used.
+
+    Returns the number deleted.
+
+    This must be run inside a db_transaction.
+    '''
+    return crud.execute("""
+        delete from triples
+         where operator in ({})
+           and id not in (select parameter_id from triple_parameters)
+           and id not in (select triple_id from triple_labels)
+           and id not in (select last_triple_id from blocks
+                           where last_triple_id not null)
+           and id not in (select predecessor from triple_order_constraints)
+           and id not in (select successor from triple_order_constraints)
+        """.format(','.join('?' * len(Constants))),
+        Constants)[0]
+
+def merge_duplicate_constants():
+    r'''Points the parents of duplicate constants in a block at one triple.
+
+    Only constants without labels or ordering constraints are merged.  The
+    first (lowest id) of the duplicates is kept.
+
+    Returns the number of triples merged away.
+
+    This must be run inside a db_transaction.
+    '''
+    crud.execute("""
+        update triple_parameters
+           set parameter_id =
+                 (select min(keep.id)
+                    from triples dup
+                         inner join triples keep
+                           on keep.block_id = dup.block_id
+                          and keep.operator = dup.operator
+                          and keep.int1 is dup.int1
+                          and keep.int2 is dup.int2
+                   where dup.id = triple_parameters.parameter_id
+                     and not exists
+                           (select null from triple_labels
+                             where triple_id = keep.id)
+                     and not exists
+                           (select null from triple_order_constraints
+                             where predecessor = keep.id
+                                or successor = keep.id))
+         where parameter_id in
+                 (select id from triples where operator in ({}))
+           and not exists
+                 (select null from triple_labels
+                   where triple_id = triple_parameters.parameter_id)
+           and not exists
+                 (select null from triple_order_constraints
+                   where predecessor = triple_parameters.parameter_id
+                      or successor = triple_parameters.parameter_id)
+        """.format(','.join('?' * len(Constants))),
+        Constants)
+    return delete_unused_constants()
+
+def fold_constants():
+    r'''Runs constant folding on all of the triples.
+
+    Returns the number of triples folded.
+
+    This must be run inside a db_transaction.
+    '''
+    ans = fold() + reassociate()
+    delete_unused_constants()
+    merge_duplicate_constants()
+    return ans
@@ -0,0 +1,287 @@
+# io_bits.py
+
+r'''Lowers the bit I/O triples to suit the AVR's I/O instructions.
+
+The 'output-bit-set', 'output-bit-clear' and 'input-bit' triples (from
+set-output-bit, clear-output-bit, toggle, output pins and input pins) on the
+IO registers that SBI, CBI, SBIS and SBIC can reach (see
+`ucc.assembler.io.bit_addressable`) are each done with one of these
+instructions (see the 'patterns' file).  This does three things to the rest:
+
+    1. An 'if-true' or 'if-false' whose condition is an 'input-bit' (or a
+       'not' of one) that isn't used anywhere else is replaced by an
+       'if-bit-set' or 'if-bit-clear', which is an SBIS or SBIC over a JMP.
+       The 'input-bit' must be the last side effect in its block, since the
+       branch reads the bit at the end of the block.
+    2. A run of bit writes to the same IO register, one right after the
+       other in a block, is combined into one 'output' (see `combine`).
+    3. The bit writes to IO registers that SBI and CBI can't reach are done
+       as a read-modify-write ('input', 'bit-or', 'bit-and' and 'output').
+
+The only function called here from outside is `lower`.
+'''
+
+from ucc.assembler import io
+from ucc.database import crud, triple
+
+Bit_writes = ('output-bit-clear', 'output-bit-set')
+
+#: {(branch, condition is a 'not'): fused branch}
+Fused_branches = {
+    ('if-true', False): 'if-bit-set',
+    ('if-true', True): 'if-bit-clear',
+    ('if-false', False): 'if-bit-clear',
+    ('if-false', True): 'if-bit-set',
+}
+Branches = tuple(sorted(set(Fused_branches.values())))
+
+def combine(port, writes):
+    r'''Figures out how to do the bit 'writes' to IO register 'port' at once.
+
+    'writes' is a sequence of (operator, bit), with no bit repeated.
+
+    Returns ('int', value) to write 'value' to 'port', ('rmw', set_mask,
+    clear_mask) to read 'port', set and clear the bits and write it back, or
+    None to leave the writes to SBI and CBI.
+
+    Writing a 0 to a PINx bit does nothing, so the other bits of a PINx
+    register can simply be written as 0s.  So the 'output-bit-set's to these
+    are written as an 'int' (LDI and OUT):
+
+        >>> combine('pinb', (('output-bit-set', 5), ('output-bit-set', 4)))
+        ('int', 48)
+        >>> combine('pinb', (('output-bit-set', 5),))
+        >>> combine('pinb', (('output-bit-clear', 5),))
+
+    As are all 8 bits of other IO registers:
+
+        >>> combine('portb', [('output-bit-set', bit) for bit in range(7)] +
+        ...                  [('output-bit-clear', 7)])
+        ('int', 127)
+
+    Otherwise, the read-modify-write must be faster than the SBIs and CBIs
+    (2 cycles each):
+
+        >>> combine('portb', (('output-bit-set', 5), ('output-bit-set', 4)))
+        ('rmw', 48, 0)
+        >>> combine('portb', (('output-bit-set', 5), ('output-bit-clear', 4)))
+        >>> combine('portb', (('output-bit-set', 5), ('output-bit-clear', 4),
+        ...                   ('output-bit-clear', 0)))
+        ('rmw', 32, 17)
+
+    Unless SBI and CBI can't reach 'port':
+
+        >>> combine('sreg', (('output-bit-set', 7),))
+        ('rmw', 128, 0)
+    '''
+    assert io.in_out_addressable(port), \
+           "{}: IO register out of reach of IN and OUT".format(port)
+    sets = clears = 0
+    for operator, bit in writes:
+        if operator == 'output-bit-set': sets |= 1 << bit
+        else: clears |= 1 << bit
+    if port in io.Toggle_registers:
+        if clears: return None
+        if len(writes) > 1 or not io.bit_addressable(port):
+            return 'int', sets
+        return None
+    if sets | clears == 0xFF:
+        return 'int', sets
+    if not io.bit_addressable(port) or \
+       2 + bool(sets) + bool(clears) < 2 * len(writes):
+        return 'rmw', sets, clears
+    return None
+
+def runs(chain):
+    r'''Splits 'chain' into the runs of bit writes that may be combined.
+
+    'chain' is a sequence of (triple_id, port, operator, bit) of bit writes
+    done one right after the other.  A run ends at a change of port, or at a
+    bit already written in the run (the first write may be a pulse).  A clear
+    of a PINx bit does nothing, and is left in a run by itself.
+
+        >>> for run in runs(((1, 'portb', 'output-bit-set', 5),
+        ...                  (2, 'portb', 'output-bit-set', 4),
+        ...                  (3, 'portb', 'output-bit-clear', 5),
+        ...                  (4, 'pinb', 'output-bit-set', 5),
+        ...                  (5, 'pinb', 'output-bit-clear', 4),
+        ...                  (6, 'pinb', 'output-bit-set', 4))):
+        ...     print([triple_id for triple_id, _, _, _ in run])
+        [1, 2]
+        [3]
+        [4]
+        [5]
+        [6]
+    '''
+    run = []
+    for write in chain:
+        _, port, operator, bit = write
+        if run and (port != run[0][1] or
+                    any(bit == b for _, _, _, b in run) or
+                    port in io.Toggle_registers and
+                      'output-bit-clear' in (operator, run[0][2])):
+            yield run
+            run = []
+        run.append(write)
+    if run: yield run
+
+def chains():
+    r'''Generates the chains of bit writes done one right after the other.
+
+    Each chain is a list of (triple_id, port, operator, bit).
+
+    Every side effect in a block has the one before it as a predecessor in
+    triple_order_constraints, so these are the bit writes linked by these.
+    '''
+    writes = {triple_id: (triple_id, port, operator, bit)
+              for triple_id, port, operator, bit
+               in crud.fetchall("""
+                    select id, string, operator, int1
+                      from triples
+                     where operator in (?, ?)
+                     order by id
+                    """, Bit_writes)}
+    following = {}              # {triple_id: next bit write}
+    for pred, succ in crud.fetchall("""
+            select c.predecessor, c.successor
+              from triple_order_constraints c
+                   inner join triples p on p.id = c.predecessor
+                   inner join triples s on s.id = c.successor
+             where p.operator in (?, ?)
+               and s.operator in (?, ?)
+               and p.block_id = s.block_id
+            """, Bit_writes + Bit_writes):
+        following[pred] = succ
+    heads = set(writes).difference(following.values())
+    for triple_id in sorted(heads):
+        chain = []
+        while triple_id is not None:
+            chain.append(writes[triple_id])
+            triple_id = following.get(triple_id)
+        yield chain
+
+def splice(run_ids, first_id, last_id):
+    r'''Replaces the triples in 'run_ids' with 'first_id' to 'last_id'.
+
+    The triples in 'run_ids' are deleted, and the triples that had to be done
+    before them (or after them) must now be done before 'first_id' (or after
+    'last_id').
+    '''
+    preds = set(crud.read_column('triple_order_constraints', 'predecessor',
+                                 successor=run_ids)) \
+              .difference(run_ids)
+    succs = set(crud.read_column('triple_order_constraints', 'successor',
+                                 predecessor=run_ids)) \
+              .difference(run_ids)
+    triple.delete_ids(run_ids)
+    constraints = [(pred, first_id) for pred in sorted(preds)] + \
+                  [(last_id, succ) for succ in sorted(succs)]
+    if first_id != last_id: constraints.append((first_id, last_id))
+    for pred, succ in constraints:
+        crud.insert('triple_order_constraints', predecessor=pred,
+                    successor=succ, orig_pred=pred, orig_succ=succ)
+
+def gen_triple(block_id, operator, params=(), **cols):
+    r'''Inserts a new triple and returns its id.
+    '''
+    triple_id = crud.insert('triples', block_id=block_id, operator=operator,
+                            **cols)
+    for num, param_id in enumerate(params, 1):
+        crud.insert('triple_parameters', parent_id=triple_id,
+                    parameter_id=param_id, parameter_num=num)
+    return triple_id
+
+def combine_writes():
+    r'''Combines the runs of bit writes.
+
+    Returns the number of bit writes replaced.
+    '''
+    count = 0
+    for chain in tuple(chains()):
+        for run in runs(chain):
+            port = run[0][1]
+            how = combine(port, [(operator, bit)
+                                 for _, _, operator, bit in run])
+            if how is None: continue
+            run_ids = tuple(triple_id for triple_id, _, _, _ in run)
+            block_id = crud.read1_column('triples', 'block_id',
+                                         id=run_ids[0])
+            if how[0] == 'int':
+                value_id = gen_triple(block_id, 'int', int1=how[1])
+                first_id = last_id = \
+                  gen_triple(block_id, 'output', (value_id,), string=port)
+            else:
+                _, sets, clears = how
+                first_id = value_id = \
+                  gen_triple(block_id, 'input', string=port)
+                if sets:
+                    value_id = gen_triple(
+                                 block_id, 'bit-or',
+                                 (value_id,
+                                  gen_triple(block_id, 'int', int1=sets)))
+                if clears:
+                    value_id = gen_triple(
+                                 block_id, 'bit-and',
+                                 (value_id,
+                                  gen_triple(block_id, 'int',
+                                             int1=~clears & 0xFF)))
+                last_id = \
+                  gen_triple(block_id, 'output', (value_id,), string=port)
+            splice(run_ids, first_id, last_id)
+            count += len(run_ids)
+    return count
+
+def single_use(triple_id):
+    r'''True if 'triple_id' is used once, and isn't stored in a variable.
+    '''
+    return crud.count('triple_parameters', parameter_id=triple_id) == 1 and \
+           not crud.count('triple_labels', triple_id=triple_id)
+
+def fuse_branches():
+    r'''Fuses the 'input-bit' tests into their branches.
+
+    Returns the number of branches fused.
+    '''
+    count = 0
+    for branch_id, branch, cond_id, cond in tuple(crud.fetchall("""
+            select t.id, t.operator, c.id, c.operator
+              from triples t
+                   inner join triple_parameters tp on tp.parent_id = t.id
+                   inner join triples c on tp.parameter_id = c.id
+             where t.operator in ('if-true', 'if-false')
+               and c.operator in ('input-bit', 'not')
+            """)):
+        if not single_use(cond_id): continue
+        deleted = [cond_id]
+        if cond == 'not':
+            bit_id = crud.read1_column('triple_parameters', 'parameter_id',
+                                       parent_id=cond_id)
+            if not single_use(bit_id): continue
+            deleted.append(bit_id)
+        else:
+            bit_id = cond_id
+        operator, port, bit = \
+          crud.read1_as_tuple('triples', 'operator', 'string', 'int1',
+                              id=bit_id)
+        if operator != 'input-bit' or not io.bit_addressable(port) or \
+           crud.count('triple_order_constraints', predecessor=bit_id):
+            continue
+        crud.delete('triple_parameters', parent_id=branch_id)
+        crud.update('triples', {'id': branch_id},
+                    operator=Fused_branches[branch, cond == 'not'],
+                    string=port, int1=bit)
+        crud.update('triple_order_constraints', {'successor': bit_id},
+                    successor=branch_id)
+        triple.delete_ids(deleted)
+        count += 1
+    return count
+
+def lower():
+    r'''Lowers the bit I/O triples.
+
+    Returns the number of triples fused or combined.
+
+    This must be run inside a db_transaction.
+    '''
+    fused = fuse_branches()
+    return fused + combine_writes()
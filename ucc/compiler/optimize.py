@@ -1,7 +1,43 @@
 # optimize.py
 
+from ucc.database import crud
+from ucc.compiler import fold_constants, dead_code, dead_stores, \
+                         value_numbering, compare_branches, value_ranges, \
+                         strength_reduce, fixed_point, switches, io_bits
+
 Debug = 0
 
 def optimize():
-    pass
+    r'''Optimizes the intermediate code (triples) in the database.
+    '''
+    with crud.db_transaction():
+        folded = fold_constants.fold_constants()
+        if Debug: print("optimize: folded", folded, "triples")
+        eliminate_dead_code()
+        lowered = fixed_point.lower()
+        if Debug: print("optimize: fixed point lowered", lowered, "triples")
+        if lowered: eliminate_dead_code()
+        replaced = value_numbering.number_values()
+        if Debug: print("optimize: value numbering replaced", replaced,
+                        "triples")
+        if replaced: eliminate_dead_code()
+        fused = compare_branches.fuse()
+        if Debug: print("optimize: fused", fused, "comparisons into branches")
+        if fused: eliminate_dead_code()
+        switched = switches.lower()
+        if Debug: print("optimize: lowered", switched, "test chains")
+        if switched: eliminate_dead_code()
+        bits = io_bits.lower()
+        if Debug: print("optimize: lowered", bits, "bit I/O triples")
+        narrowed = value_ranges.propagate()
+        if Debug: print("optimize: narrowed", narrowed, "triples to bytes")
+        reduced = strength_reduce.reduce()
+        if Debug: print("optimize: strength reduced", reduced, "triples")
+        if reduced: value_ranges.propagate()
 
+def eliminate_dead_code():
+    stores = dead_stores.delete()
+    branches, blocks, triples = dead_code.eliminate()
+    if Debug:
+        print("optimize: deleted", stores, "dead stores, folded", branches,
+              "branches, deleted", blocks, "blocks and", triples, "triples")
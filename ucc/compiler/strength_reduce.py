@@ -0,0 +1,333 @@
+# strength_reduce.py
+
+r'''Strength reduction of multiplies and divides by constants.
+
+This runs after `ucc.compiler.value_ranges`, so that the range of each
+triple is known (as its type_id).
+
+A '*' by a constant is done as shifts and an add or subtract when that's
+cheaper than the MUL code:
+
+    x * 8       =>  shift-left x 3
+    x * 10      =>  (shift-left x 3) + (shift-left x 1)
+    x * 15      =>  (shift-left x 4) - x
+
+A '*' that isn't reduced, but whose operands are both known to be in 0-255,
+becomes a 'multiply-bytes', which is a single 8x8 MUL.  If they are both in
+-128-127 instead, it becomes a 'multiply-signed-bytes', which is a single
+MULS.
+
+A '/' of two ints is floor division (`ucc.compiler.fold_constants` folds
+constant ones the same way).  A power of 2 is a 'shift-right', or a
+'shift-right-signed' (the arithmetic shift, which also rounds down) when
+the dividend may be negative:
+
+    x / 4       =>  shift-right-signed x 2
+
+A '/' by any other constant is only done when the dividend is known to be
+non-negative (see `value_ranges`), since the 'shift-right' is unsigned.
+It is done as a multiply by a scaled reciprocal followed by a shift-right:
+
+    x / c       =>  shift-right (x * m) s       where m = ceil(2**s / c)
+
+This gives the right answer for all x in 0-N so long as N * (m*c - 2**s) <
+2**s (see `reciprocal`).  If N is over 255, this uses a 'multiply-high',
+which is (x * m) >> 8 for m in 0-255, done with two 8x8 MULs:
+
+    x / c       =>  shift-right (multiply-high x m) s-8
+
+Otherwise, the product must fit in 16 bits, so N * m must be < 2**16.  If
+both N and m are in 0-255, the product is a 'multiply-bytes'.
+
+The shift counts are 'int' parameters of the shift triples.  The machine
+only has code for some counts (see the 'patterns' file), so longer shifts
+are done as a chain of shift triples (see `shift_counts`).
+'''
+
+from ucc.database import crud, triple
+
+# costs in cycles, see the 'patterns' file:
+Multiply_cost = 13      #: load the constant and do the 16x16 MUL
+Multiply_bytes_cost = 6 #: load the constant and do the 8x8 MUL or MULS
+Add_cost = 2
+
+Shift_counts = (8, 4, 3, 2, 1)  #: the counts with code, longest first
+
+def shift_counts(n):
+    r'''Returns the counts of the chain of shift triples to shift 'n' bits.
+
+        >>> shift_counts(3)
+        [3]
+        >>> shift_counts(13)
+        [8, 4, 1]
+        >>> shift_counts(0)
+        []
+    '''
+    ans = []
+    for count in Shift_counts:
+        while n >= count:
+            ans.append(count)
+            n -= count
+    return ans
+
+def shift_cost(n):
+    r'''Returns the cycles needed to shift a 16-bit value 'n' bits.
+
+    A shift by 8 just moves a register, other shifts take 2 cycles per bit.
+
+        >>> shift_cost(3)
+        6
+        >>> shift_cost(9)
+        4
+    '''
+    return sum(2 if count == 8 else 2 * count for count in shift_counts(n))
+
+def multiply_plan(c):
+    r'''Returns the cheapest shift and add plan for multiplying by 'c'.
+
+    Returns (cost, plan) where plan is one of:
+
+        ('shift', n)        -- x << n
+        ('+', a, b)         -- (x << a) + (x << b)
+        ('-', a, b)         -- (x << a) - (x << b)
+
+    Or None if 'c' is not 2**a +/- 2**b.  Only the low 16 bits of the
+    product are kept, so 'c' is taken as unsigned.
+
+        >>> multiply_plan(8)
+        (6, ('shift', 3))
+        >>> multiply_plan(10)
+        (10, ('+', 3, 1))
+        >>> multiply_plan(15)
+        (10, ('-', 4, 0))
+        >>> multiply_plan(0x140)
+        (16, ('+', 8, 6))
+        >>> multiply_plan(11)
+    '''
+    c &= 0xffff
+    if c == 0: return None
+    best = None
+    for a in range(16):
+        if c == 1 << a:
+            best = shift_cost(a), ('shift', a)
+        for b in range(a):
+            if c == (1 << a) + (1 << b):
+                plan = shift_cost(a) + shift_cost(b) + Add_cost, ('+', a, b)
+            elif c == (1 << a) - (1 << b):
+                plan = shift_cost(a) + shift_cost(b) + Add_cost, ('-', a, b)
+            else:
+                continue
+            if best is None or plan[0] < best[0]: best = plan
+    return best
+
+def reciprocal(c, n, max_m, min_s = 1):
+    r'''Returns (m, s) such that x // c == (x * m) >> s for x in 0-'n'.
+
+    With x = q*c + r, (x * m) / 2**s is x/c + x*e/(c * 2**s), where e is
+    m*c - 2**s.  This is less than q + (r+1)/c so long as x*e < 2**s.
+
+    The smallest s >= 'min_s' is used.  Returns None if there is no such m
+    <= 'max_m'.
+
+        >>> reciprocal(10, 255, 0xffff // 255)
+        (205, 11)
+        >>> reciprocal(10, 1023, 255, 8)
+        (205, 11)
+        >>> reciprocal(3, 1000, 0xffff // 1000)
+    '''
+    for s in range(min_s, 25):
+        m = -(-(1 << s) // c)           # ceil(2**s / c)
+        if m > max_m: return None
+        if n * (m * c - (1 << s)) < (1 << s):
+            return m, s
+    return None
+
+def within_byte(range):
+    r'''Is 'range' known to be in 0-255?
+
+        >>> within_byte((0, 200)), within_byte(None)
+        (True, False)
+    '''
+    return range is not None and 0 <= range[0] and range[1] <= 255
+
+def within_signed_byte(range):
+    r'''Is 'range' known to be in -128-127?
+
+        >>> within_signed_byte((-100, 20)), within_signed_byte((0, 200))
+        (True, False)
+    '''
+    return range is not None and -128 <= range[0] and range[1] <= 127
+
+class reducer:
+    r'''Rewrites the triples in the database.
+
+    The rewritten triple keeps its id, so that its parents and labels don't
+    change.
+    '''
+    def __init__(self):
+        self.reduced = 0
+
+    def range(self, triple_id):
+        r'''Returns the (min, max) range of 'triple_id', or None.
+        '''
+        for lo, hi in crud.fetchall("""
+            select ty.min_value, ty.max_value
+              from triples t
+                   inner join type ty on t.type_id = ty.id
+             where t.id = ? and ty.kind = 'int'
+            """, (triple_id,)):
+            return lo, hi
+        return None
+
+    def run(self):
+        for triple_id, operator, block_id in tuple(crud.fetchall("""
+            select id, operator, block_id
+              from triples
+             where operator in ('*', '/')
+               and (select count(*) from triple_parameters tp
+                     where tp.parent_id = triples.id) = 2
+             order by id
+            """)):
+            left, right = crud.read_column('triple_parameters',
+                                           'parameter_id',
+                                           parent_id=triple_id,
+                                           order_by='parameter_num')
+            if operator == '*':
+                self.multiply(triple_id, block_id, left, right)
+            else:
+                self.divide(triple_id, block_id, left, right)
+        return self.reduced
+
+    def constant(self, triple_id):
+        r'''Returns the value of an 'int' triple, else None.
+        '''
+        operator, int1 = crud.read1_as_tuple('triples', 'operator', 'int1',
+                                             id=triple_id)
+        return int1 if operator == 'int' else None
+
+    def multiply(self, triple_id, block_id, left, right):
+        c = self.constant(right)
+        if c is None:
+            c = self.constant(left)
+            if c is not None: left, right = right, left
+        if within_byte(self.range(left)) and within_byte(self.range(right)):
+            bytes_op = 'multiply-bytes'
+        elif within_signed_byte(self.range(left)) and \
+             within_signed_byte(self.range(right)):
+            bytes_op = 'multiply-signed-bytes'
+        else:
+            bytes_op = None
+        best = Multiply_bytes_cost if bytes_op else Multiply_cost
+        plan = multiply_plan(c) if c is not None and c != 1 else None
+        if plan is not None and plan[0] <= best:
+            kind = plan[1][0]
+            if kind == 'shift':
+                self.shift(block_id, 'shift-left', left, plan[1][1],
+                           into=triple_id)
+            else:
+                self.rewrite(triple_id, kind,
+                             self.shift(block_id, 'shift-left', left,
+                                        plan[1][1]),
+                             self.shift(block_id, 'shift-left', left,
+                                        plan[1][2]))
+        elif bytes_op:
+            self.rewrite(triple_id, bytes_op, left, right)
+        else:
+            return
+        self.reduced += 1
+
+    def divide(self, triple_id, block_id, left, right):
+        c = self.constant(right)
+        if c is None or c <= 1: return
+        x = self.range(left)
+        if c & (c - 1) == 0:
+            if x is not None and x[0] >= 0:
+                operator = 'shift-right'
+            else:
+                operator = 'shift-right-signed'
+            self.shift(block_id, operator, left, c.bit_length() - 1,
+                       into=triple_id)
+        else:
+            if x is None or x[0] < 0: return
+            n = x[1]
+            m_s = reciprocal(c, n, 255, 8) if n > 255 else None
+            if m_s is not None:
+                multiply = 'multiply-high'
+                m, s = m_s
+                s -= 8
+            else:
+                m_s = reciprocal(c, n, 0xffff // max(n, 1))
+                if m_s is None: return
+                m, s = m_s
+                multiply = 'multiply-bytes' if n <= 255 and m <= 255 \
+                                            else '*'
+            m = self.new(block_id, 'int', int1=m)
+            if s:
+                self.shift(block_id, 'shift-right',
+                           self.new(block_id, multiply, left, m), s,
+                           into=triple_id)
+            else:
+                self.rewrite(triple_id, multiply, left, m)
+        self.reduced += 1
+
+    def shift(self, block_id, operator, x, n, into = None):
+        r'''Shifts 'x' by 'n' bits.
+
+        The last shift triple is written 'into' the triple_id given, if any.
+
+        Returns the triple_id of the shifted value.
+        '''
+        counts = shift_counts(n)
+        for i, count in enumerate(counts):
+            bits = self.new(block_id, 'int', int1=count)
+            if into is not None and i == len(counts) - 1:
+                self.rewrite(into, operator, x, bits)
+                x = into
+            else:
+                x = self.new(block_id, operator, x, bits)
+        return x
+
+    def new(self, block_id, operator, *params, **columns):
+        r'''Creates a new triple, returns its id.
+        '''
+        triple_id = crud.insert('triples', block_id=block_id,
+                                operator=operator, **columns)
+        for i, param in enumerate(params, 1):
+            crud.insert('triple_parameters', parent_id=triple_id,
+                        parameter_id=param, parameter_num=i)
+        return triple_id
+
+    def rewrite(self, triple_id, operator, *params):
+        r'''Rewrites 'triple_id' in place as 'operator' of 'params'.
+
+        The old constant parameters that are no longer used are deleted.
+        '''
+        old_params = tuple(crud.read_column('triple_parameters',
+                                            'parameter_id',
+                                            parent_id=triple_id))
+        crud.delete('triple_parameters', parent_id=triple_id)
+        crud.update('triples', {'id': triple_id}, operator=operator)
+        for i, param in enumerate(params, 1):
+            crud.insert('triple_parameters', parent_id=triple_id,
+                        parameter_id=param, parameter_num=i)
+        if old_params:
+            triple.delete_ids(tuple(id for id, in crud.fetchall("""
+                select t.id
+                  from triples t
+                 where t.id in ({})
+                   and t.operator = 'int'
+                   and not exists (select null from triple_parameters tp
+                                    where tp.parameter_id = t.id)
+                   and not exists (select null from triple_labels tl
+                                    where tl.triple_id = t.id)
+                """.format(', '.join('?' * len(old_params))),
+                old_params)))
+
+def reduce():
+    r'''Reduces the multiplies and divides by constants.
+
+    Returns the number of triples reduced.
+
+    This must be run inside a db_transaction.
+    '''
+    return reducer().run()
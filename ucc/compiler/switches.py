@@ -0,0 +1,390 @@
+# switches.py
+
+r'''Lowers chains of equality tests on one variable into switches.
+
+A series of 'if's testing the same variable against different constants
+(like the dispatch on the state of a state machine) ends up as a chain of
+test blocks, each comparing the variable with one constant (after
+`ucc.compiler.compare_branches` has fused the comparisons):
+
+    head:       ... if-!= x 1       next body_1 / test_2
+    body_1:     ...                 next test_2
+    test_2:     if-!= x 2           next body_2 / test_3
+    ...
+    test_n:     if-!= x n           next body_n / default
+
+Each test after the head holds nothing but the test (a load of x, an 'int'
+and the branch), so x is the same in all of them.  This is done in two
+steps:
+
+    1. A body that doesn't change x (it stores nothing to x and, if x is a
+       global variable, calls no functions) still has x equal to its
+       constant at its end.  So the tests after it can be skipped, and it
+       goes straight to where they would have gone (usually the default).
+    2. The branch ending the head is replaced by a multi-way dispatch on x,
+       if there are enough cases:
+
+        - If the cases are dense (see `dense`), a 'jump-table' triple.  This
+          jumps through the jump_table, which has a target for each value
+          from the lowest case to the highest one.  Values out of this range
+          go to the head's next block (the default).
+        - Otherwise, a balanced tree of '<' tests (see `tree`) in new blocks,
+          ending in short chains of '=' tests.
+
+The test blocks after the head are left alone, as other blocks may still
+jump to them.  They are deleted by `ucc.compiler.dead_code` if not.
+
+The only function called here from outside is `lower`.
+'''
+
+import collections
+
+from ucc.database import crud
+from ucc.compiler import fold_constants
+
+#: The fewest cases for a jump table.
+Min_table_cases = 4
+
+#: The most targets in a jump table.  The branch to the default block jumps
+#: over the table, so this must keep it in range of a BRxx instruction.
+Max_table_size = 32
+
+#: The fewest cases for a compare tree.
+Min_tree_cases = 6
+
+#: The most cases tested one after the other at the leaves of a compare tree.
+Leaf_cases = 3
+
+Calls = ('call_direct', 'call_indirect')
+
+def dense(keys, min_cases=None, max_size=None):
+    r'''True if 'keys' should be dispatched through a jump table.
+
+    There must be at least min_cases keys, all in 0-255.  The table (covering
+    all of the values from the lowest key to the highest) must be no bigger
+    than max_size and at least half full.
+
+        >>> dense((1, 2, 3, 4))
+        True
+        >>> dense((1, 2, 3))
+        False
+        >>> dense((0, 3, 5, 7))
+        True
+        >>> dense((0, 3, 5, 9))
+        False
+        >>> dense((-1, 0, 1, 2))
+        False
+        >>> dense(range(0, 40))
+        False
+    '''
+    if min_cases is None: min_cases = Min_table_cases
+    if max_size is None: max_size = Max_table_size
+    if len(keys) < min_cases: return False
+    low, high = min(keys), max(keys)
+    size = high - low + 1
+    return low >= 0 and high <= 255 and size <= max_size and \
+           size <= 2 * len(keys)
+
+def tree(cases, leaf_cases=None):
+    r'''Returns a balanced compare tree for 'cases'.
+
+    'cases' is a sequence of (key, target) sorted by key.  The tree is either
+    ('<', key, less_tree, rest_tree) or ('=', cases) for a leaf, where the
+    cases are tested one after the other.
+
+        >>> tree(((1, 'a'), (2, 'b')))
+        ('=', ((1, 'a'), (2, 'b')))
+        >>> tree(tuple((k, 'x') for k in range(6)))
+        ('<', 3, ('=', ((0, 'x'), (1, 'x'), (2, 'x'))), ('=', ((3, 'x'), (4, 'x'), (5, 'x'))))
+        >>> tree(tuple((k, 'x') for k in range(8)))[2]
+        ('<', 2, ('=', ((0, 'x'), (1, 'x'))), ('=', ((2, 'x'), (3, 'x'))))
+    '''
+    if leaf_cases is None: leaf_cases = Leaf_cases
+    cases = tuple(cases)
+    if len(cases) <= leaf_cases:
+        return ('=', cases)
+    mid = len(cases) // 2
+    return ('<', cases[mid][0], tree(cases[:mid], leaf_cases),
+                                tree(cases[mid:], leaf_cases))
+
+def continuation(keys, i):
+    r'''Returns where the tests after keys[i] go when x == keys[i].
+
+    This is the index of the next test of the same key (whose branch is
+    taken), or None if the chain of tests is left through its end.
+
+        >>> continuation((1, 2, 3), 0)
+        >>> continuation((1, 2, 1), 0)
+        2
+    '''
+    for j in range(i + 1, len(keys)):
+        if keys[j] == keys[i]: return j
+    return None
+
+class test:
+    r'''An equality test of a variable against a constant ending a block.
+    '''
+    def __init__(self, block_id, block_name, triple_id, operator, x_id,
+                 x_operator, x_symbol_id, key, next, next_conditional,
+                 num_triples, num_stores):
+        self.block_id = block_id
+        self.block_name = block_name
+        self.triple_id = triple_id
+        self.x_id = x_id
+        self.x_operator = x_operator
+        self.key = fold_constants.to_signed(key)
+        if operator == 'if-=':
+            self.equal, self.not_equal = next_conditional, next
+        else:
+            self.equal, self.not_equal = next, next_conditional
+        self.pure = num_triples == 3 and num_stores == 0 and \
+                    x_operator in ('global', 'local')
+        self.symbol_id = x_symbol_id if self.pure else None
+
+def read_tests():
+    r'''Returns {block_name: `test`} for the blocks ending in an '=' test.
+    '''
+    return {row[1]: test(*row)
+            for row in crud.fetchall("""
+                select b.id, b.name, t.id, t.operator, x.id, x.operator,
+                       x.symbol_id, k.int1, b.next, b.next_conditional,
+                       (select count(*) from triples u
+                         where u.block_id = b.id),
+                       (select count(*)
+                          from triple_labels tl
+                               inner join triples u on tl.triple_id = u.id
+                         where u.block_id = b.id)
+                  from triples t
+                       inner join blocks b
+                         on t.block_id = b.id
+                       inner join triple_parameters tpx
+                         on tpx.parent_id = t.id
+                       inner join triples x
+                         on x.id = tpx.parameter_id
+                       inner join triple_parameters tpk
+                         on  tpk.parent_id = t.id
+                         and tpk.parameter_num != tpx.parameter_num
+                       inner join triples k
+                         on k.id = tpk.parameter_id
+                 where t.operator in ('if-=', 'if-!=')
+                   and x.operator != 'int'
+                   and k.operator = 'int'
+                   and b.next notnull
+                   and b.next_conditional notnull
+              """)}
+
+def changes(block_id, symbol_id):
+    r'''True if the code in block_id may change the variable symbol_id.
+    '''
+    if is_global(symbol_id) and \
+       crud.count('triples', block_id=block_id, operator=Calls):
+        return True
+    return bool(tuple(crud.fetchall("""
+        select null
+          from triple_labels tl
+               inner join triples t on tl.triple_id = t.id
+         where t.block_id = ?
+           and tl.symbol_id = ?
+        """, (block_id, symbol_id))))
+
+def head_variable(t):
+    r'''Returns the symbol_id of the variable tested at the end of head t.
+
+    Or None if the value tested isn't known to be a variable's value at the
+    end of the head block.
+    '''
+    symbol_ids = set(crud.fetchall("""
+        select tl.symbol_id
+          from triple_labels tl
+               inner join symbol_table sym
+                 on tl.symbol_id = sym.id
+         where tl.triple_id = ?
+           and sym.kind in ('var', 'parameter')
+        """, (t.x_id,), ctor=lambda row: row[0]))
+    if t.x_operator in ('global', 'local'):
+        symbol_ids.add(crud.read1_column('triples', 'symbol_id', id=t.x_id))
+    for symbol_id in symbol_ids:
+        # The test must see the last store to the variable in the head (if
+        # any), and nothing after it may change the variable.
+        stores = crud.fetchall("""
+            select tl.triple_id
+              from triple_labels tl
+                   inner join triples u on tl.triple_id = u.id
+             where u.block_id = ?
+               and tl.symbol_id = ?
+            """, (t.block_id, symbol_id), ctor=lambda row: row[0])
+        if set(stores) - {t.x_id}: continue
+        if is_global(symbol_id) and \
+           crud.count('triples', block_id=t.block_id, operator=Calls):
+            continue
+        return symbol_id
+    return None
+
+def is_global(symbol_id):
+    return crud.read1_column('symbol_table', 'context', id=symbol_id) is None
+
+def chain(head, tests, symbol_id):
+    r'''Returns the tests chained after 'head', and the default block name.
+
+    The list of tests starts with 'head'.
+    '''
+    ans = [head]
+    seen = {head.block_name}
+    name = head.not_equal
+    while name in tests and name not in seen and \
+          tests[name].symbol_id == symbol_id:
+        ans.append(tests[name])
+        seen.add(name)
+        name = tests[name].not_equal
+    return ans, name
+
+def predecessor_counts():
+    r'''Returns {block_name: number of jumps to it}.
+    '''
+    counts = collections.Counter()
+    for next, next_conditional in crud.read_as_tuples('blocks', 'next',
+                                                      'next_conditional'):
+        counts[next] += 1
+        counts[next_conditional] += 1
+    for target in crud.read_column('jump_table', 'target'):
+        counts[target] += 1
+    return counts
+
+def thread(tests, default, symbol_id, preds):
+    r'''Points the bodies that don't change the variable past the tests.
+
+    Returns the number of bodies changed.
+    '''
+    names = {t.block_name for t in tests}
+    keys = tuple(t.key for t in tests)
+    threaded = 0
+    for i, t in enumerate(tests):
+        if i + 1 == len(tests) or t.equal in names or preds[t.equal] != 1:
+            continue
+        body_id, next, next_conditional = \
+          crud.read1_as_tuple('blocks', 'id', 'next', 'next_conditional',
+                              name=t.equal)
+        if next != tests[i + 1].block_name or next_conditional is not None \
+           or changes(body_id, symbol_id):
+            continue
+        j = continuation(keys, i)
+        crud.update('blocks', {'id': body_id},
+                    next=default if j is None else tests[j].equal)
+        threaded += 1
+    return threaded
+
+def cases_of(tests):
+    r'''Returns [(key, target)] for 'tests', sorted by key.
+
+    The first test of each key is the one that's taken.
+    '''
+    cases = {}
+    for t in tests:
+        cases.setdefault(t.key, t.equal)
+    return sorted(cases.items())
+
+def make_jump_table(head, cases, default):
+    low = cases[0][0]
+    size = cases[-1][0] - low + 1
+    crud.delete('triple_parameters', parent_id=head.triple_id)
+    crud.insert('triple_parameters', parent_id=head.triple_id,
+                parameter_id=head.x_id, parameter_num=1)
+    crud.update('triples', {'id': head.triple_id},
+                operator='jump-table', int1=low, int2=size, string=None)
+    crud.update('blocks', {'id': head.block_id},
+                next=default, next_conditional=None)
+    targets = dict(cases)
+    for position in range(size):
+        crud.insert('jump_table', block_id=head.block_id, position=position,
+                    target=targets.get(low + position, default))
+
+def make_tree(head, cases, default, symbol_id, load_operator):
+    r'''Replaces the branch ending 'head' with a compare tree of 'cases'.
+    '''
+    fn_id = crud.read1_column('blocks', 'word_symbol_id', id=head.block_id)
+
+    def new_block():
+        name = crud.gensym('switch')
+        block_id = crud.insert('blocks', name=name, word_symbol_id=fn_id)
+        x_id = crud.insert('triples', block_id=block_id,
+                           operator=load_operator, symbol_id=symbol_id)
+        return block_id, name, x_id
+
+    def branch(block_id, branch_id, x_id, operator, key, target, next):
+        k_id = crud.insert('triples', block_id=block_id, operator='int',
+                           int1=key)
+        if branch_id is None:
+            branch_id = crud.insert('triples', block_id=block_id,
+                                    operator=operator, string=target)
+        else:
+            crud.delete('triple_parameters', parent_id=branch_id)
+            crud.update('triples', {'id': branch_id}, operator=operator,
+                        string=target)
+        crud.insert('triple_parameters', parent_id=branch_id,
+                    parameter_id=x_id, parameter_num=1)
+        crud.insert('triple_parameters', parent_id=branch_id,
+                    parameter_id=k_id, parameter_num=2)
+        crud.update('blocks', {'id': block_id}, next=next,
+                    next_conditional=target, last_triple_id=branch_id)
+
+    def fill(node, block_id, branch_id, x_id):
+        # Fills block_id with the tests for node.
+        if node[0] == '<':
+            _, key, less, rest = node
+            less_block = new_block()
+            rest_block = new_block()
+            branch(block_id, branch_id, x_id, 'if-<', key, less_block[1],
+                   rest_block[1])
+            fill(less, less_block[0], None, less_block[2])
+            fill(rest, rest_block[0], None, rest_block[2])
+        else:
+            cases = node[1]
+            for i, (key, target) in enumerate(cases):
+                if i + 1 < len(cases):
+                    next_block = new_block()
+                    next = next_block[1]
+                else:
+                    next = default
+                branch(block_id, branch_id, x_id, 'if-=', key, target, next)
+                if i + 1 < len(cases):
+                    block_id, _, x_id = next_block
+                    branch_id = None
+
+    fill(tree(cases), head.block_id, head.triple_id, head.x_id)
+
+def lower():
+    r'''Lowers the chains of equality tests into switches.
+
+    Returns the number of chains changed.
+
+    This must be run inside a db_transaction.
+    '''
+    tests = read_tests()
+    heads = {}          # {block_name: (symbol_id, [test], default)}
+    for name, t in tests.items():
+        symbol_id = head_variable(t)
+        if symbol_id is not None:
+            tests_chained, default = chain(t, tests, symbol_id)
+            if len(tests_chained) > 1:
+                heads[name] = symbol_id, tests_chained, default
+    inside = {t.block_name
+              for _, tests_chained, _ in heads.values()
+              for t in tests_chained[1:]}
+    preds = predecessor_counts()
+    changed = 0
+    for name in sorted(heads):
+        if name in inside: continue
+        symbol_id, tests_chained, default = heads[name]
+        head = tests_chained[0]
+        threaded = thread(tests_chained, default, symbol_id, preds)
+        cases = cases_of(tests_chained)
+        keys = tuple(key for key, _ in cases)
+        if dense(keys):
+            make_jump_table(head, cases, default)
+        elif len(cases) >= Min_tree_cases:
+            make_tree(head, cases, default, symbol_id,
+                      tests_chained[1].x_operator)
+        elif not threaded:
+            continue
+        changed += 1
+    return changed
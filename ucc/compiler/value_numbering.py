@@ -0,0 +1,285 @@
+# value_numbering.py
+
+r'''Global value numbering over the dominator tree.
+
+Each triple gets a value number, such that two triples with the same value
+number compute the same value.  The blocks of each function are walked in
+dominator tree order, keeping a table of the values computed by the
+dominating blocks.  A triple whose value has already been computed by a
+dominating block is replaced by a read of a new local variable (labeled on
+the dominating triple).
+
+Triples within one block are already shared by `ucc.database.block`, so this
+only looks across blocks.
+
+The value number of an operator is its operator and int1, int2, symbol and
+string, along with the value numbers of its parameters.  The value number of
+a 'global' or 'local' load is the value number of the dominating load of the
+same variable, if the variable can't be set on any path between the two
+loads.  This is the case if no block that is on a path from the dominating
+block to the loading block (including both of these) has a label for the
+variable or calls a function that sets it (in fn_global_var_uses).
+Otherwise the load gets a new value number.
+
+Triples with side effects, constants (which are cheaper to reload) and
+'local' loads (which are already in registers) are not replaced.
+'''
+
+import collections
+
+from ucc.database import crud, optimizer_prep, symbol_table
+from ucc.compiler import dataflow, dead_code
+
+Loads = ('global', 'local')
+Not_replaced = dead_code.Side_effects + ('int', 'ratio', 'approx', 'local')
+
+def dominators(entry, successors):
+    r'''Returns the immediate dominator of each node reachable from 'entry'.
+
+    'successors' is {node: sequence of nodes}.  The answer is {node: idom}
+    with the 'entry' node having an idom of None.
+
+    This uses the iterative algorithm from Cooper, Harvey and Kennedy, "A
+    Simple, Fast Dominance Algorithm".
+
+        >>> sorted(dominators('a', {'a': ('b', 'c'), 'b': ('d',),
+        ...                         'c': ('d',), 'd': ('e',), 'e': ('b',)})
+        ...          .items(), key=lambda x: x[0])
+        [('a', None), ('b', 'a'), ('c', 'a'), ('d', 'a'), ('e', 'd')]
+    '''
+    order = dataflow.reverse_postorder((entry,), successors)
+    position = {node: i for i, node in enumerate(order)}
+    predecessors = dataflow.predecessors_of(
+                     {node: successors.get(node, ()) for node in order})
+    idom = {entry: entry}
+    def intersect(a, b):
+        while a != b:
+            while position[a] > position[b]: a = idom[a]
+            while position[b] > position[a]: b = idom[b]
+        return a
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            new_idom = None
+            for pred in predecessors[node]:
+                if pred in idom:
+                    new_idom = pred if new_idom is None \
+                                    else intersect(pred, new_idom)
+            if idom.get(node) != new_idom:
+                idom[node] = new_idom
+                changed = True
+    idom[entry] = None
+    return idom
+
+def dominator_tree(idom):
+    r'''Returns {node: [children]} for the {node: idom} 'idom'.
+
+        >>> tree = dominator_tree({'a': None, 'b': 'a', 'c': 'a', 'd': 'c'})
+        >>> tree[None], tree['a'], tree['c']
+        (['a'], ['b', 'c'], ['d'])
+    '''
+    children = collections.defaultdict(list)
+    for node, parent in sorted(idom.items(), key=lambda x: str(x[0])):
+        children[parent].append(node)
+    return children
+
+def between(start, end, successors, predecessors):
+    r'''Returns the nodes on some path from 'start' to 'end' (inclusive).
+
+        >>> sorted(between('a', 'd', {'a': ('b', 'x'), 'b': ('c',),
+        ...                           'c': ('d', 'b'), 'x': ('y',)},
+        ...                {'b': ('a', 'c'), 'c': ('b',), 'd': ('c',),
+        ...                 'x': ('a',), 'y': ('x',)}))
+        ['a', 'b', 'c', 'd']
+    '''
+    return dead_code.closure((start,), successors) \
+         & dead_code.closure((end,), predecessors)
+
+class function:
+    r'''The value numbering for one function.
+    '''
+    def __init__(self, word_symbol_id, entry):
+        r'''Reads the blocks and triples for the function.
+
+        'entry' is the block_id of the function's entry block.
+        '''
+        self.word_symbol_id = word_symbol_id
+        self.entry = entry
+        self.successors = collections.defaultdict(list)
+        self.predecessors = collections.defaultdict(list)
+        for pred, succ in crud.fetchall("""
+            select bs.predecessor, bs.successor
+              from block_successors bs
+                   inner join blocks b on bs.predecessor = b.id
+             where b.word_symbol_id = ?
+            """, (word_symbol_id,)):
+            self.successors[pred].append(succ)
+            self.predecessors[succ].append(pred)
+
+        # {block_id: set of symbol_ids that may be set in the block}
+        self.sets = collections.defaultdict(set)
+        for block_id, symbol_id in crud.fetchall("""
+            select t.block_id, tl.symbol_id
+              from triples t
+                   inner join triple_labels tl on tl.triple_id = t.id
+                   inner join blocks b on t.block_id = b.id
+             where b.word_symbol_id = ?
+            union
+            select t.block_id, u.var_id
+              from triples t
+                   inner join fn_global_var_uses u
+                     on u.fn_id = t.symbol_id and u.sets
+                   inner join blocks b on t.block_id = b.id
+             where b.word_symbol_id = ?
+               and t.operator = 'call_direct'
+            """, (word_symbol_id, word_symbol_id)):
+            self.sets[block_id].add(symbol_id)
+
+        self.triples = {}       # {triple_id: (block_id, operator, int1, int2,
+                                #              symbol_id, string)}
+        self.params = collections.defaultdict(list)     # {parent: [child]}
+        self.block_triples = collections.defaultdict(list)
+        for row in crud.fetchall("""
+            select t.id, t.block_id, t.operator, t.int1, t.int2, t.symbol_id,
+                   t.string
+              from triples t
+                   inner join blocks b on t.block_id = b.id
+             where b.word_symbol_id = ?
+             order by t.id
+            """, (word_symbol_id,)):
+            self.triples[row[0]] = row[1:]
+            self.block_triples[row[1]].append(row[0])
+        for parent, child in crud.fetchall("""
+            select tp.parent_id, tp.parameter_id
+              from triple_parameters tp
+                   inner join triples t on tp.parent_id = t.id
+                   inner join blocks b on t.block_id = b.id
+             where b.word_symbol_id = ?
+             order by tp.parent_id, tp.parameter_num
+            """, (word_symbol_id,)):
+            self.params[parent].append(child)
+
+        self.temps = {}                 # {triple_id: temp symbol_id}
+        self.replaced = 0
+
+    def run(self):
+        r'''Does the value numbering and replaces the redundant triples.
+
+        Returns the number of triples replaced.
+        '''
+        idom = dominators(self.entry, self.successors)
+        self.children = dominator_tree(idom)
+        self.available = {}     # {value_number: triple_id}
+        self.loads = {}         # {symbol_id: [(value_number, block_id)]}
+        self.walk(self.entry)
+        return self.replaced
+
+    def walk(self, block_id):
+        r'''Value numbers 'block_id' and the blocks it dominates.
+        '''
+        value_numbers = {}      # {triple_id: value_number}
+        def number(triple_id):
+            if triple_id not in value_numbers:
+                _, operator, int1, int2, symbol_id, string = \
+                  self.triples[triple_id]
+                if operator in dead_code.Side_effects:
+                    vn = ('unique', triple_id)
+                elif operator in Loads:
+                    vn = self.load_number(block_id, triple_id, symbol_id)
+                else:
+                    vn = (operator, int1, int2, symbol_id, string,
+                          tuple(number(p) for p in self.params[triple_id]))
+                value_numbers[triple_id] = vn
+            return value_numbers[triple_id]
+        for triple_id in self.block_triples[block_id]:
+            number(triple_id)
+
+        # Replace the outermost available triples, starting at the roots.
+        # The triples left are made available to the dominated blocks.
+        has_parent = set(child for parent in self.block_triples[block_id]
+                               for child in self.params[parent])
+        added = []
+        visited = set()         # triples shared by several parents
+        def visit(triple_id):
+            if triple_id in visited: return
+            visited.add(triple_id)
+            vn = value_numbers[triple_id]
+            if vn in self.available:
+                if self.triples[triple_id][1] not in Not_replaced:
+                    self.replace(triple_id, self.available[vn])
+                    return
+            else:
+                self.available[vn] = triple_id
+                added.append(vn)
+                if vn[0] == 'load':
+                    self.loads.setdefault(vn[1], []).append(vn)
+            for child in self.params[triple_id]: visit(child)
+        for triple_id in self.block_triples[block_id]:
+            if triple_id not in has_parent: visit(triple_id)
+
+        for child in self.children.get(block_id, ()):
+            self.walk(child)
+        for vn in reversed(added):
+            del self.available[vn]
+            if vn[0] == 'load':
+                self.loads[vn[1]].pop()
+
+    def load_number(self, block_id, triple_id, symbol_id):
+        r'''Returns the value number for a load of 'symbol_id'.
+
+        This is the value number of the innermost dominating load of this
+        symbol if nothing between them may set it, otherwise a new one.
+        '''
+        loads = self.loads.get(symbol_id)
+        if loads:
+            vn = loads[-1]
+            dom_block = self.triples[self.available[vn]][0]
+            if not any(symbol_id in self.sets[b]
+                       for b in between(dom_block, block_id,
+                                        self.successors,
+                                        self.predecessors)):
+                return vn
+        return ('load', symbol_id, triple_id)
+
+    def replace(self, triple_id, dom_triple_id):
+        r'''Replaces 'triple_id' with a read of the value of 'dom_triple_id'.
+
+        The value is stored in a new local variable, shared by all of the
+        triples reusing 'dom_triple_id'.
+        '''
+        if dom_triple_id not in self.temps:
+            fn_symbol = symbol_table.get_by_id(self.word_symbol_id)
+            temp = symbol_table.symbol.create(crud.gensym('gvn_temp'), 'var',
+                                              fn_symbol)
+            crud.insert('triple_labels', triple_id=dom_triple_id,
+                        symbol_id=temp.id, is_gen=True)
+            self.temps[dom_triple_id] = temp.id
+        crud.update('triples', {'id': triple_id},
+                    operator='local', int1=None, int2=None, string=None,
+                    symbol_id=self.temps[dom_triple_id])
+        crud.delete('triple_parameters', parent_id=triple_id)
+        self.triples[triple_id] = \
+          (self.triples[triple_id][0], 'local', None, None,
+           self.temps[dom_triple_id], None)
+        self.params[triple_id] = []
+        self.replaced += 1
+
+def number_values():
+    r'''Runs global value numbering on all functions.
+
+    Returns the number of triples replaced.
+
+    This must be run inside a db_transaction.
+    '''
+    optimizer_prep.fill_block_successors()
+    replaced = 0
+    for word_symbol_id, label in tuple(crud.fetchall("""
+        select distinct sym.id, sym.label
+          from blocks b
+               inner join symbol_table sym on b.word_symbol_id = sym.id
+        """)):
+        entry = crud.read1_column('blocks', 'id', name=label, zero_ok=True)
+        if entry is not None:
+            replaced += function(word_symbol_id, entry).run()
+    return replaced
@@ -0,0 +1,426 @@
+# value_ranges.py
+
+r'''Value range propagation, and narrowing byte sized triples to 8 bits.
+
+The range of each triple is figured from the constants, the declared types
+of the variables (e.g., the repeat counter of a 'repeat' with a constant
+count is declared as 0 to count, and a `ucl_types.fixedpt` variable is
+declared as the range of its raw values) and interval arithmetic on the
+operators.  The range of a variable without a declared type is the hull of
+the ranges of all of the triples stored in it (and, for globals, their
+initial value).  A variable whose range keeps growing is widened to unknown.
+The range of a 'flash' read is the hull of the values in its `table`.
+
+These ranges are stored as the type_id of each triple, as a `ucl_types.int`.
+
+Then the triples that can be done with 8-bit code are marked as 'byte' in
+the triples table, so that `ucc.codegen.codegen.assign_code_seq_ids` picks
+the code_seqs marked 'byte' for them.  A triple can be done in 8 bits if:
+
+    - its value (if it has one) is in 0-255,
+    - there is a 'byte' code_seq for its operator in the machine database (or
+      it is a 'local' load),
+    - all of its parameters and all of the triples that use it can be done in
+      8 bits, and
+    - any variable that it loads or is stored in is a local variable that
+      can be kept in a single register.  That is, all of that variable's
+      loads and stores can be done in 8 bits.
+
+So the narrowing only applies to whole clusters of triples, and a byte never
+has to be extended to a word.  The one exception is an 'int', which
+`ucc.compiler.value_numbering` shares between all of its uses, so that the
+same constant may be used by both byte and word triples (like the 1 in a
+word 'x + 1' and in the byte counter of a 'repeat').  The word triples are
+given their own copy of it (see `split_constants`).
+'''
+
+import collections
+
+from ucc.database import crud, ucl_types
+from ucc.compiler import compare_branches, fold_constants
+
+Byte_range = (0, 255)
+
+Widen_after = 3         #: number of times a variable's range may grow
+
+Inputs = {'input': Byte_range, 'input-bit': Byte_range}
+
+#: byte operators without values:
+Sinks = ('if-true', 'if-false', 'output', 'jump-table') + \
+        compare_branches.Fused
+
+Bottom = ()     #: the range of a value that hasn't been figured out yet
+
+def hull(a, b):
+    r'''Returns the smallest range covering ranges 'a' and 'b'.
+
+    None is an unknown range.
+
+        >>> hull((1, 3), (5, 7))
+        (1, 7)
+        >>> hull((1, 3), None)
+    '''
+    if a is None or b is None: return None
+    return min(a[0], b[0]), max(a[1], b[1])
+
+def join(a, b):
+    r'''Returns the hull of 'a' and 'b', either of which may be Bottom.
+
+        >>> join(Bottom, (1, 3))
+        (1, 3)
+        >>> join((1, 3), (2, 5))
+        (1, 5)
+    '''
+    if a is Bottom: return b
+    if b is Bottom: return a
+    return hull(a, b)
+
+def clip(a, b):
+    r'''Returns range 'a' limited to range 'b'.
+
+        >>> clip((-1, 9), (0, 10))
+        (0, 9)
+        >>> clip(None, (0, 10))
+        (0, 10)
+    '''
+    if a is None: return b
+    return max(a[0], b[0]), min(a[1], b[1])
+
+def within(a, b):
+    r'''Is range 'a' within range 'b'?
+
+        >>> within((0, 10), Byte_range)
+        True
+        >>> within((-1, 10), Byte_range)
+        False
+        >>> within(None, Byte_range)
+        False
+    '''
+    return a is not None and b[0] <= a[0] and a[1] <= b[1]
+
+def evaluate(operator, operands, int1 = None):
+    r'''Returns the range of 'operator' applied to the 'operands' ranges.
+
+    Returns None if the range is unknown (or doesn't fit in 16 bits).
+
+        >>> evaluate('int', (), 7)
+        (7, 7)
+        >>> evaluate('+', ((0, 10), (1, 1)))
+        (1, 11)
+        >>> evaluate('-', ((0, 10), (1, 1)))
+        (-1, 9)
+        >>> evaluate('-', ((0, 10),))
+        (-10, 0)
+        >>> evaluate('*', ((-2, 3), (4, 5)))
+        (-10, 15)
+        >>> evaluate('/', ((10, 20), (2, 5)))
+        (2, 10)
+        >>> evaluate('/', ((-7, 20), (2, 5)))
+        (-4, 10)
+        >>> evaluate('/', ((10, 20), (0, 5)))
+        >>> evaluate('multiply-high', ((0, 1023), (205, 205)))
+        (0, 819)
+        >>> evaluate('shift-left', ((-1, 3), (2, 2)))
+        (-4, 12)
+        >>> evaluate('shift-right', ((16, 300), (4, 4)))
+        (1, 18)
+        >>> evaluate('shift-right-signed', ((-300, 16), (4, 4)))
+        (-19, 1)
+        >>> evaluate('fmuls', ((-100, 100), (-43, -43)))
+        (-8600, 8600)
+        >>> evaluate('fmuls', ((-128, 127), (-128, -128)))
+        >>> evaluate('bit-and', ((0, 300), (-5, 5)))
+        (0, 300)
+        >>> evaluate('bit-and', (None, (0, 1023)))
+        (0, 1023)
+        >>> evaluate('bit-or', ((0, 5), (0, 17)))
+        (0, 31)
+        >>> evaluate('*', ((0, 1000), (0, 1000)))
+        >>> evaluate('+', ((0, 10), None))
+        >>> evaluate('<', (None, (0, 10)))
+        (0, 1)
+    '''
+    if operator == 'int':
+        return int1, int1
+    if operator in Inputs:
+        return Inputs[operator]
+    if operator in fold_constants.Comparisons:
+        return 0, 1
+    if operator == 'bit-and':
+        # a mask limits the answer, even if the other operand is unknown
+        positives = [range[1] for range in operands
+                                if range is not None and range[0] >= 0]
+        return (0, min(positives)) if positives else None
+    if None in operands: return None
+    ans = None
+    if operator == '+' and len(operands) == 2:
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        ans = a_lo + b_lo, a_hi + b_hi
+    elif operator == '-' and len(operands) == 2:
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        ans = a_lo - b_hi, a_hi - b_lo
+    elif operator in ('-', 'negate') and len(operands) == 1:
+        ans = -operands[0][1], -operands[0][0]
+    elif operator in ('*', 'multiply-bytes', 'multiply-signed-bytes'):
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        products = (a_lo * b_lo, a_lo * b_hi, a_hi * b_lo, a_hi * b_hi)
+        ans = min(products), max(products)
+    elif operator == '/':
+        # Floor division, only by positives.
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        if b_lo > 0:
+            ans = min(a_lo // b_lo, a_lo // b_hi), \
+                  max(a_hi // b_lo, a_hi // b_hi)
+    elif operator == 'multiply-high':
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        if a_lo >= 0 and b_lo >= 0:
+            ans = (a_lo * b_lo) >> 8, (a_hi * b_hi) >> 8
+    elif operator == 'shift-left':
+        (a_lo, a_hi), (n, _) = operands
+        ans = a_lo << n, a_hi << n
+    elif operator == 'shift-right':
+        (a_lo, a_hi), (n, _) = operands
+        if a_lo >= 0: ans = a_lo >> n, a_hi >> n
+    elif operator == 'shift-right-signed':
+        (a_lo, a_hi), (n, _) = operands
+        ans = a_lo >> n, a_hi >> n
+    elif operator in ('fmul', 'fmuls', 'fmulsu'):
+        # FMUL shifts the product left one bit (see
+        # ucc/compiler/fixed_point.py).  The signed ones must not overflow
+        # into the sign bit.
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        products = (a_lo * b_lo, a_lo * b_hi, a_hi * b_lo, a_hi * b_hi)
+        ans = 2 * min(products), 2 * max(products)
+        if operator != 'fmul' and ans[1] > fold_constants.Signed_max:
+            return None
+    elif operator in ('bit-or', 'bit-xor'):
+        if all(lo >= 0 for lo, hi in operands):
+            ans = 0, (1 << max(hi for lo, hi in operands).bit_length()) - 1
+    if ans is not None and fold_constants.Int_min <= ans[0] \
+                       and ans[1] <= fold_constants.Int_max:
+        return ans
+    return None
+
+def initial_values():
+    r'''Returns {symbol_id: range} of the initial values of the globals.
+
+    These come from the 'bss' (zero) and 'data' assembler blocks of the
+    variables.  Data that isn't an int16 literal isn't included.
+    '''
+    ans = {}
+    for symbol_id, section, opcode, operand in crud.fetchall("""
+        select ab.word_symbol_id, ab.section, ac.opcode, ac.operand1
+          from assembler_blocks ab
+               inner join assembler_code ac on ac.block_id = ab.id
+               inner join symbol_table sym
+                 on ab.word_symbol_id = sym.id and sym.kind = 'var'
+         where ab.section in ('bss', 'data')
+        """):
+        if section == 'bss':
+            ans[symbol_id] = (0, 0)
+        elif opcode == 'int16':
+            try:
+                value = int(operand, 0)
+            except ValueError:
+                continue
+            ans[symbol_id] = (value, value)
+    return ans
+
+class program:
+    r'''The ranges of all of the triples and variables in the program.
+    '''
+    def __init__(self):
+        self.triples = {}       # {id: (operator, int1, symbol_id)}
+        for id, operator, int1, symbol_id in crud.fetchall("""
+            select id, operator, int1, symbol_id from triples
+            """):
+            self.triples[id] = operator, int1, symbol_id
+        self.params = collections.defaultdict(list)     # {parent: [child]}
+        self.parents = collections.defaultdict(list)    # {child: [parent]}
+        for parent, child in crud.fetchall("""
+            select parent_id, parameter_id
+              from triple_parameters
+             order by parent_id, parameter_num
+            """):
+            self.params[parent].append(child)
+            self.parents[child].append(parent)
+        self.labels = collections.defaultdict(list)     # {triple: [symbol]}
+        self.stores = collections.defaultdict(list)     # {symbol: [triple]}
+        for triple_id, symbol_id in crud.fetchall("""
+            select triple_id, symbol_id from triple_labels
+            """):
+            self.labels[triple_id].append(symbol_id)
+            self.stores[symbol_id].append(triple_id)
+        self.loads = collections.defaultdict(list)      # {symbol: [triple]}
+        for id, (operator, _, symbol_id) in self.triples.items():
+            if operator in ('global', 'local'):
+                self.loads[symbol_id].append(id)
+
+        # {symbol_id: range}
+        self.declared = dict(crud.fetchall("""
+            select sym.id, t.min_value, t.max_value
+              from symbol_table sym
+                   inner join type t
+                     on sym.type_id = t.id and t.kind in ('int', 'fixedpt')
+            """, ctor=lambda row: (row[0], (row[1], row[2]))))
+        self.initial = initial_values()
+        self.tables = {}        # {symbol_id: range}
+        for id, (operator, _, symbol_id) in self.triples.items():
+            if operator == 'flash' and symbol_id not in self.tables:
+                values = fold_constants.table_values(symbol_id)
+                self.tables[symbol_id] = \
+                  (min(values), max(values)) if values else None
+        self.local_vars = frozenset(crud.fetchall("""
+            select id from symbol_table
+             where kind = 'var' and context notnull
+            """, ctor=lambda row: row[0]))
+
+    def propagate(self):
+        r'''Figures out self.ranges ({triple_id: range}) and self.var_ranges.
+        '''
+        # This starts optimistically with Bottom for the variables that are
+        # stored, and iterates until the ranges don't change.
+        self.var_ranges = {}    # {symbol_id: range}
+        for symbol_id in set(self.loads) | set(self.stores):
+            if symbol_id in self.declared:
+                self.var_ranges[symbol_id] = self.declared[symbol_id]
+            elif symbol_id in self.initial:
+                self.var_ranges[symbol_id] = self.initial[symbol_id]
+            elif self.stores[symbol_id]:
+                self.var_ranges[symbol_id] = Bottom
+            else:
+                self.var_ranges[symbol_id] = None
+        grown = collections.Counter()
+        changed = True
+        while changed:
+            self.ranges = {}
+            for triple_id in self.triples: self.range(triple_id)
+            changed = False
+            for symbol_id, stores in self.stores.items():
+                # None is as wide as it gets (and must stay widened):
+                if symbol_id in self.declared or \
+                   self.var_ranges[symbol_id] is None:
+                    continue
+                new = self.initial.get(symbol_id, Bottom)
+                for triple_id in stores:
+                    new = join(new, self.ranges[triple_id])
+                if new != self.var_ranges[symbol_id]:
+                    grown[symbol_id] += 1
+                    if grown[symbol_id] > Widen_after: new = None
+                    self.var_ranges[symbol_id] = new
+                    changed = True
+
+        # Whatever is still Bottom only depends on itself, and is unknown:
+        for triple_id, range in self.ranges.items():
+            if range is Bottom: self.ranges[triple_id] = None
+        for symbol_id, range in self.var_ranges.items():
+            if range is Bottom: self.var_ranges[symbol_id] = None
+
+    def range(self, triple_id):
+        r'''Returns the range of 'triple_id' (Bottom if not known yet).
+        '''
+        if triple_id not in self.ranges:
+            operator, int1, symbol_id = self.triples[triple_id]
+            if operator in ('global', 'local'):
+                ans = self.var_ranges[symbol_id]
+            elif operator == 'flash':
+                ans = self.tables[symbol_id]
+            else:
+                params = tuple(self.range(p) for p in self.params[triple_id])
+                if Bottom in params:
+                    ans = Bottom
+                else:
+                    ans = evaluate(operator, params, int1)
+            if ans is not Bottom:
+                # The values stored in a variable with a declared type are in
+                # that type:
+                for symbol_id in self.labels[triple_id]:
+                    if symbol_id in self.declared:
+                        ans = clip(ans, self.declared[symbol_id])
+            self.ranges[triple_id] = ans
+        return self.ranges[triple_id]
+
+    def narrow(self, byte_operators):
+        r'''Returns the set of triple_ids that can be done in 8 bits.
+
+        'byte_operators' are the operators that have 'byte' code_seqs.
+
+        An 'int' in the answer may still have some parents that aren't (see
+        `split_constants`).
+        '''
+        ans = set()
+        for triple_id, (operator, _, symbol_id) in self.triples.items():
+            if operator in Sinks:
+                if operator in byte_operators: ans.add(triple_id)
+            elif (operator in byte_operators or operator == 'local') and \
+                 within(self.ranges[triple_id], Byte_range):
+                ans.add(triple_id)
+        def byte_var(symbol_id):
+            return symbol_id in self.local_vars and \
+                   all(t in ans for t in self.loads[symbol_id]) and \
+                   all(t in ans for t in self.stores[symbol_id])
+        changed = True
+        while changed:
+            changed = False
+            for triple_id in tuple(ans):
+                operator, _, symbol_id = self.triples[triple_id]
+                if not all(p in ans for p in self.params[triple_id]) or \
+                   operator != 'int' and \
+                     not all(p in ans for p in self.parents[triple_id]) or \
+                   operator == 'int' and self.parents[triple_id] and \
+                     not any(p in ans for p in self.parents[triple_id]) or \
+                   operator == 'local' and not byte_var(symbol_id) or \
+                   not all(byte_var(s) for s in self.labels[triple_id]):
+                    ans.remove(triple_id)
+                    changed = True
+        return ans
+
+def propagate():
+    r'''Stores the value ranges and marks the triples that fit in a byte.
+
+    Returns the number of triples marked as 'byte'.
+
+    This must be run inside a db_transaction.
+    '''
+    prog = program()
+    prog.propagate()
+    types = {}
+    for triple_id, range in prog.ranges.items():
+        if range is not None:
+            if range not in types:
+                types[range] = ucl_types.int.lookup(*range).id
+            crud.update('triples', {'id': triple_id}, type_id=types[range])
+    byte_triples = prog.narrow(frozenset(crud.read_column('code_seq',
+                                                          'operator',
+                                                          byte=True)))
+    crud.update('triples', {}, byte=False)
+    for triple_id in byte_triples:
+        crud.update('triples', {'id': triple_id}, byte=True)
+    split_constants(prog, byte_triples)
+    return len(byte_triples)
+
+def split_constants(prog, byte_triples):
+    r'''Gives the word triples using a byte 'int' their own copy of it.
+
+    Returns the number of copies made.
+    '''
+    copies = 0
+    for triple_id in byte_triples:
+        if prog.triples[triple_id][0] == 'int':
+            words = [p for p in prog.parents[triple_id]
+                       if p not in byte_triples]
+            if words:
+                block_id, int1, type_id = \
+                  crud.read1_as_tuple('triples', 'block_id', 'int1',
+                                      'type_id', id=triple_id)
+                copy_id = crud.insert('triples', block_id=block_id,
+                                      operator='int', int1=int1,
+                                      type_id=type_id)
+                for parent_id in words:
+                    crud.update('triple_parameters',
+                                {'parent_id': parent_id,
+                                 'parameter_id': triple_id},
+                                parameter_id=copy_id)
+                copies += 1
+    return copies
+
@@ -3,7 +3,10 @@
 r'''Helper classes for the assembler source code in the database.
 '''
 
+import collections
 import itertools
+import re
+
 from ucc.database import crud
 from ucc.assembler import asm_opcodes
 
@@ -32,9 +35,153 @@ def gen_insts(block_id):
                                block_id=block_id,
                                order_by=('inst_order',))
 
+def gen_numbered_insts(block_id):
+    r'''Generates (inst_order, label, opcode, op1, op2) for each instruction.
+    '''
+    return crud.read_as_tuples('assembler_code',
+                               'inst_order', 'label', 'opcode', 'operand1',
+                               'operand2',
+                               block_id=block_id,
+                               order_by=('inst_order',))
+
+def update_inst_opcode(block_id, inst_order, opcode):
+    crud.update('assembler_code', {'block_id': block_id,
+                                   'inst_order': inst_order},
+                opcode=opcode)
+
 def update_block_address(block_id, address):
     crud.update('assembler_blocks', {'id': block_id}, address=address)
 
+def update_block_length(block_id, length):
+    r'''Records the final (assembled) length of the block.
+    '''
+    crud.update('assembler_blocks', {'id': block_id},
+                min_length=length, max_length=length)
+
+def gen_symbol_extents():
+    r'''Generates the extent of each word_symbol in each section.
+
+    Yields (section, start, end, size, label) ordered by section and address.
+    This is only valid after the assembler has assigned the final address and
+    length to each block.
+    '''
+    return crud.fetchall("""
+        select ab.section, min(ab.address), max(ab.address + ab.max_length),
+               sum(ab.max_length), ifnull(sym.label, '?')
+          from assembler_blocks ab
+               left outer join symbol_table sym
+                 on ab.word_symbol_id = sym.id
+         where ab.address not null
+         group by ab.word_symbol_id, ab.section
+         order by ab.section, min(ab.address)
+        """)
+
+def gen_code_block_extents():
+    r'''Generates the extent of each block in the code section.
+
+    Yields (address, length, label, word_label) ordered by address.  The
+    word_label is the label of the function (or other word) that the block
+    belongs to.  This is only valid after the assembler has assigned the final
+    address and length to each block.
+    '''
+    return crud.fetchall("""
+        select ab.address, ab.max_length, ab.label, ifnull(sym.label, '?')
+          from assembler_blocks ab
+               left outer join symbol_table sym
+                 on ab.word_symbol_id = sym.id
+         where ab.section = 'code'
+           and ab.address not null
+         order by ab.address, ab.id
+        """)
+
+def update_symbol_sizes():
+    r'''Sets flash_size and ram_size in the symbol_table.
+
+    The flash_size is the size of the symbol's code and data sections, the
+    ram_size is the size of its data and bss sections.
+    '''
+    crud.execute("""
+        update symbol_table
+           set flash_size = (select sum(max_length)
+                               from assembler_blocks
+                              where word_symbol_id = symbol_table.id
+                                and section in ('code', 'data')),
+               ram_size = (select sum(max_length)
+                             from assembler_blocks
+                            where word_symbol_id = symbol_table.id
+                              and section in ('data', 'bss'))
+         where id in (select word_symbol_id from assembler_blocks)
+        """)
+
+def delete_unreferenced_words():
+    r'''Deletes the code of the words that the program never gets to.
+
+    The program starts with the words that are at a fixed address (the
+    startup code with the interrupt vector).  From there it gets to the
+    words whose labels are used in the code, or that the code falls through
+    to, and to the words used by the other sections.  The rest were only
+    needed until they were optimized away, like a word whose calls have all
+    been inlined (see `ucclib.built_in.declaration.high_level_word`), or the
+    divide16 routine when all of the '/'s were strength reduced (see
+    `ucc.compiler.strength_reduce`).
+
+    Returns the set of the word_symbol_ids whose code was deleted.
+    '''
+    word_of = dict(crud.fetchall('''
+                       select label, word_symbol_id
+                         from assembler_blocks
+                        where label notnull
+                     '''))
+    uses = collections.defaultdict(set)     # {word_symbol_id: {word used}}
+    code_words = set()
+    roots = set()
+    for word_id, section, address, next_label, operand1, operand2 \
+     in crud.fetchall('''
+            select ab.word_symbol_id, ab.section, ab.address, ab.next_label,
+                   ac.operand1, ac.operand2
+              from assembler_blocks ab
+                   left outer join assembler_code ac
+                     on ac.block_id = ab.id
+          '''):
+        if section == 'code':
+            code_words.add(word_id)
+        if section != 'code' or address is not None:
+            roots.add(word_id)
+        for label in labels_used(next_label, operand1, operand2):
+            if label in word_of: uses[word_id].add(word_of[label])
+
+    reached = set()
+    todo = list(roots)
+    while todo:
+        word_id = todo.pop()
+        if word_id not in reached:
+            reached.add(word_id)
+            todo.extend(uses[word_id])
+
+    unreferenced = code_words - reached
+    if unreferenced:
+        block_ids = tuple(crud.read_column('assembler_blocks', 'id',
+                                           section='code',
+                                           word_symbol_id=
+                                             tuple(unreferenced)))
+        crud.delete('assembler_code', block_id=block_ids)
+        crud.delete('assembler_blocks', id=block_ids)
+    return unreferenced
+
+def labels_used(*operands):
+    r'''Generates the names in 'operands' that could be labels.
+
+    These are the whole operands and the words in them, since an operand
+    may be an expression of labels.
+
+        >>> sorted(set(labels_used('first', 'lo8(-(levels))', None)))
+        ['first', 'levels', 'lo8', 'lo8(-(levels))']
+    '''
+    for operand in operands:
+        if operand is not None:
+            yield operand
+            yield from re.findall(r'[^\s(),+*/<>-]+', operand)
+
 class block:
     r'''This represents a block of assembler instructions.
 
@@ -5,6 +5,7 @@ r'''The helper classes for the AST information in the database.
 
 
 
+import copy
 import itertools
 
 from ucc.database import assembler, block, crud, fn_xref, symbol_table
@@ -315,6 +316,7 @@ def prepare_args(fn_symbol, args, words_needed):
     '''
     return tuple(arg.prepare(fn_symbol, words_needed)
                    if isinstance(arg, ast)
+                   else None if arg is None     # e.g., missing else branch
                    else prepare_args(fn_symbol, arg, words_needed)
                  for arg in args)
 
@@ -344,6 +346,93 @@ def compile_args(args):
                    else compile_args(arg)
                  for arg in args)
 
+Label_kinds = ('label', 'jump', 'if-true', 'if-false')
+
+def walk_args(args):
+    r'''Generates all of the `ast` nodes in 'args', in order.
+
+    Each node is generated before its own args.
+
+        >>> a = ast(ast(kind='int', int1=1), (ast(kind='label', label='x'),),
+        ...         None, kind='series')
+        >>> [node.kind for node in walk_args((a,))]
+        ['series', 'int', 'label']
+    '''
+    for arg in args:
+        if isinstance(arg, ast):
+            yield arg
+            for node in walk_args(arg.args): yield node
+        elif arg is not None:
+            for node in walk_args(arg): yield node
+
+def size(args):
+    r'''The number of `ast` nodes in 'args' that generate code.
+
+    This doesn't count the word being called by a 'call' node.
+
+        >>> size((ast(ast(kind='word', label='f'), ast(kind='int', int1=1),
+        ...           kind='call'),
+        ...       ast(kind='label', label='x'),
+        ...       ast(kind='no-op')))
+        2
+    '''
+    heads = set(id(node.args[0]) for node in walk_args(args)
+                                 if node.kind == 'call' and node.args)
+    return sum(1 for node in walk_args(args)
+                 if node.kind not in ('label', 'no-op', 'None', 'series')
+                    and id(node) not in heads)
+
+def copy_args(args, labels = None, symbols = None):
+    r'''Returns a copy of 'args' that can be compiled along side of 'args'.
+
+    'args' is a sequence of: None, `ast` node, or sequence of these.
+
+    The labels defined by 'label' nodes within 'args' are given new labels in
+    the copy (by `crud.gensym`), and the jumps to them are changed to match.
+    'labels' maps the old labels to the new labels, and is filled in if
+    passed.
+
+    'symbols' maps symbol_ids to the `symbol_table.symbol` that the 'word'
+    nodes for them are changed to in the copy.
+
+        >>> db_conn, _ = crud.db_connection.test()
+        >>> body = (ast(kind='label', label='endif_0007'),
+        ...         ast(ast(kind='int', int1=1), kind='if-true',
+        ...             label='endif_0007'),
+        ...         ast(kind='jump', label='elsewhere'))
+        >>> new = copy_args(body)
+        >>> [(node.kind, node.label) for node in walk_args(new)]
+        [('label', 'endif_0001'), ('if-true', 'endif_0001'), ('int', None), ('jump', 'elsewhere')]
+        >>> [(node.kind, node.label) for node in walk_args(body)]
+        [('label', 'endif_0007'), ('if-true', 'endif_0007'), ('int', None), ('jump', 'elsewhere')]
+        >>> new[1].args[0] is body[1].args[0]
+        False
+    '''
+    if labels is None: labels = {}
+    if symbols is None: symbols = {}
+    for node in walk_args(args):
+        if node.kind == 'label':
+            labels[node.label] = crud.gensym(node.label.rsplit('_', 1)[0])
+    return _copy_args(args, labels, symbols)
+
+def _copy_args(args, labels, symbols):
+    ans = []
+    for arg in args:
+        if isinstance(arg, ast):
+            new = copy.copy(arg)
+            if new.kind in Label_kinds and new.label in labels:
+                new.label = labels[new.label]
+            if new.kind == 'word' and new.symbol_id in symbols:
+                new.symbol_id = symbols[new.symbol_id].id
+                new.label = symbols[arg.symbol_id].label
+            new.args = _copy_args(arg.args, labels, symbols)
+            ans.append(new)
+        elif arg is None:
+            ans.append(None)
+        else:
+            ans.append(_copy_args(arg, labels, symbols))
+    return tuple(ans)
+
 def save_word(label, word_symbol, args):
     r'''Writes 'args' as the ast for word_symbol to the database.
 
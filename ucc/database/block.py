@@ -138,6 +138,18 @@ class block:
         # block write is done.
         self.sets_global = {}        # {symbol_id: triple}
 
+        # The 'global' triple loading each global variable since the last
+        # time it may have been set.  Loads of the variable are shared until
+        # it may have been set again, and then a new 'global' triple is
+        # needed to load the new value.
+        self.global_loads = {}       # {symbol_id: triple}
+
+        # The uses_global that had to come before the triple in sets_global
+        # for each global variable.  If a later store to the variable in
+        # this block replaces that triple's label, the triple isn't a store
+        # anymore, so these have to come before the later store instead.
+        self.store_uses = {}         # {symbol_id: [triple]}
+
         self.state = 'not_ended'
 
         Current_block = self
@@ -224,6 +236,8 @@ class block:
         if operator in ('global', 'local'):
             if symbol.id in self.labels and symbol.id not in self.dirty_labels:
                 return self.labels[symbol.id]
+        if operator == 'global' and symbol.id in self.global_loads:
+            return self.global_loads[symbol.id]
         if operator == 'call_direct':
             assert isinstance(symbol, symbol_table.symbol)
             fn_symbol = symbol
@@ -242,16 +256,17 @@ class block:
                     ans.add_soft_predecessor(t)
                 del self.uses_global[var_id]
             for var_id in uses_or_sets_vars.intersection(self.sets_global):
-                ans.add_hard_dependency(self.sets_global[var_id])
+                ans.add_hard_predecessor(self.sets_global[var_id])
             for var_id in uses_vars:
                 self.uses_global[var_id].append(ans)
             for var_id in sets_vars:
                 self.sets_global[var_id] = ans
+                self.global_loads.pop(var_id, None)
                 if var_id in self.labels: self.dirty_labels.add(var_id)
             return ans
         if operator == 'call_indirect':
             raise AssertionError("call_indirect not yet implemented")
-        if operator not in ('input', 'input-bit',
+        if operator not in ('global', 'input', 'input-bit',
                             'output', 'output-bit-set', 'output-bit-clear'):
             key = operator, parameters, int1, int2, symbol, string
             if key not in self.triples:
@@ -262,6 +277,7 @@ class block:
         ans = triple.triple(operator, parameters, int1, int2, symbol, string,
                             syntax_position_info)
         if operator == 'global':
+            self.global_loads[symbol.id] = ans
             self.uses_global[symbol.id].append(ans)
             if symbol.id in self.sets_global:
                 ans.add_hard_predecessor(self.sets_global[symbol.id])
@@ -282,17 +298,24 @@ class block:
         be stored into.  One triple may have multiple labels attached to it,
         meaning that the result must be stored into multiple places.
         '''
+        replaced = self.labels.get(symbol_id)
         self.labels[symbol_id] = triple
         self.dirty_labels.discard(symbol_id)
         if symbol_table.get_by_id(symbol_id).context is None:
             # This is a global variable!
+            uses = self.uses_global.pop(symbol_id, [])
             if symbol_id in self.sets_global:
-                triple.add_hard_predecessor(self.sets_global[symbol_id])
+                if self.sets_global[symbol_id] is replaced:
+                    # The last store is replaced by this one (so it doesn't
+                    # need to be written, unless something else uses it).
+                    uses = self.store_uses[symbol_id] + uses
+                else:
+                    triple.add_hard_predecessor(self.sets_global[symbol_id])
             self.sets_global[symbol_id] = triple
-            if symbol_id in self.uses_global:
-                for t in self.uses_global[symbol_id]:
-                    triple.add_soft_predecessor(t)
-                del self.uses_global[symbol_id]
+            self.store_uses[symbol_id] = uses
+            self.global_loads.pop(symbol_id, None)
+            for t in uses:
+                triple.add_soft_predecessor(t)
 
     def write(self, next = None):
         r'''Writes the block and associated triples to the database.
@@ -312,9 +335,6 @@ class block:
         id = crud.insert('blocks',
                          name=self.name,
                          word_symbol_id=self.word_symbol_id,
-                         last_triple_id=self.last_triple.id
-                                          if self.last_triple
-                                          else None,
                          next=next,
                          next_conditional=self.next_conditional)
 
@@ -340,6 +360,11 @@ class block:
         for t in forced_triples:
             t.write(id)
         #
+        # the last_triple doesn't have an id until it's been written:
+        #
+        if self.last_triple is not None:
+            crud.update('blocks', {'id': id}, last_triple_id=self.last_triple.id)
+        #
         # then call write_soft_predecessors for all of them:
         #
         for t in forced_triples:
@@ -360,13 +385,21 @@ def delete(symbol):
 
     This is used to delete the results from a prior compile run.
     '''
-    block_ids = tuple(crud.read_column('blocks', 'id', word_symbol_id=symbol))
+    delete_ids(tuple(crud.read_column('blocks', 'id', word_symbol_id=symbol)))
+
+def delete_ids(block_ids):
+    r'''Deletes the blocks with ids in 'block_ids' from the database.
+
+    This also deletes all associated information in the database for the
+    deleted blocks.
+    '''
     if block_ids:
         crud.delete('gens', block_id=block_ids)
         crud.delete('kills', block_id=block_ids)
         crud.delete('ins', block_id=block_ids)
         crud.delete('outs', block_id=block_ids)
         triple.delete(block_ids)
+        crud.delete('jump_table', block_id=block_ids)
         crud.delete('block_successors', predecessor=block_ids)
         crud.delete('block_successors', successor=block_ids)
         crud.delete('blocks', id=block_ids)
@@ -88,6 +88,14 @@ def expand(quiet = False):
 
     symbol_table.update()
 
+def get_calls(fn_id):
+    r'''Get the functions called directly by function fn_id.
+
+    Returns a frozenset of symbol_ids.
+    '''
+    return frozenset(crud.read_column('fn_calls', 'called_id',
+                                      caller_id=fn_id, depth=1))
+
 def get_var_uses(fn_id):
     r'''Get global variables usage for function fn_id.
 
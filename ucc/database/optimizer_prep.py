@@ -2,69 +2,71 @@
 
 r'''Create the database cross reference tables needed by the optimizer.
 
-This isn't used yet...
+The dataflow problems solved over these (reaching definitions, live variables
+and available expressions) are in `ucc.compiler.block_dataflow`.
 '''
 
-import itertools
+import collections
 
 from ucc.database import crud
 
-def reaching_definitions():
-    crud.delete('ins')
-    crud.delete('outs')
-    crud.delete('kills')
+def fill_block_successors():
+    r'''Fills the block_successors table from blocks.next/next_conditional.
 
-    # Kills is just the starting gens table:
+    The targets in the jump_table are successors too.
+    '''
+    crud.delete('block_successors')
     crud.execute("""
-        insert into kills (block_id, symbol_id)
-        select distinct block_id, symbol_id from gens
+        insert or ignore into block_successors (predecessor, successor)
+        select b.id, s.id
+          from blocks b
+               inner join blocks s
+                 on s.name in (b.next, b.next_conditional)
+        union
+        select jt.block_id, s.id
+          from jump_table jt
+               inner join blocks s
+                 on s.name = jt.target
     """)
 
-    # Add gens for global variables in fn calls to calling blocks:
-    #
-    # E.g. if block B calls FOO, add all gens of global variables inside FOO to
-    #      the gens of B.
-    #
-    # These aren't included in kills, because there may be paths in FOO that
-    # don't kill a variable set along another path.
-    #
-    # FIX: This should exclude declarations in FOO that are killed by later
-    #      code in B.
-    crud.execute("""
-        insert into gens (block_id, symbol_id, triple_id)
-        select t.block_id, g.symbol_id, g.triple_id
-          from triple t
-               inner join block b on t.int_1 = b.word_symbol_id
-               inner join gens g on g.block_id = b.id
-               inner join symbol_table st
-                 on g.symbol_id = st.id and st.context is null
-         where t.operator = 'call_direct'
-    """)
 
-    # Starting outs simply taken from gens:
-    crud.execute("""insert into outs (block_id, symbol_id, triple_id)
-                    select block_id, symbol_id, triple_id
-                      from gens
-    """)
+def flow_graph():
+    r'''Returns (entries, successors, nodes) for all of the blocks.
 
-    # Iterate as long as changes are made:
-    for depth in itertools.count(0):
-        rowcount = crud.execute("""
-          insert or ignore into ins (block_id, symbol_id, triple_id)
-          select bs.successor, outs.symbol_id, outs.triple_id
-            from outs inner join block_successors bs
-              on outs.block_id = bs.predecessor
-        """)[0]
-        if not rowcount:
-            print("reaching_definitions: did", 2 * depth + 1, "database calls")
-            break
-        rowcount = crud.execute("""
-          insert or ignore into outs (block_id, symbol_id, triple_id)
-          select block_id, symbol_id, triple_id
-            from ins
-           where symbol_id not in (select symbol_id from kills
-                                    where kills.block_id = ins.block_id)
-        """)[0]
-        if not rowcount:
-            print("reaching_definitions: did", 2 * depth + 2, "database calls")
-            break
+    'entries' are the entry blocks of each word (the block with the word's
+    name), 'successors' is {block_id: [block_id]} from block_successors and
+    'nodes' are all of the block_ids.
+
+    This requires fill_block_successors to have been run.
+    '''
+    entries = tuple(crud.fetchall("""
+        select b.id
+          from blocks b
+               inner join symbol_table sym
+                 on b.word_symbol_id = sym.id and b.name = sym.label
+         order by b.id
+        """, ctor=lambda row: row[0]))
+    successors = collections.defaultdict(list)
+    for pred, succ in crud.fetchall("""
+        select predecessor, successor from block_successors
+         order by predecessor, successor
+        """):
+        successors[pred].append(succ)
+    return entries, successors, tuple(crud.read_column('blocks', 'id'))
+
+def call_sets(sets):
+    r'''Yields (block_id, var_id, triple_id) for globals used by calls.
+
+    These are the global variables that the function called by each
+    'call_direct' triple sets (if 'sets' is true) or only uses (if 'sets' is
+    false).
+    '''
+    return crud.fetchall("""
+        select t.block_id, u.var_id, t.id
+          from triples t
+               inner join fn_global_var_uses u on u.fn_id = t.symbol_id
+               inner join symbol_table sym
+                 on u.var_id = sym.id and sym.context isnull
+         where t.operator = 'call_direct'
+           and u.sets = ?
+        """, (bool(sets),))
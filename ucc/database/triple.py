@@ -93,11 +93,13 @@ class triple:
         requires 'pred', but this dependency alone is not enough to cause
         'pred' to be saved to the database.
 
-        'pred' must be a triple.
+        'pred' must be a triple.  Adding the same 'pred' again does nothing.
 
         See also, `add_hard_predecessor`.
         '''
-        self.soft_predecessors.append(pred)
+        if pred not in self.soft_predecessors and \
+           pred not in self.hard_predecessors:
+            self.soft_predecessors.append(pred)
 
     def add_hard_predecessor(self, pred):
         r'''Adds a hard link between 'pred' and self.
@@ -105,11 +107,15 @@ class triple:
         The hard link guarantees that if self is needed, then 'pred' is also
         needed.
 
-        'pred' must be a triple.
+        'pred' must be a triple.  Adding the same 'pred' again does nothing,
+        and a hard link replaces a soft link.
 
         See also, `add_soft_predecessor`.
         '''
-        self.hard_predecessors.append(pred)
+        if pred not in self.hard_predecessors:
+            self.hard_predecessors.append(pred)
+            if pred in self.soft_predecessors:
+                self.soft_predecessors.remove(pred)
 
     def write(self, block_id):
         r'''Writes triple to database.
@@ -185,7 +191,14 @@ def delete(block_ids):
 
     This also deletes the data associated with the triples.
     '''
-    triple_ids = tuple(crud.read_column('triples', 'id', block_id=block_ids))
+    delete_ids(tuple(crud.read_column('triples', 'id', block_id=block_ids)))
+
+def delete_ids(triple_ids):
+    r'''Delete the triples with ids in 'triple_ids'.
+
+    This also deletes the data associated with the triples, except for their
+    use as parameters to other triples.
+    '''
     if triple_ids:
         crud.delete('triple_parameters', parent_id=triple_ids)
         crud.delete('triple_order_constraints', predecessor=triple_ids)
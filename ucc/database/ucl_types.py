@@ -47,7 +47,7 @@ def init():
     global Types_by_id
     Types_by_id = {}        #: {id: type object}
     for row in crud.read_as_dicts('type'):
-        getattr(globals(), row['kind']).from_db(row)
+        globals()[row['kind']].from_db(row)
 
 class base_type:
     r'''Base class for all types.
@@ -100,7 +100,7 @@ class base_type:
             row['element_type'] = Types_by_id[row['element_type']]
         key = cls.row_to_key(row)
         cls.Instances[key] = \
-          cls(row['id'], {col: row['col'] for col in cls.Columns},
+          cls(row['id'], {col: row[col] for col in cls.Columns},
               cls.read_sub_elements(row, key))
 
     @classmethod
@@ -36,7 +36,7 @@ def genparser(filename, rules, token_dict, output_file = sys.stdout):
             ('left', 'BIT_AND'),
             ('right', 'NEGATE', 'BIT_NOT'),
             ('nonassoc', ')', ']'),
-            ('left', '.'),
+            ('left', '(', '[', '.'),
         )
 
         token_dict = {
@@ -0,0 +1,1126 @@
+# avr.py
+
+r'''A cycle counting simulator for the AVR core (ATmega328P).
+
+The flash is kept as a list of 16 bit words.  Each word is decoded (using
+`ucc.simulator.decode`) the first time that it is executed into a python
+closure that carries out the instruction.  These closures take no arguments
+and return (next_pc, clock_cycles).  They are cached by address in 'code',
+so the main loop in `cpu.run` is just a list lookup and a call per
+instruction.
+
+The data memory is a bytearray holding the 32 registers, the I/O registers
+and the SRAM, using the same addresses as `ucc.assembler.io`.  The SREG and
+SP live in their I/O addresses.
+
+Writes to the PINx registers toggle the PORTx bits (as they do on the
+ATmega328P), and the PINx registers read the PORTx outputs, or the value set
+by `cpu.set_input` for input pins.
+
+There are no peripherals or interrupts.  Since nothing can then break out of
+a jump to itself (like the 'termination_loop' in startup.asm), or a SLEEP,
+these halt the simulation.
+
+    >>> c = cpu()
+    >>> c.load_words(0, (0xe0a5,         # ldi  r26,5
+    ...                  0x95aa,         # dec  r26
+    ...                  0xf7f1,         # brne .-4
+    ...                  0xcfff))        # rjmp .
+    >>> c.run()
+    >>> c.halted, c.pc, c.cycles, c.data[26]
+    (True, 3, 15, 0)
+'''
+
+from ucc.assembler import io, hex_file
+from ucc.simulator import decode
+
+# SREG bits:
+C = 0x01
+Z = 0x02
+N = 0x04
+V = 0x08
+S = 0x10
+H = 0x20
+T = 0x40
+I = 0x80
+
+SREG = io.sreg
+SPL = io.spl
+SPH = io.sph
+
+Flash_words = 0x4000    #: 32K bytes
+Ram_end = 0x8FF         #: last SRAM address
+
+Ports = (
+    #: (pin, ddr, port) data addresses
+    (io.pinb, io.ddrb, io.portb),
+    (io.pinc, io.ddrc, io.portc),
+    (io.pind, io.ddrd, io.portd),
+)
+
+class halted(Exception):
+    r'''Raised by an instruction that can never continue.'''
+
+Nzs_flags = tuple((N | S if r & 0x80 else 0) | (0 if r else Z)
+                  for r in range(256))
+    #: N, Z and S flags for an 8 bit result with V == 0.
+
+def add8(a, b, c):
+    r'''Returns (a + b + c) & 0xFF, and the H, S, V, N, Z and C flags.
+
+        >>> add8(0x7f, 1, 0) == (0x80, H | N | V)
+        True
+        >>> add8(0xff, 1, 0) == (0, H | Z | C)
+        True
+    '''
+    r = a + b + c
+    r8 = r & 0xFF
+    f = (r >> 8) | ((((a & 0xF) + (b & 0xF) + c) & 0x10) << 1)
+    if (a ^ r8) & (b ^ r8) & 0x80: f |= V
+    if r8 & 0x80: f |= N
+    if not r8: f |= Z
+    if ((f >> 2) ^ (f >> 3)) & 1: f |= S
+    return r8, f
+
+def sub8(a, b, c):
+    r'''Returns (a - b - c) & 0xFF, and the H, S, V, N, Z and C flags.
+
+        >>> sub8(0, 1, 0) == (0xff, H | N | S | C)
+        True
+        >>> sub8(0x80, 1, 0) == (0x7f, H | V | S)
+        True
+        >>> sub8(5, 5, 0) == (0, Z)
+        True
+    '''
+    r = a - b - c
+    r8 = r & 0xFF
+    f = C if r < 0 else 0
+    if (a & 0xF) - (b & 0xF) - c < 0: f |= H
+    if (a ^ b) & (a ^ r8) & 0x80: f |= V
+    if r8 & 0x80: f |= N
+    if not r8: f |= Z
+    if ((f >> 2) ^ (f >> 3)) & 1: f |= S
+    return r8, f
+
+Add_table = None    #: [(carry << 16) | (a << 8) | b] -> (flags << 8) | result
+Sub_table = None    #: [(carry << 16) | (a << 8) | b] -> (flags << 8) | result
+
+def make_tables():
+    r'''Builds Add_table and Sub_table (once).
+
+    These save calling `add8` and `sub8` for each add and subtract.
+
+        >>> make_tables()
+        >>> from ucc.simulator import avr
+        >>> avr.Sub_table[(1 << 16) | (0x10 << 8) | 0x0f] == ((H | Z) << 8)
+        True
+    '''
+    global Add_table, Sub_table
+    if Add_table is None:
+        Add_table = [(f << 8) | r
+                     for r, f in (add8(a, b, c)
+                                  for c in (0, 1)
+                                    for a in range(256)
+                                      for b in range(256))]
+        Sub_table = [(f << 8) | r
+                     for r, f in (sub8(a, b, c)
+                                  for c in (0, 1)
+                                    for a in range(256)
+                                      for b in range(256))]
+
+def nvzs16(r16, v):
+    r'''Returns the N, Z, and S flags for a 16 bit result, plus V if 'v'.
+    '''
+    f = V if v else 0
+    if r16 & 0x8000: f |= N
+    if not r16: f |= Z
+    if ((f >> 2) ^ (f >> 3)) & 1: f |= S
+    return f
+
+def signed8(n):
+    return n - 0x100 if n & 0x80 else n
+
+class cpu:
+    r'''The simulated processor.
+
+    The interesting attributes are:
+
+        data
+          bytearray of the data memory (registers, I/O and SRAM).
+        flash
+          list of 16 bit words.
+        pc
+          program counter (word address).
+        cycles
+          number of clock cycles executed so far.
+        min_sp
+          lowest stack pointer value seen, for peak stack use.
+        halted
+          True once the program can not continue.
+    '''
+    def __init__(self, flash_words = Flash_words, ram_end = Ram_end):
+        make_tables()
+        self.flash = [0xFFFF] * flash_words
+        self.data = bytearray(ram_end + 1)
+        self.ram_end = ram_end
+        self.decoder = decode.decoder()
+        self.write_hooks = {}   # {data_address: fn(address, value)}
+        self.watchers = {}      # {data_address: [fn(cpu, address, value)]}
+        self.inputs = {}        # {pin_address: value driven onto pins}
+        for pin, ddr, port in Ports:
+            self.write_hooks[pin] = self.write_pin
+            self.write_hooks[ddr] = self.write_port
+            self.write_hooks[port] = self.write_port
+        self.reset()
+
+    def reset(self):
+        r'''Resets the processor (but not the SRAM).
+        '''
+        self.code = [None] * len(self.flash)
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        for i in range(0x20, 0x100):
+            self.data[i] = 0
+        self.set_sp(self.ram_end)
+        self.min_sp = self.ram_end
+        self.update_pins()
+
+    def load_hex(self, filename):
+        r'''Loads a .hex file into flash.
+        '''
+        for address, byte in hex_file.read(filename):
+            word = self.flash[address >> 1]
+            if address & 1:
+                self.flash[address >> 1] = (word & 0x00FF) | (byte << 8)
+            else:
+                self.flash[address >> 1] = (word & 0xFF00) | byte
+        self.code = [None] * len(self.flash)
+
+    def load_words(self, word_address, words):
+        r'''Loads a sequence of 16 bit words into flash.
+        '''
+        for i, word in enumerate(words, word_address):
+            self.flash[i] = word
+        self.code = [None] * len(self.flash)
+
+    def reg(self, n):
+        return self.data[n]
+
+    def reg16(self, n):
+        r'''Returns the value of the register pair starting at register 'n'.
+        '''
+        return self.data[n] | (self.data[n + 1] << 8)
+
+    def get_sp(self):
+        return self.data[SPL] | (self.data[SPH] << 8)
+
+    def set_sp(self, sp):
+        self.data[SPL] = sp & 0xFF
+        self.data[SPH] = sp >> 8
+
+    def push(self, byte):
+        sp = self.data[SPL] | (self.data[SPH] << 8)
+        self.data[sp] = byte
+        sp -= 1
+        if sp < self.min_sp: self.min_sp = sp
+        self.data[SPL] = sp & 0xFF
+        self.data[SPH] = sp >> 8
+
+    def pop(self):
+        sp = (self.data[SPL] | (self.data[SPH] << 8)) + 1
+        self.data[SPL] = sp & 0xFF
+        self.data[SPH] = sp >> 8
+        return self.data[sp]
+
+    def push_pc(self, pc):
+        self.push(pc & 0xFF)
+        self.push(pc >> 8)
+
+    def pop_pc(self):
+        hi = self.pop()
+        return (hi << 8) | self.pop()
+
+    def stack_used(self):
+        r'''Returns the peak number of bytes used on the stack.
+        '''
+        return self.ram_end - self.min_sp
+
+    def write_data(self, address, value):
+        r'''Writes 'value' to data 'address', honoring the I/O semantics.
+        '''
+        hook = self.write_hooks.get(address)
+        if hook is None:
+            self.data[address] = value
+        else:
+            hook(address, value)
+
+    def watch(self, address, fn):
+        r'''Calls fn(cpu, address, value) each time 'address' changes.
+
+        Only works for the PORTx and DDRx addresses.  Writes that leave the
+        value unchanged aren't reported.  Writes to PINx are reported as
+        changes to PORTx.
+        '''
+        self.watchers.setdefault(address, []).append(fn)
+
+    def write_port(self, address, value):
+        changed = value != self.data[address]
+        self.data[address] = value
+        self.update_pins()
+        if changed:
+            for fn in self.watchers.get(address, ()):
+                fn(self, address, value)
+
+    def write_pin(self, pin, value):
+        r'''Writing a 1 to a PINx bit toggles the PORTx bit.
+        '''
+        if value:
+            port = pin + 2
+            self.write_port(port, self.data[port] ^ value)
+
+    def set_input(self, pin, value):
+        r'''Drives 'value' onto the input pins of the PINx register 'pin'.
+
+        None means that nothing is driving the pins, so the pull-ups (PORTx)
+        determine the value read.
+        '''
+        self.inputs[pin] = value
+        self.update_pins()
+
+    def update_pins(self):
+        data = self.data
+        for pin, ddr, port in Ports:
+            outputs = data[port] & data[ddr]
+            external = self.inputs.get(pin)
+            if external is None: external = data[port]
+            data[pin] = outputs | (external & ~data[ddr] & 0xFF)
+
+    def set_io_bit(self, address, bit):
+        r'''SBI semantics: only writes the one bit to PINx registers.
+        '''
+        if address in self.write_hooks and \
+           self.write_hooks[address] == self.write_pin:
+            self.write_pin(address, 1 << bit)
+        else:
+            self.write_data(address, self.data[address] | (1 << bit))
+
+    def clear_io_bit(self, address, bit):
+        r'''CBI semantics: writing a 0 to PINx does nothing.
+        '''
+        if address in self.write_hooks and \
+           self.write_hooks[address] == self.write_pin:
+            return
+        self.write_data(address, self.data[address] & ~(1 << bit) & 0xFF)
+
+    def read_program_byte(self, address):
+        word = self.flash[address >> 1]
+        return (word >> 8) if address & 1 else (word & 0xFF)
+
+    def inst_words(self, pc):
+        r'''Returns the number of words in the instruction at 'pc'.
+        '''
+        t = self.decoder.lookup(self.flash[pc])
+        return t.num_words if t is not None else 1
+
+    def decode(self, pc):
+        r'''Decodes the instruction at 'pc', caches and returns its closure.
+        '''
+        word = self.flash[pc]
+        t = self.decoder.lookup(word)
+        if t is None:
+            def illegal():
+                raise AssertionError(
+                        "illegal instruction 0x{:04x} at 0x{:04x}"
+                          .format(word, 2 * pc))
+            fn = illegal
+        else:
+            bits = word
+            if t.num_words == 2:
+                bits = (word << 16) | self.flash[pc + 1]
+            fn = Semantics[t.name](self, pc, t.operands(bits), t.cycles,
+                                   pc + t.num_words)
+        self.code[pc] = fn
+        return fn
+
+    def run(self, max_cycles = None, stop_pc = None):
+        r'''Runs until 'max_cycles' more cycles have passed.
+
+        Also stops when the program halts or reaches (word address) 'stop_pc'.
+        '''
+        code = self.code
+        decode = self.decode
+        pc = self.pc
+        cycles = self.cycles
+        limit = float('inf') if max_cycles is None else cycles + max_cycles
+        try:
+            while cycles < limit and pc != stop_pc:
+                fn = code[pc]
+                if fn is None: fn = decode(pc)
+                self.cycles = cycles
+                pc, n = fn()
+                cycles += n
+        except halted:
+            self.halted = True
+        finally:
+            self.pc = pc
+            self.cycles = cycles
+
+    def run_edges(self, targets, max_cycles = None):
+        r'''Like `run`, but counts the arrivals at the 'targets' pcs.
+
+        Returns {(from_pc, to_pc): count} for each time that the instruction
+        at (word address) 'from_pc' was followed by one at 'to_pc' in
+        'targets'.  This is slower than `run`, and is used to gather
+        execution profiles.
+
+            >>> c = cpu()
+            >>> c.load_words(0, (0xe0a3,         # ldi  r26,3
+            ...                  0x95aa,         # dec  r26
+            ...                  0xf7f1,         # brne .-4
+            ...                  0xcfff))        # rjmp .
+            >>> sorted(c.run_edges(frozenset((1, 3))).items())
+            [((0, 1), 1), ((2, 1), 2), ((2, 3), 1)]
+        '''
+        code = self.code
+        decode = self.decode
+        pc = self.pc
+        cycles = self.cycles
+        limit = float('inf') if max_cycles is None else cycles + max_cycles
+        counts = {}
+        try:
+            while cycles < limit:
+                fn = code[pc]
+                if fn is None: fn = decode(pc)
+                self.cycles = cycles
+                from_pc = pc
+                pc, n = fn()
+                cycles += n
+                if pc in targets:
+                    key = from_pc, pc
+                    counts[key] = counts.get(key, 0) + 1
+        except halted:
+            self.halted = True
+        finally:
+            self.pc = pc
+            self.cycles = cycles
+        return counts
+
+    def run_instructions(self, count):
+        r'''Executes 'count' instructions (for single stepping).
+        '''
+        for i in range(count):
+            if self.halted: break
+            fn = self.code[self.pc]
+            if fn is None: fn = self.decode(self.pc)
+            try:
+                self.pc, n = fn()
+            except halted:
+                self.halted = True
+            else:
+                self.cycles += n
+
+
+#########################################################################
+# Instruction semantics.
+#
+# Each of these takes (cpu, pc, operands, cycles, next_pc) and returns a
+# closure for the instruction at 'pc'.
+#########################################################################
+
+def add_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Add_table
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def add():
+        x = table[(data[d] << 8) | data[r]]
+        data[d] = x & 0xFF
+        data[SREG] = (data[SREG] & 0xC0) | (x >> 8)
+        return ans
+    return add
+
+def adc_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Add_table
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def adc():
+        sreg = data[SREG]
+        x = table[((sreg & C) << 16) | (data[d] << 8) | data[r]]
+        data[d] = x & 0xFF
+        data[SREG] = (sreg & 0xC0) | (x >> 8)
+        return ans
+    return adc
+
+def sub_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Sub_table
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def sub():
+        x = table[(data[d] << 8) | data[r]]
+        data[d] = x & 0xFF
+        data[SREG] = (data[SREG] & 0xC0) | (x >> 8)
+        return ans
+    return sub
+
+def subi_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Sub_table
+    d, k = ops['d'], ops['K']
+    ans = next_pc, cycles
+    def subi():
+        x = table[(data[d] << 8) | k]
+        data[d] = x & 0xFF
+        data[SREG] = (data[SREG] & 0xC0) | (x >> 8)
+        return ans
+    return subi
+
+def sbc_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Sub_table
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def sbc():
+        sreg = data[SREG]
+        x = table[((sreg & C) << 16) | (data[d] << 8) | data[r]]
+        data[d] = x & 0xFF
+        # Z is only left set if it was already set:
+        data[SREG] = (sreg & 0xC0) | ((x >> 8) & (0xFD | sreg))
+        return ans
+    return sbc
+
+def sbci_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Sub_table
+    d, k = ops['d'], ops['K']
+    ans = next_pc, cycles
+    def sbci():
+        sreg = data[SREG]
+        x = table[((sreg & C) << 16) | (data[d] << 8) | k]
+        data[d] = x & 0xFF
+        data[SREG] = (sreg & 0xC0) | ((x >> 8) & (0xFD | sreg))
+        return ans
+    return sbci
+
+def cp_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Sub_table
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def cp():
+        data[SREG] = (data[SREG] & 0xC0) \
+                   | (table[(data[d] << 8) | data[r]] >> 8)
+        return ans
+    return cp
+
+def cpc_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Sub_table
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def cpc():
+        sreg = data[SREG]
+        x = table[((sreg & C) << 16) | (data[d] << 8) | data[r]]
+        data[SREG] = (sreg & 0xC0) | ((x >> 8) & (0xFD | sreg))
+        return ans
+    return cpc
+
+def cpi_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    table = Sub_table
+    d, k = ops['d'], ops['K']
+    ans = next_pc, cycles
+    def cpi():
+        data[SREG] = (data[SREG] & 0xC0) | (table[(data[d] << 8) | k] >> 8)
+        return ans
+    return cpi
+
+def word_inst(cpu, pc, ops, cycles, next_pc, subtract = False):
+    data = cpu.data
+    d, k = ops['d'], ops['K']
+    ans = next_pc, cycles
+    def word_op():
+        rd = data[d] | (data[d + 1] << 8)
+        if subtract:
+            r = (rd - k) & 0xFFFF
+            f = C if r & ~rd & 0x8000 else 0
+            f |= nvzs16(r, rd & ~r & 0x8000)
+        else:
+            r = (rd + k) & 0xFFFF
+            f = C if ~r & rd & 0x8000 else 0
+            f |= nvzs16(r, ~rd & r & 0x8000)
+        data[d] = r & 0xFF
+        data[d + 1] = r >> 8
+        data[SREG] = (data[SREG] & 0xE0) | f
+        return ans
+    return word_op
+
+def adiw_inst(cpu, pc, ops, cycles, next_pc):
+    return word_inst(cpu, pc, ops, cycles, next_pc)
+
+def sbiw_inst(cpu, pc, ops, cycles, next_pc):
+    return word_inst(cpu, pc, ops, cycles, next_pc, subtract=True)
+
+def logic_inst(cpu, pc, ops, cycles, next_pc, op, immediate = False):
+    data = cpu.data
+    d = ops['d']
+    r = ops['r'] if not immediate else None
+    k = ops['K'] if immediate else None
+    ans = next_pc, cycles
+    def logic():
+        result = op(data[d], k if immediate else data[r])
+        data[d] = result
+        data[SREG] = (data[SREG] & 0xE1) | Nzs_flags[result]
+        return ans
+    return logic
+
+def and_inst(cpu, pc, ops, cycles, next_pc):
+    return logic_inst(cpu, pc, ops, cycles, next_pc, lambda a, b: a & b)
+
+def andi_inst(cpu, pc, ops, cycles, next_pc):
+    return logic_inst(cpu, pc, ops, cycles, next_pc, lambda a, b: a & b, True)
+
+def or_inst(cpu, pc, ops, cycles, next_pc):
+    return logic_inst(cpu, pc, ops, cycles, next_pc, lambda a, b: a | b)
+
+def ori_inst(cpu, pc, ops, cycles, next_pc):
+    return logic_inst(cpu, pc, ops, cycles, next_pc, lambda a, b: a | b, True)
+
+def eor_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def eor():
+        result = data[d] ^ data[r]
+        data[d] = result
+        data[SREG] = (data[SREG] & 0xE1) | Nzs_flags[result]
+        return ans
+    return eor
+
+def com_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d = ops['d']
+    ans = next_pc, cycles
+    def com():
+        result = 0xFF - data[d]
+        data[d] = result
+        data[SREG] = (data[SREG] & 0xE0) | Nzs_flags[result] | C
+        return ans
+    return com
+
+def neg_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d = ops['d']
+    ans = next_pc, cycles
+    def neg():
+        result, f = sub8(0, data[d], 0)
+        data[d] = result
+        data[SREG] = (data[SREG] & 0xC0) | f
+        return ans
+    return neg
+
+def inc_dec_inst(cpu, pc, ops, cycles, next_pc, delta):
+    data = cpu.data
+    d = ops['d']
+    overflow = 0x80 if delta == 1 else 0x7F
+    ans = next_pc, cycles
+    def inc_dec():
+        result = (data[d] + delta) & 0xFF
+        data[d] = result
+        f = Nzs_flags[result]
+        if result == overflow: f ^= V | S
+        data[SREG] = (data[SREG] & 0xE1) | f
+        return ans
+    return inc_dec
+
+def inc_inst(cpu, pc, ops, cycles, next_pc):
+    return inc_dec_inst(cpu, pc, ops, cycles, next_pc, 1)
+
+def dec_inst(cpu, pc, ops, cycles, next_pc):
+    return inc_dec_inst(cpu, pc, ops, cycles, next_pc, -1)
+
+def mul_inst(cpu, pc, ops, cycles, next_pc, signed_d = False,
+             signed_r = False, shift = 0):
+    data = cpu.data
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def mul():
+        a = signed8(data[d]) if signed_d else data[d]
+        b = signed8(data[r]) if signed_r else data[r]
+        product = (a * b) & 0xFFFF
+        f = C if product & 0x8000 else 0
+        product = (product << shift) & 0xFFFF
+        if not product: f |= Z
+        data[0] = product & 0xFF
+        data[1] = product >> 8
+        data[SREG] = (data[SREG] & 0xFC) | f
+        return ans
+    return mul
+
+def muls_inst(cpu, pc, ops, cycles, next_pc):
+    return mul_inst(cpu, pc, ops, cycles, next_pc, True, True)
+
+def mulsu_inst(cpu, pc, ops, cycles, next_pc):
+    return mul_inst(cpu, pc, ops, cycles, next_pc, True, False)
+
+def fmul_inst(cpu, pc, ops, cycles, next_pc):
+    return mul_inst(cpu, pc, ops, cycles, next_pc, shift=1)
+
+def fmuls_inst(cpu, pc, ops, cycles, next_pc):
+    return mul_inst(cpu, pc, ops, cycles, next_pc, True, True, 1)
+
+def fmulsu_inst(cpu, pc, ops, cycles, next_pc):
+    return mul_inst(cpu, pc, ops, cycles, next_pc, True, False, 1)
+
+def shift_inst(cpu, pc, ops, cycles, next_pc, kind):
+    data = cpu.data
+    d = ops['d']
+    ans = next_pc, cycles
+    def shift():
+        rd = data[d]
+        sreg = data[SREG]
+        if kind == 'lsr':
+            result = rd >> 1
+        elif kind == 'ror':
+            result = (rd >> 1) | ((sreg & C) << 7)
+        else:
+            result = (rd >> 1) | (rd & 0x80)
+        data[d] = result
+        f = Nzs_flags[result] & (N | Z)
+        if rd & 1: f |= C
+        if bool(f & N) != bool(f & C): f |= V
+        if bool(f & N) != bool(f & V): f |= S
+        data[SREG] = (sreg & 0xE0) | f
+        return ans
+    return shift
+
+def lsr_inst(cpu, pc, ops, cycles, next_pc):
+    return shift_inst(cpu, pc, ops, cycles, next_pc, 'lsr')
+
+def ror_inst(cpu, pc, ops, cycles, next_pc):
+    return shift_inst(cpu, pc, ops, cycles, next_pc, 'ror')
+
+def asr_inst(cpu, pc, ops, cycles, next_pc):
+    return shift_inst(cpu, pc, ops, cycles, next_pc, 'asr')
+
+def swap_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d = ops['d']
+    ans = next_pc, cycles
+    def swap():
+        rd = data[d]
+        data[d] = ((rd << 4) | (rd >> 4)) & 0xFF
+        return ans
+    return swap
+
+def bset_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    mask = 1 << ops['s']
+    ans = next_pc, cycles
+    def bset():
+        data[SREG] |= mask
+        return ans
+    return bset
+
+def bclr_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    mask = ~(1 << ops['s']) & 0xFF
+    ans = next_pc, cycles
+    def bclr():
+        data[SREG] &= mask
+        return ans
+    return bclr
+
+def bst_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, mask = ops['d'], 1 << ops['b']
+    ans = next_pc, cycles
+    def bst():
+        if data[d] & mask: data[SREG] |= T
+        else: data[SREG] &= ~T & 0xFF
+        return ans
+    return bst
+
+def bld_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, mask = ops['d'], 1 << ops['b']
+    ans = next_pc, cycles
+    def bld():
+        if data[SREG] & T: data[d] |= mask
+        else: data[d] &= ~mask & 0xFF
+        return ans
+    return bld
+
+def mov_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def mov():
+        data[d] = data[r]
+        return ans
+    return mov
+
+def movw_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, r = ops['d'], ops['r']
+    ans = next_pc, cycles
+    def movw():
+        data[d] = data[r]
+        data[d + 1] = data[r + 1]
+        return ans
+    return movw
+
+def ldi_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, k = ops['d'], ops['K']
+    ans = next_pc, cycles
+    def ldi():
+        data[d] = k
+        return ans
+    return ldi
+
+Pointer_regs = {3: 26, 2: 28, 0: 30}    #: x field to X, Y or Z register
+
+def ld_st_inst(cpu, pc, ops, cycles, next_pc, store):
+    data = cpu.data
+    reg = ops['r'] if store else ops['d']
+    ptr = Pointer_regs[ops['x']]
+    post_inc = ops['p'] == 1
+    pre_dec = ops['p'] == 2
+    write_data = cpu.write_data
+    ans = next_pc, cycles
+    def ld_st():
+        address = data[ptr] | (data[ptr + 1] << 8)
+        if pre_dec: address = (address - 1) & 0xFFFF
+        if store: write_data(address, data[reg])
+        else: data[reg] = data[address]
+        if post_inc: address = (address + 1) & 0xFFFF
+        if pre_dec or post_inc:
+            data[ptr] = address & 0xFF
+            data[ptr + 1] = address >> 8
+        return ans
+    return ld_st
+
+def ld_inst(cpu, pc, ops, cycles, next_pc):
+    return ld_st_inst(cpu, pc, ops, cycles, next_pc, False)
+
+def st_inst(cpu, pc, ops, cycles, next_pc):
+    return ld_st_inst(cpu, pc, ops, cycles, next_pc, True)
+
+def ldd_std_inst(cpu, pc, ops, cycles, next_pc, store):
+    data = cpu.data
+    reg = ops['r'] if store else ops['d']
+    ptr = 28 if ops['y'] else 30
+    q = ops['q']
+    write_data = cpu.write_data
+    ans = next_pc, cycles
+    def ldd_std():
+        address = (data[ptr] | (data[ptr + 1] << 8)) + q
+        if store: write_data(address, data[reg])
+        else: data[reg] = data[address]
+        return ans
+    return ldd_std
+
+def ldd_inst(cpu, pc, ops, cycles, next_pc):
+    return ldd_std_inst(cpu, pc, ops, cycles, next_pc, False)
+
+def std_inst(cpu, pc, ops, cycles, next_pc):
+    return ldd_std_inst(cpu, pc, ops, cycles, next_pc, True)
+
+def lds_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, address = ops['d'], ops['K']
+    ans = next_pc, cycles
+    def lds():
+        data[d] = data[address]
+        return ans
+    return lds
+
+def sts_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    r, address = ops['r'], ops['K']
+    write_data = cpu.write_data
+    ans = next_pc, cycles
+    def sts():
+        write_data(address, data[r])
+        return ans
+    return sts
+
+def lpm_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d = ops.get('d', 0)
+    post_inc = ops.get('p', 0)
+    read_program_byte = cpu.read_program_byte
+    ans = next_pc, cycles
+    def lpm():
+        z = data[30] | (data[31] << 8)
+        data[d] = read_program_byte(z)
+        if post_inc:
+            z = (z + 1) & 0xFFFF
+            data[30] = z & 0xFF
+            data[31] = z >> 8
+        return ans
+    return lpm
+
+def in_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d, address = ops['d'], ops['A']
+    ans = next_pc, cycles
+    def in_():
+        data[d] = data[address]
+        return ans
+    return in_
+
+def out_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    r, address = ops['r'], ops['A']
+    write_data = cpu.write_data
+    ans = next_pc, cycles
+    def out():
+        write_data(address, data[r])
+        return ans
+    return out
+
+def sbi_inst(cpu, pc, ops, cycles, next_pc):
+    address, bit = ops['A'], ops['b']
+    set_io_bit = cpu.set_io_bit
+    ans = next_pc, cycles
+    def sbi():
+        set_io_bit(address, bit)
+        return ans
+    return sbi
+
+def cbi_inst(cpu, pc, ops, cycles, next_pc):
+    address, bit = ops['A'], ops['b']
+    clear_io_bit = cpu.clear_io_bit
+    ans = next_pc, cycles
+    def cbi():
+        clear_io_bit(address, bit)
+        return ans
+    return cbi
+
+def push_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d = ops['d']
+    push = cpu.push
+    ans = next_pc, cycles
+    def push_():
+        push(data[d])
+        return ans
+    return push_
+
+def pop_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    d = ops['d']
+    pop = cpu.pop
+    ans = next_pc, cycles
+    def pop_():
+        data[d] = pop()
+        return ans
+    return pop_
+
+def nop_inst(cpu, pc, ops, cycles, next_pc):
+    ans = next_pc, cycles or 1
+    def nop():
+        return ans
+    return nop
+
+def sleep_inst(cpu, pc, ops, cycles, next_pc):
+    def sleep():
+        raise halted
+    return sleep
+
+def rjmp_inst(cpu, pc, ops, cycles, next_pc):
+    ans = next_pc + ops['k'], cycles
+    if ans[0] == pc:
+        def rjmp_self():
+            raise halted
+        return rjmp_self
+    def rjmp():
+        return ans
+    return rjmp
+
+def jmp_inst(cpu, pc, ops, cycles, next_pc):
+    ans = ops['k'], cycles
+    if ans[0] == pc:
+        def jmp_self():
+            raise halted
+        return jmp_self
+    def jmp():
+        return ans
+    return jmp
+
+def ijmp_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    def ijmp():
+        return data[30] | (data[31] << 8), cycles
+    return ijmp
+
+def rcall_inst(cpu, pc, ops, cycles, next_pc):
+    push_pc = cpu.push_pc
+    ans = next_pc + ops['k'], cycles
+    def rcall():
+        push_pc(next_pc)
+        return ans
+    return rcall
+
+def call_inst(cpu, pc, ops, cycles, next_pc):
+    push_pc = cpu.push_pc
+    ans = ops['k'], cycles
+    def call():
+        push_pc(next_pc)
+        return ans
+    return call
+
+def icall_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    push_pc = cpu.push_pc
+    def icall():
+        push_pc(next_pc)
+        return data[30] | (data[31] << 8), cycles
+    return icall
+
+def ret_inst(cpu, pc, ops, cycles, next_pc):
+    pop_pc = cpu.pop_pc
+    def ret():
+        return pop_pc(), cycles
+    return ret
+
+def reti_inst(cpu, pc, ops, cycles, next_pc):
+    data = cpu.data
+    pop_pc = cpu.pop_pc
+    def reti():
+        data[SREG] |= I
+        return pop_pc(), cycles
+    return reti
+
+def branch_inst(cpu, pc, ops, cycles, next_pc, if_set):
+    data = cpu.data
+    mask = 1 << ops['s']
+    taken = next_pc + ops['k'], 2
+    not_taken = next_pc, 1
+    def branch():
+        if bool(data[SREG] & mask) == if_set: return taken
+        return not_taken
+    return branch
+
+def brbs_inst(cpu, pc, ops, cycles, next_pc):
+    return branch_inst(cpu, pc, ops, cycles, next_pc, True)
+
+def brbc_inst(cpu, pc, ops, cycles, next_pc):
+    return branch_inst(cpu, pc, ops, cycles, next_pc, False)
+
+def skip_inst(cpu, pc, ops, cycles, next_pc, test):
+    r''''test' is fn(data) -> True to skip the next instruction.
+    '''
+    data = cpu.data
+    next_words = cpu.inst_words(next_pc)
+    skip = next_pc + next_words, 1 + next_words
+    no_skip = next_pc, 1
+    def skip_():
+        if test(data): return skip
+        return no_skip
+    return skip_
+
+def cpse_inst(cpu, pc, ops, cycles, next_pc):
+    d, r = ops['d'], ops['r']
+    return skip_inst(cpu, pc, ops, cycles, next_pc,
+                     lambda data: data[d] == data[r])
+
+def sbrc_inst(cpu, pc, ops, cycles, next_pc):
+    r, mask = ops['r'], 1 << ops['b']
+    return skip_inst(cpu, pc, ops, cycles, next_pc,
+                     lambda data: not data[r] & mask)
+
+def sbrs_inst(cpu, pc, ops, cycles, next_pc):
+    r, mask = ops['r'], 1 << ops['b']
+    return skip_inst(cpu, pc, ops, cycles, next_pc,
+                     lambda data: data[r] & mask)
+
+def sbic_inst(cpu, pc, ops, cycles, next_pc):
+    address, mask = ops['A'], 1 << ops['b']
+    return skip_inst(cpu, pc, ops, cycles, next_pc,
+                     lambda data: not data[address] & mask)
+
+def sbis_inst(cpu, pc, ops, cycles, next_pc):
+    address, mask = ops['A'], 1 << ops['b']
+    return skip_inst(cpu, pc, ops, cycles, next_pc,
+                     lambda data: data[address] & mask)
+
+Semantics = {
+    #: Maps template names (see `ucc.simulator.decode`) to the function
+    #: creating the closure for that instruction.
+    'ADD': add_inst,
+    'ADC': adc_inst,
+    'ADIW': adiw_inst,
+    'SUB': sub_inst,
+    'SUBI': subi_inst,
+    'SBC': sbc_inst,
+    'SBCI': sbci_inst,
+    'SBIW': sbiw_inst,
+    'AND': and_inst,
+    'ANDI': andi_inst,
+    'OR': or_inst,
+    'ORI': ori_inst,
+    'EOR': eor_inst,
+    'COM': com_inst,
+    'NEG': neg_inst,
+    'INC': inc_inst,
+    'DEC': dec_inst,
+    'MUL': mul_inst,
+    'MULS': muls_inst,
+    'MULSU': mulsu_inst,
+    'FMUL': fmul_inst,
+    'FMULS': fmuls_inst,
+    'FMULSU': fmulsu_inst,
+    'RJMP': rjmp_inst,
+    'IJMP': ijmp_inst,
+    'JMP': jmp_inst,
+    'RCALL': rcall_inst,
+    'ICALL': icall_inst,
+    'CALL': call_inst,
+    'RET': ret_inst,
+    'RETI': reti_inst,
+    'CPSE': cpse_inst,
+    'CP': cp_inst,
+    'CPC': cpc_inst,
+    'CPI': cpi_inst,
+    'SBRC': sbrc_inst,
+    'SBRS': sbrs_inst,
+    'SBIC': sbic_inst,
+    'SBIS': sbis_inst,
+    'BRBS': brbs_inst,
+    'BRBC': brbc_inst,
+    'SBI': sbi_inst,
+    'CBI': cbi_inst,
+    'LSR': lsr_inst,
+    'ROR': ror_inst,
+    'ASR': asr_inst,
+    'SWAP': swap_inst,
+    'BSET': bset_inst,
+    'BCLR': bclr_inst,
+    'BST': bst_inst,
+    'BLD': bld_inst,
+    'MOV': mov_inst,
+    'MOVW': movw_inst,
+    'LDI': ldi_inst,
+    'LD': ld_inst,
+    'LDD': ldd_inst,
+    'LDS': lds_inst,
+    'ST': st_inst,
+    'STD': std_inst,
+    'STS': sts_inst,
+    'LPM': lpm_inst,
+    'LPM_R0': lpm_inst,
+    'SPM': nop_inst,
+    'IN': in_inst,
+    'OUT': out_inst,
+    'PUSH': push_inst,
+    'POP': pop_inst,
+    'NOP': nop_inst,
+    'SLEEP': sleep_inst,
+    'WDR': nop_inst,
+    'BREAK': nop_inst,
+}
@@ -0,0 +1,399 @@
+# bench.py
+
+r'''Code quality benchmarks.
+
+Each benchmark kernel is a small package under examples/bench.  The kernel is
+compiled, run on the `ucc.simulator.avr` simulator until it halts (the 'run'
+task returning to the 'termination_loop'), and scored by the number of clock
+cycles run, the number of flash bytes and the peak stack use.
+
+Each kernel must also leave the results that it is expected to: the changes
+it makes to the output ports must match its 'expected.trace' (see
+`ucc.simulator.gpio_trace`), and the global variables listed in its
+'expected.vars' must end with the values given there.  Every global variable
+of the kernel must be listed there.  A kernel that doesn't is reported as
+failed.
+
+The scores are appended to a history file, one line per kernel per run, so
+that each run can be compared against the last one to flag regressions.  This
+is examples/bench/history, which is local to each checkout and not kept in
+git (the cycle counts only compare within the same tree).  The history lines
+are tab separated:
+
+    run_label  kernel  cycles  flash  stack  error
+
+With '-' for the missing numbers for kernels that fail.
+'''
+
+import os
+import sys
+import sqlite3
+import subprocess
+
+from ucc.assembler import hex_file
+from ucc.codegen import expand_assembler
+from ucc.database import crud
+from ucc.simulator import avr, gpio_trace
+
+Metrics = ('cycles', 'flash', 'stack')
+
+Max_cycles = 10000000
+
+Expected_trace = 'expected.trace'
+Expected_vars = 'expected.vars'
+
+Root_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+             os.path.abspath(__file__))))
+Bench_dir = os.path.join(Root_dir, 'examples', 'bench')
+History_filename = os.path.join(Bench_dir, 'history')
+
+class result:
+    r'''The scores for one kernel.
+
+    A kernel that failed has an 'error' and None for its scores.
+
+        >>> r = result('calls', 197, 134, 4)
+        >>> r
+        <result calls: cycles 197, flash 134, stack 4>
+        >>> r.ok
+        True
+        >>> r.as_line('v1')
+        'v1\tcalls\t197\t134\t4\t'
+        >>> result.from_line(r.as_line('v1'))
+        ('v1', <result calls: cycles 197, flash 134, stack 4>)
+        >>> bad = result('if_chain', error='does not compile')
+        >>> bad
+        <result if_chain: does not compile>
+        >>> result.from_line(bad.as_line('v1'))
+        ('v1', <result if_chain: does not compile>)
+    '''
+    def __init__(self, kernel, cycles = None, flash = None, stack = None,
+                       error = None):
+        self.kernel = kernel
+        self.cycles = cycles
+        self.flash = flash
+        self.stack = stack
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if not self.ok:
+            return "<result {}: {}>".format(self.kernel, self.error)
+        return "<result {}: {}>".format(self.kernel,
+                 ', '.join("{} {}".format(m, getattr(self, m))
+                           for m in Metrics))
+
+    def as_line(self, run_label):
+        return '\t'.join([run_label, self.kernel] +
+                         ['-' if getattr(self, m) is None
+                              else str(getattr(self, m))
+                          for m in Metrics] +
+                         [self.error or ''])
+
+    @classmethod
+    def from_line(cls, line):
+        r'''Returns run_label, result.
+        '''
+        run_label, kernel, cycles, flash, stack, error = \
+          line.rstrip('\r\n').split('\t')
+        return run_label, cls(kernel,
+                              *[None if n == '-' else int(n)
+                                for n in (cycles, flash, stack)],
+                              error = error or None)
+
+def kernels(bench_dir = Bench_dir):
+    r'''Returns the sorted names of the kernels in 'bench_dir'.
+    '''
+    return sorted(name for name in os.listdir(bench_dir)
+                       if os.path.exists(os.path.join(bench_dir, name,
+                                                      'package.xml')))
+
+def compile_kernel(kernel_dir):
+    r'''Compiles the kernel package in 'kernel_dir'.
+
+    The compile is done in a separate python process using
+    scripts/compile.py, so that one kernel can't upset the next one.
+
+    Returns None if it worked, or the last line of the error output.
+    '''
+    hex_filename = os.path.join(kernel_dir, 'flash.hex')
+    if os.path.exists(hex_filename):
+        os.remove(hex_filename)
+    proc = subprocess.Popen((sys.executable,
+                             os.path.join(Root_dir, 'scripts', 'compile.py'),
+                             kernel_dir),
+                            stdout = subprocess.PIPE,
+                            stderr = subprocess.STDOUT)
+    output = proc.communicate()[0].decode('ascii', 'replace')
+    if proc.returncode == 0 and os.path.exists(hex_filename):
+        return None
+    lines = [line for line in output.splitlines()
+                  if line.strip() and not line.startswith(' ')]
+    if not lines: return "does not compile"
+    return lines[-1].strip()
+
+def flash_bytes(hex_filename):
+    r'''Returns the number of bytes loaded by .hex file 'hex_filename'.
+    '''
+    return sum(1 for _ in hex_file.read(hex_filename))
+
+def read_vars(filename):
+    r'''Returns [(var, value)] from the .vars file 'filename'.
+
+    Each line is a global variable's name and value.  Lines starting with
+    '#' are comments.
+
+        >>> import io
+        >>> read_vars(io.StringIO('# var value\ntotal 3700\n\nstep 0x8\n'))
+        [('total', 3700), ('step', 8)]
+    '''
+    if isinstance(filename, str):
+        with open(filename, 'rt', encoding='ascii') as f:
+            return read_vars(f)
+    ans = []
+    for line in filename:
+        line = line.strip()
+        if not line or line.startswith('#'): continue
+        name, value = line.split()
+        ans.append((name, int(value, 0)))
+    return ans
+
+def global_vars(kernel_dir):
+    r'''Returns the set of the names of the kernel's global variables.
+
+    These are from the kernel's database, left by its last compile.
+    '''
+    db_conn = sqlite3.connect(os.path.join(kernel_dir, crud.Db_filename))
+    try:
+        return frozenset(label for label, in db_conn.execute('''
+            select label
+              from symbol_table
+             where kind = 'var'
+               and context isnull
+          '''))
+    finally:
+        db_conn.close()
+
+def var_registers(kernel_dir):
+    r'''Returns {var: register} of the pinned global variables.
+
+    These are from the kernel's database, left by its last compile (see
+    `ucc.codegen.pin_globals`).
+    '''
+    db_conn = sqlite3.connect(os.path.join(kernel_dir, crud.Db_filename))
+    try:
+        return dict(db_conn.execute('''
+            select sym.label, ru.assigned_register
+              from reg_use ru
+                   inner join symbol_table sym
+                     on ru.ref_id = sym.id
+             where ru.kind = 'global'
+               and ru.assigned_register notnull
+          '''))
+    finally:
+        db_conn.close()
+
+def reg_value(cpu, register):
+    r'''Returns the unsigned value in 'register' (e.g., 'r16', 'd24' or 'X').
+
+        >>> cpu = avr.cpu()
+        >>> cpu.load_words(0, (0xe0a5, 0xe0b1))    # ldi r26,5; ldi r27,1
+        >>> cpu.run_instructions(2)
+        >>> reg_value(cpu, 'X'), reg_value(cpu, 'd26'), reg_value(cpu, 'r26')
+        (261, 261, 5)
+    '''
+    register = expand_assembler.Pointer_pairs.get(register, register)
+    if register[0] == 'd': return cpu.reg16(int(register[1:]))
+    return cpu.reg(int(register[1:]))
+
+def check(cpu, trace, kernel_dir):
+    r'''Checks the final state of the kernel in 'kernel_dir'.
+
+    'trace' is the trace of the port changes made while running 'cpu'.
+
+    Every global variable of the kernel must be listed in its
+    'expected.vars', so that none of its results go unchecked.
+
+    Returns None if it is right, or a description of the first thing wrong.
+    '''
+    golden_filename = os.path.join(kernel_dir, Expected_trace)
+    if not os.path.exists(golden_filename):
+        return "no " + Expected_trace
+    differences = gpio_trace.compare(gpio_trace.read(golden_filename), trace)
+    if differences:
+        return "ports: " + differences[0]
+    vars_filename = os.path.join(kernel_dir, Expected_vars)
+    if os.path.exists(vars_filename):
+        expected_vars = read_vars(vars_filename)
+    else:
+        expected_vars = []
+    unchecked = global_vars(kernel_dir).difference(
+                  var for var, expected in expected_vars)
+    if unchecked:
+        return "{}: not in {}".format(min(unchecked), Expected_vars)
+    registers = var_registers(kernel_dir)
+    for var, expected in expected_vars:
+        if var not in registers:
+            return "{}: not in a register".format(var)
+        value = reg_value(cpu, registers[var])
+        if value != expected & 0xffff:
+            return "{} is {}, expected {}".format(var, value, expected)
+    return None
+
+def measure(kernel, kernel_dir, max_cycles = Max_cycles):
+    r'''Runs the kernel's flash.hex on the simulator, returns a `result`.
+
+    The kernel must halt within 'max_cycles', leaving the expected results
+    (see `check`).
+    '''
+    hex_filename = os.path.join(kernel_dir, 'flash.hex')
+    cpu = avr.cpu()
+    cpu.load_hex(hex_filename)
+    trace = gpio_trace.capture(cpu, max_cycles)
+    if not cpu.halted:
+        return result(kernel, error = "did not halt in {} cycles"
+                                        .format(max_cycles))
+    error = check(cpu, trace, kernel_dir)
+    if error is not None:
+        return result(kernel, error = error)
+    return result(kernel, cpu.cycles, flash_bytes(hex_filename),
+                  cpu.stack_used())
+
+def run_kernel(kernel, bench_dir = Bench_dir, max_cycles = Max_cycles):
+    r'''Compiles and measures 'kernel', returns a `result`.
+    '''
+    kernel_dir = os.path.join(bench_dir, kernel)
+    error = compile_kernel(kernel_dir)
+    if error is not None:
+        return result(kernel, error = error)
+    return measure(kernel, kernel_dir, max_cycles)
+
+def peephole_counts(kernel, bench_dir = Bench_dir):
+    r'''Returns {rule: count} of the peephole rules applied to 'kernel'.
+
+    These are the counts left in the kernel's database by its last compile
+    (see `ucc.codegen.peephole`).
+    '''
+    db_filename = os.path.join(bench_dir, kernel, crud.Db_filename)
+    if not os.path.exists(db_filename):
+        return {}
+    db_conn = sqlite3.connect(db_filename)
+    try:
+        return dict(db_conn.execute("select rule, count from peephole_counts"))
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        db_conn.close()
+
+def format_peephole_counts(counts):
+    r'''Generates lines of a table of the peephole rules applied.
+
+    'counts' is a sequence of (kernel, {rule: count}).
+
+        >>> for line in format_peephole_counts(
+        ...                 (('k1', {'tst_after_1': 1, 'branch_over_jmp': 2}),
+        ...                  ('k2', {}))):
+        ...     print(line)
+        kernel          peephole rules applied
+        k1              branch_over_jmp 2, tst_after_1 1
+        k2              none
+    '''
+    yield "{:15} peephole rules applied".format('kernel')
+    for kernel, rules in counts:
+        yield "{:15} {}".format(kernel,
+                                ', '.join("{} {}".format(rule, rules[rule])
+                                          for rule in sorted(rules))
+                                  or 'none')
+
+def read_history(filename = History_filename):
+    r'''Returns a list of (run_label, result) in the order run.
+    '''
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'rt', encoding='ascii') as f:
+        return [result.from_line(line) for line in f
+                                       if line.strip() and line[0] != '#']
+
+def write_history(run_label, results, filename = History_filename):
+    r'''Appends the 'results' to the history file 'filename'.
+    '''
+    with open(filename, 'at', encoding='ascii') as f:
+        for r in results:
+            f.write(r.as_line(run_label) + '\n')
+
+def latest(history):
+    r'''Returns {kernel: result} of the last result for each kernel.
+
+        >>> latest((('a', result('k1', 10, 2, 2)),
+        ...         ('a', result('k2', 20, 2, 2)),
+        ...         ('b', result('k1', 9, 2, 2))))
+        {'k1': <result k1: cycles 9, flash 2, stack 2>, 'k2': <result k2: cycles 20, flash 2, stack 2>}
+    '''
+    return dict((r.kernel, r) for run_label, r in history)
+
+def regressions(old, new, tolerance = 0):
+    r'''Generates (kernel, metric, old_value, new_value) for each regression.
+
+    'old' is {kernel: result}, 'new' is a sequence of results.  A metric
+    regresses when it grows by more than 'tolerance' percent.  A kernel that
+    worked before and now fails is reported with a metric of 'error'.
+
+        >>> old = {'k1': result('k1', 100, 40, 2),
+        ...        'k2': result('k2', error='does not compile'),
+        ...        'k3': result('k3', 100, 40, 2)}
+        >>> new = (result('k1', 101, 38, 4), result('k2', 10, 10, 2),
+        ...        result('k3', error='did not halt'), result('k4', 1, 1, 1))
+        >>> for r in regressions(old, new): print(r)
+        ('k1', 'cycles', 100, 101)
+        ('k1', 'stack', 2, 4)
+        ('k3', 'error', None, 'did not halt')
+        >>> for r in regressions(old, new, 5): print(r)
+        ('k1', 'stack', 2, 4)
+        ('k3', 'error', None, 'did not halt')
+    '''
+    for r in new:
+        before = old.get(r.kernel)
+        if before is None or not before.ok:
+            continue
+        if not r.ok:
+            yield r.kernel, 'error', None, r.error
+            continue
+        for m in Metrics:
+            old_value = getattr(before, m)
+            new_value = getattr(r, m)
+            if new_value > old_value * (1 + tolerance / 100.0):
+                yield r.kernel, m, old_value, new_value
+
+def format_results(results, old = {}):
+    r'''Generates lines of a table of 'results'.
+
+    Each score is followed by its change from the 'old' {kernel: result}.
+
+        >>> for line in format_results(
+        ...                 (result('k1', 101, 38, 2),
+        ...                  result('k2', error='does not compile')),
+        ...                 {'k1': result('k1', 100, 40, 2)}):
+        ...     print(line)
+        kernel                cycles     flash  stack
+        k1                  101 (+1)   38 (-2)      2
+        k2              does not compile
+    '''
+    yield "{:15} {:>12} {:>9} {:>6}".format('kernel', *Metrics)
+    for r in results:
+        if not r.ok:
+            yield "{:15} {}".format(r.kernel, r.error)
+            continue
+        before = old.get(r.kernel)
+        columns = []
+        for m in Metrics:
+            value = getattr(r, m)
+            if before is not None and before.ok and \
+               getattr(before, m) != value:
+                columns.append("{} ({:+})".format(value,
+                                                  value - getattr(before, m)))
+            else:
+                columns.append(str(value))
+        yield "{:15} {:>12} {:>9} {:>6}".format(r.kernel, *columns)
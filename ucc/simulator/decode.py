@@ -0,0 +1,189 @@
+# decode.py
+
+r'''Instruction decoder built from the templates in `ucc.assembler.asm_opcodes`.
+
+Each instruction template (e.g., '0000 11rd dddd rrrr') is turned into a mask
+and value to recognize the instruction, and a list of bit positions for each
+operand letter to extract the operand fields.
+
+Aliases (like TST for AND, or BREQ for BRBS) share their encoding with
+another instruction and are not used for decoding.
+'''
+
+from ucc.assembler import asm_opcodes, asm_inst
+
+Aliases = frozenset((
+    'TST', 'CLR', 'LSL', 'ROL', 'SBR', 'CBR', 'SER',
+    'BREQ', 'BRNE', 'BRCS', 'BRCC', 'BRSH', 'BRLO', 'BRMI', 'BRPL',
+    'BRGE', 'BRLT', 'BRHS', 'BRHC', 'BRTS', 'BRTC', 'BRVS', 'BRVC',
+    'BRIE', 'BRID',
+    'SEC', 'CLC', 'SEN', 'CLN', 'SEZ', 'CLZ', 'SEI', 'CLI',
+    'SES', 'CLS', 'SEV', 'CLV', 'SET', 'CLT', 'SEH', 'CLH',
+))
+
+Extra_templates = (
+    #: Encodings not in asm_opcodes: (name, template, cycles).
+    ('LPM_R0', '1001 0101 1100 1000', 3),    # LPM with R0 and Z implied
+)
+
+class template:
+    r'''A decodable instruction template.
+
+        >>> t = template('ADD', '0000 11rd dddd rrrr', 1)
+        >>> hex(t.mask), hex(t.value), t.num_words
+        ('0xfc00', '0xc00', 1)
+        >>> t.matches(0x0c4c)
+        True
+        >>> sorted(t.fields(0x0c4c).items())
+        [('d', 4), ('r', 12)]
+    '''
+    def __init__(self, name, opcode, cycles, notes = None):
+        self.name = name
+        self.opcode = opcode.replace(' ', '')
+        self.cycles = cycles
+        self.notes = notes or {}
+        self.num_words = len(self.opcode) // 16
+        self.mask = self.value = 0
+        self.positions = {}     # {letter: [bit# of lsb, ... bit# of msb]}
+        for i, x in enumerate(self.opcode[::-1]):
+            if x in '01':
+                if i >= 16 * (self.num_words - 1):
+                    self.mask |= 1 << (i - 16 * (self.num_words - 1))
+                    if x == '1':
+                        self.value |= 1 << (i - 16 * (self.num_words - 1))
+            else:
+                self.positions.setdefault(x, []).append(i)
+        self.num_fixed_bits = bin(self.mask).count('1')
+
+    def __repr__(self):
+        return "<template {}>".format(self.name)
+
+    def matches(self, word):
+        r'''Does the first (or only) instruction 'word' match this template?
+        '''
+        return word & self.mask == self.value and self.valid(word)
+
+    def valid(self, word):
+        r'''Checks operand combinations that the template can't express.
+
+        The LD and ST templates encode X, Y and Z pointers with their inc/dec
+        codes in the same bits as several other instructions, so only the
+        legal combinations are accepted.
+        '''
+        if self.name in ('LD', 'ST'):
+            low_bits = word & 0xF
+            if not word & 0x1000:
+                return low_bits in (0x0, 0x8)
+            return low_bits in (0x1, 0x2, 0x9, 0xA, 0xC, 0xD, 0xE)
+        return True
+
+    def fields(self, bits):
+        r'''Returns {letter: raw_field_value} for the instruction 'bits'.
+
+        For two word instructions, 'bits' is (first_word << 16) | second_word.
+        '''
+        ans = {}
+        for letter, positions in self.positions.items():
+            n = 0
+            for i, pos in enumerate(positions):
+                n |= ((bits >> pos) & 1) << i
+            ans[letter] = n
+        return ans
+
+    def operands(self, bits):
+        r'''Returns {letter: operand_value} for the instruction 'bits'.
+
+        This converts the raw fields back into what the programmer wrote.
+        Registers are register numbers, relative 'k' offsets are signed word
+        offsets, 'A' is converted to its data memory address.
+
+            >>> t = template('ADIW', '1001 0110 KKdd KKKK', 2, {'d': (24,30)})
+            >>> sorted(t.operands(0x9611).items())
+            [('K', 1), ('d', 26)]
+            >>> t = template('MOVW', '0000 0001 dddd rrrr', 1,
+            ...              {'d': (0,30), 'r': (0,30)})
+            >>> sorted(t.operands(0x01fc).items())
+            [('d', 30), ('r', 24)]
+            >>> t = template('RJMP', '1100 kkkk kkkk kkkk', 2,
+            ...              {'k': (-2048,2047)})
+            >>> t.operands(0xcfff)
+            {'k': -1}
+            >>> t = template('OUT', '1011 1AAr rrrr AAAA', 1)
+            >>> sorted(t.operands(0xb825).items())
+            [('A', 37), ('r', 2)]
+        '''
+        ans = self.fields(bits)
+        for letter, value in ans.items():
+            num_bits = len(self.positions[letter])
+            note = self.notes.get(letter)
+            if letter in 'dr' and isinstance(note, tuple):
+                low, high = note
+                if high - low + 1 == 2**num_bits:
+                    ans[letter] = low + value
+                else:
+                    ans[letter] = low + 2 * value
+            elif letter == 'k' and isinstance(note, tuple):
+                if value >= 2**(num_bits - 1):
+                    value -= 2**num_bits
+                ans[letter] = value
+            elif letter == 'A':
+                ans[letter] = value + 0x20
+        return ans
+
+def templates():
+    r'''Returns a list of all `template` objects, most specific first.
+
+        >>> ts = templates()
+        >>> [t.name for t in ts if t.name in ('LDD', 'BRBS', 'BREQ', 'NOP')]
+        ['NOP', 'BRBS', 'LDD']
+    '''
+    ans = []
+    for name in dir(asm_opcodes):
+        inst = getattr(asm_opcodes, name)
+        if isinstance(inst, asm_inst.inst1) and \
+           not isinstance(inst, (asm_inst.bytes, asm_inst.relaxed)) and \
+           name not in Aliases:
+            ans.append(template(name, inst.opcode, inst.cycles, inst.notes))
+    for name, opcode, cycles in Extra_templates:
+        ans.append(template(name, opcode, cycles))
+    ans.sort(key=lambda t: (-t.num_fixed_bits, t.name))
+    return ans
+
+class decoder:
+    r'''Finds the `template` for an instruction word.
+
+    The answers are cached by word.
+
+        >>> d = decoder()
+        >>> d.lookup(0x0000)
+        <template NOP>
+        >>> d.lookup(0x940c)
+        <template JMP>
+        >>> d.lookup(0x8108)
+        <template LD>
+        >>> d.lookup(0x810c)
+        <template LDD>
+        >>> d.lookup(0x900f)
+        <template POP>
+        >>> d.lookup(0xf409)
+        <template BRBC>
+        >>> d.lookup(0xffff)
+    '''
+    def __init__(self):
+        self.templates = templates()
+        self.cache = {}
+
+    def lookup(self, word):
+        r'''Returns the `template` for 'word', or None if illegal.
+        '''
+        try:
+            return self.cache[word]
+        except KeyError:
+            for t in self.templates:
+                if t.matches(word):
+                    ans = t
+                    break
+            else:
+                ans = None
+            self.cache[word] = ans
+            return ans
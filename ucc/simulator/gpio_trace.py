@@ -0,0 +1,165 @@
+# gpio_trace.py
+
+r'''Captures and compares traces of the output ports.
+
+A trace is a list of (cycle, port, value) for each change to PORTB, PORTC or
+PORTD while running the program on the `ucc.simulator.avr` simulator.  The
+'port' is the port's name in `ucc.assembler.io` (e.g., 'portb').
+
+Traces are stored in .trace files, one change per line:
+
+    cycle  port  value
+
+With the value in hex.  Lines starting with '#' are comments.
+
+Comparing a trace against a golden trace checks that the same ports were set
+to the same values in the same order.  The cycle counts are only compared if
+a timing tolerance is given, so that the code generation can change without
+breaking the golden traces.
+'''
+
+from ucc.assembler import io
+from ucc.simulator import avr
+
+Ports = ('portb', 'portc', 'portd')
+
+Chunk_cycles = 10000    #: cycles run between checks for max_changes
+
+def capture(cpu, max_cycles, max_changes = None):
+    r'''Runs 'cpu' and returns the trace of its port changes.
+
+    Stops after 'max_cycles', when the program halts, or once 'max_changes'
+    have been captured.  The cycle recorded for each change is the cycle count
+    when the instruction making the change started.
+
+        >>> c = avr.cpu()
+        >>> c.load_words(0, (0xe2a0,        # ldi  r26,0x20
+        ...                  0xb9a4,        # out  io.ddrb,r26
+        ...                  0xb9a3,        # out  io.pinb,r26
+        ...                  0x9a5d,        # sbi  io.portd,5
+        ...                  0xb9a3,        # out  io.pinb,r26
+        ...                  0xcfff))       # rjmp .
+        >>> for change in capture(c, 1000): print(change)
+        (2, 'portb', 32)
+        (3, 'portd', 32)
+        (5, 'portb', 0)
+        >>> c.reset()
+        >>> capture(c, 1000, 1)
+        [(2, 'portb', 32)]
+    '''
+    changes = []
+    def record(cpu, address, value, name):
+        changes.append((cpu.cycles, name, value))
+    for name in Ports:
+        cpu.watch(getattr(io, name),
+                  lambda cpu, address, value, name=name:
+                    record(cpu, address, value, name))
+    end = cpu.cycles + max_cycles
+    while not cpu.halted and cpu.cycles < end:
+        if max_changes is not None and len(changes) >= max_changes:
+            break
+        cpu.run(min(Chunk_cycles, end - cpu.cycles))
+    if max_changes is not None:
+        del changes[max_changes:]
+    return changes
+
+def capture_hex(hex_filename, max_cycles, max_changes = None):
+    r'''Loads 'hex_filename' into a new cpu and returns its trace.
+    '''
+    cpu = avr.cpu()
+    cpu.load_hex(hex_filename)
+    return capture(cpu, max_cycles, max_changes)
+
+def format_trace(trace):
+    r'''Generates the lines of a .trace file (without the newlines).
+
+        >>> for line in format_trace(((14, 'portb', 0xdf), (35, 'portb', 0xff))):
+        ...     print(line)
+        14 portb 0xdf
+        35 portb 0xff
+    '''
+    for cycle, port, value in trace:
+        yield "{} {} 0x{:02x}".format(cycle, port, value)
+
+def write(trace, filename):
+    r'''Writes 'trace' to .trace file 'filename'.
+    '''
+    with open(filename, 'wt', encoding='ascii') as trace_file:
+        trace_file.write("# cycle port value\n")
+        for line in format_trace(trace):
+            trace_file.write(line + '\n')
+
+def read(filename):
+    r'''Returns the trace in .trace file 'filename'.
+    '''
+    with open(filename, 'rt', encoding='ascii') as trace_file:
+        return list(parse(trace_file))
+
+def parse(lines):
+    r'''Generates (cycle, port, value) for each line in 'lines'.
+
+        >>> tuple(parse(('# comment', '', '14 portb 0xdf')))
+        ((14, 'portb', 223),)
+    '''
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'): continue
+        cycle, port, value = line.split()
+        yield int(cycle), port, int(value, 16)
+
+def compare(golden, trace, tolerance = None):
+    r'''Compares 'trace' against the 'golden' trace.
+
+    Returns a list of strings describing the differences (empty if there are
+    none).
+
+    The ports and values must match, in order, with no changes missing or
+    left over.  The cycles are only compared if 'tolerance' is given, then
+    each cycle count may differ by this fraction of the golden cycle count.
+
+        >>> golden = ((14, 'portb', 0xdf), (35, 'portb', 0xff))
+        >>> compare(golden, ((20, 'portb', 0xdf), (50, 'portb', 0xff)))
+        []
+        >>> compare(golden, ((14, 'portb', 0xdf), (50, 'portb', 0xff)), 0.1)
+        ['change 2: expected portb=0xff at cycle 35, got it at cycle 50']
+        >>> compare(golden, ((14, 'portb', 0xdf), (35, 'portc', 0xff)))
+        ['change 2: expected portb=0xff, got portc=0xff']
+        >>> compare(golden, ((14, 'portb', 0xdf),))
+        ['trace ends after 1 changes, expected 2']
+        >>> compare(golden[:1], golden)
+        ['trace has 2 changes, expected 1']
+    '''
+    differences = []
+    for i, ((g_cycle, g_port, g_value), (cycle, port, value)) \
+     in enumerate(zip(golden, trace), 1):
+        if (g_port, g_value) != (port, value):
+            differences.append(
+              "change {}: expected {}=0x{:02x}, got {}=0x{:02x}"
+                .format(i, g_port, g_value, port, value))
+            break
+        if tolerance is not None and \
+           abs(cycle - g_cycle) > tolerance * g_cycle:
+            differences.append(
+              "change {}: expected {}=0x{:02x} at cycle {}, "
+              "got it at cycle {}"
+                .format(i, g_port, g_value, g_cycle, cycle))
+    if len(trace) < len(golden) and not differences:
+        differences.append("trace ends after {} changes, expected {}"
+                             .format(len(trace), len(golden)))
+    if len(trace) > len(golden) and not differences:
+        differences.append("trace has {} changes, expected {}"
+                             .format(len(trace), len(golden)))
+    return differences
+
+def check(hex_filename, golden_filename, tolerance = None):
+    r'''Runs 'hex_filename' and compares its trace to 'golden_filename'.
+
+    The program is run until it has made as many changes as the golden trace
+    has, or for twice the golden trace's cycles.
+
+    Returns the list of differences (see `compare`).
+    '''
+    golden = read(golden_filename)
+    max_cycles = 2 * golden[-1][0] + Chunk_cycles if golden else Chunk_cycles
+    return compare(golden, capture_hex(hex_filename, max_cycles, len(golden)),
+                   tolerance)
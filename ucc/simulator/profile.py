@@ -0,0 +1,113 @@
+# profile.py
+
+r'''Gathers block, edge and call execution counts by running the program.
+
+The program in the package's flash.hex is run on the `ucc.simulator.avr`
+simulator, counting each arrival at the start of a code block.  The block
+addresses come from the assembler_blocks in the package's ucc.db.  The counts
+are written to a flash.profile file (see `ucc.assembler.profile_file`), which
+the compiler uses on the next compile to lay out the blocks and functions.
+'''
+
+import os
+import bisect
+
+from ucc.database import crud, assembler
+from ucc.assembler import profile_file
+from ucc.simulator import avr
+
+Max_cycles = 10000000
+
+def reduce(edge_counts, extents):
+    r'''Converts the simulator's 'edge_counts' into profile entries.
+
+    'edge_counts' is {(from_pc, to_pc): count}, as returned by
+    `avr.cpu.run_edges`.  'extents' is a sequence of (address, length, label,
+    word_label) for the code blocks (with byte addresses and lengths).
+
+    Returns a list of 'block', 'edge' and 'call' entries (see
+    `ucc.assembler.profile_file`).
+
+    Empty blocks can't be seen, so they get no counts.  A return lands on the
+    block following the call (if the call ended its block), this is counted
+    as an edge from the calling block.
+
+        >>> extents = ((0, 4, 'run', 'run'), (4, 0, 'empty', 'run'),
+        ...            (4, 4, 'loop', 'run'), (8, 2, 'tail', 'run'),
+        ...            (10, 2, 'done', 'run'), (12, 2, 'blink', 'blink'))
+        >>> for entry in reduce({(1, 2): 1, (2, 6): 10, (6, 4): 10,
+        ...                      (4, 2): 9, (4, 5): 1}, extents):
+        ...     print(entry)
+        ('block', 'blink', 'blink', 10)
+        ('block', 'run', 'done', 1)
+        ('block', 'run', 'loop', 10)
+        ('block', 'run', 'tail', 10)
+        ('edge', 'run', 'loop', 'tail', 10)
+        ('edge', 'run', 'run', 'loop', 1)
+        ('edge', 'run', 'tail', 'done', 1)
+        ('edge', 'run', 'tail', 'loop', 9)
+        ('call', 'run', 'blink', 10)
+    '''
+    starts = []
+    blocks = []         # (label, word_label) parallel to starts
+    for address, length, label, word_label in extents:
+        if length:
+            starts.append(address // 2)
+            blocks.append((label, word_label))
+    index = {start: i for i, start in enumerate(starts)}
+
+    def containing(pc):
+        i = bisect.bisect_right(starts, pc) - 1
+        if i < 0: return None
+        return blocks[i]
+
+    block_counts = {}
+    edges = {}
+    calls = {}
+    def add(d, key, n):
+        d[key] = d.get(key, 0) + n
+    for (from_pc, to_pc), n in edge_counts.items():
+        to_label, to_word = blocks[index[to_pc]]
+        add(block_counts, (to_word, to_label), n)
+        from_block = containing(from_pc)
+        if from_block is None: continue
+        from_label, from_word = from_block
+        if from_word == to_word:
+            add(edges, (to_word, from_label, to_label), n)
+        elif to_label == to_word:
+            add(calls, (from_word, to_word), n)
+        else:
+            # returned to the block following the call:
+            prior = containing(to_pc - 1)
+            if prior is not None and prior[1] == to_word:
+                add(edges, (to_word, prior[0], to_label), n)
+    ans = []
+    for kind, counts in (('block', block_counts), ('edge', edges),
+                         ('call', calls)):
+        ans.extend((kind,) + key + (n,) for key, n in sorted(counts.items()))
+    return ans
+
+def gather(package_dir, max_cycles = Max_cycles):
+    r'''Runs the package's flash.hex and returns (cpu, profile entries).
+
+    The package must have been compiled, so that its ucc.db has the
+    assembler_blocks.
+    '''
+    with crud.db_connection(package_dir):
+        extents = list(assembler.gen_code_block_extents())
+    cpu = avr.cpu()
+    cpu.load_hex(os.path.join(package_dir, 'flash.hex'))
+    targets = frozenset(address // 2
+                        for address, length, label, word_label in extents
+                        if length)
+    edge_counts = cpu.run_edges(targets, max_cycles)
+    return cpu, reduce(edge_counts, extents)
+
+def write(package_dir, max_cycles = Max_cycles):
+    r'''Gathers the profile and writes it to flash.profile in package_dir.
+
+    Returns the cpu after the run.
+    '''
+    cpu, entries = gather(package_dir, max_cycles)
+    profile_file.write(entries, package_dir, 'flash')
+    return cpu
@@ -4,12 +4,17 @@ r'''The granddaddy (root) of all words!
 '''
 
 import os.path
-from ucc.database import ast, block, crud, symbol_table
+from ucc.database import ast, block, crud, fn_xref, symbol_table
 from ucc.parser import parse
 from ucc.word import helpers, word as word_module
 
 Empty_set = frozenset()
 
+#: Calls (as statements) to high-level words with no more than this many ast
+#: nodes (see `ucc.database.ast.size`) are inlined, if the word doesn't call
+#: other high-level words and doesn't suspend.  0 turns inlining off.
+Inline_size = 12
+
 class declaration:
     r'''All words are subclasses of declaration.
 
@@ -144,9 +149,10 @@ class high_level_word(word):
     '''
     def parse_file(self, parser, debug = 0):
         filename = self.ww.get_filename()
-        for i, label in enumerate(self.ww.get_value('argument')):
-            symbol_table.symbol.create(label, 'parameter', self.ww.symbol,
-                                       int1=i)
+        with crud.db_transaction():
+            for i, label in enumerate(self.ww.get_value('argument')):
+                symbol_table.symbol.create(label, 'parameter', self.ww.symbol,
+                                           int1=i)
         worked, ast_args = parse.parse_file(parser, self.ww, debug)
         if not worked:
             raise AssertionError("parse failed for " + filename)
@@ -163,10 +169,13 @@ class high_level_word(word):
                  .format(self.label, block.Current_block.name)
         block.delete(self.ww.symbol)
         block.block(self.label, self.ww.symbol.id)
-        parameters = ast.compile_args(self.ast_args)
+        # The values of the statements (e.g., 'set') aren't returned, they may
+        # not even be in the last block:
+        ast.compile_args(self.ast_args)
         if block.Current_block:
-            block.Current_block.block_end(
-              block.Current_block.gen_triple('return', parameters))
+            # gen_triple may start a new Current_block, so do it first:
+            ret = block.Current_block.gen_triple('return')
+            block.Current_block.block_end(ret)
 
     def compile_value(self, ast_node):
         assert len(ast_node.args) == 2
@@ -180,7 +189,58 @@ class high_level_word(word):
                  symbol=self.ww.symbol)
 
     def compile_statement(self, ast_node):
-        self.compile_value(ast_node)
+        if self.inlinable(block.Current_block.word_symbol_id):
+            self.compile_inline(ast_node)
+        else:
+            self.compile_value(ast_node)
+
+    def inlinable(self, caller_id):
+        r'''Should calls to this word from 'caller_id' be inlined?
+
+        Only leaf words (that don't call other high-level words) are inlined,
+        so recursive words never are.
+        '''
+        symbol = self.ww.symbol
+        if symbol.id == caller_id or symbol.suspends or \
+           getattr(self, 'ast_args', None) is None or \
+           ast.size(self.ast_args) > Inline_size:
+            return False
+        return not any(isinstance(symbol_table.get_by_id(called_id).word_obj,
+                                  high_level_word)
+                       for called_id in fn_xref.get_calls(symbol.id))
+
+    def compile_inline(self, ast_node):
+        r'''Compiles a copy of this word's ast in place of the call.
+
+        The parameters and local variables of this word become new local
+        variables of the caller.
+        '''
+        assert len(ast_node.args) == 2
+        fn_args = self.ww.get_value('argument')
+        assert len(ast_node.args[1]) == len(fn_args), \
+               "{}: incorrect number of arguments, expected {}, got {}" \
+                 .format(self.label, len(fn_args), len(ast_node.args[1]))
+        caller = symbol_table.get_by_id(block.Current_block.word_symbol_id)
+        symbols = {}    # {symbol_id: new symbol}
+        def new_local(sym):
+            if sym.id not in symbols:
+                symbols[sym.id] = \
+                  symbol_table.symbol.create(crud.gensym(sym.label), 'var',
+                                             caller, type_id=sym.type_id)
+            return symbols[sym.id]
+        params = [new_local(symbol_table.get(label, self.ww.symbol))
+                  for label in fn_args]
+        for node in ast.walk_args(self.ast_args):
+            if node.kind == 'word' and \
+               symbol_table.get_by_id(node.symbol_id).context is self.ww.symbol:
+                new_local(symbol_table.get_by_id(node.symbol_id))
+        arg_triples = tuple(arg.compile() for arg in ast_node.args[1])
+        for param, arg_triple in zip(params, arg_triples):
+            block.Current_block.label(param.id, arg_triple)
+        body = ast.copy_args(self.ast_args, symbols=symbols)
+        for node in ast.walk_args(body):
+            node.word_symbol = caller
+        ast.compile_args(body)
 
 
 def load_class(ww):
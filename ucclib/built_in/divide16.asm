@@ -0,0 +1,50 @@
+    # Signed 16-bit floor division: d24 = d24 / d22, rounded down.
+    #
+    # This is called by the code for '/' (see ucc/codegen/avr/patterns),
+    # which gives it d26 for the remainder and r21 for the loop counter.  d22
+    # is trashed.  The answer for a divide by 0 is garbage.
+    mov  r21,r25
+    eor  r21,r23
+    bst  r21,7          # T is set if the answer is negative
+    tst  r25
+    brpl divide16_right
+    com  r25            # negate the dividend
+    neg  r24
+    sbci r25,0xFF
+divide16_right
+    tst  r23
+    brpl divide16_unsigned
+    com  r23            # negate the divisor
+    neg  r22
+    sbci r23,0xFF
+divide16_unsigned
+    sub  r26,r26        # clears the remainder and the carry
+    clr  r27
+    ldi  r21,17
+divide16_loop
+    rol  r24            # shift the next quotient bit in from the carry
+    rol  r25
+    dec  r21
+    breq divide16_sign
+    rol  r26
+    rol  r27
+    sub  r26,r22
+    sbc  r27,r23
+    brcc divide16_fits
+    add  r26,r22        # the divisor doesn't fit, put the remainder back
+    adc  r27,r23
+    clc
+    rjmp divide16_loop
+divide16_fits
+    sec
+    rjmp divide16_loop
+divide16_sign
+    brtc divide16_done
+    com  r25            # negate the quotient
+    neg  r24
+    sbci r25,0xFF
+    or   r26,r27        # and round it down if there is a remainder
+    breq divide16_done
+    sbiw r24,1
+divide16_done
+    ret
@@ -22,7 +22,8 @@ class input_pin(declaration.word):
 
         If on-is LOW, it does a bit-xor with the bit.
         '''
-        assert len(ast_node.args) == 1
+        assert not ast_node.args, \
+               "{}: takes no arguments".format(self.label)
 
         pin_number = self.ww.get_value('pin_number')
         on_is = self.ww.get_answer('on_is').tag
@@ -31,7 +32,7 @@ class input_pin(declaration.word):
 
         input_bit = block.Current_block.gen_triple(
                       'input-bit',
-                      string='io.pin' + port_label,
+                      string='pin' + port_label,
                       int1=bit_number,
                       syntax_position_info=ast_node.get_syntax_position_info())
 
@@ -53,7 +54,8 @@ class input_pin(declaration.word):
 
         If on-is LOW, it does a 'not' on the bit.
         '''
-        assert len(ast_node.args) == 1
+        assert not ast_node.args, \
+               "{}: takes no arguments".format(self.label)
 
         pin_number = self.ww.get_value('pin_number')
         on_is = self.ww.get_answer('on_is').tag
@@ -62,7 +64,7 @@ class input_pin(declaration.word):
 
         input_bit = block.Current_block.gen_triple(
                       'input-bit',
-                      string='io.pin' + port_label,
+                      string='pin' + port_label,
                       int1=bit_number,
                       syntax_position_info=ast_node.get_syntax_position_info())
 
@@ -15,6 +15,16 @@ class operator(declaration.word):
     
     The label is used as the intermediate code operator.
     ''' 
+    def parse_file(self, parser, debug = 0):
+        r'''Returns the assembler word that the operator's code calls, if any.
+
+        This is the operator's 'runtime' answer (see 'divide.xml').
+        '''
+        runtime = self.ww.get_answer('runtime', None)
+        if runtime is None or not runtime.is_answered():
+            return declaration.Empty_set
+        return frozenset((runtime.get_value(),))
+
     def compile_value(self, ast_node):
         assert len(ast_node.args) >= 2 and len(ast_node.args) <= 3, \
                "{}: incorrect number of arguments, expected 1 or 2, got {}" \
@@ -30,3 +40,11 @@ class operator(declaration.word):
                  self.label, args,
                  syntax_position_info=ast_node.get_syntax_position_info())
 
+
+    def compile_condition(self, ast_node):
+        r'''Any value can be used as a condition (0 is false).
+
+        A comparison used as a condition is later fused into the branch (see
+        `ucc.compiler.compare_branches`).
+        '''
+        return self.compile_value(ast_node)
@@ -3,11 +3,83 @@
 r'''Repeat statement.
 
 This is implemented as a macro.
+
+Repeats with a small constant count are unrolled (fully, or partly with
+fewer loop iterations) so long as the unrolled body doesn't take more than
+`Unroll_budget` ast nodes.  Loops with an empty body (delay loops) and loops
+with loops in their body are never unrolled.
 '''
 
-from ucc.database import ast, crud, symbol_table
+from ucc.database import ast, crud, symbol_table, ucl_types
 from ucclib.built_in import macro
 
+#: The most ast nodes allowed for the unrolled copies of a repeat body.  0
+#: turns unrolling off.
+Unroll_budget = 32
+
+def has_loop(args):
+    r'''True if there is a jump back to a label within 'args'.
+    '''
+    labels_seen = set()
+    for node in ast.walk_args(args):
+        if node.kind == 'label':
+            labels_seen.add(node.label)
+        elif node.kind in ast.Label_kinds and node.label in labels_seen:
+            return True
+    return False
+
+def unroll(count, body_size, budget = None):
+    r'''Decides how to unroll a repeat 'count' of a body of 'body_size' nodes.
+
+    Returns copies, iterations, extra; where the loop runs 'iterations' times
+    over 'copies' of the body, after 'extra' copies of the body on their own.
+    So count == copies * iterations + extra.  If 'iterations' is 1, there is
+    no loop left.
+
+    Not unrolled:
+
+        >>> unroll(100, 0, 24)
+        (1, 100, 0)
+        >>> unroll(100, 13, 24)
+        (1, 100, 0)
+        >>> unroll(100, 3, 0)
+        (1, 100, 0)
+
+    Fully unrolled:
+
+        >>> unroll(8, 3, 24)
+        (8, 1, 0)
+
+    Partly unrolled, with as few iterations as the budget allows:
+
+        >>> unroll(100, 3, 24)
+        (5, 20, 0)
+        >>> unroll(10, 4, 24)
+        (5, 2, 0)
+        >>> unroll(11, 4, 24)
+        (5, 2, 1)
+
+    Preferring a count that fits in a byte:
+
+        >>> unroll(1000, 3, 24)
+        (8, 125, 0)
+        >>> unroll(600, 12, 24)
+        (2, 300, 0)
+    '''
+    if budget is None: budget = Unroll_budget
+    if body_size == 0 or count * body_size <= budget:
+        if body_size and count > 1:
+            return count, 1, 0
+        return 1, count, 0
+    best = 1, count, 0
+    for copies in range(2, min(budget // body_size, count - 1) + 1):
+        iterations, extra = divmod(count, copies)
+        if (copies + extra) * body_size <= budget:
+            if (iterations > 255, iterations, copies + extra) < \
+               (best[1] > 255, best[1], best[0] + best[2]):
+                best = copies, iterations, extra
+    return best
+
 class repeat(macro.macro):
     def macro_expand(self, fn_symbol, ast_node, words_needed):
         #print "repeat.macro_expand"
@@ -41,9 +113,27 @@ class repeat(macro.macro):
                 if count.int1 == 1:
                     return ast_node.macro_expand(fn_symbol, words_needed, body,
                                                  kind='series')
+                if has_loop(body):
+                    copies, iterations, extra = 1, count.int1, 0
+                else:
+                    copies, iterations, extra = unroll(count.int1,
+                                                       ast.size(body))
+                bodies = [body] + [ast.copy_args(body)
+                                   for _ in range(copies + extra - 1)]
+                if iterations == 1:
+                    return ast_node.macro_expand(fn_symbol, words_needed,
+                                                 sum(bodies, ()),
+                                                 kind='series')
+                before_loop = sum(bodies[copies:], ())
+                body = sum(bodies[:copies], ())
+                if iterations != count.int1:
+                    count = ast.copy_args((count,))[0]
+                    count.int1 = iterations
                 first_jmp = ()
                 test_label = ()
             else:
+                before_loop = ()
+                test = crud.gensym('repeat_test')
                 first_jmp = (
                   ast.ast.from_parser(syntax_position, kind='jump', label=test,
                                                        expect='statement'),
@@ -54,10 +144,15 @@ class repeat(macro.macro):
                 )
 
             loop_var = crud.gensym('repeat_var')
-            symbol_id = \
-              symbol_table.symbol.create(loop_var, 'var', fn_symbol).id
-            test = crud.gensym('repeat_test')
-            new_args = (
+            if count.kind == 'int':
+                # The loop var counts down from count to 0:
+                symbol_id = \
+                  symbol_table.symbol.create(loop_var, 'var', fn_symbol,
+                    type_id=ucl_types.int.lookup(0, count.int1).id).id
+            else:
+                symbol_id = \
+                  symbol_table.symbol.create(loop_var, 'var', fn_symbol).id
+            new_args = before_loop + (
               ast.ast.from_parser(syntax_position,
                                   ast.ast.word(symbol_table.get('set').id,
                                                head_syntax_position),
@@ -35,6 +35,9 @@ startup2
     out  io.sph,r29
     out  io.spl,r28
     # need to add data, bss and eeprom initialization here...
+init_globals
+    # the code to set the global variables kept in registers goes here
+    # (see ucc/codegen/pin_globals.py)
     call run
 termination_loop
     rjmp termination_loop
@@ -0,0 +1,39 @@
+# table.py
+
+r'''A table of constant values, kept in flash.
+
+The values are placed in the 'code' section (as int16s), so they don't take
+any RAM.  They are read with LPM by the 'flash' triple, which is what
+'table(index)' compiles to.
+'''
+
+import re
+
+from ucc.database import assembler, block
+from ucclib.built_in import declaration
+
+class table(declaration.word):
+    def asm_label(self):
+        r'''The assembler label of the table.
+
+        The label must be a Python identifier, since the assembler evals the
+        operands that it is used in (like 'lo8(label)').
+        '''
+        return re.sub(r'\W', '_', self.label)
+
+    def compile(self):
+        assembler.delete(self.ww.symbol)
+        asm_block = assembler.block(self.ww.symbol.id, 'code',
+                                    self.asm_label())
+        for value in self.ww.get_value('value'):
+            asm_block.append_inst('int16', str(value))
+        asm_block.write()
+
+    def compile_value(self, ast_node):
+        assert len(ast_node.args) == 2, \
+               "{}: expected one index, got {}" \
+                 .format(self.label, len(ast_node.args) - 1)
+        index = ast_node.args[1].compile()
+        return block.Current_block.gen_triple(
+                 'flash', (index,),
+                 symbol=self.ww.symbol, string=self.asm_label())